@@ -1,6 +1,17 @@
-from flask import Flask, jsonify
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, jsonify, request, Response
+from app.catalog import Catalog, TIMESTAMP_FORMAT, parse_backup_file_name, read_binlog_position
 from app.config import Config
+from app.delta import materialize
+from app.modules.mysql_binlog import list_binlogs
+from app.modules.postgres_wal import MANIFEST_NAME, read_wal_range, segment_name
+from datetime import datetime
+from app.history import RunHistory
+from app.metrics import Metrics
+from app.pool import WorkerPool
 from app.scheduler import Scheduler
+from app.throttle import TokenBucket
+import hmac
 import logging
 import os
 import click
@@ -12,56 +23,264 @@ app.config.from_object(Config)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the appropriate database module based on the configuration
-if Config.DB_TYPE == 'mysql':
-    from app.modules.mysql_module import MySQLModule as DatabaseModule
-elif Config.DB_TYPE == 'postgis':
-    from app.modules.postgis_module import PostGISModule as DatabaseModule
-elif Config.DB_TYPE == 'postgres':
-    from app.modules.postgres_module import PostgresModule as DatabaseModule
-else:
-    raise ValueError("Unsupported DB_TYPE. Use 'mysql' or 'postgis'.")
-
-db_module = DatabaseModule(
-    host=Config.DB_HOST,
-    port=Config.DB_PORT,
-    username=Config.DB_USER,
-    password=Config.DB_PASSWORD,
-    maintenance_db=Config.DB_MAINTENANCE_NAME
-)
-
-# Initialize the scheduler with multiple cron configurations
-scheduler = Scheduler(
-    db_module=db_module,
-    cron_configs=Config.CRON_CONFIGS,
-    backup_dir=Config.BACKUP_DIR
-)
+
+def load_module_class(db_type):
+    """Imports the database module class of a database type."""
+    if db_type == 'mysql':
+        from app.modules.mysql_module import MySQLModule
+        return MySQLModule
+    elif db_type == 'postgis':
+        from app.modules.postgis_module import PostGISModule
+        return PostGISModule
+    elif db_type == 'postgres':
+        from app.modules.postgres_module import PostgresModule
+        return PostgresModule
+    raise ValueError("Unsupported DB_TYPE. Use 'mysql', 'postgres' or 'postgis'.")
+
+
+# Targets backed up by this process share the job scheduler, the metrics, the global rate limit and,
+# when several servers are configured, a worker pool capping the dumps per target and per host
+background_scheduler = BackgroundScheduler()
+metrics_registry = Metrics()
+rate_limit = TokenBucket(Config.BACKUP_GLOBAL_RATE_LIMIT_MB * 1024 * 1024 if Config.BACKUP_GLOBAL_RATE_LIMIT_MB
+                         else None)
+pool = WorkerPool(Config.BACKUP_WORKERS) if Config.TARGETS[0]['name'] else None
+schedulers = {}
+for target in Config.TARGETS:
+    target_name = target['name']
+    # Each named target keeps its backups, catalog and log archives in its own folder
+    target_dir = Config.BACKUP_DIR / target_name if target_name else Config.BACKUP_DIR
+    target_module = load_module_class(target['type'])(
+        host=target['host'],
+        port=target['port'],
+        username=target['user'],
+        password=target['password'],
+        maintenance_db=target['maintenance_db'],
+        target=target_name
+    )
+    schedulers[target_name] = Scheduler(
+        db_module=target_module,
+        cron_configs=target['cron_configs'],
+        backup_dir=target_dir,
+        catalog=Catalog(target_dir),
+        metrics=metrics_registry.labels(target=target_name) if target_name else metrics_registry,
+        history=RunHistory(Config.HISTORY_SIZE),
+        rate_limit=rate_limit,
+        instance_id=Config.BACKUP_INSTANCE_ID,
+        pool=pool,
+        background_scheduler=background_scheduler
+    )
+    if pool:
+        target_key, host_key = schedulers[target_name].get_pool_keys()
+        pool.limit(target_key, target['concurrency'])
+        pool.limit(host_key, Config.BACKUP_HOST_CONCURRENCY)
+targets = {target['name']: target for target in Config.TARGETS}
+
+
+def get_scheduler(target_name=None):
+    """
+    Get the scheduler of a target.
+
+    Args:
+        target_name (str): The name of the target, the first one if not set.
+
+    Returns:
+        Scheduler: The scheduler of the target.
+
+    Raises:
+        click.BadParameter: If no target has this name.
+    """
+    if not target_name:
+        return next(iter(schedulers.values()))
+    if target_name not in schedulers:
+        raise click.BadParameter(f"Unknown target '{target_name}', use one of {list(schedulers)}")
+    return schedulers[target_name]
+
+
+# The scheduler, module and catalog of the target restored by default
+scheduler = get_scheduler(Config.RESTORE_TARGET)
+db_module = scheduler.db_module
+catalog = scheduler.catalog
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Endpoint to get the current health state of the last backup operation."""
-    if scheduler.get_health():
+    """Endpoint to get the current health state of the backups, with the failed health policies."""
+    problems = [f"{name}: {problem}" if name else problem
+                for name, target_scheduler in schedulers.items() for problem in target_scheduler.get_health_problems()]
+    if not problems:
         return jsonify({"health": "healthy"}), 200
     else:
-        return jsonify({"health": "failed"}), 500
+        return jsonify({"health": "failed", "problems": problems}), 500
+
+
+@app.route('/status', methods=['GET'])
+def status():
+    """Endpoint to get the history of the latest backup runs of each configuration and database."""
+    healthy = all(target_scheduler.get_health() for target_scheduler in schedulers.values())
+    if pool is None:
+        return jsonify({"health": "healthy" if healthy else "failed", "configs": scheduler.history.snapshot()}), 200
+    return jsonify({"health": "healthy" if healthy else "failed",
+                    "targets": {name: {"configs": target_scheduler.history.snapshot()}
+                                for name, target_scheduler in schedulers.items()}}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint exposing the backup metrics in the Prometheus text format."""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cancel', methods=['POST'])
+def cancel():
+    """
+    Endpoint cancelling the running dumps, of the database given as `database` query parameter or all,
+    on the target given as `target` query parameter or on all targets.
+
+    The request must carry the configured `CANCEL_TOKEN` as bearer token.
+    """
+    if not Config.CANCEL_TOKEN:
+        return jsonify({"error": "Cancellation is disabled, set CANCEL_TOKEN to enable it"}), 403
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(authorization, f"Bearer {Config.CANCEL_TOKEN}".encode('utf-8')):
+        return jsonify({"error": "Invalid or missing token"}), 401
+    target_name = request.args.get('target')
+    if target_name and target_name not in schedulers:
+        return jsonify({"error": f"Unknown target '{target_name}'"}), 404
+    cancelled = sum(target_scheduler.cancel_backups(request.args.get('database'))
+                    for name, target_scheduler in schedulers.items() if not target_name or name == target_name)
+    return jsonify({"cancelled": cancelled}), 200
+
+
+def validate_timestamp(ctx, param, value):
+    """
+    Checks that a timestamp option is in the format of the backup timestamps.
+
+    Args:
+        ctx (click.Context): The click context.
+        param (click.Parameter): The option.
+        value (str): The timestamp, None if not given.
+
+    Returns:
+        str: The timestamp.
+
+    Raises:
+        click.BadParameter: If the timestamp is not in the YYYYmmddHHMMSS format.
+    """
+    if value is not None:
+        try:
+            datetime.strptime(value, TIMESTAMP_FORMAT)
+        except ValueError:
+            raise click.BadParameter(f"'{value}' is not a timestamp in the YYYYmmddHHMMSS format")
+    return value
 
 
 @app.cli.command("restore")
 @click.argument("name_or_path")
-def restore(name_or_path):
+@click.option("--jobs", default=Config.RESTORE_JOBS, show_default=True, help="Number of parallel restore jobs.")
+@click.option("--at", "timestamp", default=None, callback=validate_timestamp,
+              help="Restore the latest backup taken at or before this timestamp (YYYYmmddHHMMSS).")
+@click.option("--timeout", default=Config.RESTORE_TIMEOUT, type=float,
+              help="Maximum duration of each restore step in seconds.")
+@click.option("--swap/--no-swap", default=Config.RESTORE_SWAP, show_default=True,
+              help="Load the backup into a shadow database and swap it with the live one once loaded.")
+@click.option("--table", "tables", multiple=True,
+              help="Restore only this table, leaving the rest of the database untouched. Can be repeated.")
+@click.option("--schema", default=None, help="Schema of the restored tables, or schema to restore (PostgreSQL).")
+@click.option("--data-dir", default=None, type=click.Path(path_type=Path),
+              help="Empty data directory where a physical base backup is recovered (PostgreSQL).")
+@click.option("--binlog/--no-binlog", default=None,
+              help="Replay the archived binary logs on top of the restored dump (MySQL), by default only "
+                   "with --at or --to-gtid.")
+@click.option("--to-gtid", "gtid", default=None,
+              help="Replay the archived binary logs up to this GTID, included (MySQL).")
+@click.option("--target", "target_name", default=Config.RESTORE_TARGET or None,
+              help="Target whose backup is restored, the first one if not set.")
+def restore(name_or_path, jobs, timestamp, timeout, swap, tables, schema, data_dir, binlog, gtid, target_name):
     """
     Restore the database from a given configuration name or backup file path.
 
+    With `--table` or `--schema`, only these tables or this schema are restored into the live
+    database, using the sidecar index of the backup.
+
+    Physical base backups are recovered into `--data-dir`, replaying the archived WAL up to
+    the `--at` timestamp, or to the end of the archive.
+
+    MySQL dumps with binary log coordinates are restored, then with `--at` or `--to-gtid` the
+    archived binary logs are replayed on top of them up to the timestamp or the GTID. With
+    `--binlog` alone they are replayed to the end of the archive.
+
     Args:
         name_or_path (str): The configuration name or the path to the backup file.
+        jobs (int): The number of parallel restore jobs.
+        timestamp (str): Restore the latest backup of the configuration taken at or before this timestamp.
+        timeout (float): The maximum duration of each restore step in seconds.
+        swap (bool): Whether to restore into a shadow database swapped with the live one.
+        tables (tuple): The tables to restore, the whole database if empty.
+        schema (str): The schema of the tables to restore.
+        data_dir (Path): The data directory where a physical base backup is recovered.
+        binlog (bool): Whether to replay the archived binary logs on top of a MySQL dump, None to
+            replay them only up to a target time or GTID.
+        gtid (str): The GTID of the last transaction replayed from the binary logs.
+        target_name (str): The target whose backup is restored.
     """
+    scheduler = get_scheduler(target_name)
+    db_module, catalog = scheduler.db_module, scheduler.catalog
+    target_type = targets[scheduler.db_module.target]['type']
+    target_time = datetime.strptime(timestamp, TIMESTAMP_FORMAT) if timestamp else None
+
+    def restore_cluster(backup_path):
+        """Recovers a physical base backup into the data directory, up to the target time."""
+        if not data_dir:
+            logger.error(f"Backup '{backup_path}' is a physical base backup, use --data-dir to recover it")
+            return False
+        wal_range = read_wal_range(backup_path)
+        catalog.sync_wal(scheduler.wal_dir)
+        covered_until = catalog.wal_covered_until(segment_name(wal_range['timeline'], wal_range['start_lsn']))
+        if covered_until is None:
+            logger.warning(f"The WAL archive has no segment of base backup '{backup_path}'")
+        elif target_time and covered_until < target_time.timestamp():
+            logger.warning(f"The WAL archive ends at {datetime.fromtimestamp(covered_until)}, before {target_time}")
+        return db_module.restore_cluster(backup_path, data_dir, scheduler.wal_dir, target_time, timeout=timeout)
+
+    def replay_binlog(db_name, source_path):
+        """Replays the archived binary logs on top of a restored MySQL dump, up to the target time or GTID."""
+        position = read_binlog_position(source_path)
+        binlog_files = list_binlogs(scheduler.binlog_dir, position['file']) if position else []
+        if not binlog_files or binlog_files[0].name != position['file']:
+            if gtid:
+                logger.error(f"The binary log archive cannot replay backup '{source_path}' up to GTID {gtid}")
+                return False
+            logger.info(f"No archived binary logs to replay on top of backup '{source_path}'")
+            return True
+        if target_time and binlog_files[-1].stat().st_mtime < target_time.timestamp():
+            logger.warning(f"The binary log archive ends at {datetime.fromtimestamp(binlog_files[-1].stat().st_mtime)}"
+                           f", before {target_time}")
+        return db_module.replay_binlog(db_name, scheduler.binlog_dir, position['file'], position['position'],
+                                       stop_time=target_time, stop_gtid=gtid, timeout=timeout)
+
+    def restore_backup(db_name, backup_path):
+        """Restores the whole database, or only the selected tables or schema, rebuilding delta backups."""
+        if (backup_path / MANIFEST_NAME).exists():
+            return restore_cluster(backup_path)
+        with materialize(backup_path, timeout=timeout) as source_path:
+            if tables or schema:
+                return db_module.restore_tables(db_name, source_path, list(tables), schema=schema, timeout=timeout)
+            restored = db_module.restore_database(db_name, source_path, jobs=jobs, timeout=timeout, swap=swap)
+            if not restored or target_type != 'mysql' or binlog is False:
+                return restored
+            if binlog is None and not (target_time or gtid):
+                logger.info(f"Binary logs not replayed on top of backup '{source_path}': use --at, --to-gtid or "
+                            f"--binlog to replay them")
+                return restored
+            return replay_binlog(db_name, source_path)
+
     if os.path.exists(name_or_path):
         # If a file path is provided
         backup_path = Path(name_or_path)
-        restore_db_name = backup_path.name.rsplit('.', 1)[0]  # Extract the database name from the file name
+        restore_db_name, _ = parse_backup_file_name(backup_path)  # Extract the database name from the file name
         logger.info(f"Attempting to restore database '{restore_db_name}' from file '{name_or_path}'")
-        restore_success = db_module.restore_database(restore_db_name, backup_path)
+        restore_success = restore_backup(restore_db_name, backup_path)
         if restore_success:
             logger.info(f"Restore successful for '{name_or_path}'")
         else:
@@ -69,14 +288,13 @@ def restore(name_or_path):
     else:
         # If a configuration name is provided
         restore_cron_name = name_or_path
-        restore_backup_dir = Config.BACKUP_DIR / restore_cron_name
-        backup_file = max(restore_backup_dir.glob('**/*.backup'), key=os.path.getmtime, default=None)
-        if backup_file:
-            backup_file_path = Path(backup_file)
-            restore_db_name = backup_file_path.name.rsplit('.', 1)[0]  # Extract the database name from the file name
+        backup_entry = catalog.latest(restore_cron_name, before=timestamp)
+        if backup_entry:
+            backup_file = backup_file_path = catalog.resolve(backup_entry)
+            restore_db_name = backup_entry['database']
             logger.info(f"Attempting to restore database '{restore_db_name}' from latest backup '{backup_file}' for "
                         f"configuration '{restore_cron_name}'")
-            restore_success = db_module.restore_database(restore_db_name, backup_file_path)
+            restore_success = restore_backup(restore_db_name, backup_file_path)
             if restore_success:
                 logger.info(f"Restore successful for configuration '{restore_cron_name}' "
                             f"using backup file '{backup_file}'")
@@ -87,22 +305,32 @@ def restore(name_or_path):
             logger.warning(f"No backups found for configuration '{restore_cron_name}'")
 
 
+@app.cli.command("rebuild-catalog")
+def rebuild_catalog():
+    """Rebuild the backup catalog of each target from the backups stored in its backup directory."""
+    for target_scheduler in schedulers.values():
+        recorded = target_scheduler.catalog.rebuild()
+        logger.info(f"Backup catalog of {target_scheduler.backup_dir} rebuilt with {recorded} backups")
+
+
 if __name__ == '__main__':
     if Config.RESTORE_CONFIG_NAME:
         logger.info(f"Startup restore is configured at {Config.RESTORE_CONFIG_NAME}")
         cron_name = Config.RESTORE_CONFIG_NAME
-        backup_dir = Config.BACKUP_DIR / cron_name
-        latest_backup = max(backup_dir.glob('**/*.backup'), key=os.path.getmtime, default=None)
+        latest_entry = catalog.latest(cron_name)
+        latest_backup = latest_backup_path = catalog.resolve(latest_entry) if latest_entry else None
         logger.info(f"Detected latest backup: {latest_backup}")
-        if latest_backup:
-            latest_backup_path = Path(latest_backup)
-            db_name = latest_backup_path.name.rsplit('.', 2)[0]  # Extract the database name from the file name
+        if latest_entry:
+            db_name = latest_entry['database']
             logger.info(f"Attempting to restore database '{db_name}' from latest backup '{latest_backup}' for "
                         f"configuration '{cron_name}' at startup")
-            success = db_module.restore_database(db_name, latest_backup_path)
+            with materialize(latest_backup_path, timeout=Config.RESTORE_TIMEOUT) as source_path:
+                success = db_module.restore_database(db_name, source_path, jobs=Config.RESTORE_JOBS,
+                                                     timeout=Config.RESTORE_TIMEOUT, swap=Config.RESTORE_SWAP)
             if success:
                 logger.info(f"Restore successful at startup for configuration '{cron_name}'")
             else:
                 logger.error(f"Restore failed at startup for configuration '{cron_name}'")
-    scheduler.start()
+    for target_scheduler in schedulers.values():
+        target_scheduler.start()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,597 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import sqlite3
+import subprocess
+import shutil
+import logging
+
+from app.chunkstore import ChunkStore, RecipeReader, is_recipe, read_recipe
+from app.compression import detect_codec, decompress_command
+from app.delta import base_cache_path, delta_path, read_delta, resolve_base
+from app.index import index_path
+from app.modules.mysql_binlog import BINLOG_HEADER_SIZE, list_binlogs, parse_binlog_name, parse_binlog_position
+from app.modules.mysql_parallel import MANIFEST_FILE
+from app.modules.postgres_bundle import is_bundle
+from app.modules.postgres_wal import MANIFEST_NAME, parse_segment, read_wal_range, segment_name
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Format of the timestamps in backup file names and in the catalog
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+# Header of the PostgreSQL custom format archives
+PG_CUSTOM_MAGIC = b'PGDMP'
+
+
+def parse_backup_file_name(path: Path) -> Tuple[str, Optional[str]]:
+    """
+    Extracts the database name and the timestamp from a backup file name.
+
+    Files not named `<database>.<timestamp>.backup`, e.g. a dump copied by hand, are named
+    after their file name without its last extension.
+
+    Args:
+        path (Path): The backup file path, named `<database>.<timestamp>.backup`.
+
+    Returns:
+        Tuple[str, Optional[str]]: The database name and the timestamp, None if the name has no timestamp.
+    """
+    parts = path.name.rsplit('.', 2)
+    if len(parts) == 3 and parts[2] == 'backup':
+        try:
+            datetime.strptime(parts[1], TIMESTAMP_FORMAT)
+            return parts[0], parts[1]
+        except ValueError:
+            pass
+    return path.name.rsplit('.', 1)[0], None
+
+
+def read_header(path: Path, size: int = 5) -> bytes:
+    """
+    Reads the first bytes of a backup file, decompressing them if the file is compressed.
+
+    Args:
+        path (Path): The backup file.
+        size (int): The number of bytes to read.
+
+    Returns:
+        bytes: The first bytes of the uncompressed backup.
+    """
+    if is_recipe(path):
+        with RecipeReader(path) as reader:
+            return reader.read(size)
+    codec = detect_codec(path)
+    if not codec:
+        with open(path, 'rb') as f:
+            return f.read(size)
+    process = subprocess.Popen(decompress_command(codec, path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        return process.stdout.read(size)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def read_binlog_position(path: Path) -> Optional[dict]:
+    """
+    Reads the MySQL binary log coordinates a backup is consistent with.
+
+    Args:
+        path (Path): The backup file or directory.
+
+    Returns:
+        Optional[dict]: The binary log 'file' and 'position' recorded by the dump, None if the
+            backup has no binary log coordinates.
+    """
+    if path.is_dir():
+        manifest = path / MANIFEST_FILE
+        return json.loads(manifest.read_text()).get('binlog') if manifest.exists() else None
+    return parse_binlog_position(read_header(path, BINLOG_HEADER_SIZE))
+
+
+def describe_artifact(path: Path) -> Tuple[str, Optional[str], int]:
+    """
+    Inspects a backup artifact on disk.
+
+    Args:
+        path (Path): The backup file or directory.
+
+    Returns:
+        Tuple[str, Optional[str], int]: The dump format ('directory', 'custom', 'plain',
+            'bundle' for bundles of per-table dumps or 'base' for physical base backups),
+            the compression codec (None if not compressed, 'chunks' for chunked backups,
+            'delta' for delta backups) and the size in bytes. The size of a chunked backup is
+            the size of its recipe and of the chunks it added to the chunk store. The format
+            of a delta backup is the format of its base, None if the base is missing.
+    """
+    if path.is_dir():
+        size = sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+        if (path / MANIFEST_NAME).exists():
+            archive = next(path.glob('base.tar*'), None)
+            return 'base', detect_codec(archive) if archive else None, size
+        return 'directory', None, size
+    if is_recipe(path):
+        dump_format = 'custom' if read_header(path).startswith(PG_CUSTOM_MAGIC) else 'plain'
+        return dump_format, 'chunks', path.stat().st_size + read_recipe(path)['new_bytes']
+    delta = read_delta(path)
+    if delta:
+        base_file = resolve_base(path, delta)
+        return describe_artifact(base_file)[0] if base_file.exists() else None, 'delta', path.stat().st_size
+    if is_bundle(path):
+        return 'bundle', None, path.stat().st_size
+    dump_format = 'custom' if read_header(path).startswith(PG_CUSTOM_MAGIC) else 'plain'
+    return dump_format, detect_codec(path), path.stat().st_size
+
+
+class Catalog:
+    """
+    Persistent index of the backup artifacts, stored as an SQLite database in the backup directory.
+
+    Every artifact is recorded with its configuration, database, timestamp, size, format and
+    status, so that retention and restore lookups are indexed queries instead of directory scans.
+
+    Chunked backups are recipes of chunks of the chunk store of the backup directory: recording
+    a recipe references its chunks, and removing it releases them, deleting the chunks no other
+    recipe references.
+
+    Delta backups are recorded with the path of their base, and a base is never expired while
+    a delta made against it is still in the catalog.
+
+    Physical base backups are recorded with the WAL range they need, and the segments of the
+    WAL archive are tracked in their own table, so the archive is pruned up to the oldest
+    base backup and the time a base backup can be recovered to is known.
+
+    MySQL dumps are recorded with the binary log coordinates they are consistent with, so the
+    binary log archive is pruned up to the oldest of them.
+
+    Dumps taken by the scheduler are recorded with their duration and the size of the database,
+    so the duration of the next runs can be predicted.
+
+    Attributes:
+        backup_dir (Path): The root directory of the backups.
+        path (Path): The path of the catalog database.
+        chunk_store (ChunkStore): The chunk store of the chunked backups.
+    """
+
+    FILE_NAME = 'catalog.sqlite3'
+
+    # Columns added after the first catalog version, created on existing catalogs when missing
+    EXTRA_COLUMNS = {
+        'change_token': 'TEXT',
+        'unchanged_since': 'TEXT',
+        'base': 'TEXT',
+        'wal_start': 'TEXT',
+        'wal_end': 'TEXT',
+        'binlog_file': 'TEXT',
+        'binlog_position': 'INTEGER',
+        'duration': 'REAL',
+        'source_size': 'INTEGER',
+    }
+
+    def __init__(self, backup_dir: Path):
+        """
+        Open the catalog of a backup directory, creating it from the backups on disk if missing.
+
+        Args:
+            backup_dir (Path): The root directory of the backups.
+        """
+        self.backup_dir = Path(backup_dir)
+        self.path = self.backup_dir / self.FILE_NAME
+        self.chunk_store = ChunkStore(self.backup_dir / ChunkStore.DIR_NAME)
+        created = not self.path.exists()
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS backups (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config TEXT NOT NULL,
+                    database TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    path TEXT NOT NULL UNIQUE,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    format TEXT,
+                    compression TEXT,
+                    status TEXT NOT NULL
+                )
+            """)
+            columns = {column['name'] for column in connection.execute("PRAGMA table_info(backups)")}
+            for column, column_type in self.EXTRA_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE backups ADD COLUMN {column} {column_type}")
+            connection.execute("CREATE INDEX IF NOT EXISTS backups_lookup "
+                               "ON backups (config, database, status, timestamp)")
+            connection.execute("CREATE INDEX IF NOT EXISTS backups_config_lookup "
+                               "ON backups (config, status, timestamp)")
+            connection.execute("CREATE INDEX IF NOT EXISTS backups_base_lookup ON backups (base)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS wal_segments (
+                    name TEXT PRIMARY KEY,
+                    timeline INTEGER NOT NULL,
+                    segment INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    modified REAL NOT NULL
+                )
+            """)
+        if created:
+            self.rebuild()
+
+    @contextmanager
+    def _connect(self):
+        """
+        Opens a connection to the catalog database, committed and closed on exit.
+
+        Yields:
+            sqlite3.Connection: The connection, returning rows as dictionaries.
+        """
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = lambda cursor, row: {col[0]: row[i] for i, col in enumerate(cursor.description)}
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _relative(self, path: Path) -> str:
+        """Path of an artifact relative to the backup directory, as stored in the catalog."""
+        return str(Path(path).relative_to(self.backup_dir))
+
+    def resolve(self, entry: dict) -> Path:
+        """
+        Returns the absolute path of a catalog entry.
+
+        Args:
+            entry (dict): The catalog entry.
+
+        Returns:
+            Path: The absolute path of the artifact.
+        """
+        return self.backup_dir / entry['path']
+
+    def record(self, cron_name: str, path: Path, status: str = 'success', change_token: Optional[str] = None,
+               unchanged_since: Optional[dict] = None, duration: Optional[float] = None,
+               source_size: Optional[int] = None) -> dict:
+        """
+        Records a backup artifact, describing it from its file name and content.
+
+        Databases found unchanged since a previous backup are recorded with the 'unchanged'
+        status and a reference to that backup, without any artifact on disk.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            path (Path): The path of the backup artifact.
+            status (str): The status of the backup, 'success', 'failed' or 'unchanged'.
+            change_token (str): The change token of the database when it was backed up.
+            unchanged_since (dict): The catalog entry of the previous backup of an unchanged database.
+            duration (float): The duration of the dump in seconds, if known.
+            source_size (int): The size of the database in bytes when it was backed up, if known.
+
+        Returns:
+            dict: The recorded catalog entry.
+        """
+        db_name, timestamp = parse_backup_file_name(path)
+        dump_format, compression, size = None, None, 0
+        if path.exists():
+            dump_format, compression, size = describe_artifact(path)
+        if compression == 'chunks' and status != 'unchanged':
+            self.chunk_store.reference(path, [digest for digest, _ in read_recipe(path)['chunks']])
+        base = None
+        if compression == 'delta' and status != 'unchanged':
+            base = self._relative(resolve_base(path, read_delta(path)))
+        wal_range = read_wal_range(path) if dump_format == 'base' else None
+        binlog = None
+        if dump_format in ('plain', 'directory') and compression != 'delta' and status != 'unchanged':
+            binlog = read_binlog_position(path)
+        entry = {
+            'config': cron_name,
+            'database': db_name,
+            'timestamp': timestamp,
+            'path': self._relative(path),
+            'size': size,
+            'format': dump_format,
+            'compression': compression,
+            'status': status,
+            'change_token': change_token,
+            'unchanged_since': unchanged_since['path'] if unchanged_since else None,
+            'base': base,
+            'wal_start': segment_name(wal_range['timeline'], wal_range['start_lsn']) if wal_range else None,
+            'wal_end': segment_name(wal_range['timeline'], wal_range['end_lsn']) if wal_range else None,
+            'binlog_file': binlog['file'] if binlog else None,
+            'binlog_position': binlog['position'] if binlog else None,
+            'duration': duration,
+            'source_size': source_size,
+        }
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO backups (config, database, timestamp, path, size, format, compression, status, "
+                "change_token, unchanged_since, base, wal_start, wal_end, binlog_file, binlog_position, duration, "
+                "source_size) VALUES (:config, :database, :timestamp, :path, :size, :format, :compression, :status, "
+                ":change_token, :unchanged_since, :base, :wal_start, :wal_end, :binlog_file, :binlog_position, "
+                ":duration, :source_size)", entry)
+        return entry
+
+    def remove(self, entry: dict) -> None:
+        """
+        Removes a backup artifact and its sidecar files from disk and from the catalog.
+
+        Args:
+            entry (dict): The catalog entry of the artifact.
+        """
+        path = self.resolve(entry)
+        if entry['status'] == 'unchanged':
+            # Records of unchanged databases have no artifact on disk
+            pass
+        elif path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+        if entry['status'] != 'unchanged' and entry['compression'] == 'chunks':
+            self.chunk_store.release(path)
+        if entry['status'] != 'unchanged':
+            for sidecar in (index_path(path), delta_path(path), base_cache_path(path)):
+                if sidecar.exists():
+                    sidecar.unlink()
+        with self._connect() as connection:
+            connection.execute("DELETE FROM backups WHERE path = ?", (entry['path'],))
+
+    def latest(self, cron_name: str, db_name: Optional[str] = None, before: Optional[str] = None) -> Optional[dict]:
+        """
+        Finds the latest successful backup of a configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The database name, None for any database.
+            before (str): Only consider backups taken at or before this timestamp (`YYYYmmddHHMMSS`).
+
+        Returns:
+            Optional[dict]: The catalog entry, None if there are no backups.
+        """
+        query = "SELECT * FROM backups WHERE config = ? AND status = 'success'"
+        params = [cron_name]
+        if db_name is not None:
+            query += " AND database = ?"
+            params.append(db_name)
+        if before is not None:
+            query += " AND timestamp <= ?"
+            params.append(before)
+        query += " ORDER BY timestamp DESC, id DESC LIMIT 1"
+        with self._connect() as connection:
+            return connection.execute(query, params).fetchone()
+
+    def expired(self, cron_name: str, db_name: str, retention_max: int) -> List[dict]:
+        """
+        Finds the backups of a database exceeding the retention limit, and its failed backups.
+
+        Records of unchanged databases exceeding the retention limit are returned as well.
+        Backups that are the base of delta backups not expired with them are kept.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            retention_max (int): The maximum number of successful backups to retain.
+
+        Returns:
+            List[dict]: The catalog entries to delete.
+        """
+        with self._connect() as connection:
+            expired = connection.execute(
+                "SELECT * FROM backups WHERE config = ? AND database = ? AND status = 'success' "
+                "ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?", (cron_name, db_name, retention_max)).fetchall()
+            unchanged = connection.execute(
+                "SELECT * FROM backups WHERE config = ? AND database = ? AND status = 'unchanged' "
+                "ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?", (cron_name, db_name, retention_max)).fetchall()
+            failed = connection.execute(
+                "SELECT * FROM backups WHERE config = ? AND database = ? AND status = 'failed'",
+                (cron_name, db_name)).fetchall()
+            expired_paths = {entry['path'] for entry in expired + unchanged + failed}
+            kept = []
+            for entry in expired:
+                dependents = connection.execute("SELECT path FROM backups WHERE base = ?", (entry['path'],)).fetchall()
+                if any(dependent['path'] not in expired_paths for dependent in dependents):
+                    logger.info(f"Keeping backup {entry['path']}, base of {len(dependents)} delta backups")
+                    kept.append(entry)
+        return [entry for entry in expired if entry not in kept] + unchanged + failed
+
+    def delta_base(self, cron_name: str, db_name: str, full_every: int) -> Optional[Tuple[dict, int]]:
+        """
+        Finds the full backup the next backup of a database can be stored as a delta against.
+
+        Deltas are always made against the latest full backup, so every delta is rebuilt from
+        its base alone, and a new full backup is taken once `full_every` deltas were made
+        against the latest one, including the deltas already expired.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            full_every (int): The number of deltas between two full backups.
+
+        Returns:
+            Optional[Tuple[dict, int]]: The catalog entry of the base and the number of deltas
+                made against it, None if the next backup must be full.
+        """
+        latest = self.latest(cron_name, db_name)
+        if latest is None:
+            return None
+        deltas = 0
+        if latest['base']:
+            delta = read_delta(self.resolve(latest))
+            deltas = delta['sequence'] if delta else full_every
+        with self._connect() as connection:
+            base = connection.execute("SELECT * FROM backups WHERE path = ?",
+                                      (latest['base'] or latest['path'],)).fetchone()
+        if (base is None or base['format'] in ('directory', 'bundle') or not self.resolve(base).exists()
+                or deltas >= full_every):
+            return None
+        return base, deltas
+
+    def sync_wal(self, wal_dir: Path) -> int:
+        """
+        Records the completed segments of the WAL archive, and forgets the segments deleted from it.
+
+        Args:
+            wal_dir (Path): The WAL archive directory.
+
+        Returns:
+            int: The number of segments in the archive.
+        """
+        segments = []
+        for path in wal_dir.iterdir() if wal_dir.exists() else []:
+            parsed = parse_segment(path.name)
+            if parsed and not parsed[2]:
+                stat = path.stat()
+                segments.append((path.name, parsed[0], parsed[1], stat.st_size, stat.st_mtime))
+        with self._connect() as connection:
+            connection.execute("CREATE TEMPORARY TABLE present (name TEXT PRIMARY KEY)")
+            connection.executemany("INSERT INTO present (name) VALUES (?)", [(segment[0],) for segment in segments])
+            connection.execute("DELETE FROM wal_segments WHERE name NOT IN (SELECT name FROM present)")
+            connection.executemany("INSERT OR IGNORE INTO wal_segments (name, timeline, segment, size, modified) "
+                                   "VALUES (?, ?, ?, ?, ?)", segments)
+        return len(segments)
+
+    def wal_covered_until(self, wal_start: str) -> Optional[float]:
+        """
+        Finds the time a base backup can be recovered to with the WAL archive.
+
+        Args:
+            wal_start (str): The first WAL segment needed by the base backup.
+
+        Returns:
+            Optional[float]: The modification time of the last segment of the unbroken sequence
+                of archived segments starting at `wal_start`, None if `wal_start` is not archived.
+        """
+        timeline, number, _ = parse_segment(wal_start)
+        with self._connect() as connection:
+            segments = connection.execute(
+                "SELECT segment, modified FROM wal_segments WHERE timeline = ? AND segment >= ? ORDER BY segment",
+                (timeline, number)).fetchall()
+        covered_until = None
+        for expected, segment in enumerate(segments, start=number):
+            if segment['segment'] != expected:
+                break
+            covered_until = segment['modified']
+        return covered_until
+
+    def prune_wal(self, wal_dir: Path) -> int:
+        """
+        Deletes the archived WAL segments older than the oldest physical base backup.
+
+        Nothing is deleted while there are no base backups.
+
+        Args:
+            wal_dir (Path): The WAL archive directory.
+
+        Returns:
+            int: The number of segments deleted.
+        """
+        with self._connect() as connection:
+            starts = [row['wal_start'] for row in connection.execute(
+                "SELECT wal_start FROM backups WHERE format = 'base' AND status = 'success' AND wal_start IS NOT NULL")]
+            if not starts:
+                return 0
+            oldest = min(parse_segment(start)[1] for start in starts)
+            expired = connection.execute("SELECT name FROM wal_segments WHERE segment < ?", (oldest,)).fetchall()
+            for segment in expired:
+                (wal_dir / segment['name']).unlink(missing_ok=True)
+            connection.execute("DELETE FROM wal_segments WHERE segment < ?", (oldest,))
+        if expired:
+            logger.info(f"Deleted {len(expired)} WAL segments older than the oldest base backup")
+        return len(expired)
+
+    def prune_binlogs(self, binlog_dir: Path) -> int:
+        """
+        Deletes the archived binary logs older than the oldest dump with binary log coordinates.
+
+        Nothing is deleted while there are no such dumps.
+
+        Args:
+            binlog_dir (Path): The binary log archive directory.
+
+        Returns:
+            int: The number of binary log files deleted.
+        """
+        with self._connect() as connection:
+            starts = [row['binlog_file'] for row in connection.execute(
+                "SELECT DISTINCT binlog_file FROM backups WHERE status = 'success' AND binlog_file IS NOT NULL")
+                if parse_binlog_name(row['binlog_file'])]
+        if not starts:
+            return 0
+        oldest = min(starts, key=lambda name: parse_binlog_name(name)[1])
+        expired = [path for path in list_binlogs(binlog_dir)
+                   if parse_binlog_name(path.name)[1] < parse_binlog_name(oldest)[1]]
+        for path in expired:
+            path.unlink(missing_ok=True)
+        if expired:
+            logger.info(f"Deleted {len(expired)} binary logs older than {oldest}")
+        return len(expired)
+
+    def durations(self, cron_name: str, samples: int = 5) -> Dict[str, List[dict]]:
+        """
+        Finds the durations of the latest successful dumps of each database of a configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            samples (int): The number of dumps kept for each database.
+
+        Returns:
+            Dict[str, List[dict]]: The latest dumps of each database, newest first, with their
+                'duration' in seconds and the 'source_size' of the database in bytes.
+        """
+        durations = {}
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT database, duration, source_size FROM backups WHERE config = ? AND status = 'success' "
+                "AND duration IS NOT NULL ORDER BY timestamp DESC, id DESC", (cron_name,)).fetchall()
+        for row in rows:
+            runs = durations.setdefault(row['database'], [])
+            if len(runs) < samples:
+                runs.append({'duration': row['duration'], 'source_size': row['source_size']})
+        return durations
+
+    def count(self, cron_name: str, db_name: str) -> int:
+        """
+        Counts the successful backups of a database.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+
+        Returns:
+            int: The number of backups.
+        """
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) AS n FROM backups WHERE config = ? AND database = ? AND status = 'success'",
+                (cron_name, db_name)).fetchone()['n']
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the catalog from the backup artifacts on disk.
+
+        The backup tree is expected to follow the `<config>/<year>/<month>/<day>/<database>.<timestamp>.backup`
+        layout, and every artifact found is recorded as successful. The chunks of the chunk store
+        referenced only by recipes no longer on disk are deleted, so no backup should be running.
+
+        Returns:
+            int: The number of artifacts recorded.
+        """
+        logger.info(f"Rebuilding backup catalog {self.path} from {self.backup_dir}")
+        with self._connect() as connection:
+            connection.execute("DELETE FROM backups")
+        recorded = 0
+        recipes = []
+        for config_dir in sorted(p for p in self.backup_dir.iterdir() if p.is_dir() and p != self.chunk_store.root):
+            for artifact in config_dir.glob('*/*/*/*.backup'):
+                if parse_backup_file_name(artifact)[1] is None:
+                    logger.warning(f"Skipping backup with unexpected name: {artifact}")
+                    continue
+                if self.record(config_dir.name, artifact)['compression'] == 'chunks':
+                    recipes.append(artifact)
+                recorded += 1
+        self.chunk_store.prune(recipes)
+        logger.info(f"Backup catalog rebuilt with {recorded} backups")
+        return recorded
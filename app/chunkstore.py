@@ -0,0 +1,497 @@
+from bisect import bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+import logging
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Header of the recipe files stored in place of chunked backups
+RECIPE_MAGIC = b'NDBRECIPE1\n'
+
+# Bounds of the chunk sizes: boundaries are only looked for between the minimum and the maximum size
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# A boundary is cut where the low bits of the window hash are zero, about one candidate in 8192
+BOUNDARY_MASK = (1 << 13) - 1
+
+# Number of bytes before a candidate position hashed to decide whether it is a boundary
+WINDOW_SIZE = 48
+
+# Candidate boundary positions: line ends, and row separators of multi-row INSERT statements
+CANDIDATE_PATTERN = re.compile(rb'\n|\),\(')
+
+# Length of the longest candidate, minus one: a candidate may start this many bytes before the end of a buffer
+CANDIDATE_OVERLAP = 2
+
+# Chunks stored by the running writers and not yet referenced by their recipe, by store root and hash,
+# with the number of writers using them
+_pending: Dict[Tuple[str, str], int] = {}
+_pending_lock = threading.Lock()
+
+
+def find_boundary(buffer: bytes, min_size: int = MIN_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE,
+                  mask: int = BOUNDARY_MASK, start: int = 0) -> Optional[int]:
+    """
+    Finds the end of the first chunk of a buffer with content-defined boundaries.
+
+    Candidate positions after `min_size` bytes are line ends and row separators; a candidate is
+    a boundary when the hash of the `WINDOW_SIZE` bytes before it matches the mask. Boundaries
+    only depend on the bytes around them, so data inserted or removed in a dump only changes
+    the chunks around the change and the following chunks realign on the same boundaries.
+
+    Args:
+        buffer (bytes): The data not yet chunked.
+        min_size (int): The minimum chunk size.
+        max_size (int): The maximum chunk size, cut at when no boundary is found before.
+        mask (int): The mask of the window hash, defining the average distance between boundaries.
+        start (int): The position from which candidates are looked for, when the buffer before
+            it was already searched without finding a boundary.
+
+    Returns:
+        Optional[int]: The length of the first chunk, None if more data is needed to find it.
+    """
+    end = min(len(buffer), max_size)
+    for match in CANDIDATE_PATTERN.finditer(buffer, max(min_size, start), end):
+        position = match.end()
+        if zlib.crc32(buffer[position - WINDOW_SIZE:position]) & mask == 0:
+            return position
+    return max_size if len(buffer) >= max_size else None
+
+
+class ChunkStore:
+    """
+    Content-addressed store of backup chunks, shared by all the backups of a backup directory.
+
+    Chunks are stored once under their SHA-256 hash in `<root>/<hash[:2]>/<hash>`, compressed
+    with zlib when requested. Every chunk is referenced by the recipes of the backups using it,
+    and the references are kept in an SQLite database in the store: a chunk is deleted as soon
+    as the last recipe referencing it is released. The references of a new recipe are recorded
+    at once when it is complete, the chunks stored until then being pending: they are not
+    deleted while a writer of this process uses them.
+
+    Attributes:
+        root (Path): The root directory of the store.
+    """
+
+    DIR_NAME = '.chunks'
+    FILE_NAME = 'refs.sqlite3'
+
+    def __init__(self, root: Path):
+        """
+        Open a chunk store, created on its first write.
+
+        Args:
+            root (Path): The root directory of the store.
+        """
+        self.root = Path(root)
+
+    @contextmanager
+    def _connect(self):
+        """
+        Opens a connection to the reference database, committed and closed on exit.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.root / self.FILE_NAME, timeout=60)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS refs (recipe TEXT NOT NULL, hash TEXT NOT NULL, "
+                                   "PRIMARY KEY (recipe, hash))")
+                connection.execute("CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash)")
+                yield connection
+        finally:
+            connection.close()
+
+    def key(self, recipe_file: Path) -> str:
+        """
+        Returns the key of the references of a recipe, its path relative to the backup directory.
+
+        Args:
+            recipe_file (Path): The recipe file.
+
+        Returns:
+            str: The key.
+        """
+        return os.path.relpath(Path(recipe_file).absolute(), self.root.absolute().parent)
+
+    def chunk_path(self, digest: str) -> Path:
+        """Path of a chunk in the store."""
+        return self.root / digest[:2] / digest
+
+    def _pending_key(self, digest: str) -> Tuple[str, str]:
+        """Key of a chunk in the pending chunks of the process."""
+        return str(self.root.absolute()), digest
+
+    def put(self, data: bytes, compress: bool = False, level: int = 6) -> Tuple[str, int]:
+        """
+        Stores a pending chunk, unless the store already has it.
+
+        The chunk is marked pending before it is looked for, so it cannot be collected by the
+        release of another recipe until `settle` is called, once the recipe using it has
+        recorded its references.
+
+        Args:
+            data (bytes): The chunk.
+            compress (bool): Whether to compress a new chunk with zlib.
+            level (int): The zlib compression level.
+
+        Returns:
+            Tuple[str, int]: The hash of the chunk, and the bytes written to disk, 0 if the
+                chunk was already stored.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with _pending_lock:
+            key = self._pending_key(digest)
+            _pending[key] = _pending.get(key, 0) + 1
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, 0
+        payload = b'Z' + zlib.compress(data, level) if compress else b'R' + data
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, 'wb') as f:
+            f.write(payload)
+        os.replace(temporary, path)
+        return digest, len(payload)
+
+    def get(self, digest: str) -> bytes:
+        """
+        Reads a chunk from the store.
+
+        Args:
+            digest (str): The hash of the chunk.
+
+        Returns:
+            bytes: The chunk.
+
+        Raises:
+            FileNotFoundError: If the chunk is missing from the store.
+        """
+        payload = self.chunk_path(digest).read_bytes()
+        return zlib.decompress(payload[1:]) if payload[:1] == b'Z' else payload[1:]
+
+    def settle(self, digests: Iterable[str], referenced: bool = True) -> int:
+        """
+        Ends the pending state of chunks stored with `put`.
+
+        Args:
+            digests (Iterable[str]): The hashes of the chunks, once per call to `put`.
+            referenced (bool): Whether a recipe references the chunks now; if not, e.g. for a
+                failed dump, the chunks no recipe references are deleted.
+
+        Returns:
+            int: The number of chunks deleted.
+        """
+        with _pending_lock:
+            for digest in digests:
+                key = self._pending_key(digest)
+                _pending[key] -= 1
+                if not _pending[key]:
+                    del _pending[key]
+        if referenced:
+            return 0
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            return self._collect(connection, set(digests))
+
+    def _collect(self, connection, digests: Iterable[str]) -> int:
+        """Deletes the chunks no recipe references and no writer uses, within a transaction."""
+        deleted = 0
+        for digest in digests:
+            if connection.execute("SELECT 1 FROM refs WHERE hash = ? LIMIT 1", (digest,)).fetchone() is not None:
+                continue
+            with _pending_lock:
+                if self._pending_key(digest) in _pending:
+                    continue
+                try:
+                    self.chunk_path(digest).unlink()
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    def reference(self, recipe_file: Path, digests: Iterable[str]) -> None:
+        """
+        Records the references of a recipe to its chunks, e.g. for a new recipe or a hardlinked copy of a recipe.
+
+        Args:
+            recipe_file (Path): The recipe.
+            digests (Iterable[str]): The hashes of its chunks.
+        """
+        key = self.key(recipe_file)
+        with self._connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO refs (recipe, hash) VALUES (?, ?)",
+                                   [(key, digest) for digest in set(digests)])
+
+    def release(self, recipe_file: Path) -> int:
+        """
+        Removes the references of a recipe and deletes the chunks no other recipe references.
+
+        Args:
+            recipe_file (Path): The recipe.
+
+        Returns:
+            int: The number of chunks deleted.
+        """
+        key = self.key(recipe_file)
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            digests = [digest for digest, in connection.execute("SELECT hash FROM refs WHERE recipe = ?", (key,))]
+            connection.execute("DELETE FROM refs WHERE recipe = ?", (key,))
+            deleted = self._collect(connection, digests)
+        if deleted:
+            logger.info(f"Deleted {deleted} chunks no longer referenced after releasing {key}")
+        return deleted
+
+    def prune(self, recipe_files: Iterable[Path]) -> int:
+        """
+        Releases the recipes that are referenced in the store but not in the given list.
+
+        Args:
+            recipe_files (Iterable[Path]): The recipes still in use.
+
+        Returns:
+            int: The number of chunks deleted.
+        """
+        if not (self.root / self.FILE_NAME).exists():
+            return 0
+        keep = {self.key(recipe_file) for recipe_file in recipe_files}
+        with self._connect() as connection:
+            keys = [key for key, in connection.execute("SELECT DISTINCT recipe FROM refs")]
+        return sum(self.release(self.root.parent / key) for key in keys if key not in keep)
+
+
+class ChunkWriter:
+    """
+    Writes a dump to the chunk store, and its recipe in place of the backup file.
+
+    It is used as the output of a ProcessRunner job, which calls `write` with the blocks of
+    the dump in order.
+
+    Attributes:
+        store (ChunkStore): The chunk store.
+        recipe_file (Path): The backup file where the recipe is written.
+        chunks (List[Tuple[str, int]]): The hash and length of the chunks written so far.
+        new_bytes (int): The bytes of the new chunks written to the store.
+    """
+
+    def __init__(self, store: ChunkStore, recipe_file: Path, compress: bool = False, level: int = 6):
+        """
+        Initialize the writer.
+
+        Args:
+            store (ChunkStore): The chunk store.
+            recipe_file (Path): The backup file where the recipe is written.
+            compress (bool): Whether to compress the new chunks with zlib.
+            level (int): The zlib compression level.
+        """
+        self.store = store
+        self.recipe_file = Path(recipe_file)
+        self.compress = compress
+        self.level = level
+        self.chunks: List[Tuple[str, int]] = []
+        self.new_bytes = 0
+        self._buffer = bytearray()
+        # Length of the start of the buffer already searched for a boundary
+        self._searched = 0
+        self._offset = 0
+
+    def _put(self, data: bytes) -> None:
+        """Stores a chunk and appends it to the recipe."""
+        digest, written = self.store.put(data, self.compress, self.level)
+        self.chunks.append((digest, len(data)))
+        self.new_bytes += written
+
+    def write(self, data: bytes) -> int:
+        """
+        Writes a block of the dump, storing the chunks it completes.
+
+        Args:
+            data (bytes): The block.
+
+        Returns:
+            int: The length of the block.
+        """
+        self._buffer += data
+        self._offset += len(data)
+        while True:
+            cut = find_boundary(self._buffer, start=self._searched)
+            if cut is None:
+                self._searched = max(0, len(self._buffer) - CANDIDATE_OVERLAP)
+                break
+            self._put(bytes(self._buffer[:cut]))
+            del self._buffer[:cut]
+            self._searched = 0
+        return len(data)
+
+    def tell(self) -> int:
+        """Returns the number of bytes written so far."""
+        return self._offset
+
+    def close(self) -> dict:
+        """
+        Stores the last chunk, records the references of the recipe and writes it.
+
+        Returns:
+            dict: The recipe.
+        """
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer = bytearray()
+        digests = [digest for digest, _ in self.chunks]
+        try:
+            self.store.reference(self.recipe_file, digests)
+        except BaseException:
+            self.abort()
+            raise
+        self.store.settle(digests)
+        recipe = {
+            'store': os.path.relpath(self.store.root.absolute(), self.recipe_file.absolute().parent),
+            'compression': 'zlib' if self.compress else None,
+            'size': self._offset,
+            'new_bytes': self.new_bytes,
+            'chunks': self.chunks,
+        }
+        with open(self.recipe_file, 'wb') as f:
+            f.write(RECIPE_MAGIC + json.dumps(recipe).encode('utf-8'))
+        logger.info(f"Backup {self.recipe_file} stored as {len(self.chunks)} chunks, "
+                    f"{self.new_bytes} new bytes for {self._offset} bytes of dump")
+        return recipe
+
+    def abort(self) -> None:
+        """Deletes the chunks of a failed dump no other recipe references, without writing its recipe."""
+        self.store.settle([digest for digest, _ in self.chunks], referenced=False)
+        self.chunks = []
+
+
+def is_recipe(path: Path) -> bool:
+    """
+    Checks whether a backup file is the recipe of a chunked backup.
+
+    Args:
+        path (Path): The backup file.
+
+    Returns:
+        bool: True if the file is a recipe.
+    """
+    if not path.is_file():
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(RECIPE_MAGIC)) == RECIPE_MAGIC
+
+
+def read_recipe(path: Path) -> dict:
+    """
+    Reads the recipe of a chunked backup.
+
+    Args:
+        path (Path): The recipe file.
+
+    Returns:
+        dict: The recipe.
+    """
+    with open(path, 'rb') as f:
+        return json.loads(f.read()[len(RECIPE_MAGIC):])
+
+
+class RecipeReader:
+    """
+    Reads a chunked backup as a file, loading its chunks from the store as they are needed.
+
+    Attributes:
+        recipe (dict): The recipe of the backup.
+        store (ChunkStore): The chunk store of the recipe.
+    """
+
+    def __init__(self, recipe_file: Path):
+        """
+        Open a chunked backup.
+
+        Args:
+            recipe_file (Path): The recipe file.
+        """
+        self.recipe = read_recipe(recipe_file)
+        self.store = ChunkStore(Path(recipe_file).parent / self.recipe['store'])
+        self._starts = []
+        offset = 0
+        for _, length in self.recipe['chunks']:
+            self._starts.append(offset)
+            offset += length
+        self._position = 0
+        self._chunk_index = None
+        self._chunk = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Iterates over the lines of the backup."""
+        pending = b''
+        while True:
+            block = self.read(1024 * 1024)
+            if not block:
+                break
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """Moves to a position of the uncompressed backup."""
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.recipe['size']
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        """Returns the current position in the uncompressed backup."""
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads bytes of the uncompressed backup from the current position.
+
+        Args:
+            size (int): The maximum number of bytes to read, -1 for the rest of the backup.
+
+        Returns:
+            bytes: The bytes read, empty at the end of the backup.
+        """
+        if size < 0:
+            size = self.recipe['size'] - self._position
+        blocks = []
+        while size > 0 and self._position < self.recipe['size']:
+            index = bisect_right(self._starts, self._position) - 1
+            if index != self._chunk_index:
+                self._chunk = self.store.get(self.recipe['chunks'][index][0])
+                self._chunk_index = index
+            start = self._position - self._starts[index]
+            block = self._chunk[start:start + size]
+            blocks.append(block)
+            self._position += len(block)
+            size -= len(block)
+        return b''.join(blocks)
+
+    def close(self) -> None:
+        """Releases the chunk in memory."""
+        self._chunk, self._chunk_index = b'', None
@@ -0,0 +1,240 @@
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+import logging
+
+from app.chunkstore import ChunkStore, ChunkWriter, RecipeReader, is_recipe
+from app.process import default_runner
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Compression codecs, with the commands compressing stdin to stdout and decompressing a file
+# to stdout, the magic bytes identifying their output and their default level
+CODECS = {
+    'zstd': {
+        'compress': ['zstd', '-q', '-c', '-{level}', '-T{threads}'],
+        'decompress': ['zstd', '-q', '-d', '-c'],
+        'magic': b'\x28\xb5\x2f\xfd',
+        'default_level': 3,
+    },
+    'lz4': {
+        'compress': ['lz4', '-q', '-c', '-{level}'],
+        'decompress': ['lz4', '-q', '-d', '-c'],
+        'magic': b'\x04\x22\x4d\x18',
+        'default_level': 1,
+    },
+    'gzip': {
+        'compress': ['gzip', '-c', '-{level}'],
+        'decompress': ['gzip', '-d', '-c'],
+        'magic': b'\x1f\x8b',
+        'default_level': 6,
+    },
+}
+
+
+def compress_command(codec: str, level: Optional[int] = None, threads: int = 0) -> List[str]:
+    """
+    Builds the command compressing its standard input to its standard output.
+
+    Args:
+        codec (str): The compression codec, one of CODECS.
+        level (int): The compression level, the codec default if None.
+        threads (int): The number of compression threads, 0 for one per core (zstd only).
+
+    Returns:
+        List[str]: The argv of the compression command.
+    """
+    if level is None:
+        level = CODECS[codec]['default_level']
+    return [arg.format(level=level, threads=threads) for arg in CODECS[codec]['compress']]
+
+
+def decompress_command(codec: str, source_file: Path) -> List[str]:
+    """
+    Builds the command decompressing a file to its standard output.
+
+    Args:
+        codec (str): The compression codec, one of CODECS.
+        source_file (Path): The compressed file.
+
+    Returns:
+        List[str]: The argv of the decompression command.
+    """
+    return CODECS[codec]['decompress'] + [str(source_file)]
+
+
+def zlib_level(compression_level: Optional[int]) -> int:
+    """
+    Maps a codec compression level to the zlib level used for the chunks of the chunk store.
+
+    Args:
+        compression_level (int): The compression level, the default if None.
+
+    Returns:
+        int: The zlib level, between 1 and 9.
+    """
+    return 6 if compression_level is None else min(max(compression_level, 1), 9)
+
+
+def read_stages(source_file: Path) -> Tuple[List[List[str]], object]:
+    """
+    Builds the first stages and the input of a pipeline reading the uncompressed content of a backup.
+
+    Compressed backups are read by a decompression stage and chunked backups are streamed
+    from the chunk store, while plain backups are read directly by the next stage.
+
+    Args:
+        source_file (Path): The backup file.
+
+    Returns:
+        Tuple[List[List[str]], object]: The argv of the stages to put before the reading
+            command, and the standard input of the pipeline (a Path, a RecipeReader or None).
+    """
+    if is_recipe(source_file):
+        return [], RecipeReader(source_file)
+    codec = detect_codec(source_file)
+    if codec:
+        return [decompress_command(codec, source_file)], None
+    return [], source_file
+
+
+class LineWriter:
+    """
+    Writer passing the lines of the blocks it receives, e.g. the output of a job, to a callback.
+    """
+
+    def __init__(self, callback: Callable[[bytes], None]):
+        """
+        Initialize the writer.
+
+        Args:
+            callback (callable): Called with each line, including its line feed.
+        """
+        self._callback = callback
+        # Parts of the line not ended yet, joined once its end is received
+        self._partial: List[bytes] = []
+
+    def write(self, block: bytes) -> int:
+        """
+        Passes the complete lines of a block to the callback, keeping the last partial line.
+
+        Args:
+            block (bytes): The block.
+
+        Returns:
+            int: The size of the block.
+        """
+        lines = block.split(b'\n')
+        if len(lines) > 1:
+            self._partial.append(lines[0])
+            lines[0] = b''.join(self._partial)
+            self._partial = []
+            for line in lines[:-1]:
+                self._callback(line + b'\n')
+        if lines[-1]:
+            self._partial.append(lines[-1])
+        return len(block)
+
+    def close(self) -> None:
+        """Passes the last line to the callback if it has no line feed."""
+        if self._partial:
+            self._callback(b''.join(self._partial))
+            self._partial = []
+
+
+def scan_lines(source_file: Path, callback: Callable[[bytes], None], name: str = None,
+               timeout: float = None) -> None:
+    """
+    Passes the uncompressed lines of a backup file to a callback.
+
+    Compressed backups are decompressed by a job of the shared process runner, so the scan
+    can be cancelled and times out like the other restore steps.
+
+    Args:
+        source_file (Path): The backup file.
+        callback (callable): Called with each line, including its line feed.
+        name (str): The name of the decompression job, used to cancel it.
+        timeout (float): The maximum duration of the decompression in seconds, None for no limit.
+
+    Raises:
+        subprocess.CalledProcessError: If the decompression fails.
+        subprocess.TimeoutExpired: If the decompression exceeds its timeout.
+        JobCancelled: If the decompression is cancelled.
+    """
+    stages, stdin = read_stages(source_file)
+    if stages:
+        writer = LineWriter(callback)
+        default_runner().run(stages, name=name, stdin=stdin, stdout=writer, timeout=timeout)
+        writer.close()
+        return
+    with (stdin if hasattr(stdin, 'read') else open(stdin, 'rb')) as lines:
+        for line in lines:
+            callback(line)
+
+
+def detect_codec(source_file: Path) -> Optional[str]:
+    """
+    Detects the codec a backup file was compressed with from its magic bytes.
+
+    Args:
+        source_file (Path): The backup file.
+
+    Returns:
+        Optional[str]: The codec name, or None if the file is not compressed or is a directory.
+    """
+    if not source_file.is_file():
+        return None
+    with open(source_file, 'rb') as f:
+        header = f.read(4)
+    for codec, settings in CODECS.items():
+        if header.startswith(settings['magic']):
+            return codec
+    return None
+
+
+def stream_to_file(command: List[str], destination_file: Path, compression: Optional[str] = None,
+                   compression_level: Optional[int] = None, compression_threads: int = 0, env: dict = None,
+                   timeout: float = None, name: str = None, chunk_store: Optional[ChunkStore] = None) -> int:
+    """
+    Runs a dump command and streams its standard output to a file, through a compression
+    process if a codec is given.
+
+    The output is copied block by block on the event loop of the shared process runner, so
+    the dump is never held in memory nor written uncompressed to disk.
+
+    With a chunk store, the dump is split into content-defined chunks stored once in the
+    store, compressed with zlib if a codec is given, and the file is the recipe of the backup.
+
+    Args:
+        command (List[str]): The argv of the dump command writing the dump to its standard output.
+        destination_file (Path): The file where the dump will be stored.
+        compression (str): The compression codec, None to store the dump uncompressed.
+        compression_level (int): The compression level, the codec default if None.
+        compression_threads (int): The number of compression threads, 0 for one per core.
+        env (dict): Environment variables added to the environment of the dump command.
+        timeout (float): The maximum duration of the dump in seconds, None for no limit.
+        name (str): The name of the job, used to cancel it.
+        chunk_store (ChunkStore): The chunk store of the backup, None to write the dump to the file.
+
+    Returns:
+        int: The number of uncompressed bytes produced by the dump command.
+
+    Raises:
+        subprocess.CalledProcessError: If the dump or the compression command fails.
+        subprocess.TimeoutExpired: If the dump exceeds its timeout.
+        JobCancelled: If the dump is cancelled.
+    """
+    if chunk_store:
+        writer = ChunkWriter(chunk_store, destination_file, bool(compression), zlib_level(compression_level))
+        try:
+            dump_bytes = default_runner().run([command], name=name, stdout=writer, env=env, timeout=timeout)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return dump_bytes
+    stages = [command]
+    if compression:
+        stages.append(compress_command(compression, compression_level, compression_threads))
+    return default_runner().run(stages, name=name, stdout=destination_file, env=env, timeout=timeout)
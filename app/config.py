@@ -1,5 +1,8 @@
 import os
+import copy
 import json
+import re
+import socket
 from pathlib import Path
 import logging
 
@@ -21,9 +24,68 @@ class Config:
     # Backup configurations
     CRON_CONFIGS = os.getenv('CRON_CONFIGS', '0 0 * * *')
     BACKUP_DIR = Path('/backups')
+    BACKUP_CONCURRENCY = int(os.getenv('BACKUP_CONCURRENCY', 1))  # databases dumped at the same time
+    BACKUP_COMPRESSION = os.getenv('BACKUP_COMPRESSION', 'none')  # 'none', 'zstd', 'lz4' or 'gzip'
+    BACKUP_COMPRESSION_LEVEL = os.getenv('BACKUP_COMPRESSION_LEVEL')  # codec default if not set
+    BACKUP_COMPRESSION_LEVEL = int(BACKUP_COMPRESSION_LEVEL) if BACKUP_COMPRESSION_LEVEL else None
+    BACKUP_COMPRESSION_THREADS = int(os.getenv('BACKUP_COMPRESSION_THREADS', 0))  # 0 means one per core
+    BACKUP_SKIP_UNCHANGED = os.getenv('BACKUP_SKIP_UNCHANGED', 'false').lower() == 'true'
+    BACKUP_TIMEOUT = float(os.getenv('BACKUP_TIMEOUT', 0)) or None  # seconds, no limit if 0
+    BACKUP_STORAGE = os.getenv('BACKUP_STORAGE', 'files')  # 'files' or 'chunks' for the deduplicated chunk store
+    BACKUP_INDEX = os.getenv('BACKUP_INDEX', 'true').lower() == 'true'  # sidecar table index for single-table restore
+    BACKUP_DELTA = os.getenv('BACKUP_DELTA', 'false').lower() == 'true'  # zstd deltas against the latest full backup
+    BACKUP_DELTA_FULL_EVERY = int(os.getenv('BACKUP_DELTA_FULL_EVERY', 24))  # deltas between two full backups
+    BACKUP_INCREMENTAL = os.getenv('BACKUP_INCREMENTAL', 'false').lower() == 'true'  # reuse unchanged tables
+    BACKUP_BINLOG = os.getenv('BACKUP_BINLOG', 'false').lower() == 'true'  # archive binary logs, replayed on restore
+
+    # Load settings, the server being overloaded above the active sessions or replication lag thresholds
+    BACKUP_LOAD_MAX_ACTIVE = os.getenv('BACKUP_LOAD_MAX_ACTIVE')  # no limit if not set
+    BACKUP_LOAD_MAX_ACTIVE = int(BACKUP_LOAD_MAX_ACTIVE) if BACKUP_LOAD_MAX_ACTIVE else None
+    BACKUP_LOAD_MAX_LAG = os.getenv('BACKUP_LOAD_MAX_LAG')  # seconds, no limit if not set
+    BACKUP_LOAD_MAX_LAG = float(BACKUP_LOAD_MAX_LAG) if BACKUP_LOAD_MAX_LAG else None
+    BACKUP_LOAD_DEFER_MAX = float(os.getenv('BACKUP_LOAD_DEFER_MAX', 0))  # seconds a run waits for the load to drop
+    BACKUP_LOAD_CONCURRENCY = int(os.getenv('BACKUP_LOAD_CONCURRENCY', 1))  # databases dumped at once when overloaded
+    BACKUP_LOAD_RATE_LIMIT_MB = os.getenv('BACKUP_LOAD_RATE_LIMIT_MB')  # MB/s when overloaded, no limit if not set
+    BACKUP_LOAD_RATE_LIMIT_MB = float(BACKUP_LOAD_RATE_LIMIT_MB) if BACKUP_LOAD_RATE_LIMIT_MB else None
+    BACKUP_LOAD_CHECK_INTERVAL = float(os.getenv('BACKUP_LOAD_CHECK_INTERVAL', 30))  # seconds between load samples
+
+    # Throttle settings, limiting the write rate and the priority of the dumps
+    BACKUP_RATE_LIMIT_MB = os.getenv('BACKUP_RATE_LIMIT_MB')  # MB/s of each dump, no limit if not set
+    BACKUP_RATE_LIMIT_MB = float(BACKUP_RATE_LIMIT_MB) if BACKUP_RATE_LIMIT_MB else None
+    BACKUP_GLOBAL_RATE_LIMIT_MB = os.getenv('BACKUP_GLOBAL_RATE_LIMIT_MB')  # MB/s of all the dumps, no limit if not set
+    BACKUP_GLOBAL_RATE_LIMIT_MB = float(BACKUP_GLOBAL_RATE_LIMIT_MB) if BACKUP_GLOBAL_RATE_LIMIT_MB else None
+    BACKUP_NICE = os.getenv('BACKUP_NICE')  # 0 to 19, priority unchanged if not set
+    BACKUP_NICE = int(BACKUP_NICE) if BACKUP_NICE else None
+    BACKUP_IONICE_CLASS = os.getenv('BACKUP_IONICE_CLASS') or None  # 'best-effort' or 'idle', unchanged if not set
+    BACKUP_IONICE_LEVEL = os.getenv('BACKUP_IONICE_LEVEL')  # 0 to 7 within the 'best-effort' class
+    BACKUP_IONICE_LEVEL = int(BACKUP_IONICE_LEVEL) if BACKUP_IONICE_LEVEL else None
+
+    # Scheduling settings, for runs overlapping or missing their fire time
+    BACKUP_MAX_INSTANCES = int(os.getenv('BACKUP_MAX_INSTANCES', 1))  # runs of a configuration going at the same time
+    BACKUP_COALESCE = os.getenv('BACKUP_COALESCE', 'true').lower() == 'true'  # skip overrunning runs instead of queuing
+    BACKUP_MISFIRE_GRACE_TIME = float(os.getenv('BACKUP_MISFIRE_GRACE_TIME', 60))  # seconds, no limit if 0
+    BACKUP_JITTER = float(os.getenv('BACKUP_JITTER', 0))  # seconds the runs of this instance are shifted by, at most
+    BACKUP_INSTANCE_ID = os.getenv('BACKUP_INSTANCE_ID') or socket.gethostname()  # seeds the jitter of this instance
+
+    # API settings
+    CANCEL_TOKEN = os.getenv('CANCEL_TOKEN') or None  # bearer token of POST /cancel, disabled if not set
+
+    # Health settings
+    HEALTH_MAX_INTERVALS = float(os.getenv('HEALTH_MAX_INTERVALS', 2))  # max fire times since the latest success
+    HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', 50))  # runs kept in memory per configuration and database
+
+    # Target settings, for several database servers backed up by the same process
+    TARGETS = os.getenv('TARGETS')  # JSON list of targets, only the DB_* server if not set
+    BACKUP_WORKERS = int(os.getenv('BACKUP_WORKERS', 4))  # databases dumped at the same time over all the targets
+    BACKUP_HOST_CONCURRENCY = os.getenv('BACKUP_HOST_CONCURRENCY')  # dumps at once per host, no limit if not set
+    BACKUP_HOST_CONCURRENCY = int(BACKUP_HOST_CONCURRENCY) if BACKUP_HOST_CONCURRENCY else None
 
     # Restore settings
     RESTORE_CONFIG_NAME = os.getenv('RESTORE_CONFIG_NAME', '')
+    RESTORE_TARGET = os.getenv('RESTORE_TARGET', '')  # target of the startup restore, the first one if not set
+    RESTORE_JOBS = int(os.getenv('RESTORE_JOBS', 1))  # parallel pg_restore jobs
+    RESTORE_SWAP = os.getenv('RESTORE_SWAP', 'false').lower() == 'true'  # load into a shadow database, then swap
+    RESTORE_TIMEOUT = float(os.getenv('RESTORE_TIMEOUT', 0)) or None  # seconds per restore step, no limit if 0
 
     # Parse CRON_CONFIGS from environment variable
     try:
@@ -35,16 +97,144 @@ class Config:
                 raise ValueError("Each configuration must contain a 'cron' key.")
             if len(cron_configs) > 1 and 'name' not in config:
                 raise ValueError("Each configuration must contain a 'name' key if there are multiple configurations.")
-            # Set default value for retention_max if not provided
-            config.setdefault('retention_max', 90)
             if 'name' not in config:
                 config['name'] = 'default'
-        CRON_CONFIGS = cron_configs
-        logger.info(f"Parsed CRON_CONFIGS: {CRON_CONFIGS}")
+        logger.info(f"Parsed CRON_CONFIGS: {cron_configs}")
     except json.JSONDecodeError:
         # Assume the CRON_CONFIGS is a single cron string and wrap it in a list of dicts
-        CRON_CONFIGS = [{"cron": CRON_CONFIGS, "retention_max": 90, "name": "default"}]
-        logger.info(f"Using single cron configuration: {CRON_CONFIGS}")
+        cron_configs = [{"cron": CRON_CONFIGS, "name": "default"}]
+        logger.info(f"Using single cron configuration: {cron_configs}")
+
+    # Parse TARGETS, each target inheriting the DB_* settings and the CRON_CONFIGS it does not set
+    if TARGETS:
+        targets = json.loads(TARGETS)
+        if not isinstance(targets, list) or not targets:
+            raise ValueError("TARGETS must be a non-empty list of dictionaries.")
+        for target in targets:
+            if 'name' not in target or 'type' not in target:
+                raise ValueError("Each target must contain a 'name' and a 'type' key.")
+            if not re.fullmatch(r'[A-Za-z0-9_.-]+', target['name']):
+                raise ValueError("The 'name' key of a target must only contain letters, digits, '_', '.' and '-'.")
+            if target['type'] not in ('mysql', 'postgres', 'postgis'):
+                raise ValueError("The 'type' key of a target must be one of 'mysql', 'postgres' or 'postgis'.")
+            target.setdefault('host', DB_HOST)
+            target.setdefault('port', 3306 if target['type'] == 'mysql' else 5432)
+            target.setdefault('user', DB_USER)
+            target.setdefault('password', DB_PASSWORD)
+            target.setdefault('maintenance_db', target['user'])
+            target.setdefault('concurrency', None)
+            target.setdefault('cron_configs', copy.deepcopy(cron_configs))
+            if isinstance(target['cron_configs'], str):
+                target['cron_configs'] = [{"cron": target['cron_configs'], "name": "default"}]
+            for config in target['cron_configs']:
+                if 'cron' not in config:
+                    raise ValueError("Each configuration must contain a 'cron' key.")
+                if len(target['cron_configs']) > 1 and 'name' not in config:
+                    raise ValueError("Each configuration must contain a 'name' key if there are multiple "
+                                     "configurations.")
+                config.setdefault('name', 'default')
+            if target['concurrency'] is not None and target['concurrency'] < 1:
+                raise ValueError("The 'concurrency' key of a target must be at least 1.")
+        if len({target['name'] for target in targets}) != len(targets):
+            raise ValueError("The names of the targets must be unique.")
+        logger.info(f"Parsed TARGETS: {[target['name'] for target in targets]}")
+    else:
+        targets = [{'name': None, 'type': DB_TYPE, 'host': DB_HOST, 'port': DB_PORT, 'user': DB_USER,
+                    'password': DB_PASSWORD, 'maintenance_db': DB_MAINTENANCE_NAME, 'concurrency': None,
+                    'cron_configs': cron_configs}]
+
+    # Set default values for the optional keys not provided
+    for target in targets:
+        for config in target['cron_configs']:
+            config.setdefault('retention_max', 90)
+            config.setdefault('concurrency', BACKUP_CONCURRENCY)
+            config.setdefault('dump_format', 'custom')
+            config.setdefault('dump_jobs', 1)
+            config.setdefault('dump_profile', 'copy')
+            config.setdefault('dump_chunk_mb', 512)
+            config.setdefault('compression', BACKUP_COMPRESSION)
+            config.setdefault('compression_level', BACKUP_COMPRESSION_LEVEL)
+            config.setdefault('compression_threads', BACKUP_COMPRESSION_THREADS)
+            config.setdefault('skip_unchanged', BACKUP_SKIP_UNCHANGED)
+            config.setdefault('timeout', BACKUP_TIMEOUT)
+            config.setdefault('index', BACKUP_INDEX)
+            config.setdefault('storage', BACKUP_STORAGE)
+            config.setdefault('mode', 'logical')
+            config.setdefault('delta', BACKUP_DELTA)
+            config.setdefault('delta_full_every', BACKUP_DELTA_FULL_EVERY)
+            config.setdefault('incremental', BACKUP_INCREMENTAL)
+            config.setdefault('binlog', BACKUP_BINLOG)
+            config.setdefault('load_max_active', BACKUP_LOAD_MAX_ACTIVE)
+            config.setdefault('load_max_lag', BACKUP_LOAD_MAX_LAG)
+            config.setdefault('load_defer_max', BACKUP_LOAD_DEFER_MAX)
+            config.setdefault('load_concurrency', BACKUP_LOAD_CONCURRENCY)
+            config.setdefault('load_rate_limit_mb', BACKUP_LOAD_RATE_LIMIT_MB)
+            config.setdefault('load_check_interval', BACKUP_LOAD_CHECK_INTERVAL)
+            config.setdefault('rate_limit_mb', BACKUP_RATE_LIMIT_MB)
+            config.setdefault('nice', BACKUP_NICE)
+            config.setdefault('ionice_class', BACKUP_IONICE_CLASS)
+            config.setdefault('ionice_level', BACKUP_IONICE_LEVEL)
+            config.setdefault('max_instances', BACKUP_MAX_INSTANCES)
+            config.setdefault('coalesce', BACKUP_COALESCE)
+            config.setdefault('misfire_grace_time', BACKUP_MISFIRE_GRACE_TIME)
+            config.setdefault('jitter', BACKUP_JITTER)
+            config.setdefault('health_max_intervals', HEALTH_MAX_INTERVALS)
+            if config['compression'] == 'none':
+                config['compression'] = None
+            if config['dump_format'] not in ('custom', 'directory', 'bundle'):
+                raise ValueError("The 'dump_format' key must be one of 'custom', 'directory' or 'bundle'.")
+            if config['dump_format'] == 'bundle' and target['type'] not in ('postgres', 'postgis'):
+                raise ValueError("The 'bundle' dump format is only supported by postgres and postgis.")
+            if config['dump_profile'] not in ('copy', 'inserts', 'schema-only'):
+                raise ValueError("The 'dump_profile' key must be one of 'copy', 'inserts' or 'schema-only'.")
+            if config['compression'] not in (None, 'zstd', 'lz4', 'gzip'):
+                raise ValueError("The 'compression' key must be one of 'none', 'zstd', 'lz4' or 'gzip'.")
+            if config['storage'] not in ('files', 'chunks'):
+                raise ValueError("The 'storage' key must be either 'files' or 'chunks'.")
+            if config['mode'] not in ('logical', 'physical'):
+                raise ValueError("The 'mode' key must be either 'logical' or 'physical'.")
+            if config['mode'] == 'physical' and target['type'] not in ('postgres', 'postgis'):
+                raise ValueError("The 'physical' mode is only supported by postgres and postgis.")
+            if config['delta'] and config['dump_format'] != 'custom':
+                raise ValueError("The 'delta' key requires the 'custom' dump format.")
+            if config['delta_full_every'] < 1:
+                raise ValueError("The 'delta_full_every' key must be at least 1.")
+            if config['incremental'] and config['dump_format'] != 'directory':
+                raise ValueError("The 'incremental' key requires the 'directory' dump format.")
+            if config['binlog'] and target['type'] != 'mysql':
+                raise ValueError("The 'binlog' key is only supported by mysql.")
+            if config['binlog'] and config['delta']:
+                raise ValueError("The 'binlog' key cannot be combined with the 'delta' key.")
+            if config['load_defer_max'] < 0:
+                raise ValueError("The 'load_defer_max' key must not be negative.")
+            if config['load_concurrency'] < 1:
+                raise ValueError("The 'load_concurrency' key must be at least 1.")
+            if config['load_rate_limit_mb'] is not None and config['load_rate_limit_mb'] <= 0:
+                raise ValueError("The 'load_rate_limit_mb' key must be positive.")
+            if config['load_check_interval'] <= 0:
+                raise ValueError("The 'load_check_interval' key must be positive.")
+            if config['rate_limit_mb'] is not None and config['rate_limit_mb'] <= 0:
+                raise ValueError("The 'rate_limit_mb' key must be positive.")
+            if config['nice'] is not None and not 0 <= config['nice'] <= 19:
+                raise ValueError("The 'nice' key must be between 0 and 19.")
+            if config['ionice_class'] not in (None, 'best-effort', 'idle'):
+                raise ValueError("The 'ionice_class' key must be either 'best-effort' or 'idle'.")
+            if config['ionice_level'] is not None and not 0 <= config['ionice_level'] <= 7:
+                raise ValueError("The 'ionice_level' key must be between 0 and 7.")
+            if config['max_instances'] < 1:
+                raise ValueError("The 'max_instances' key must be at least 1.")
+            if config['misfire_grace_time'] < 0:
+                raise ValueError("The 'misfire_grace_time' key must not be negative.")
+            if config['jitter'] < 0:
+                raise ValueError("The 'jitter' key must not be negative.")
+    if BACKUP_WORKERS < 1:
+        raise ValueError("BACKUP_WORKERS must be at least 1.")
+    if BACKUP_HOST_CONCURRENCY is not None and BACKUP_HOST_CONCURRENCY < 1:
+        raise ValueError("BACKUP_HOST_CONCURRENCY must be at least 1.")
+    if BACKUP_GLOBAL_RATE_LIMIT_MB is not None and BACKUP_GLOBAL_RATE_LIMIT_MB <= 0:
+        raise ValueError("BACKUP_GLOBAL_RATE_LIMIT_MB must be positive.")
+    CRON_CONFIGS = targets[0]['cron_configs']
+    TARGETS = targets
 
     # Log final configurations
     logger.info(f"DB_HOST: {DB_HOST}")
@@ -54,5 +244,39 @@ class Config:
     logger.info(f"DB_NAME: {DB_MAINTENANCE_NAME}")
     logger.info(f"DB_TYPE: {DB_TYPE}")
     logger.info(f"BACKUP_DIR: {BACKUP_DIR}")
+    logger.info(f"BACKUP_CONCURRENCY: {BACKUP_CONCURRENCY}")
+    logger.info(f"BACKUP_COMPRESSION: {BACKUP_COMPRESSION}")
+    logger.info(f"BACKUP_SKIP_UNCHANGED: {BACKUP_SKIP_UNCHANGED}")
+    logger.info(f"BACKUP_TIMEOUT: {BACKUP_TIMEOUT}")
+    logger.info(f"BACKUP_INDEX: {BACKUP_INDEX}")
+    logger.info(f"BACKUP_STORAGE: {BACKUP_STORAGE}")
+    logger.info(f"BACKUP_DELTA: {BACKUP_DELTA}")
+    logger.info(f"BACKUP_DELTA_FULL_EVERY: {BACKUP_DELTA_FULL_EVERY}")
+    logger.info(f"BACKUP_INCREMENTAL: {BACKUP_INCREMENTAL}")
+    logger.info(f"BACKUP_BINLOG: {BACKUP_BINLOG}")
+    logger.info(f"BACKUP_LOAD_MAX_ACTIVE: {BACKUP_LOAD_MAX_ACTIVE}")
+    logger.info(f"BACKUP_LOAD_MAX_LAG: {BACKUP_LOAD_MAX_LAG}")
+    logger.info(f"BACKUP_LOAD_DEFER_MAX: {BACKUP_LOAD_DEFER_MAX}")
+    logger.info(f"BACKUP_LOAD_CONCURRENCY: {BACKUP_LOAD_CONCURRENCY}")
+    logger.info(f"BACKUP_LOAD_RATE_LIMIT_MB: {BACKUP_LOAD_RATE_LIMIT_MB}")
+    logger.info(f"BACKUP_LOAD_CHECK_INTERVAL: {BACKUP_LOAD_CHECK_INTERVAL}")
+    logger.info(f"BACKUP_RATE_LIMIT_MB: {BACKUP_RATE_LIMIT_MB}")
+    logger.info(f"BACKUP_GLOBAL_RATE_LIMIT_MB: {BACKUP_GLOBAL_RATE_LIMIT_MB}")
+    logger.info(f"BACKUP_NICE: {BACKUP_NICE}")
+    logger.info(f"BACKUP_IONICE_CLASS: {BACKUP_IONICE_CLASS}")
+    logger.info(f"BACKUP_IONICE_LEVEL: {BACKUP_IONICE_LEVEL}")
+    logger.info(f"BACKUP_MAX_INSTANCES: {BACKUP_MAX_INSTANCES}")
+    logger.info(f"BACKUP_COALESCE: {BACKUP_COALESCE}")
+    logger.info(f"BACKUP_MISFIRE_GRACE_TIME: {BACKUP_MISFIRE_GRACE_TIME}")
+    logger.info(f"BACKUP_JITTER: {BACKUP_JITTER}")
+    logger.info(f"BACKUP_INSTANCE_ID: {BACKUP_INSTANCE_ID}")
     logger.info(f"CRON_CONFIGS: {CRON_CONFIGS}")
+    logger.info(f"TARGETS: {[(target['name'], target['type'], target['host']) for target in TARGETS]}")
+    logger.info(f"BACKUP_WORKERS: {BACKUP_WORKERS}")
+    logger.info(f"BACKUP_HOST_CONCURRENCY: {BACKUP_HOST_CONCURRENCY}")
+    logger.info(f"CANCEL_TOKEN: {'set' if CANCEL_TOKEN else None}")
+    logger.info(f"HEALTH_MAX_INTERVALS: {HEALTH_MAX_INTERVALS}")
     logger.info(f"RESTORE_CONFIG_NAME: {RESTORE_CONFIG_NAME}")
+    logger.info(f"RESTORE_TARGET: {RESTORE_TARGET}")
+    logger.info(f"RESTORE_JOBS: {RESTORE_JOBS}")
+    logger.info(f"RESTORE_SWAP: {RESTORE_SWAP}")
@@ -0,0 +1,314 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+import json
+import os
+import shutil
+import tempfile
+import logging
+
+from app.compression import CODECS, compress_command, read_stages
+from app.index import index_path
+from app.process import default_runner
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Suffix of the sidecar file describing a delta backup and its base
+DELTA_SUFFIX = '.delta'
+
+# Version of the delta sidecar layout, bumped on incompatible changes
+DELTA_VERSION = 1
+
+# Suffix of the uncompressed copy of a base, kept beside it while deltas are made against it
+BASE_CACHE_SUFFIX = '.raw'
+
+# Window log of the delta decompression, allowing references up to the largest zstd window (2 GB)
+DELTA_WINDOW_LOG = 31
+
+# Size from which zstd refuses the base or the file of a delta (--patch-from), the largest zstd window
+DELTA_MAX_SIZE = 1 << DELTA_WINDOW_LOG
+
+
+def delta_path(backup_file: Path) -> Path:
+    """
+    Returns the path of the delta sidecar of a backup.
+
+    Args:
+        backup_file (Path): The backup file.
+
+    Returns:
+        Path: The sidecar path, `<backup>.delta`.
+    """
+    return backup_file.with_name(backup_file.name + DELTA_SUFFIX)
+
+
+def base_cache_path(base_file: Path) -> Path:
+    """
+    Returns the path of the uncompressed copy of a base backup.
+
+    Args:
+        base_file (Path): The base backup file.
+
+    Returns:
+        Path: The cache path, `<backup>.raw`.
+    """
+    return base_file.with_name(base_file.name + BASE_CACHE_SUFFIX)
+
+
+def read_delta(backup_file: Path) -> Optional[dict]:
+    """
+    Reads the delta sidecar of a backup.
+
+    Args:
+        backup_file (Path): The backup file.
+
+    Returns:
+        Optional[dict]: The sidecar, with the 'base' path relative to the directory of the
+            backup and the 'sequence' number of the delta, None if the backup is not a delta.
+    """
+    path = delta_path(backup_file)
+    if not path.exists():
+        return None
+    delta = json.loads(path.read_text())
+    if delta.get('version') != DELTA_VERSION:
+        raise ValueError(f"Delta {path} has unsupported version {delta.get('version')}")
+    return delta
+
+
+def write_delta(backup_file: Path, base_file: Path, sequence: int) -> Path:
+    """
+    Writes the delta sidecar of a backup, replacing the previous one atomically.
+
+    The base is recorded relative to the directory of the backup, and must be written again
+    for the copies of the backup published into the trees of other cron configurations.
+
+    Args:
+        backup_file (Path): The delta backup file.
+        base_file (Path): The full backup the delta was made against.
+        sequence (int): The number of deltas made against the base up to this one.
+
+    Returns:
+        Path: The sidecar path.
+    """
+    path = delta_path(backup_file)
+    temporary = path.with_name(path.name + '.tmp')
+    base = os.path.relpath(Path(base_file).absolute(), Path(backup_file).absolute().parent)
+    temporary.write_text(json.dumps({'version': DELTA_VERSION, 'base': base, 'sequence': sequence}))
+    os.replace(temporary, path)
+    return path
+
+
+def resolve_base(backup_file: Path, delta: dict) -> Path:
+    """
+    Returns the path of the base of a delta backup.
+
+    Args:
+        backup_file (Path): The delta backup file.
+        delta (dict): The delta sidecar of the backup.
+
+    Returns:
+        Path: The base backup file.
+    """
+    return Path(os.path.normpath(backup_file.parent / delta['base']))
+
+
+def delta_command(base_file: Path, source_file: Path, compression_level: Optional[int] = None,
+                  compression_threads: int = 0) -> List[str]:
+    """
+    Builds the command writing to its standard output the zstd delta of a file against a base.
+
+    Args:
+        base_file (Path): The uncompressed base.
+        source_file (Path): The uncompressed file to encode.
+        compression_level (int): The zstd compression level, the codec default if None.
+        compression_threads (int): The number of compression threads, 0 for one per core.
+
+    Returns:
+        List[str]: The argv of the delta command.
+    """
+    return compress_command('zstd', compression_level, compression_threads) + [f'--patch-from={base_file}',
+                                                                              str(source_file)]
+
+
+def patch_command(base_file: Path, delta_file: Path) -> List[str]:
+    """
+    Builds the command writing to its standard output a file rebuilt from its base and its delta.
+
+    Args:
+        base_file (Path): The uncompressed base.
+        delta_file (Path): The delta backup file.
+
+    Returns:
+        List[str]: The argv of the patch command.
+    """
+    return CODECS['zstd']['decompress'] + [f'--long={DELTA_WINDOW_LOG}', f'--patch-from={base_file}',
+                                           str(delta_file)]
+
+
+def decompress_to(source_file: Path, destination_file: Path, timeout: float = None) -> None:
+    """
+    Writes the uncompressed content of a backup to a file, replaced atomically once written.
+
+    Args:
+        source_file (Path): The backup file, compressed, chunked or plain.
+        destination_file (Path): The file to write.
+        timeout (float): The maximum duration of the copy in seconds, None for no limit.
+    """
+    stages, stdin = read_stages(source_file)
+    temporary = destination_file.with_name(destination_file.name + '.tmp')
+    try:
+        default_runner().run(stages or [['cat']], stdin=stdin, stdout=temporary, timeout=timeout)
+        os.replace(temporary, destination_file)
+    finally:
+        temporary.unlink(missing_ok=True)
+        if hasattr(stdin, 'close'):
+            stdin.close()
+
+
+def is_plain(backup_file: Path) -> bool:
+    """
+    Checks whether a backup file is stored uncompressed, so it can be read as it is.
+
+    Args:
+        backup_file (Path): The backup file.
+
+    Returns:
+        bool: True if the backup is neither compressed nor chunked.
+    """
+    stages, stdin = read_stages(backup_file)
+    if hasattr(stdin, 'close'):
+        stdin.close()
+    return not stages and stdin == backup_file
+
+
+def ensure_base_cache(base_file: Path, timeout: float = None) -> Path:
+    """
+    Returns the uncompressed content of a base backup, writing its cache beside it if needed.
+
+    Plain bases are used as they are, while compressed and chunked bases are decompressed
+    once into `<backup>.raw`, kept for the next deltas made against the same base.
+
+    Args:
+        base_file (Path): The base backup file.
+        timeout (float): The maximum duration of the decompression in seconds, None for no limit.
+
+    Returns:
+        Path: The uncompressed base.
+    """
+    if is_plain(base_file):
+        return base_file
+    cache = base_cache_path(base_file)
+    if not cache.exists():
+        logger.info(f"Decompressing base {base_file} to {cache}")
+        decompress_to(base_file, cache, timeout)
+    return cache
+
+
+def delta_fits(base_file: Path, source_file: Optional[Path] = None) -> bool:
+    """
+    Checks whether a delta can be encoded against a base, from the sizes known without decompressing it.
+
+    The uncompressed size of a compressed base without cache is only known once it is
+    decompressed, and is checked again by encode_delta.
+
+    Args:
+        base_file (Path): The base backup file.
+        source_file (Path): The uncompressed file to encode, None to check the base only.
+
+    Returns:
+        bool: False if the base or the file is too large for zstd (see DELTA_MAX_SIZE).
+    """
+    cache = base_cache_path(base_file)
+    base = cache if cache.exists() else base_file
+    sizes = [base.stat().st_size] + ([source_file.stat().st_size] if source_file else [])
+    return max(sizes) < DELTA_MAX_SIZE
+
+
+def drop_base_cache(base_file: Path) -> None:
+    """
+    Deletes the uncompressed copy of a base backup, if any.
+
+    Args:
+        base_file (Path): The base backup file.
+    """
+    cache = base_cache_path(base_file)
+    if cache.exists():
+        logger.info(f"Deleting base cache {cache}")
+        cache.unlink()
+
+
+def encode_delta(source_file: Path, base_file: Path, destination_file: Path, sequence: int,
+                 compression_level: Optional[int] = None, compression_threads: int = 0, timeout: float = None,
+                 name: str = None) -> int:
+    """
+    Stores an uncompressed dump as a zstd delta against a full backup, with its delta sidecar.
+
+    Args:
+        source_file (Path): The uncompressed dump.
+        base_file (Path): The full backup the delta is made against.
+        destination_file (Path): The delta backup file.
+        sequence (int): The number of deltas made against the base up to this one.
+        compression_level (int): The zstd compression level, the codec default if None.
+        compression_threads (int): The number of compression threads, 0 for one per core.
+        timeout (float): The maximum duration of the encoding in seconds, None for no limit.
+        name (str): The name of the job, used to cancel it.
+
+    Returns:
+        int: The size of the delta in bytes.
+
+    Raises:
+        subprocess.CalledProcessError: If the base cannot be decompressed or the delta encoded.
+        ValueError: If the base or the dump is too large for zstd (see DELTA_MAX_SIZE).
+    """
+    if not delta_fits(base_file, source_file):
+        raise ValueError(f"Base {base_file} or dump {source_file} exceeds the {DELTA_MAX_SIZE} bytes zstd deltas allow")
+    base = ensure_base_cache(base_file, timeout)
+    if base.stat().st_size >= DELTA_MAX_SIZE:
+        raise ValueError(f"Uncompressed base {base} exceeds the {DELTA_MAX_SIZE} bytes zstd deltas allow")
+    default_runner().run([delta_command(base, source_file, compression_level, compression_threads)], name=name,
+                         stdout=destination_file, timeout=timeout)
+    write_delta(destination_file, base_file, sequence)
+    return destination_file.stat().st_size
+
+
+@contextmanager
+def materialize(backup_file: Path, timeout: float = None) -> Iterator[Path]:
+    """
+    Provides the full content of a backup to restore it, rebuilding delta backups from their base.
+
+    A delta is rebuilt into a temporary file beside it, with a copy of its sidecar index,
+    deleted on exit. Other backups are provided as they are.
+
+    Args:
+        backup_file (Path): The backup file or directory.
+        timeout (float): The maximum duration of each rebuild step in seconds, None for no limit.
+
+    Yields:
+        Path: The backup to restore.
+
+    Raises:
+        FileNotFoundError: If the base of a delta is missing.
+    """
+    delta = read_delta(backup_file) if backup_file.is_file() else None
+    if not delta:
+        yield backup_file
+        return
+    base_file = resolve_base(backup_file, delta)
+    if not base_file.exists():
+        raise FileNotFoundError(f"Base {base_file} of delta backup {backup_file} is missing")
+    with tempfile.TemporaryDirectory(prefix='.restore-', dir=backup_file.parent) as directory:
+        # The cache of the latest base is reused, older bases are decompressed for the restore only
+        base = base_cache_path(base_file)
+        if is_plain(base_file):
+            base = base_file
+        elif not base.exists():
+            base = Path(directory) / base_file.name
+            decompress_to(base_file, base, timeout)
+        restored_file = Path(directory) / backup_file.name
+        logger.info(f"Rebuilding delta backup {backup_file} from base {base_file}")
+        default_runner().run([patch_command(base, backup_file)], stdout=restored_file, timeout=timeout)
+        if index_path(backup_file).exists():
+            shutil.copyfile(index_path(backup_file), index_path(restored_file))
+        yield restored_file
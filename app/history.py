@@ -0,0 +1,99 @@
+from collections import deque
+from typing import Dict, List, Optional
+import threading
+
+
+class RunHistory:
+    """
+    Bounded in-memory history of the backup runs of each configuration and database.
+
+    Every (configuration, database) pair keeps its latest runs in a ring buffer, and the
+    latest successful run is tracked separately so health checks are constant-time lookups.
+
+    Attributes:
+        size (int): The number of runs kept for each configuration and database.
+    """
+
+    def __init__(self, size: int = 50):
+        """
+        Initialize an empty history.
+
+        Args:
+            size (int): The number of runs kept for each configuration and database.
+        """
+        self.size = size
+        self._lock = threading.Lock()
+        self._runs: Dict[tuple, deque] = {}
+        self._last_success: Dict[tuple, dict] = {}
+        self._config_runs: Dict[str, dict] = {}
+
+    def record(self, cron_name: str, db_name: str, start: float, end: float, bytes_written: int,
+               status: str) -> dict:
+        """
+        Record a backup run of a database.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            start (float): The Unix time the run started.
+            end (float): The Unix time the run ended.
+            bytes_written (int): The size of the backup written to disk.
+            status (str): The status of the run, 'success', 'unchanged' or 'failed'.
+
+        Returns:
+            dict: The recorded run.
+        """
+        run = {'start': start, 'end': end, 'bytes': bytes_written, 'status': status}
+        key = (cron_name, db_name)
+        with self._lock:
+            self._runs.setdefault(key, deque(maxlen=self.size)).append(run)
+            if status != 'failed':
+                self._last_success[key] = run
+        return run
+
+    def record_config_run(self, cron_name: str, start: float, end: float, databases: List[str],
+                          error: Optional[str] = None) -> None:
+        """
+        Record a backup run of a whole configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            start (float): The Unix time the run started.
+            end (float): The Unix time the run ended.
+            databases (List[str]): The databases found on the server by the run.
+            error (str): The error stopping the run before the databases were backed up, if any.
+        """
+        with self._lock:
+            self._config_runs[cron_name] = {'start': start, 'end': end, 'databases': list(databases), 'error': error}
+
+    def config_run(self, cron_name: str) -> Optional[dict]:
+        """Latest run of a configuration, None if it never ran."""
+        with self._lock:
+            return self._config_runs.get(cron_name)
+
+    def latest(self, cron_name: str, db_name: str) -> Optional[dict]:
+        """Latest run of a database, None if it never ran."""
+        with self._lock:
+            runs = self._runs.get((cron_name, db_name))
+            return runs[-1] if runs else None
+
+    def last_success(self, cron_name: str, db_name: str) -> Optional[dict]:
+        """Latest successful or unchanged run of a database, None if there is none."""
+        with self._lock:
+            return self._last_success.get((cron_name, db_name))
+
+    def snapshot(self) -> dict:
+        """
+        Export the whole history.
+
+        Returns:
+            dict: The runs of every configuration, with its latest run and the runs of each database.
+        """
+        with self._lock:
+            configs = {}
+            for cron_name, config_run in self._config_runs.items():
+                configs[cron_name] = {'last_run': dict(config_run), 'databases': {}}
+            for (cron_name, db_name), runs in self._runs.items():
+                config = configs.setdefault(cron_name, {'last_run': None, 'databases': {}})
+                config['databases'][db_name] = [dict(run) for run in runs]
+            return configs
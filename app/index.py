@@ -0,0 +1,388 @@
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import subprocess
+import logging
+
+from app.chunkstore import ChunkStore, ChunkWriter, RecipeReader, is_recipe
+from app.compression import CODECS, compress_command, zlib_level
+from app.process import default_runner
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Suffix of the sidecar index stored beside each backup artifact
+INDEX_SUFFIX = '.index'
+
+# Version of the index layout, bumped on incompatible changes
+INDEX_VERSION = 1
+
+# Size of the blocks copied when sections are extracted
+COPY_SIZE = 1024 * 1024
+
+# Uncompressed size of a frame from which the next section starts a new frame
+FRAME_SIZE = 1024 * 1024
+
+# A function recognizing the line opening a section of a dump, returning its kind and name
+Boundary = Callable[[bytes], Optional[Tuple[str, str]]]
+
+
+def index_path(backup_file: Path) -> Path:
+    """
+    Returns the path of the sidecar index of a backup.
+
+    Args:
+        backup_file (Path): The backup file or directory.
+
+    Returns:
+        Path: The index path, `<backup>.index`.
+    """
+    return backup_file.with_name(backup_file.name + INDEX_SUFFIX)
+
+
+def read_index(backup_file: Path) -> Optional[dict]:
+    """
+    Reads the sidecar index of a backup.
+
+    Args:
+        backup_file (Path): The backup file or directory.
+
+    Returns:
+        Optional[dict]: The index, None if the backup has no index or it cannot be read.
+    """
+    path = index_path(backup_file)
+    if not path.exists():
+        return None
+    try:
+        index = json.loads(path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable index {path}: {e}")
+        return None
+    if index.get('version') != INDEX_VERSION:
+        logger.warning(f"Ignoring index {path} with unsupported version {index.get('version')}")
+        return None
+    return index
+
+
+def write_index(backup_file: Path, index: dict) -> Path:
+    """
+    Writes the sidecar index of a backup, replacing the previous one atomically.
+
+    Args:
+        backup_file (Path): The backup file or directory.
+        index (dict): The index.
+
+    Returns:
+        Path: The index path.
+    """
+    path = index_path(backup_file)
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps({'version': INDEX_VERSION, **index}))
+    os.replace(temporary, path)
+    return path
+
+
+class SectionWriter:
+    """
+    Writes a text dump to a file as a sequence of sections, recording the offset of each one.
+
+    A new section starts at every line recognized by the boundary function. When a codec is
+    given, the sections are compressed as independent frames, consecutive sections sharing a
+    frame until it holds FRAME_SIZE bytes, so small sections do not each need a compressor:
+    the concatenated frames are still a valid compressed stream for the codec tools, while a
+    single section can be decompressed on its own by reading its frame only.
+
+    It is used as the output of a ProcessRunner job, which calls `write` with the blocks of
+    the dump in order. The sections can also be written to another writer instead of a file,
+    such as a ChunkWriter, in which case they are not compressed as frames.
+
+    Attributes:
+        sections (List[dict]): The sections written, with their kind and name, the offset and
+            length of their uncompressed text, the offset and length of their frame, and the
+            offset of their text in the uncompressed frame.
+    """
+
+    def __init__(self, destination_file: Path, boundary: Boundary, compression: Optional[str] = None,
+                 compression_level: Optional[int] = None, compression_threads: int = 0, output=None,
+                 priority: Optional[List[str]] = None):
+        """
+        Initialize the writer, creating the destination file.
+
+        Args:
+            destination_file (Path): The file where the dump is written.
+            boundary (Boundary): The function recognizing the first line of each section.
+            compression (str): The compression codec of the frames, None to store the dump uncompressed.
+            compression_level (int): The compression level, the codec default if None.
+            compression_threads (int): The number of compression threads, 0 for one per core.
+            output: A writer with `write`, `tell` and `close` methods receiving the dump instead
+                of the destination file, None to write the file.
+            priority (List[str]): The argv prefix setting the priority of the compressors (see priority_command).
+        """
+        self.boundary = boundary
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+        self.sections: List[dict] = []
+        self._output = output
+        self._priority = priority or []
+        self._file = output or open(destination_file, 'wb', buffering=0)
+        self._compressor = None
+        self._pending = b''
+        self._offset = 0
+        # Offset, uncompressed length and first section of the current frame
+        self._frame_offset = 0
+        self._frame_length = 0
+        self._frame_start = 0
+        self._start_section('header', None)
+
+    def _start_section(self, kind: str, name: Optional[str]) -> None:
+        """Starts a new section at the current offset, in a new frame unless the current one is still small."""
+        if not self.compression or not self.sections or self._frame_length >= FRAME_SIZE:
+            self._end_frame()
+            self._start_frame()
+        self.sections.append({'kind': kind, 'name': name, 'offset': self._offset, 'length': 0,
+                              'frame_offset': self._frame_offset, 'frame_length': 0,
+                              'frame_skip': self._frame_length})
+
+    def _start_frame(self) -> None:
+        """Starts a new frame at the current position of the file, with a new compressor if needed."""
+        self._frame_offset = self._file.tell()
+        self._frame_length = 0
+        self._frame_start = len(self.sections)
+        if self.compression:
+            self._compressor = subprocess.Popen(
+                self._priority + compress_command(self.compression, self.compression_level, self.compression_threads),
+                stdin=subprocess.PIPE, stdout=self._file)
+
+    def _end_frame(self) -> None:
+        """Flushes the current frame and records its length in its sections."""
+        if not self.sections:
+            return
+        if self._compressor:
+            self._compressor.stdin.close()
+            if self._compressor.wait() != 0:
+                raise subprocess.CalledProcessError(self._compressor.returncode, self._compressor.args)
+            self._compressor = None
+        frame_length = self._file.tell() - self._frame_offset
+        for section in self.sections[self._frame_start:]:
+            section['frame_length'] = frame_length
+
+    def _emit(self, data: bytes) -> None:
+        """Writes text to the current section."""
+        if not data:
+            return
+        if self._compressor:
+            self._compressor.stdin.write(data)
+        else:
+            self._file.write(data)
+        self.sections[-1]['length'] += len(data)
+        self._offset += len(data)
+        self._frame_length += len(data)
+
+    def write(self, chunk: bytes) -> int:
+        """
+        Writes a block of the dump, starting new sections at the boundaries it contains.
+
+        Only comment lines are checked against the boundary function, and the last incomplete
+        line is kept until the next block, so blocks may be cut anywhere.
+
+        Args:
+            chunk (bytes): The block.
+
+        Returns:
+            int: The length of the block.
+        """
+        data = self._pending + chunk
+        emitted, search = 0, 0
+        while True:
+            start = data.find(b'\n--', search)
+            if start < 0:
+                break
+            end = data.find(b'\n', start + 1)
+            if end < 0:
+                break
+            section = self.boundary(data[start + 1:end + 1])
+            if section:
+                self._emit(data[emitted:start + 1])
+                self._start_section(*section)
+                emitted = start + 1
+            search = end
+        cut = max(data.rfind(b'\n'), emitted)
+        self._emit(data[emitted:cut])
+        self._pending = data[cut:]
+        return len(chunk)
+
+    def close(self) -> List[dict]:
+        """
+        Writes the rest of the dump and closes the file. A writer given as output is left open.
+
+        Returns:
+            List[dict]: The sections written.
+        """
+        try:
+            self._emit(self._pending)
+            self._pending = b''
+            self._end_frame()
+        finally:
+            if self._compressor:
+                self._compressor.kill()
+                self._compressor.wait()
+            if not self._output:
+                self._file.close()
+        return self.sections
+
+
+def stream_to_indexed_file(command: List[str], destination_file: Path, boundary: Boundary,
+                           compression: Optional[str] = None, compression_level: Optional[int] = None,
+                           compression_threads: int = 0, env: dict = None, timeout: float = None,
+                           name: str = None, chunk_store: Optional[ChunkStore] = None) -> int:
+    """
+    Runs a dump command and streams its standard output to a file split into sections,
+    writing the sidecar index of the sections beside it.
+
+    Args:
+        command (List[str]): The argv of the dump command writing the dump to its standard output.
+        destination_file (Path): The file where the dump will be stored.
+        boundary (Boundary): The function recognizing the first line of each section.
+        compression (str): The compression codec, None to store the dump uncompressed.
+        compression_level (int): The compression level, the codec default if None.
+        compression_threads (int): The number of compression threads, 0 for one per core.
+        env (dict): Environment variables added to the environment of the dump command.
+        timeout (float): The maximum duration of the dump in seconds, None for no limit.
+        name (str): The name of the job, used to cancel it.
+        chunk_store (ChunkStore): The chunk store of the backup, None to write the sections to the file.
+
+    Returns:
+        int: The number of uncompressed bytes produced by the dump command.
+
+    Raises:
+        subprocess.CalledProcessError: If the dump or the compression of a section fails.
+        subprocess.TimeoutExpired: If the dump exceeds its timeout.
+        JobCancelled: If the dump is cancelled.
+    """
+    chunk_writer = None
+    if chunk_store:
+        # Chunks are compressed one by one, sections are read back from the recipe
+        chunk_writer = ChunkWriter(chunk_store, destination_file, bool(compression), zlib_level(compression_level))
+        compression = None
+    writer = SectionWriter(destination_file, boundary, compression, compression_level, compression_threads,
+                           output=chunk_writer, priority=default_runner().priority(name) if name else None)
+    try:
+        try:
+            dump_bytes = default_runner().run([command], name=name, stdout=writer, env=env, timeout=timeout)
+        finally:
+            sections = writer.close()
+    except BaseException:
+        if chunk_writer:
+            chunk_writer.abort()
+        raise
+    if chunk_writer:
+        chunk_writer.close()
+    write_index(destination_file, {'format': 'sections', 'compression': compression, 'sections': sections})
+    logger.info(f"Backup {destination_file} indexed with {len(sections)} sections.")
+    return dump_bytes
+
+
+class _FrameReader:
+    """Reader of the compressed bytes of a frame of a backup, streamed to a decompression job."""
+
+    def __init__(self, source, backup_file: Path, offset: int, length: int):
+        """Initialize the reader, seeking the source to the frame."""
+        self._source = source
+        self._backup_file = backup_file
+        self._remaining = length
+        source.seek(offset)
+
+    def read(self, size: int = -1) -> bytes:
+        """Returns the next block of the frame, an empty block at its end."""
+        if self._remaining <= 0:
+            return b''
+        block = self._source.read(min(COPY_SIZE, self._remaining))
+        if not block:
+            raise EOFError(f"Backup {self._backup_file} is shorter than its index")
+        self._remaining -= len(block)
+        return block
+
+
+class _SectionSlice:
+    """Writer keeping the text of a section from the uncompressed frame holding it."""
+
+    def __init__(self, output: BinaryIO, skip: int, length: int):
+        """Initialize the writer, skipping the text of the sections before the section in the frame."""
+        self._output = output
+        self._skip = skip
+        self._remaining = length
+
+    def write(self, block: bytes) -> int:
+        """Writes the part of a block of the frame belonging to the section."""
+        if self._skip >= len(block):
+            self._skip -= len(block)
+            return len(block)
+        text = block[self._skip:self._skip + self._remaining]
+        self._skip = 0
+        self._remaining -= len(text)
+        if text:
+            self._output.write(text)
+        return len(block)
+
+
+def extract_sections(backup_file: Path, sections: Iterable[dict], compression: Optional[str],
+                     output: BinaryIO, name: str = None, timeout: float = None) -> int:
+    """
+    Copies the uncompressed text of some sections of an indexed backup to a file.
+
+    Only the frames of the given sections are read, or the chunks holding them for chunked
+    backups, and decompressed by jobs of the shared process runner.
+
+    Args:
+        backup_file (Path): The indexed backup file.
+        sections (Iterable[dict]): The sections to copy, from the index of the backup.
+        compression (str): The compression codec of the backup, None if it is not compressed.
+        output (BinaryIO): The file, or any writer, receiving the text of the sections.
+        name (str): The name of the decompression jobs, used to cancel them.
+        timeout (float): The maximum duration of each decompression in seconds, None for no limit.
+
+    Returns:
+        int: The number of uncompressed bytes copied.
+
+    Raises:
+        subprocess.CalledProcessError: If a frame cannot be decompressed.
+        subprocess.TimeoutExpired: If a decompression exceeds its timeout.
+        JobCancelled: If a decompression is cancelled.
+    """
+    copied = 0
+    with (RecipeReader(backup_file) if is_recipe(backup_file) else open(backup_file, 'rb')) as source:
+        for section in sections:
+            frame = _FrameReader(source, backup_file, section['frame_offset'], section['frame_length'])
+            if compression:
+                text = _SectionSlice(output, section.get('frame_skip', 0), section['length'])
+                default_runner().run([CODECS[compression]['decompress']], name=name, stdin=frame, stdout=text,
+                                     timeout=timeout)
+            else:
+                for block in iter(frame.read, b''):
+                    output.write(block)
+            copied += section['length']
+    output.flush()
+    return copied
+
+
+def iter_sections(lines: Iterable[bytes], boundary: Boundary) -> Iterator[Tuple[str, Optional[str], bytes]]:
+    """
+    Splits the lines of a text dump into sections, for dumps without an index.
+
+    Args:
+        lines (Iterable[bytes]): The lines of the dump.
+        boundary (Boundary): The function recognizing the first line of each section.
+
+    Yields:
+        Tuple[str, Optional[str], bytes]: The kind, the name and a line of the section the line
+            belongs to, 'header' and None for the lines before the first section.
+    """
+    kind, name = 'header', None
+    for line in lines:
+        section = boundary(line) if line.startswith(b'--') else None
+        if section:
+            kind, name = section
+        yield kind, name, line
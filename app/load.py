@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from typing import Callable, Optional
+import threading
+import time
+import logging
+
+from app.throttle import TokenBucket
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class LoadGovernor:
+    """
+    Adapts a backup run to the load of the database server.
+
+    The load is sampled before the run, to defer it while the server is overloaded, and then
+    periodically while the run lasts. While the server is overloaded, fewer databases are
+    dumped at the same time and the dumps taking their tokens from `bucket` are rate limited.
+
+    Attributes:
+        max_active (int): The number of active sessions above which the server is overloaded, None for no limit.
+        max_lag (float): The replication lag in seconds above which the server is overloaded, None for no limit.
+        concurrency (int): The number of databases dumped at the same time.
+        throttled_concurrency (int): The number of databases dumped at the same time while the server is overloaded.
+        rate_limit (float): The dump rate in bytes per second while the server is overloaded, None for no limit.
+        interval (float): The seconds between two samples of the load.
+        bucket (TokenBucket): The token bucket rate limiting the dumps while the server is overloaded.
+        overloaded (bool): Whether the latest sample found the server overloaded.
+        load (dict): The latest sample of the load, None if it could not be read.
+    """
+
+    def __init__(self, sample: Callable[[], Optional[dict]], max_active: Optional[int] = None,
+                 max_lag: Optional[float] = None, concurrency: int = 1, throttled_concurrency: int = 1,
+                 rate_limit: Optional[float] = None, interval: float = 30.0,
+                 observe: Optional[Callable[[Optional[dict], bool], None]] = None):
+        """
+        Initialize the governor, considering the server not overloaded until it is sampled.
+
+        Args:
+            sample (callable): Samples the load of the server (see AbstractModule.get_server_load).
+            max_active (int): The number of active sessions above which the server is overloaded.
+            max_lag (float): The replication lag in seconds above which the server is overloaded.
+            concurrency (int): The number of databases dumped at the same time.
+            throttled_concurrency (int): The number of databases dumped at the same time while overloaded.
+            rate_limit (float): The dump rate in bytes per second while overloaded, None for no limit.
+            interval (float): The seconds between two samples of the load.
+            observe (callable): Called with the load and the overloaded state after each sample.
+        """
+        self._sample = sample
+        self.max_active = max_active
+        self.max_lag = max_lag
+        self.concurrency = max(1, concurrency)
+        self.throttled_concurrency = max(1, min(throttled_concurrency, self.concurrency))
+        self.rate_limit = rate_limit
+        self.interval = interval
+        self._observe = observe
+        self.bucket = TokenBucket()
+        self.overloaded = False
+        self.load = None
+        self._running = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_overloaded(self, load: Optional[dict]) -> bool:
+        """
+        Compares a sample of the load with the thresholds.
+
+        Args:
+            load (dict): The sample, None if it could not be read.
+
+        Returns:
+            bool: Whether the server is overloaded; a server whose load is unknown is not.
+        """
+        if not load:
+            return False
+        if self.max_active is not None and load.get('active') is not None and load['active'] > self.max_active:
+            return True
+        return self.max_lag is not None and load.get('lag') is not None and load['lag'] > self.max_lag
+
+    def update(self) -> bool:
+        """
+        Samples the load and adapts the concurrency and the rate limit to it.
+
+        Returns:
+            bool: Whether the server is overloaded.
+        """
+        try:
+            load = self._sample()
+        except Exception as e:
+            logger.warning(f"Cannot sample the server load: {e}")
+            load = None
+        overloaded = self.is_overloaded(load)
+        if overloaded != self.overloaded:
+            logger.warning(f"Server overloaded ({load}), throttling backups" if overloaded
+                           else f"Server load back to normal ({load}), no longer throttling backups")
+        with self._condition:
+            self.load, self.overloaded = load, overloaded
+            self.bucket.rate = self.rate_limit if overloaded else None
+            self._condition.notify_all()
+        if self._observe:
+            self._observe(load, overloaded)
+        return overloaded
+
+    def wait_until_calm(self, grace: float) -> float:
+        """
+        Defers the run while the server is overloaded, at most for the grace window.
+
+        Args:
+            grace (float): The maximum time to wait in seconds.
+
+        Returns:
+            float: The time waited in seconds.
+        """
+        start = time.monotonic()
+        while self.update():
+            remaining = grace - (time.monotonic() - start)
+            if remaining <= 0 or self._stop.wait(min(self.interval, remaining)):
+                break
+        return time.monotonic() - start
+
+    def start(self) -> None:
+        """Starts sampling the load in a background thread, until stop is called."""
+        self._thread = threading.Thread(target=self._monitor, name="load-governor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling the load."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _monitor(self) -> None:
+        """Samples the load every interval."""
+        while not self._stop.wait(self.interval):
+            self.update()
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until one more database can be dumped at the current load, and holds its slot.
+
+        Yields:
+            None: While the slot is held.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._running < (self.throttled_concurrency if self.overloaded
+                                                              else self.concurrency))
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
@@ -0,0 +1,107 @@
+from typing import Dict, Tuple
+import threading
+
+
+# Metrics exposed by the backup application, with their type and help text
+METRICS = {
+    'backup_dump_duration_seconds': ('gauge', 'Duration of the latest dump of the database.'),
+    'backup_bytes_written': ('gauge', 'Bytes written to disk by the latest backup of the database.'),
+    'backup_dump_bytes': ('gauge', 'Uncompressed bytes produced by the latest dump of the database.'),
+    'backup_throughput_bytes_per_second': ('gauge', 'Dump throughput of the latest backup of the database.'),
+    'backup_compression_ratio': ('gauge', 'Ratio between dumped and written bytes of the latest backup.'),
+    'backup_last_success_timestamp_seconds': ('gauge', 'Unix time of the latest successful or unchanged backup.'),
+    'backup_cleanup_duration_seconds': ('gauge', 'Duration of the latest retention cleanup of the database.'),
+    'backup_artifacts': ('gauge', 'Number of backups of the database on disk.'),
+    'backup_runs_total': ('counter', 'Backups of the database by status.'),
+    'backup_database_size_bytes': ('gauge', 'Size of the database on the server before the latest run.'),
+    'backup_predicted_duration_seconds': ('gauge', 'Predicted duration of the latest run of the configuration.'),
+    'backup_predicted_overrun_seconds': ('gauge', 'Predicted time the latest run of the configuration goes past '
+                                                  'the next cron firing, 0 if it ends before.'),
+    'backup_server_active_sessions': ('gauge', 'Active sessions of the database server, less the backup tools.'),
+    'backup_server_replication_lag_seconds': ('gauge', 'Replication lag of the database server.'),
+    'backup_load_throttled': ('gauge', 'Whether the runs of the configuration are throttled by the server load.'),
+    'backup_deferred_seconds': ('gauge', 'Time the latest run of the configuration was deferred by the server load.'),
+    'backup_throttled_runs_total': ('counter', 'Runs of the configuration started while the server was overloaded.'),
+    'backup_skipped_runs_total': ('counter', 'Scheduled runs of the configuration skipped, by reason.'),
+    'backup_delayed_runs_total': ('counter', 'Scheduled runs of the configuration started late.'),
+    'backup_start_delay_seconds': ('gauge', 'Time between the fire time and the start of the latest run of the '
+                                            'configuration.'),
+}
+
+
+def _escape(value) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metrics:
+    """
+    Thread-safe registry of the backup metrics, rendered in the Prometheus text format.
+
+    Attributes:
+        values (dict): The metric samples, keyed by metric name and then by sorted label pairs.
+    """
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._labels: Dict[str, str] = {}
+        self.values: Dict[str, Dict[Tuple, float]] = {name: {} for name in METRICS}
+
+    def labels(self, **labels) -> 'Metrics':
+        """
+        Get a view of the registry adding labels to the samples it sets, e.g. the target of a scheduler.
+
+        Args:
+            **labels: The labels added to the samples.
+
+        Returns:
+            Metrics: The view, sharing the samples of the registry.
+        """
+        view = Metrics.__new__(Metrics)
+        view._lock = self._lock
+        view._labels = {**self._labels, **labels}
+        view.values = self.values
+        return view
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """
+        Set the value of a gauge.
+
+        Args:
+            name (str): The metric name, one of METRICS.
+            value (float): The value.
+            **labels: The labels of the sample.
+        """
+        with self._lock:
+            self.values[name][tuple(sorted({**self._labels, **labels}.items()))] = value
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increment a counter.
+
+        Args:
+            name (str): The metric name, one of METRICS.
+            value (float): The increment.
+            **labels: The labels of the sample.
+        """
+        key = tuple(sorted({**self._labels, **labels}.items()))
+        with self._lock:
+            self.values[name][key] = self.values[name].get(key, 0) + value
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in sorted(self.values[name].items()):
+                    label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return '\n'.join(lines) + '\n'
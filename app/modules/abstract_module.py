@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
 
 class AbstractModule(metaclass=ABCMeta):
@@ -9,7 +10,8 @@ class AbstractModule(metaclass=ABCMeta):
     backing up, and restoring databases.
     """
 
-    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str):
+    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str,
+                 target: Optional[str] = None):
         """
         Initializes the database module with connection details.
 
@@ -19,12 +21,14 @@ class AbstractModule(metaclass=ABCMeta):
             username (str): The username to connect to the database.
             password (str): The password to connect to the database.
             maintenance_db (str): The name of the database used for maintenance.
+            target (str): The name of the backup target of the server, None if it is the only one.
         """
         self._host = host
         self._port = port
         self._username = username
         self._password = password
         self._maintenance_db = maintenance_db
+        self._target = target
 
     @property
     def host(self) -> str:
@@ -76,6 +80,32 @@ class AbstractModule(metaclass=ABCMeta):
         """
         return self._password
 
+    @property
+    def target(self) -> Optional[str]:
+        """
+        Returns the name of the backup target of the server.
+
+        Returns:
+            Optional[str]: The name of the target, None if the server is the only one backed up.
+        """
+        return self._target
+
+    def job_name(self, kind: str, name: str) -> str:
+        """
+        Returns the name of a job of the process runner working on this server.
+
+        Jobs are named after their kind and the database or file they work on, qualified by
+        the target when several servers are backed up by the same process.
+
+        Args:
+            kind (str): The kind of job, e.g. 'backup' or 'restore'.
+            name (str): The database or file the job works on.
+
+        Returns:
+            str: The name of the job.
+        """
+        return f"{kind}:{self._target}/{name}" if self._target else f"{kind}:{name}"
+
     @abstractmethod
     def list_all_databases(self) -> List[str]:
         """
@@ -86,14 +116,69 @@ class AbstractModule(metaclass=ABCMeta):
         """
         raise Exception("Unsupported method")
 
+    def get_change_token(self, name: str) -> Optional[str]:
+        """
+        Computes a token of the server-side change counters of a database, which stays the
+        same as long as the database content does not change.
+
+        Args:
+            name (str): The name of the database.
+
+        Returns:
+            Optional[str]: The change token, None if changes cannot be detected.
+        """
+        return None
+
+    def get_database_sizes(self) -> Dict[str, int]:
+        """
+        Reads the size of the databases of the server.
+
+        Returns:
+            Dict[str, int]: The size in bytes of each database, empty if the sizes cannot be read.
+        """
+        return {}
+
+    def get_server_load(self) -> Optional[dict]:
+        """
+        Samples the load of the server, leaving out the sessions of the backup tools.
+
+        Returns:
+            Optional[dict]: The number of 'active' sessions running a statement and the
+                replication 'lag' in seconds (None if the server does not replicate), None if
+                the load cannot be read.
+        """
+        return None
+
+    @staticmethod
+    def _shadow_database_name(name: str, kind: str = 'restore', timestamp: str = None) -> str:
+        """
+        Builds the name of a temporary database standing beside a live one during a restore.
+
+        The live name is truncated so the result fits the 63 characters limit of PostgreSQL.
+
+        Args:
+            name (str): The name of the live database.
+            kind (str): The role of the temporary database, 'restore' for the database being
+                loaded or 'old' for the replaced one.
+            timestamp (str): The timestamp of the restore, the current time if None.
+
+        Returns:
+            str: The name of the temporary database, `<name>__<kind>_<timestamp>`.
+        """
+        timestamp = timestamp or datetime.now().strftime('%Y%m%d%H%M%S')
+        suffix = f"__{kind}_{timestamp}"
+        return f"{name[:63 - len(suffix)]}{suffix}"
+
     @abstractmethod
-    def backup_database(self, name: str, destination_file: Path) -> bool:
+    def backup_database(self, name: str, destination_file: Path, **options) -> bool:
         """
         Backs up the specified database to a file.
 
         Args:
             name (str): The name of the database to back up.
             destination_file (Path): The path to the file where the backup will be stored.
+            **options: Dump options of the cron configuration; options not supported by
+                the module are ignored.
 
         Returns:
             bool: True if the backup was successful, False otherwise.
@@ -101,15 +186,106 @@ class AbstractModule(metaclass=ABCMeta):
         raise Exception("Unsupported method")
 
     @abstractmethod
-    def restore_database(self, name: str, source_file: Path) -> bool:
+    def restore_database(self, name: str, source_file: Path, **options) -> bool:
         """
         Restores the specified database from a backup file.
 
         Args:
             name (str): The name of the database to restore.
             source_file (Path): The path to the backup file.
+            **options: Restore options; options not supported by the module are ignored. With
+                `swap=True` the backup is loaded into a shadow database swapped with the live one
+                once loaded, instead of dropping the live database first.
+
+        Returns:
+            bool: True if the restore was successful, False otherwise.
+        """
+        raise Exception("Unsupported method")
+
+    def restore_tables(self, name: str, source_file: Path, tables: List[str], schema: Optional[str] = None,
+                       **options) -> bool:
+        """
+        Restores some tables of a database from a backup, leaving the rest of the database untouched.
+
+        Args:
+            name (str): The name of the database to restore the tables into.
+            source_file (Path): The path to the backup file.
+            tables (List[str]): The names of the tables to restore.
+            schema (str): The schema of the tables, for the servers having schemas.
+            **options: Restore options; options not supported by the module are ignored.
 
         Returns:
             bool: True if the restore was successful, False otherwise.
         """
         raise Exception("Unsupported method")
+
+    def backup_cluster(self, destination_dir: Path, **options) -> bool:
+        """
+        Takes a physical base backup of the whole server.
+
+        Args:
+            destination_dir (Path): The directory where the backup will be stored.
+            **options: Dump options of the cron configuration; options not supported by
+                the module are ignored.
+
+        Returns:
+            bool: True if the backup was successful, False otherwise.
+        """
+        raise Exception("Unsupported method")
+
+    def receive_wal(self, wal_dir: Path, slot: str, compression: Optional[str] = None) -> None:
+        """
+        Archives the write-ahead log of the server continuously, until the connection is lost.
+
+        Args:
+            wal_dir (Path): The WAL archive directory.
+            slot (str): The name of the replication slot.
+            compression (str): The compression codec of the archived segments, None for no compression.
+        """
+        raise Exception("Unsupported method")
+
+    def restore_cluster(self, source_dir: Path, data_dir: Path, wal_dir: Path, target_time: Optional[datetime] = None,
+                        **options) -> bool:
+        """
+        Prepares a data directory recovering a physical base backup to a point in time.
+
+        Args:
+            source_dir (Path): The base backup directory.
+            data_dir (Path): The data directory of the server to recover.
+            wal_dir (Path): The WAL archive directory.
+            target_time (datetime): The time to recover to, the end of the archived WAL if None.
+            **options: Restore options; options not supported by the module are ignored.
+
+        Returns:
+            bool: True if the data directory was prepared, False otherwise.
+        """
+        raise Exception("Unsupported method")
+
+    def receive_binlog(self, binlog_dir: Path, server_id: int) -> None:
+        """
+        Archives the binary logs of the server continuously, until the connection is lost.
+
+        Args:
+            binlog_dir (Path): The binary log archive directory.
+            server_id (int): The server id the archiver connects with.
+        """
+        raise Exception("Unsupported method")
+
+    def replay_binlog(self, name: str, binlog_dir: Path, start_file: str, start_position: int,
+                      stop_time: Optional[datetime] = None, stop_gtid: Optional[str] = None, **options) -> bool:
+        """
+        Replays the changes of a database from the archived binary logs, on top of a restored dump.
+
+        Args:
+            name (str): The name of the database.
+            binlog_dir (Path): The binary log archive directory.
+            start_file (str): The binary log file recorded by the dump.
+            start_position (int): The position in this file recorded by the dump.
+            stop_time (datetime): The time to stop at, the end of the archive if None.
+            stop_gtid (str): The GTID of the last transaction to replay, the end of the archive if None.
+            **options: Restore options; options not supported by the module are ignored.
+
+        Returns:
+            bool: True if the replay was successful, False otherwise.
+        """
+        raise Exception("Unsupported method")
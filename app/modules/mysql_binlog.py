@@ -0,0 +1,127 @@
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+import re
+
+# Bytes read from the start of a dump to find the binary log coordinates written by mysqldump
+BINLOG_HEADER_SIZE = 64 * 1024
+
+# Commented CHANGE MASTER (MariaDB, MySQL before 8.0.23) or CHANGE REPLICATION SOURCE statement
+# written by `mysqldump --master-data=2`/`--source-data=2` with the coordinates of the dump
+POSITION_PATTERN = re.compile(rb"CHANGE (?:MASTER|REPLICATION SOURCE) TO (?:MASTER|SOURCE)_LOG_FILE='([^']+)',\s*"
+                              rb"(?:MASTER|SOURCE)_LOG_POS=(\d+)")
+
+# Name of a binary log file, `<basename>.<sequence number>`
+BINLOG_PATTERN = re.compile(r'^(.+)\.(\d{6,})$')
+
+# MySQL GTIDs are `<source uuid>:<transaction number>`, MariaDB GTIDs `<domain>-<server id>-<sequence number>`
+MYSQL_GTID_PATTERN = re.compile(r'^([0-9a-fA-F-]{36}(?::[A-Za-z0-9_]+)?):(\d+)$')
+MARIADB_GTID_PATTERN = re.compile(r'^\d+-\d+-\d+$')
+
+# Largest transaction number of a MySQL GTID
+MAX_GTID_NUMBER = 2 ** 63 - 2
+
+
+def parse_binlog_position(header: bytes) -> Optional[dict]:
+    """
+    Finds the binary log coordinates recorded in the header of a mysqldump file.
+
+    Args:
+        header (bytes): The first bytes of the uncompressed dump.
+
+    Returns:
+        Optional[dict]: The binary log 'file' and 'position' the dump is consistent with,
+            None if the dump was taken without `--master-data`.
+    """
+    match = POSITION_PATTERN.search(header)
+    if not match:
+        return None
+    return {'file': match.group(1).decode('utf-8'), 'position': int(match.group(2))}
+
+
+def parse_binlog_name(name: str) -> Optional[Tuple[str, int]]:
+    """
+    Parses the name of a binary log file.
+
+    Args:
+        name (str): The file name, e.g. `binlog.000042`.
+
+    Returns:
+        Optional[Tuple[str, int]]: The basename and the sequence number of the file, None if
+            the file is not a binary log.
+    """
+    match = BINLOG_PATTERN.match(name)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def list_binlogs(binlog_dir: Path, start_file: Optional[str] = None) -> List[Path]:
+    """
+    Lists the archived binary log files in order.
+
+    Args:
+        binlog_dir (Path): The binary log archive directory.
+        start_file (str): If given, only the files with the same basename from this one on are listed.
+
+    Returns:
+        List[Path]: The binary log files, by sequence number.
+    """
+    start = parse_binlog_name(start_file) if start_file else None
+    binlogs = []
+    for path in binlog_dir.iterdir() if binlog_dir.exists() else []:
+        parsed = parse_binlog_name(path.name)
+        if parsed and (not start or (parsed[0] == start[0] and parsed[1] >= start[1])):
+            binlogs.append((parsed, path))
+    return [path for _, path in sorted(binlogs)]
+
+
+def gtid_stop_options(gtid: str) -> List[str]:
+    """
+    Builds the mysqlbinlog options replaying the binary logs up to a GTID, included.
+
+    MySQL GTIDs are replayed by excluding the later transactions of the same source,
+    MariaDB GTIDs are given to mysqlbinlog as the stop position (MariaDB 10.8 or later).
+
+    Args:
+        gtid (str): The GTID of the last transaction to replay.
+
+    Returns:
+        List[str]: The mysqlbinlog options.
+
+    Raises:
+        ValueError: If the GTID is neither a MySQL nor a MariaDB GTID.
+    """
+    match = MYSQL_GTID_PATTERN.match(gtid)
+    if match:
+        return [f'--exclude-gtids={match.group(1)}:{int(match.group(2)) + 1}-{MAX_GTID_NUMBER}']
+    if MARIADB_GTID_PATTERN.match(gtid):
+        return [f'--stop-position={gtid}']
+    raise ValueError(f"Unsupported GTID '{gtid}'")
+
+
+def replay_command(name: str, binlog_files: List[Path], start_position: int, stop_time: Optional[datetime] = None,
+                   stop_gtid: Optional[str] = None, skip_gtids: bool = False) -> List[str]:
+    """
+    Builds the mysqlbinlog command writing the SQL replaying the changes of a database.
+
+    Args:
+        name (str): The name of the database whose changes are replayed.
+        binlog_files (List[Path]): The binary log files, in order.
+        start_position (int): The position in the first file to start from.
+        stop_time (datetime): The local time to stop at, the end of the files if None.
+        stop_gtid (str): The GTID of the last transaction to replay, the end of the files if None.
+        skip_gtids (bool): Whether to replay the transactions without their GTIDs, so a MySQL
+            server applies them again even though it already executed them.
+
+    Returns:
+        List[str]: The argv of the replay command.
+    """
+    command = ['mysqlbinlog', f'--database={name}', f'--start-position={start_position}']
+    if stop_time:
+        command.append(f'--stop-datetime={stop_time.strftime("%Y-%m-%d %H:%M:%S")}')
+    if stop_gtid:
+        command += gtid_stop_options(stop_gtid)
+    if skip_gtids:
+        command.append('--skip-gtids')
+    return command + [str(path) for path in binlog_files]
@@ -0,0 +1,415 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import re
+import tempfile
+import threading
+import time
+import logging
+
+import mysql.connector
+
+from app.compression import decompress_command, detect_codec, scan_lines
+from app.modules.mysql_parallel import MANIFEST_FILE, SCHEMA_FILE
+from app.process import default_runner
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Size above which the data of a table of a plain dump is split into several files loaded in parallel
+SPLIT_SIZE = 64 * 1024 * 1024
+
+# Comment lines of mysqldump opening the sections of a plain dump
+SECTION_PATTERN = re.compile(rb'^-- (Table structure for table|Dumping data for table|Temporary view structure for '
+                             rb'view|Final view structure for view|Dumping routines|Dumping events) `?([^`\n]*)`?')
+
+# Kinds of the sections of a plain dump, as recorded in its index
+SECTION_KINDS = {
+    b'Table structure for table': 'structure',
+    b'Dumping data for table': 'data',
+    b'Temporary view structure for view': 'view',
+    b'Final view structure for view': 'final-view',
+    b'Dumping routines': 'routines',
+    b'Dumping events': 'events',
+}
+
+# Lines of a data section dropped when it is split for parallel loading
+SKIPPED_DATA_PATTERN = re.compile(rb'^(LOCK TABLES |UNLOCK TABLES;|/\*!40000 ALTER TABLE .* (DISABLE|ENABLE) KEYS)')
+
+# End of the CREATE TABLE statement of a structure section, after which come the triggers of a schema-only dump
+STRUCTURE_END = b'/*!40101 SET character_set_client = @saved_cs_client */;'
+
+# Definitions of a CREATE TABLE statement created after the data is loaded
+SECONDARY_KEY_PATTERN = re.compile(r'^\s*(UNIQUE |FULLTEXT |SPATIAL )?KEY `[^`]+` '
+                                   r'\(((?:`[^`]+`(?:\(\d+\))?(?: ASC| DESC)?,?)+)\)')
+KEY_COLUMN_PATTERN = re.compile(r'`([^`]+)`')
+FOREIGN_KEY_PATTERN = re.compile(r'^\s*CONSTRAINT `[^`]+` FOREIGN KEY ')
+AUTO_INCREMENT_PATTERN = re.compile(r'^\s*`([^`]+)` .*\bAUTO_INCREMENT\b')
+CREATE_TABLE_PATTERN = re.compile(r'^CREATE TABLE `([^`]+)` \((.*?)\n(\)[^;]*;)', re.MULTILINE | re.DOTALL)
+
+
+def dump_section(line: bytes) -> Optional[Tuple[str, str]]:
+    """
+    Recognizes the comment line opening a section of a plain dump.
+
+    Args:
+        line (bytes): A line of the dump.
+
+    Returns:
+        Optional[Tuple[str, str]]: The kind of the section (one of SECTION_KINDS) and the name
+            of its table or view, None if the line does not open a section.
+    """
+    match = SECTION_PATTERN.match(line)
+    if not match:
+        return None
+    return SECTION_KINDS[match.group(1)], match.group(2).decode('utf-8')
+
+
+def defer_keys(schema: str) -> Tuple[str, Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Removes the secondary keys and the foreign keys from the CREATE TABLE statements of a schema.
+
+    Loading rows into tables with only their primary key, and building the other keys once
+    afterwards, is much faster than updating every key for each row. Keys with an
+    AUTO_INCREMENT column among their columns are kept, as MySQL requires that column to be
+    indexed, e.g. by a composite key of a MyISAM table numbering rows within groups.
+
+    Args:
+        schema (str): The SQL schema dumped by mysqldump.
+
+    Returns:
+        Tuple[str, Dict[str, List[str]], Dict[str, List[str]]]: The schema without the deferred
+            keys, and the definitions of the deferred secondary keys and foreign keys by table.
+    """
+    secondary_keys, foreign_keys = {}, {}
+
+    def strip(match):
+        table, body, tail = match.group(1), match.group(2), match.group(3)
+        definitions = [line.rstrip().rstrip(',') for line in body.split('\n') if line.strip()]
+        auto_increment = {m.group(1) for m in map(AUTO_INCREMENT_PATTERN.match, definitions) if m}
+        kept = []
+        for definition in definitions:
+            key = SECONDARY_KEY_PATTERN.match(definition)
+            if key and auto_increment.isdisjoint(KEY_COLUMN_PATTERN.findall(key.group(2))):
+                secondary_keys.setdefault(table, []).append(definition.strip())
+            elif FOREIGN_KEY_PATTERN.match(definition):
+                foreign_keys.setdefault(table, []).append(definition.strip())
+            else:
+                kept.append(definition)
+        return f"CREATE TABLE `{table}` (\n" + ",\n".join(kept) + f"\n{tail}"
+
+    return CREATE_TABLE_PATTERN.sub(strip, schema), secondary_keys, foreign_keys
+
+
+class SplitDump:
+    """
+    A plain mysqldump file split into the parts loaded by the ParallelLoader.
+
+    Attributes:
+        header (bytes): The session settings at the top of the dump, prepended to every data file.
+        schema (bytes): The CREATE TABLE statements and temporary view structures.
+        tables (Dict[str, List[Path]]): The data files of each table.
+        post (bytes): The triggers, final view structures and routines, created after the data.
+    """
+
+    def __init__(self):
+        """Initialize an empty split dump."""
+        self.header = b''
+        self.schema = b''
+        self.tables: Dict[str, List[Path]] = {}
+        self.post = b''
+
+
+class DumpSplitter:
+    """
+    Splits a plain mysqldump file at its table boundaries, line by line.
+
+    The data of each table goes to its own files, a new file starting at an INSERT statement
+    every `split_size` bytes, so large tables are loaded in parallel too. Triggers found after
+    the data or the CREATE TABLE statement of a table are moved after the data, so they do not
+    fire while it is loaded.
+
+    Attributes:
+        work_dir (Path): The directory where the data files are written.
+        split_size (int): The size in bytes of the data files.
+    """
+
+    def __init__(self, work_dir: Path, split_size: int = SPLIT_SIZE):
+        """
+        Initialize the splitter.
+
+        Args:
+            work_dir (Path): The directory where the data files are written.
+            split_size (int): The size in bytes of the data files.
+        """
+        self.work_dir = work_dir
+        self.split_size = split_size
+        self._dump = SplitDump()
+        self._header, self._schema, self._post = [], [], []
+        self._section, self._table = None, None
+        self._data_file, self._data_size, self._data_index = None, 0, 0
+        self._after_data = False
+
+    def feed(self, line: bytes) -> None:
+        """
+        Splits the next line of the dump.
+
+        Args:
+            line (bytes): The line, including its line feed.
+        """
+        match = SECTION_PATTERN.match(line)
+        if match:
+            self._section, self._table = match.group(1), match.group(2).decode('utf-8')
+            self._after_data = False
+            self._close_data_file()
+        section = self._section
+        if section is None:
+            self._header.append(line)
+        elif section == b'Dumping data for table':
+            if self._after_data or line.startswith(b'UNLOCK TABLES;'):
+                self._after_data = True
+                if not line.startswith(b'UNLOCK TABLES;'):
+                    self._post.append(line)
+            elif SKIPPED_DATA_PATTERN.match(line):
+                return
+            elif line.startswith(b'INSERT INTO '):
+                if self._data_file is None or self._data_size >= self.split_size:
+                    self._close_data_file()
+                    self._data_index += 1
+                    path = self.work_dir / f"{self._data_index:05d}.sql"
+                    self._dump.tables.setdefault(self._table, []).append(path)
+                    self._data_file = open(path, 'wb')
+                    self._data_file.write(b''.join(self._header))
+                    self._data_size = 0
+                self._data_file.write(line)
+                self._data_size += len(line)
+        elif section == b'Table structure for table':
+            (self._post if self._after_data else self._schema).append(line)
+            self._after_data = self._after_data or line.startswith(STRUCTURE_END)
+        elif section == b'Temporary view structure for view':
+            self._schema.append(line)
+        else:
+            self._post.append(line)
+
+    def close(self) -> SplitDump:
+        """
+        Closes the last data file.
+
+        Returns:
+            SplitDump: The parts of the dump.
+        """
+        self._close_data_file()
+        dump = self._dump
+        dump.header, dump.schema, dump.post = b''.join(self._header), b''.join(self._schema), b''.join(self._post)
+        return dump
+
+    def _close_data_file(self) -> None:
+        """Closes the data file being written, if any."""
+        if self._data_file:
+            self._data_file.close()
+            self._data_file = None
+
+
+def split_dump(lines: Iterable[bytes], work_dir: Path, split_size: int = SPLIT_SIZE) -> SplitDump:
+    """
+    Splits the lines of a plain mysqldump file at its table boundaries (see DumpSplitter).
+
+    Args:
+        lines (Iterable[bytes]): The lines of the dump.
+        work_dir (Path): The directory where the data files are written.
+        split_size (int): The size in bytes of the data files.
+
+    Returns:
+        SplitDump: The parts of the dump.
+    """
+    splitter = DumpSplitter(work_dir, split_size)
+    try:
+        for line in lines:
+            splitter.feed(line)
+    finally:
+        dump = splitter.close()
+    return dump
+
+
+class ParallelLoader:
+    """
+    Parallel loader of MySQL dumps, for plain mysqldump files and directory format dumps.
+
+    The schema is created first without secondary keys and foreign keys, then the data of
+    the tables is loaded by a pool of mysql clients with bulk load session settings (foreign
+    key and unique checks disabled, and binary logging disabled when the user is allowed to).
+    Secondary keys are then built table by table in parallel, foreign keys are added without
+    checking the loaded rows, and the triggers, views and routines are created last.
+
+    Attributes:
+        module (MySQLModule): The module of the server.
+        name (str): The name of the database to load.
+        jobs (int): The number of concurrent mysql clients.
+        timeout (float): The maximum duration of each load step in seconds, None for no limit.
+        stats (Dict[str, dict]): The bytes, rows and seconds of the data load of each table.
+    """
+
+    def __init__(self, module, name: str, jobs: int = 4, timeout: float = None):
+        """
+        Initialize the loader.
+
+        Args:
+            module (MySQLModule): The module of the server.
+            name (str): The name of the database to load, which must exist and be empty.
+            jobs (int): The number of concurrent mysql clients.
+            timeout (float): The maximum duration of each load step in seconds, None for no limit.
+        """
+        self.module = module
+        self.name = name
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._init_command = None
+
+    def _command(self) -> List[str]:
+        """Returns the argv of a mysql client loading the database with the bulk load session settings."""
+        if self._init_command is None:
+            settings = ['foreign_key_checks=0', 'unique_checks=0']
+            if self._can_disable_binlog():
+                settings.append('sql_log_bin=0')
+            self._init_command = "SET SESSION " + ", ".join(settings)
+        return ['mysql', *self.module._connection_options(), f'--init-command={self._init_command}', self.name]
+
+    def _can_disable_binlog(self) -> bool:
+        """Checks whether the user is allowed to disable the binary log of its sessions."""
+        try:
+            connection = mysql.connector.connect(host=self.module.host, port=self.module.port,
+                                                 user=self.module.username, password=self.module.password)
+        except mysql.connector.Error:
+            return False
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SET SESSION sql_log_bin = 0")
+            cursor.close()
+            return True
+        except mysql.connector.Error:
+            logger.info("Binary logging stays enabled during the load: not allowed to disable it.")
+            return False
+        finally:
+            connection.close()
+
+    def _load(self, source: Path = None, sql: bytes = None) -> None:
+        """Loads an SQL file, decompressing it if needed, or SQL text into the database."""
+        runner = default_runner()
+        job_name = self.module.job_name("restore", self.name)
+        if sql is not None:
+            with tempfile.NamedTemporaryFile(suffix='.sql') as file:
+                file.write(sql)
+                file.flush()
+                runner.run([self._command()], name=job_name, stdin=Path(file.name), timeout=self.timeout)
+            return
+        codec = detect_codec(source)
+        if codec:
+            runner.run([decompress_command(codec, source), self._command()], name=job_name, timeout=self.timeout)
+        else:
+            runner.run([self._command()], name=job_name, stdin=source, timeout=self.timeout)
+
+    def _load_table(self, table: str, files: List[Path], rows: Optional[int] = None) -> None:
+        """Loads the data files of a table in order, recording its load statistics."""
+        start = time.monotonic()
+        for file in files:
+            self._load(file)
+        seconds = time.monotonic() - start
+        size = sum(file.stat().st_size for file in files)
+        with self._lock:
+            self.stats[table] = {'bytes': size, 'rows': rows, 'seconds': seconds}
+        rate = f"{size / seconds / 1024 / 1024:.1f} MB/s" if seconds else "n/a"
+        if rows is not None and seconds:
+            rate += f", {rows / seconds:.0f} rows/s"
+        logger.info(f"Table {self.name}.{table} loaded from {len(files)} files in {seconds:.1f}s ({rate}).")
+
+    def _parallel(self, tasks: List[tuple]) -> None:
+        """Runs (function, *args) tasks on the pool, raising the first error."""
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for future in [executor.submit(*task) for task in tasks]:
+                future.result()
+
+    def _load_data(self, tables: Dict[str, List[Path]], rows: Dict[str, int] = None) -> None:
+        """Loads the data of the tables in parallel, the largest tables first, and splits them across
+        the pool when they have several files."""
+        rows = rows or {}
+        tasks = []
+        for table, files in sorted(tables.items(), key=lambda item: -sum(f.stat().st_size for f in item[1])):
+            if len(files) > 1 and self.jobs > 1:
+                # Files of one table hold disjoint rows and are loaded concurrently
+                tasks.extend((self._load_table, f"{table}#{i}", [file]) for i, file in enumerate(files))
+            else:
+                tasks.append((self._load_table, table, files, rows.get(table)))
+        self._parallel(tasks)
+        for table, files in tables.items():
+            parts = [self.stats.pop(f"{table}#{i}") for i in range(len(files)) if f"{table}#{i}" in self.stats]
+            if parts:
+                self.stats[table] = {'bytes': sum(p['bytes'] for p in parts), 'rows': rows.get(table),
+                                     'seconds': max(p['seconds'] for p in parts)}
+
+    def _create_keys(self, secondary_keys: Dict[str, List[str]], foreign_keys: Dict[str, List[str]]) -> None:
+        """Builds the deferred secondary keys in parallel, then adds the deferred foreign keys."""
+        def alter(table, definitions):
+            start = time.monotonic()
+            clauses = ", ".join(f"ADD {definition}" for definition in definitions)
+            self._load(sql=f"ALTER TABLE `{table}` {clauses};\n".encode('utf-8'))
+            logger.info(f"Keys of {self.name}.{table} created in {time.monotonic() - start:.1f}s.")
+
+        self._parallel([(alter, table, definitions) for table, definitions in secondary_keys.items()])
+        self._parallel([(alter, table, definitions) for table, definitions in foreign_keys.items()])
+
+    def load_plain(self, source_file: Path) -> Dict[str, dict]:
+        """
+        Loads a plain mysqldump file, compressed, chunked or not.
+
+        Args:
+            source_file (Path): The dump file.
+
+        Returns:
+            Dict[str, dict]: The load statistics of each table.
+        """
+        # The split copy goes to the temporary directory of the system (TMPDIR), not beside the backups
+        with tempfile.TemporaryDirectory(prefix='restore-') as work_dir:
+            splitter = DumpSplitter(Path(work_dir))
+            try:
+                scan_lines(source_file, splitter.feed, name=self.module.job_name("restore", self.name),
+                           timeout=self.timeout)
+            finally:
+                dump = splitter.close()
+            logger.info(f"Dump {source_file} split into {sum(map(len, dump.tables.values()))} files "
+                        f"of {len(dump.tables)} tables.")
+
+            schema, secondary_keys, foreign_keys = defer_keys(dump.schema.decode('utf-8'))
+            self._load(sql=dump.header + schema.encode('utf-8'))
+            self._load_data(dump.tables)
+            self._create_keys(secondary_keys, foreign_keys)
+            self._load(sql=dump.header + dump.post)
+        return self.stats
+
+    def load_directory(self, source_dir: Path) -> Dict[str, dict]:
+        """
+        Loads a directory format dump written by ParallelDump.
+
+        Args:
+            source_dir (Path): The directory of the dump.
+
+        Returns:
+            Dict[str, dict]: The load statistics of each table.
+        """
+        manifest = json.loads((source_dir / MANIFEST_FILE).read_text())
+        # The schema dump has no data sections, so no data file is written to the backup directory
+        with open(source_dir / manifest.get('schema', SCHEMA_FILE), 'rb') as lines:
+            dump = split_dump(lines, source_dir)
+
+        schema, secondary_keys, foreign_keys = defer_keys(dump.schema.decode('utf-8'))
+        self._load(sql=dump.header + schema.encode('utf-8'))
+        tables = {table['name']: [source_dir / chunk['file'] for chunk in table['chunks']]
+                  for table in manifest['tables']}
+        rows = {table['name']: sum(chunk.get('rows', 0) for chunk in table['chunks']) for table in manifest['tables']}
+        self._load_data(tables, rows)
+        self._create_keys(secondary_keys, foreign_keys)
+        self._load(sql=dump.header + dump.post)
+        return self.stats
@@ -1,13 +1,25 @@
 import time
+from datetime import datetime
 
 import mysql.connector
 from mysql.connector import Error
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, Dict, List, Optional, Set
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 import logging
 
+from app.chunkstore import ChunkStore
+from app.compression import stream_to_file, detect_codec, decompress_command, read_stages, scan_lines
+from app.index import extract_sections, iter_sections, read_index, stream_to_indexed_file
 from app.modules.abstract_module import AbstractModule
+from app.modules.mysql_binlog import list_binlogs, replay_command
+from app.modules.mysql_loader import STRUCTURE_END, ParallelLoader, dump_section
+from app.modules.mysql_parallel import MANIFEST_FILE, SCHEMA_FILE, ParallelDump
+from app.process import JobCancelled, StreamPipe, default_runner
 
 # Configura il logger
 logger = logging.getLogger(__name__)
@@ -20,7 +32,35 @@ class MySQLModule(AbstractModule):
     for listing, backing up, and restoring databases.
     """
 
-    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str):
+    # mysqldump options of each dump profile, 'copy' being the fast path of multi-row inserts
+    DUMP_PROFILES = {
+        'copy': ['--complete-insert'],
+        'inserts': ['--complete-insert', '--skip-extended-insert'],
+        'schema-only': ['--no-data'],
+    }
+
+    # mysqldump options recording the binary log coordinates of the dump as a comment, taken
+    # from a consistent snapshot with only a brief global read lock
+    BINLOG_OPTIONS = ['--single-transaction', '--master-data=2']
+
+    # mysqldump options dumping the stored routines and events with the tables, views and triggers
+    ROUTINE_OPTIONS = ['--routines', '--events']
+
+    # Schema objects recreated when a restored database is swapped in, in creation order, with
+    # the query listing them and the columns of their SHOW CREATE row holding their SQL mode
+    # (None for views, which have none) and their definition
+    SWAPPED_OBJECTS = {
+        'FUNCTION': ("SELECT ROUTINE_NAME FROM information_schema.ROUTINES "
+                     "WHERE ROUTINE_SCHEMA = %s AND ROUTINE_TYPE = 'FUNCTION'", 1, 2),
+        'PROCEDURE': ("SELECT ROUTINE_NAME FROM information_schema.ROUTINES "
+                      "WHERE ROUTINE_SCHEMA = %s AND ROUTINE_TYPE = 'PROCEDURE'", 1, 2),
+        'VIEW': ("SELECT TABLE_NAME FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s", None, 1),
+        'TRIGGER': ("SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = %s", 1, 2),
+        'EVENT': ("SELECT EVENT_NAME FROM information_schema.EVENTS WHERE EVENT_SCHEMA = %s", 1, 3),
+    }
+
+    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str,
+                 target: Optional[str] = None):
         """
         Initializes the MySQLModule with connection details.
 
@@ -29,8 +69,10 @@ class MySQLModule(AbstractModule):
             port (str): The port number of the MySQL server.
             username (str): The username to connect to the MySQL server.
             password (str): The password to connect to the MySQL server.
+            maintenance_db (str): The name of the database used for maintenance.
+            target (str): The name of the backup target of the server, None if it is the only one.
         """
-        super().__init__(host, port, username, password, maintenance_db)
+        super().__init__(host, port, username, password, maintenance_db, target)
 
     def _connect(self):
         """
@@ -84,60 +126,780 @@ class MySQLModule(AbstractModule):
             logger.error("Unknown error connecting to database.")
             return []
 
-    def backup_database(self, name: str, destination_file: Path) -> bool:
+    def get_database_sizes(self) -> Dict[str, int]:
+        """
+        Reads the size of the databases of the MySQL server, as the data and index length of
+        their tables in information_schema.
+
+        Returns:
+            Dict[str, int]: The size in bytes of each database, empty if the sizes cannot be read.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                try:
+                    # MySQL 8 caches table statistics for a day by default
+                    cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                except Error:
+                    pass
+                cursor.execute("SELECT TABLE_SCHEMA, SUM(COALESCE(DATA_LENGTH, 0) + COALESCE(INDEX_LENGTH, 0)) "
+                               "FROM information_schema.TABLES GROUP BY TABLE_SCHEMA")
+                sizes = cursor.fetchall()
+                cursor.close()
+                return {db_name: int(size) for db_name, size in sizes}
+            except Error as e:
+                logger.error(f"Error reading database sizes: {e}")
+                return {}
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return {}
+
+    def get_server_load(self) -> Optional[dict]:
+        """
+        Samples the load of the MySQL server from the Threads_running status variable, less
+        the running threads of this process, and the replication lag of a replica.
+
+        The threads of this process are the connections whose `_pid` connection attribute is
+        the id of this process, e.g. the parallel dumpers and loaders, or of a process of a
+        running job of the runner, e.g. mysqldump. Without the performance schema only the
+        connection sampling the load is left out.
+
+        Returns:
+            Optional[dict]: The number of 'active' threads and the replication 'lag' in seconds,
+                None if the load cannot be read.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+                running = int(cursor.fetchone()['Value'])
+                pids = [str(pid) for pid in [os.getpid(), *default_runner().pids()]]
+                try:
+                    cursor.execute("SELECT COUNT(DISTINCT p.ID) AS own FROM information_schema.PROCESSLIST p "
+                                   "JOIN performance_schema.session_connect_attrs a ON a.PROCESSLIST_ID = p.ID "
+                                   "WHERE p.COMMAND <> 'Sleep' AND a.ATTR_NAME = '_pid' "
+                                   f"AND a.ATTR_VALUE IN ({', '.join(['%s'] * len(pids))})", pids)
+                    own = int(cursor.fetchone()['own'])
+                except Error:
+                    # Performance schema disabled: only this connection is known to be ours
+                    own = 1
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except Error:
+                    # MariaDB and MySQL before 8.0.22
+                    cursor.execute("SHOW SLAVE STATUS")
+                replica = cursor.fetchone()
+                cursor.close()
+                lag = None
+                if replica:
+                    lag = replica.get('Seconds_Behind_Source', replica.get('Seconds_Behind_Master'))
+                return {'active': max(0, running - own), 'lag': float(lag) if lag is not None else None}
+            except Error as e:
+                logger.error(f"Error reading server load: {e}")
+                return None
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return None
+
+    def get_change_token(self, name: str) -> Optional[str]:
+        """
+        Computes a token of the tables, views, routines and triggers of a database from
+        information_schema.
+
+        Tables are described by their creation and update times and by their row count and
+        data length statistics. A table without update time (e.g. an InnoDB table not written
+        since the server started) cannot be told unchanged without scanning it, so the
+        database is then considered changed.
+
+        Args:
+            name (str): The name of the database.
+
+        Returns:
+            Optional[str]: The change token, None if the database cannot be inspected or may have changed.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                try:
+                    # MySQL 8 caches table statistics for a day by default
+                    cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                except Error:
+                    pass
+                cursor.execute("SELECT TABLE_NAME, TABLE_TYPE, ENGINE, CREATE_TIME, UPDATE_TIME, TABLE_ROWS, "
+                               "DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                               "ORDER BY TABLE_NAME", (name,))
+                tables = cursor.fetchall()
+                for table_name, table_type, _, _, update_time, *_ in tables:
+                    if table_type == 'BASE TABLE' and update_time is None:
+                        logger.info(f"Table {name}.{table_name} has no update time, database {name} is dumped")
+                        cursor.close()
+                        return None
+                cursor.execute("SELECT TABLE_NAME, VIEW_DEFINITION FROM information_schema.VIEWS "
+                               "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME", (name,))
+                views = cursor.fetchall()
+                cursor.execute("SELECT ROUTINE_NAME, ROUTINE_TYPE, LAST_ALTERED FROM information_schema.ROUTINES "
+                               "WHERE ROUTINE_SCHEMA = %s ORDER BY ROUTINE_NAME", (name,))
+                routines = cursor.fetchall()
+                cursor.execute("SELECT TRIGGER_NAME, CREATED FROM information_schema.TRIGGERS "
+                               "WHERE TRIGGER_SCHEMA = %s ORDER BY TRIGGER_NAME", (name,))
+                triggers = cursor.fetchall()
+                cursor.close()
+                return hashlib.sha256(repr((tables, views, routines, triggers)).encode('utf-8')).hexdigest()
+            except Error as e:
+                logger.error(f"Error reading change information of database {name}: {e}")
+                return None
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return None
+
+    def backup_database(self, name: str, destination_file: Path, dump_format: str = 'custom', dump_jobs: int = 1,
+                        dump_chunk_mb: int = 512, dump_profile: str = 'copy', compression: str = None,
+                        compression_level: int = None, compression_threads: int = 0, timeout: float = None,
+                        index: bool = True, chunk_store: ChunkStore = None, stats: dict = None,
+                        binlog: bool = False, incremental: bool = False, previous_backup: Path = None,
+                        **options) -> bool:
         """
         Backs up the specified database to a file.
 
+        The 'copy' profile stores table data as multi-row INSERT statements, the 'inserts'
+        profile as one INSERT statement per row and the 'schema-only' profile does not store
+        table data at all. If a compression codec is given, the dump is compressed while it
+        is streamed to the file.
+
+        With the 'directory' format the backup is a directory of per-table chunks dumped by
+        `dump_jobs` connections sharing one consistent snapshot, tables larger than
+        `dump_chunk_mb` being split into primary key ranges (see ParallelDump).
+
+        With `index`, a single file dump is written as one section per table structure, table
+        data, view and routines block, each compressed as an independent frame, and the offsets
+        of the sections are stored in the sidecar index `<backup>.index`, so single tables can
+        be restored without reading the whole file. Directory format dumps are indexed by their
+        manifest.
+
+        With a chunk store, a single file dump is stored as deduplicated chunks, compressed with
+        zlib if a codec is given, and the backup file is its recipe (see stream_to_file).
+
+        With `incremental`, a directory format dump hardlinks the chunks of the tables unchanged
+        since `previous_backup` instead of dumping them again (see ParallelDump).
+
+        With `binlog`, a single file dump records in its header the binary log coordinates it
+        is consistent with, where the replay of the archived binary logs starts (see
+        replay_binlog). Directory format dumps always record them in their manifest.
+
         Args:
             name (str): The name of the database to back up.
             destination_file (Path): The path to the file where the backup will be stored.
+            dump_format (str): The dump format, 'custom' for a single mysqldump file or 'directory'.
+            dump_jobs (int): The number of parallel connections used by the 'directory' format.
+            dump_chunk_mb (int): The size in MB above which tables are split by the 'directory' format.
+            dump_profile (str): The dump profile, 'copy', 'inserts' or 'schema-only'.
+            compression (str): The compression codec ('zstd', 'lz4' or 'gzip'), None for no compression.
+            compression_level (int): The compression level, the codec default if None.
+            compression_threads (int): The number of compression threads, 0 for one per core.
+            timeout (float): The maximum duration of the dump in seconds, None for no limit.
+            index (bool): Whether to write the sidecar index of the sections of a single file dump.
+            chunk_store (ChunkStore): The chunk store of the backup, None to write the dump to the file.
+            stats (dict): If given, filled with the 'dump_bytes' produced by the dump tool when known.
+            binlog (bool): Whether to record the binary log coordinates of a single file dump.
+            incremental (bool): Whether to reuse the chunks of the tables unchanged since the previous backup.
+            previous_backup (Path): The previous incremental backup of the database, None for a full dump.
+            **options: Other dump options of the cron configuration, not used by mysqldump.
 
         Returns:
             bool: True if the backup was successful, False otherwise.
         """
-        command = (f"mysqldump --complete-insert -h {self._host} -P {self._port} -u {self._username} -p{self._password} {name} >"
-                   f" {destination_file}")
+        command = ['mysqldump', *self.DUMP_PROFILES[dump_profile], *self.ROUTINE_OPTIONS,
+                   *(self.BINLOG_OPTIONS if binlog else []), *self._connection_options(), name]
+        if incremental and dump_format != 'directory':
+            logger.warning(f"Incremental backup only applies to directory format dumps of {name}.")
         try:
-            subprocess.run(command, shell=True, check=True, text=True)
+            if dump_format == 'directory':
+                if chunk_store:
+                    logger.warning(f"Chunk storage is not applied to directory format backup of {name}.")
+                dump_bytes = ParallelDump(self, name, destination_file, dump_jobs, dump_chunk_mb * 1024 * 1024,
+                                          dump_profile, compression, compression_level, compression_threads,
+                                          timeout, incremental, previous_backup).run()
+            elif index:
+                dump_bytes = stream_to_indexed_file(command, destination_file, dump_section, compression,
+                                                    compression_level, compression_threads, timeout=timeout,
+                                                    name=self.job_name("backup", name), chunk_store=chunk_store)
+            else:
+                dump_bytes = stream_to_file(command, destination_file, compression, compression_level,
+                                            compression_threads, timeout=timeout, name=self.job_name("backup", name),
+                                            chunk_store=chunk_store)
+            if stats is not None:
+                stats['dump_bytes'] = dump_bytes
             logger.info(f"Backup successful for database {name} to {destination_file}.")
             return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled, Error) as e:
             logger.error(f"Error backing up database {name}: {e}")
             return False
 
-    def restore_database(self, name: str, source_file: Path) -> bool:
+    def _connection_options(self) -> List[str]:
+        """
+        Returns the options connecting the MySQL tools to the server.
+
+        Returns:
+            List[str]: The connection options.
+        """
+        return ['-h', self._host, '-P', str(self._port), '-u', self._username, f'-p{self._password}']
+
+    def restore_database(self, name: str, source_file: Path, jobs: int = 1, timeout: float = None,
+                         swap: bool = False, stats: dict = None, **options) -> bool:
         """
-        Restores the specified database from a backup file.
+        Restores the specified database from a backup file, decompressing or unchunking it if needed.
+
+        Directory format backups, and plain backups restored with more than one job, are
+        loaded by a ParallelLoader: tables are loaded by `jobs` concurrent clients with bulk
+        load session settings, and secondary keys and foreign keys are created once the data
+        is in. Other backups are piped to a single mysql client.
+
+        By default the live database is dropped before the backup is loaded. With `swap` the
+        backup is loaded into a shadow database `<name>__restore_<timestamp>`, whose tables
+        replace the tables of the live database with a single atomic RENAME TABLE once it is
+        loaded and holds every table of the backup; its views, triggers, routines and events
+        then replace those of the live database (see _swap_database).
 
         Args:
             name (str): The name of the database to restore.
-            source_file (Path): The path to the backup file.
+            source_file (Path): The path to the backup file or directory.
+            jobs (int): The number of tables loaded at the same time.
+            timeout (float): The maximum duration of each restore step in seconds, None for no limit.
+            swap (bool): Whether to load the backup into a shadow database swapped with the live one.
+            stats (dict): If given, filled with the load statistics of each table under 'tables'
+                when the backup is loaded in parallel.
+            **options: Restore options, not used by the mysql client.
 
         Returns:
             bool: True if the restore was successful, False otherwise.
         """
-        drop_command = (f"mysql -h {self._host} -P {self._port} -u {self._username} -p{self._password}"
-                        f" -e 'DROP DATABASE IF EXISTS {name}; CREATE DATABASE {name};'")
-        restore_command = (f"mysql -h {self._host} -P {self._port} -u {self._username} -p{self._password} {name}"
-                           f" < {source_file}")
+        target = self._shadow_database_name(name) if swap else name
+        drop_command = ['mysql', *self._connection_options(),
+                        '-e', f'DROP DATABASE IF EXISTS {target}; CREATE DATABASE {target};']
+        restore_command = ['mysql', *self._connection_options(), target]
 
+        runner = default_runner()
+        job_name = self.job_name("restore", name)
         try:
             # Drop and recreate the database
-            subprocess.run(drop_command, shell=True, check=True, text=True, encoding='utf-8')
-            logger.info(f"Database {name} dropped and recreated successfully.")
+            runner.run([drop_command], name=job_name, timeout=timeout)
+            logger.info(f"Database {target} dropped and recreated successfully.")
 
             # Restore the database from the backup file
-            subprocess.run(restore_command, shell=True, check=True, text=True, encoding='utf-8')
-            logger.info(f"Restore successful for database {name} from {source_file}.")
+            if source_file.is_dir() or jobs > 1:
+                loader = ParallelLoader(self, target, jobs, timeout)
+                tables = loader.load_directory(source_file) if source_file.is_dir() else loader.load_plain(source_file)
+                if stats is not None:
+                    stats['tables'] = tables
+            else:
+                stages, stdin = read_stages(source_file)
+                runner.run(stages + [restore_command], name=job_name, stdin=stdin, timeout=timeout)
+            logger.info(f"Restore successful for database {target} from {source_file}.")
+
+            if swap:
+                self._check_restored_database(target, len(self._backup_tables(source_file, job_name, timeout)))
+                self._swap_database(target, name)
             return True
-        except subprocess.CalledProcessError as e:
-            logger.error(
-                f"Error restoring database {name}: {e}. Command: "
-                f"{drop_command if e.cmd == drop_command else restore_command}")
-            return False
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled, Error) as e:
+            logger.error(f"Error restoring database {name}: {e}")
         except FileNotFoundError:
             logger.error(f"Backup file {source_file} not found.")
-            return False
         except Exception as e:
             logger.error(f"Unexpected error occurred while restoring database {name}: {e}")
+        if swap:
+            self._drop_database(target)
+        return False
+
+    def restore_tables(self, name: str, source_file: Path, tables: List[str], schema: str = None,
+                       timeout: float = None, **options) -> bool:
+        """
+        Restores some tables of a database from a backup, leaving the other tables untouched.
+
+        Each table is dropped and recreated with its triggers, then its rows are loaded. Indexed
+        single file backups are read through their sidecar index, so only the frames of the
+        sections of these tables are read and decompressed; backups without an index are
+        scanned in full. Directory format backups are read from their schema and from the
+        chunks of these tables.
+
+        Args:
+            name (str): The name of the database to restore the tables into.
+            source_file (Path): The path to the backup file or directory.
+            tables (List[str]): The names of the tables to restore.
+            schema (str): Not used, MySQL databases have no schemas.
+            timeout (float): The maximum duration of the restore in seconds, None for no limit.
+            **options: Other restore options, not used by the mysql client.
+
+        Returns:
+            bool: True if the restore was successful, False otherwise.
+        """
+        if schema:
+            logger.warning(f"Schema filter '{schema}' ignored: MySQL databases have no schemas.")
+        restore_command = ['mysql', *self._connection_options(), name]
+        job_name = self.job_name("restore", name)
+        try:
+            missing = set(tables) - self._backup_tables(source_file, job_name, timeout)
+            if missing:
+                logger.error(f"Tables {', '.join(sorted(missing))} not found in backup {source_file}.")
+                return False
+            # The SQL of the tables is streamed to the standard input of the mysql client
+            pipe = StreamPipe()
+            job = default_runner().submit([restore_command], name=job_name, stdin=pipe, timeout=timeout)
+            pipe.attach(job)
+            try:
+                if source_file.is_dir():
+                    self._extract_directory_tables(source_file, set(tables), pipe, job_name, timeout)
+                else:
+                    self._extract_plain_tables(source_file, set(tables), pipe, job_name, timeout)
+                pipe.close()
+                job.result()
+            except BaseException:
+                job.cancel()
+                pipe.close()
+                raise
+            logger.info(f"Tables {', '.join(tables)} of database {name} restored from {source_file}.")
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled) as e:
+            logger.error(f"Error restoring tables of database {name}: {e}")
+        except FileNotFoundError:
+            logger.error(f"Backup file {source_file} not found.")
+        except Exception as e:
+            logger.error(f"Unexpected error occurred while restoring tables of database {name}: {e}")
+        return False
+
+    def receive_binlog(self, binlog_dir: Path, server_id: int) -> None:
+        """
+        Archives the binary logs of the server with mysqlbinlog, until the connection is lost.
+
+        The files are copied as they are written, starting again from the last archived file,
+        which is copied again in full, or from the oldest binary log kept by the server when
+        the archive is empty.
+
+        Args:
+            binlog_dir (Path): The binary log archive directory.
+            server_id (int): The server id mysqlbinlog connects with, unique among the replicas of the server.
+
+        Raises:
+            subprocess.CalledProcessError: If mysqlbinlog fails.
+            mysql.connector.Error: If the binary logs of the server cannot be listed.
+            JobCancelled: If the archiving is cancelled.
+        """
+        binlog_dir.mkdir(parents=True, exist_ok=True)
+        archived = list_binlogs(binlog_dir)
+        start_file = archived[-1].name if archived else self._first_binlog()
+        command = ['mysqlbinlog', *self._connection_options(), '--read-from-remote-server', '--raw', '--stop-never',
+                   f'--stop-never-slave-server-id={server_id}', f'--result-file={binlog_dir}/', start_file]
+        logger.info(f"Archiving binary logs to {binlog_dir} from {start_file}.")
+        default_runner().run([command], name=self.job_name("binlog", "archive"))
+
+    def replay_binlog(self, name: str, binlog_dir: Path, start_file: str, start_position: int,
+                      stop_time: datetime = None, stop_gtid: str = None, timeout: float = None, **options) -> bool:
+        """
+        Replays the changes of a database from the archived binary logs, on top of a restored dump.
+
+        The changes are read from the binary log coordinates recorded by the dump, up to the
+        stop time or GTID or to the end of the archive. MySQL servers apply the transactions
+        without their GTIDs, since they already executed them before the dump was restored.
+
+        Args:
+            name (str): The name of the database.
+            binlog_dir (Path): The binary log archive directory.
+            start_file (str): The binary log file recorded by the dump.
+            start_position (int): The position in this file recorded by the dump.
+            stop_time (datetime): The local time to stop at, the end of the archive if None.
+            stop_gtid (str): The GTID of the last transaction to replay, the end of the archive if None.
+            timeout (float): The maximum duration of the replay in seconds, None for no limit.
+            **options: Other restore options, not used by mysqlbinlog.
+
+        Returns:
+            bool: True if the replay was successful, False otherwise.
+        """
+        binlog_files = list_binlogs(binlog_dir, start_file)
+        if not binlog_files or binlog_files[0].name != start_file:
+            logger.error(f"Binary log {start_file} is not archived in {binlog_dir}.")
+            return False
+        try:
+            command = replay_command(name, binlog_files, start_position, stop_time, stop_gtid,
+                                     skip_gtids=not self._is_mariadb())
+            logger.info(f"Replaying {len(binlog_files)} binary logs into database {name} from "
+                        f"{start_file}:{start_position}.")
+            default_runner().run([command, ['mysql', *self._connection_options()]], name=self.job_name("restore", name),
+                                 timeout=timeout)
+            logger.info(f"Binary logs replayed into database {name}.")
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled, ValueError) as e:
+            logger.error(f"Error replaying binary logs into database {name}: {e}")
+            return False
+
+    def _first_binlog(self) -> str:
+        """
+        Returns the oldest binary log file kept by the server.
+
+        Returns:
+            str: The file name.
+
+        Raises:
+            mysql.connector.Error: If the binary logs cannot be listed, e.g. when binary logging is disabled.
+        """
+        connection = self._connect()
+        if not connection:
+            raise Error(msg="Cannot connect to list the binary logs")
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SHOW BINARY LOGS")
+            binlogs = cursor.fetchall()
+            cursor.close()
+        finally:
+            connection.close()
+        if not binlogs:
+            raise Error(msg="The server has no binary logs")
+        return binlogs[0][0]
+
+    def _is_mariadb(self) -> bool:
+        """
+        Checks whether the server is a MariaDB server.
+
+        Returns:
+            bool: True for MariaDB, False for MySQL or if the server cannot be queried.
+        """
+        connection = self._connect()
+        if not connection:
+            return False
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT VERSION()")
+            version = cursor.fetchone()[0]
+            cursor.close()
+            return 'MariaDB' in version
+        except Error:
             return False
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _extract_plain_tables(source_file: Path, tables: Set[str], output: BinaryIO, name: str = None,
+                              timeout: float = None) -> Set[str]:
+        """
+        Writes the header and the structure and data sections of some tables of a single file dump.
+
+        Args:
+            source_file (Path): The dump file.
+            tables (Set[str]): The names of the tables.
+            output (BinaryIO): The file, or any writer, receiving the SQL of the tables.
+            name (str): The name of the decompression jobs, used to cancel them.
+            timeout (float): The maximum duration of each decompression in seconds, None for no limit.
+
+        Returns:
+            Set[str]: The tables found in the dump.
+        """
+        def wanted(kind, table):
+            return kind == 'header' or (kind in ('structure', 'data') and table in tables)
+
+        index = read_index(source_file)
+        if index and index.get('format') == 'sections':
+            sections = [section for section in index['sections'] if wanted(section['kind'], section['name'])]
+            extract_sections(source_file, sections, index['compression'], output, name=name, timeout=timeout)
+            return {section['name'] for section in sections if section['kind'] == 'structure'}
+
+        logger.info(f"Backup {source_file} has no index, scanning it for tables {', '.join(sorted(tables))}.")
+        found = set()
+        kind, table = 'header', None
+
+        def copy(line):
+            nonlocal kind, table
+            section = dump_section(line) if line.startswith(b'--') else None
+            if section:
+                kind, table = section
+            if wanted(kind, table):
+                output.write(line)
+                if kind == 'structure':
+                    found.add(table)
+
+        scan_lines(source_file, copy, name=name, timeout=timeout)
+        output.flush()
+        return found
+
+    @staticmethod
+    def _extract_directory_tables(source_dir: Path, tables: Set[str], output: BinaryIO, name: str = None,
+                                  timeout: float = None) -> Set[str]:
+        """
+        Writes the structure, the data chunks and then the triggers of some tables of a directory format dump.
+
+        Args:
+            source_dir (Path): The directory of the dump.
+            tables (Set[str]): The names of the tables.
+            output (BinaryIO): The file, or any writer, receiving the SQL of the tables.
+            name (str): The name of the decompression jobs, used to cancel them.
+            timeout (float): The maximum duration of each decompression in seconds, None for no limit.
+
+        Returns:
+            Set[str]: The tables found in the dump.
+        """
+        manifest = json.loads((source_dir / MANIFEST_FILE).read_text())
+        found, triggers = set(), []
+        with open(source_dir / manifest.get('schema', SCHEMA_FILE), 'rb') as lines:
+            after_structure = False
+            for kind, table, line in iter_sections(lines, dump_section):
+                if kind == 'header':
+                    output.write(line)
+                elif kind == 'structure' and table in tables:
+                    if table not in found:
+                        found.add(table)
+                        after_structure = False
+                    # Triggers follow the CREATE TABLE statement, and are created after the rows are loaded
+                    if after_structure:
+                        triggers.append(line)
+                    else:
+                        output.write(line)
+                    after_structure = after_structure or line.startswith(STRUCTURE_END)
+        for table in manifest['tables']:
+            if table['name'] not in tables:
+                continue
+            for chunk in table['chunks']:
+                path = source_dir / chunk['file']
+                codec = detect_codec(path)
+                if codec:
+                    default_runner().run([decompress_command(codec, path)], name=name, stdout=output,
+                                         timeout=timeout)
+                else:
+                    with open(path, 'rb') as chunk_file:
+                        shutil.copyfileobj(chunk_file, output)
+        output.write(b''.join(triggers))
+        output.flush()
+        return found
+
+    def _backup_tables(self, source_file: Path, name: str = None, timeout: float = None) -> Set[str]:
+        """
+        Lists the tables of a backup, from the manifest of a directory format dump, from the
+        index of a single file dump, or by scanning the table structure sections of the dump.
+
+        Args:
+            source_file (Path): The backup file or directory.
+            name (str): The name of the job decompressing a scanned dump.
+            timeout (float): The maximum duration of the scan in seconds, None for no limit.
+
+        Returns:
+            Set[str]: The names of the tables.
+        """
+        if source_file.is_dir():
+            manifest = json.loads((source_file / MANIFEST_FILE).read_text())
+            return {table['name'] for table in manifest['tables']}
+        index = read_index(source_file)
+        if index and index.get('format') == 'sections':
+            return {section['name'] for section in index['sections'] if section['kind'] == 'structure'}
+        tables = set()
+
+        def collect(line):
+            section = dump_section(line) if line.startswith(b'-- ') else None
+            if section and section[0] == 'structure':
+                tables.add(section[1])
+
+        scan_lines(source_file, collect, name=name, timeout=timeout)
+        return tables
+
+    def _check_restored_database(self, name: str, expected: int) -> int:
+        """
+        Checks that a restored database can be queried and holds every table of its backup.
+
+        Args:
+            name (str): The name of the restored database.
+            expected (int): The number of tables of the backup.
+
+        Returns:
+            int: The number of tables of the database.
+
+        Raises:
+            mysql.connector.Error: If the database cannot be queried or has another number of tables.
+        """
+        connection = self._connect()
+        if not connection:
+            raise Error(msg=f"Cannot connect to check restored database {name}")
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                           "AND TABLE_TYPE = 'BASE TABLE'", (name,))
+            tables = cursor.fetchone()[0]
+            cursor.close()
+        finally:
+            connection.close()
+        if tables != expected:
+            raise Error(msg=f"Restored database {name} has {tables} tables, its backup has {expected}")
+        logger.info(f"Restored database {name} checked with {tables} tables.")
+        return tables
+
+    def _read_definitions(self, cursor, database: str) -> Dict[str, List[tuple]]:
+        """
+        Reads the definitions of the views, triggers, routines and events of a database.
+
+        Args:
+            cursor: A cursor of a connection to the server.
+            database (str): The name of the database.
+
+        Returns:
+            Dict[str, List[tuple]]: The name, SQL mode and definition of each object, by kind (see SWAPPED_OBJECTS).
+        """
+        definitions = {}
+        for kind, (query, mode_column, definition_column) in self.SWAPPED_OBJECTS.items():
+            cursor.execute(query, (database,))
+            definitions[kind] = []
+            for object_name, in cursor.fetchall():
+                cursor.execute(f"SHOW CREATE {kind} `{database}`.`{object_name}`")
+                row = cursor.fetchone()
+                definitions[kind].append((object_name, row[mode_column] if mode_column is not None else None,
+                                          row[definition_column]))
+        return definitions
+
+    @staticmethod
+    def _create_objects(cursor, database: str, definitions: Dict[str, List[tuple]], source: str,
+                        kinds: Optional[Set[str]] = None) -> None:
+        """
+        Creates views, triggers, routines and events in a database from the definitions read in another one.
+
+        Objects may depend on each other, e.g. views on other views, so the failing ones are
+        created again until no more can be.
+
+        Args:
+            cursor: A cursor of a connection to the server.
+            database (str): The database where the objects are created.
+            definitions (Dict[str, List[tuple]]): The definitions, as read by _read_definitions.
+            source (str): The database the definitions were read from, whose qualified names are replaced.
+            kinds (Set[str]): The kinds of objects to create, all if None.
+
+        Raises:
+            mysql.connector.Error: If an object cannot be created.
+        """
+        cursor.execute("SELECT @@SESSION.sql_mode")
+        session_mode = cursor.fetchone()[0]
+        cursor.execute(f"USE `{database}`")
+        pending = [(mode, definition.replace(f"`{source}`.", f"`{database}`."))
+                   for kind, objects in definitions.items() if kinds is None or kind in kinds
+                   for _, mode, definition in objects]
+        try:
+            while pending:
+                failed = []
+                for mode, definition in pending:
+                    cursor.execute("SET SESSION sql_mode = %s", (session_mode if mode is None else mode,))
+                    try:
+                        cursor.execute(definition)
+                    except Error:
+                        failed.append((mode, definition))
+                if len(failed) == len(pending):
+                    mode, definition = failed[0]
+                    cursor.execute("SET SESSION sql_mode = %s", (session_mode if mode is None else mode,))
+                    cursor.execute(definition)
+                pending = failed
+        finally:
+            cursor.execute("SET SESSION sql_mode = %s", (session_mode,))
+
+    def _swap_database(self, shadow: str, name: str) -> None:
+        """
+        Replaces the content of a live database with a restored shadow database.
+
+        MySQL cannot rename databases, so all base tables are moved with a single RENAME TABLE
+        statement, which is atomic: the live tables go to a temporary `<name>__old_<timestamp>`
+        database and the shadow tables take their place. Tables with triggers cannot be moved
+        across databases, so the triggers of both databases are dropped right before the rename,
+        once all the definitions are read, and so are the live views named like a shadow table.
+        If the rename fails, these triggers and views are recreated in the live database and the
+        temporary database is dropped.
+
+        Once the tables are renamed, the views, triggers, routines and events of the live
+        database are recreated in the temporary database, so it holds a complete copy of the
+        replaced database, and the ones of the shadow database replace them in the live
+        database. The temporary databases are dropped at the end, unless the objects of the
+        shadow database cannot be created, in which case the replaced database is kept.
+
+        Args:
+            shadow (str): The name of the restored shadow database.
+            name (str): The name of the live database.
+
+        Raises:
+            mysql.connector.Error: If the tables cannot be swapped.
+        """
+        old = self._shadow_database_name(name, 'old')
+        connection = self._connect()
+        if not connection:
+            raise Error(msg=f"Cannot connect to swap database {name}")
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+            tables = {}
+            for database in (shadow, name):
+                cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                               "AND TABLE_TYPE = 'BASE TABLE'", (database,))
+                tables[database] = [table for table, in cursor.fetchall()]
+            shadow_objects = self._read_definitions(cursor, shadow)
+            live_objects = self._read_definitions(cursor, name)
+            # Live objects dropped before the rename, and restored if it fails
+            blocking = {'TRIGGER': live_objects['TRIGGER'],
+                        'VIEW': [view for view in live_objects['VIEW'] if view[0] in tables[shadow]]}
+
+            cursor.execute(f"CREATE DATABASE `{old}`")
+            for trigger, _, _ in shadow_objects['TRIGGER']:
+                cursor.execute(f"DROP TRIGGER `{shadow}`.`{trigger}`")
+            try:
+                for trigger, _, _ in blocking['TRIGGER']:
+                    cursor.execute(f"DROP TRIGGER `{name}`.`{trigger}`")
+                for view, _, _ in blocking['VIEW']:
+                    cursor.execute(f"DROP VIEW `{name}`.`{view}`")
+                renames = ([f"`{name}`.`{table}` TO `{old}`.`{table}`" for table in tables[name]] +
+                           [f"`{shadow}`.`{table}` TO `{name}`.`{table}`" for table in tables[shadow]])
+                if renames:
+                    cursor.execute("RENAME TABLE " + ", ".join(renames))
+            except Error:
+                logger.error(f"Swap of database {name} failed, restoring its triggers and views.")
+                self._create_objects(cursor, name, blocking, name)
+                cursor.execute(f"DROP DATABASE `{old}`")
+                raise
+
+            self._create_objects(cursor, old, live_objects, name)
+            try:
+                for kind in ('FUNCTION', 'PROCEDURE', 'EVENT'):
+                    for object_name, _, _ in live_objects[kind]:
+                        cursor.execute(f"DROP {kind} IF EXISTS `{name}`.`{object_name}`")
+                shadow_views = {view for view, _, _ in shadow_objects['VIEW']}
+                for view, _, _ in live_objects['VIEW']:
+                    if view not in shadow_views and view not in tables[shadow]:
+                        cursor.execute(f"DROP VIEW IF EXISTS `{name}`.`{view}`")
+                for index, (view, mode, definition) in enumerate(shadow_objects['VIEW']):
+                    shadow_objects['VIEW'][index] = (view, mode, definition.replace("CREATE ", "CREATE OR REPLACE ", 1))
+                self._create_objects(cursor, name, shadow_objects, shadow)
+            except Error as e:
+                logger.error(f"Objects of database {shadow} not created in {name}: {e}. The replaced database "
+                             f"is kept as {old}.")
+                raise
+            logger.info(f"Database {shadow} swapped in as {name}.")
+            cursor.close()
+        finally:
+            connection.close()
+        self._drop_database(old)
+        self._drop_database(shadow)
+
+    def _drop_database(self, name: str) -> None:
+        """
+        Drops a temporary database of a restore, logging a warning if it cannot be dropped.
+
+        Args:
+            name (str): The name of the database.
+        """
+        connection = self._connect()
+        if not connection:
+            logger.warning(f"Database {name} left on the server: cannot connect to drop it.")
+            return
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+            cursor.close()
+            logger.info(f"Database {name} dropped successfully.")
+        except Error as e:
+            logger.warning(f"Database {name} left on the server: {e}")
+        finally:
+            connection.close()
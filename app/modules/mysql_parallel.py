@@ -0,0 +1,476 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+import json
+import os
+import shutil
+import queue
+import subprocess
+import threading
+import time
+import logging
+
+import mysql.connector
+
+from app.compression import compress_command
+from app.process import StreamPipe, default_runner
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Name of the file describing the layout of a parallel dump
+MANIFEST_FILE = 'manifest.json'
+
+# Name of the file holding the schema of a parallel dump
+SCHEMA_FILE = 'schema.sql'
+
+# Maximum size of a multi-row INSERT statement written to the chunks
+STATEMENT_SIZE = 1024 * 1024
+
+# Rows fetched from the server at once by the dump workers
+FETCH_SIZE = 1000
+
+# Session settings at the top of each data chunk, so chunks can be loaded independently
+CHUNK_HEADER = ("/*!40101 SET NAMES utf8mb4 */;\n"
+                "SET TIME_ZONE='+00:00';\n"
+                "SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n"
+                "SET FOREIGN_KEY_CHECKS=0;\n"
+                "SET UNIQUE_CHECKS=0;\n")
+
+# Column types rendered as bare numbers, BIT values being rendered as integers
+NUMERIC_TYPES = {'tinyint', 'smallint', 'mediumint', 'int', 'bigint', 'decimal', 'float', 'double', 'bit'}
+
+# Column types rendered as hexadecimal literals, since their bytes are not text
+BINARY_TYPES = {'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'geometry', 'point',
+                'linestring', 'polygon', 'multipoint', 'multilinestring', 'multipolygon', 'geometrycollection',
+                'geomcollection'}
+
+
+def value_expression(column: str, data_type: str) -> str:
+    """
+    Builds the SQL expression rendering the value of a column as an SQL literal on the server.
+
+    Args:
+        column (str): The name of the column.
+        data_type (str): The data type of the column, as in information_schema.COLUMNS.
+
+    Returns:
+        str: The SQL expression, evaluating to the literal or to the word NULL.
+    """
+    if data_type == 'bit':
+        return f"IFNULL(`{column}` + 0, 'NULL')"
+    if data_type in NUMERIC_TYPES:
+        return f"IFNULL(`{column}`, 'NULL')"
+    if data_type in BINARY_TYPES:
+        return f"IF(`{column}` IS NULL, 'NULL', CONCAT('X''', HEX(`{column}`), ''''))"
+    # QUOTE renders NULL as the word NULL and the other values as escaped string literals
+    return f"QUOTE(`{column}`)"
+
+
+def row_expression(columns: List[str], types: List[str]) -> str:
+    """
+    Builds the SQL expression rendering a row as the parenthesized values of an INSERT statement.
+
+    Args:
+        columns (List[str]): The names of the columns.
+        types (List[str]): The data types of the columns.
+
+    Returns:
+        str: The SQL expression.
+    """
+    values = ", ',', ".join(value_expression(column, data_type) for column, data_type in zip(columns, types))
+    return f"CONCAT('(', {values}, ')')"
+
+
+def is_unchanged(previous: dict, table: dict, snapshot_time: Optional[str]) -> bool:
+    """
+    Checks whether a table is unchanged since a previous incremental dump.
+
+    A table is unchanged if its columns and signature are the same. Tables with an update time
+    must also have been last written before the snapshot of the previous dump, in an earlier
+    second, since a write in the same second would leave the update time as it is; tables
+    without update time (e.g. InnoDB tables not written since the server started) are compared
+    by checksum.
+
+    Args:
+        previous (dict): The manifest entry of the table in the previous dump.
+        table (dict): The table, with its current 'columns' and 'signature'.
+        snapshot_time (str): The server time of the snapshot of the previous dump.
+
+    Returns:
+        bool: True if the chunks of the previous dump can be reused.
+    """
+    signature = table.get('signature')
+    if not signature or signature != previous.get('signature') or table['columns'] != previous['columns']:
+        return False
+    if signature['update_time'] is None:
+        return signature['checksum'] is not None
+    return snapshot_time is not None and signature['update_time'] < snapshot_time
+
+
+class ParallelDump:
+    """
+    Parallel dump of a MySQL database into a directory of per-table chunks.
+
+    A global read lock is taken while every worker connection starts a transaction with a
+    consistent snapshot, so all workers see the database at the same instant; the lock is
+    released as soon as the snapshots exist. Tables are then dumped concurrently, tables
+    larger than the chunk size being split into ranges of their integer primary key. Only
+    InnoDB tables are consistent after the lock is released.
+
+    The directory holds the schema dumped by mysqldump, the data chunks as SQL files of
+    INSERT statements and a manifest recording the chunk layout and the binary log position
+    of the snapshot.
+
+    An incremental dump records the signature of each table, its creation and update times
+    read under the global read lock, or its checksum in the snapshot when it has no update
+    time. The chunks of the tables unchanged since the previous dump (see is_unchanged) are
+    hardlinked from it instead of being dumped again, so the directory is still a full dump.
+
+    The rows are rendered as SQL by the server, and each chunk is written by a job of the
+    process runner named after the backup of the database, so the chunks are throttled,
+    prioritized and cancelled with its other backup jobs.
+
+    Attributes:
+        module (MySQLModule): The module of the server.
+        name (str): The name of the database.
+        destination (Path): The directory of the dump.
+        jobs (int): The number of worker connections.
+        chunk_size (int): The size in bytes above which tables are split into ranges.
+        incremental (bool): Whether to record the signature of the tables and reuse the unchanged ones.
+        previous (Path): The directory of the previous incremental dump, None if there is none.
+    """
+
+    def __init__(self, module, name: str, destination: Path, jobs: int = 4, chunk_size: int = 512 * 1024 * 1024,
+                 dump_profile: str = 'copy', compression: str = None, compression_level: int = None,
+                 compression_threads: int = 0, timeout: float = None, incremental: bool = False,
+                 previous: Path = None):
+        """
+        Initialize the dump.
+
+        Args:
+            module (MySQLModule): The module of the server.
+            name (str): The name of the database.
+            destination (Path): The directory of the dump, created if missing.
+            jobs (int): The number of worker connections.
+            chunk_size (int): The size in bytes above which tables are split into ranges.
+            dump_profile (str): The dump profile, 'copy', 'inserts' or 'schema-only'.
+            compression (str): The compression codec of the chunks, None for no compression.
+            compression_level (int): The compression level, the codec default if None.
+            compression_threads (int): The number of compression threads, 0 for one per core.
+            timeout (float): The maximum duration of the dump in seconds, None for no limit.
+            incremental (bool): Whether to record the signature of the tables and reuse the unchanged ones.
+            previous (Path): The directory of the previous incremental dump, None if there is none.
+        """
+        self.module = module
+        self.name = name
+        self.destination = Path(destination)
+        self.jobs = max(1, jobs)
+        self.chunk_size = chunk_size
+        self.dump_profile = dump_profile
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.timeout = timeout
+        self.incremental = incremental
+        self.previous = Path(previous) if previous else None
+        self._dump_bytes = 0
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+
+    def _connect(self):
+        """Opens a connection to the database, with the C extension of mysql.connector when it is installed."""
+        return mysql.connector.connect(host=self.module.host, port=self.module.port, user=self.module.username,
+                                       password=self.module.password, database=self.name, charset='utf8mb4')
+
+    def run(self) -> int:
+        """
+        Runs the dump.
+
+        Returns:
+            int: The number of uncompressed bytes dumped.
+
+        Raises:
+            mysql.connector.Error: If the database cannot be read.
+            subprocess.CalledProcessError: If the schema dump or the compression fails.
+            subprocess.TimeoutExpired: If the dump exceeds its timeout.
+        """
+        self.destination.mkdir(parents=True, exist_ok=True)
+        lock_connection = self._connect()
+        workers = []
+        try:
+            lock_cursor = lock_connection.cursor()
+            if self.incremental:
+                self._prepare_signatures(lock_cursor)
+            lock_cursor.execute("FLUSH TABLES WITH READ LOCK")
+            for _ in range(self.jobs):
+                connection = self._connect()
+                cursor = connection.cursor()
+                cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("SET SESSION time_zone = '+00:00'")
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                cursor.close()
+                workers.append(connection)
+            binlog = self._binlog_position(lock_cursor)
+            signatures, snapshot_time = self._read_signatures(lock_cursor) if self.incremental else ({}, None)
+            # The schema cannot change while the global read lock is held
+            self._dump_schema()
+            lock_cursor.execute("UNLOCK TABLES")
+            lock_cursor.close()
+            logger.info(f"Consistent snapshot of database {self.name} taken on {len(workers)} connections.")
+
+            tables = self._plan(workers[0]) if self.dump_profile != 'schema-only' else []
+            if self.incremental:
+                for table in tables:
+                    table['signature'] = signatures.get(table['name'])
+                self._checksum(workers[0], tables)
+                self._reuse(tables)
+            tasks = queue.Queue()
+            for table in sorted(tables, key=lambda t: -t['size']):
+                if table.get('reused'):
+                    continue
+                for chunk in table['chunks']:
+                    tasks.put((table, chunk))
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                for future in [executor.submit(self._work, connection, tasks) for connection in workers]:
+                    future.result()
+
+            manifest = {
+                'version': 1,
+                'database': self.name,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'profile': self.dump_profile,
+                'compression': self.compression,
+                'binlog': binlog,
+                'snapshot_time': snapshot_time,
+                'schema': SCHEMA_FILE,
+                'tables': [{key: table[key] for key in ('name', 'columns', 'primary_key', 'chunks', 'signature',
+                                                        'reused') if key in table}
+                           for table in tables],
+            }
+            (self.destination / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, default=str))
+            return self._dump_bytes
+        finally:
+            for connection in workers + [lock_connection]:
+                connection.close()
+
+    def _binlog_position(self, cursor) -> Optional[dict]:
+        """Reads the binary log position of the snapshot, None if the binary log is disabled or not readable."""
+        for statement in ("SHOW BINARY LOG STATUS", "SHOW MASTER STATUS"):
+            try:
+                cursor.execute(statement)
+                row = cursor.fetchone()
+                cursor.fetchall()
+            except mysql.connector.Error:
+                continue
+            if row:
+                return {'file': row[0], 'position': row[1], 'gtid_set': row[4] if len(row) > 4 else None}
+            return None
+        return None
+
+    def _prepare_signatures(self, cursor) -> None:
+        """Sets the session of the lock connection to read the current table statistics in UTC."""
+        cursor.execute("SET SESSION time_zone = '+00:00'")
+        try:
+            # MySQL 8 caches table statistics for a day by default
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except mysql.connector.Error:
+            pass
+
+    def _read_signatures(self, cursor) -> tuple:
+        """Reads the creation and update times of the tables and the server time, under the global read lock."""
+        cursor.execute("SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'", (self.name,))
+        signatures = {table_name: {'create_time': str(create_time),
+                                   'update_time': str(update_time) if update_time else None, 'checksum': None}
+                      for table_name, create_time, update_time in cursor.fetchall()}
+        cursor.execute("SELECT NOW()")
+        return signatures, str(cursor.fetchone()[0])
+
+    def _checksum(self, connection, tables: List[dict]) -> None:
+        """Records the checksum of the tables without update time in their signature, read in the snapshot."""
+        cursor = connection.cursor()
+        for table in tables:
+            if table.get('signature') and table['signature']['update_time'] is None:
+                self._remaining()
+                cursor.execute(f"CHECKSUM TABLE `{table['name']}`")
+                table['signature']['checksum'] = cursor.fetchone()[1]
+        cursor.close()
+
+    def _reuse(self, tables: List[dict]) -> None:
+        """Hardlinks the chunks of the tables unchanged since the previous dump, marking them as reused."""
+        manifest_file = self.previous / MANIFEST_FILE if self.previous else None
+        if not manifest_file or not manifest_file.exists():
+            return
+        previous = json.loads(manifest_file.read_text())
+        if previous.get('profile') != self.dump_profile or previous.get('compression') != self.compression:
+            logger.info(f"Previous dump {self.previous} has other dump options, dumping all tables of {self.name}.")
+            return
+        previous_tables = {table['name']: table for table in previous['tables']}
+        reused = 0
+        for table in tables:
+            old = previous_tables.get(table['name'])
+            if (not old or not is_unchanged(old, table, previous.get('snapshot_time'))
+                    or not all((self.previous / chunk['file']).exists() for chunk in old['chunks'])):
+                continue
+            prefix = table['chunks'][0]['file'].split('.', 1)[0]
+            table['chunks'] = [dict(chunk, file=f"{prefix}.{number:05d}.sql")
+                               for number, chunk in enumerate(old['chunks'])]
+            for old_chunk, chunk in zip(old['chunks'], table['chunks']):
+                try:
+                    os.link(self.previous / old_chunk['file'], self.destination / chunk['file'])
+                except OSError:
+                    shutil.copyfile(self.previous / old_chunk['file'], self.destination / chunk['file'])
+            table['reused'] = True
+            reused += 1
+        logger.info(f"Reused the chunks of {reused} of {len(tables)} tables of {self.name} from {self.previous}.")
+
+    def _dump_schema(self) -> None:
+        """Dumps the schema of the database, with its views, triggers, routines and events, with mysqldump."""
+        command = ['mysqldump', '--no-data', '--skip-lock-tables', '--single-transaction',
+                   *self.module.ROUTINE_OPTIONS, *self.module._connection_options(), self.name]
+        schema_bytes = default_runner().run([command], name=self.module.job_name("backup", self.name),
+                                            stdout=self.destination / SCHEMA_FILE, timeout=self._remaining())
+        with self._lock:
+            self._dump_bytes += schema_bytes
+
+    def _plan(self, connection) -> List[dict]:
+        """
+        Lists the tables to dump and splits the large ones into primary key ranges.
+
+        Args:
+            connection: A worker connection, inside the snapshot.
+
+        Returns:
+            List[dict]: The tables, with their columns and column types, primary key, estimated size and chunks.
+        """
+        cursor = connection.cursor()
+        cursor.execute("SELECT TABLE_NAME, DATA_LENGTH FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME", (self.name,))
+        tables = []
+        for index, (table_name, size) in enumerate(cursor.fetchall()):
+            cursor.execute("SELECT COLUMN_NAME, DATA_TYPE, EXTRA FROM information_schema.COLUMNS "
+                           "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+                           (self.name, table_name))
+            # Generated columns are computed again on restore and cannot be inserted
+            columns = [(column, data_type) for column, data_type, extra in cursor.fetchall()
+                       if 'GENERATED' not in (extra or '').upper()]
+            cursor.execute("SELECT k.COLUMN_NAME, c.DATA_TYPE FROM information_schema.KEY_COLUMN_USAGE k "
+                           "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA "
+                           "AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME "
+                           "WHERE k.TABLE_SCHEMA = %s AND k.TABLE_NAME = %s AND k.CONSTRAINT_NAME = 'PRIMARY' "
+                           "ORDER BY k.ORDINAL_POSITION", (self.name, table_name))
+            primary_key = cursor.fetchall()
+            table = {'name': table_name, 'columns': [column for column, _ in columns],
+                     'types': [data_type.lower() for _, data_type in columns], 'size': size or 0,
+                     'primary_key': [column for column, _ in primary_key]}
+            ranges = [(None, None)]
+            if (len(primary_key) == 1 and primary_key[0][1] in ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+                    and table['size'] > self.chunk_size):
+                ranges = self._ranges(cursor, table_name, primary_key[0][0], -(-table['size'] // self.chunk_size))
+            table['chunks'] = [{'file': f"{index:04d}.{chunk:05d}.sql", 'from': low, 'to': high}
+                               for chunk, (low, high) in enumerate(ranges)]
+            tables.append(table)
+        cursor.close()
+        return tables
+
+    def _ranges(self, cursor, table_name: str, column: str, count: int) -> List[tuple]:
+        """Splits the primary key values of a table into `count` ranges of equal width."""
+        cursor.execute(f"SELECT MIN(`{column}`), MAX(`{column}`) FROM `{table_name}`")
+        low, high = cursor.fetchone()
+        if low is None or count < 2:
+            return [(None, None)]
+        step = max(1, -(-(high - low + 1) // count))
+        bounds = list(range(low + step, high + 1, step))
+        return list(zip([None] + bounds, bounds + [None]))
+
+    def _remaining(self) -> Optional[float]:
+        """Seconds left before the deadline of the dump, raising TimeoutExpired once it is passed."""
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(['mysql-parallel-dump', self.name], self.timeout)
+        return remaining
+
+    def _work(self, connection, tasks: queue.Queue) -> None:
+        """Dumps chunks from the queue on a worker connection until the queue is empty or a worker failed."""
+        while not self._failed.is_set():
+            try:
+                table, chunk = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._dump_chunk(connection, table, chunk)
+            except BaseException:
+                # The other workers stop too, e.g. instead of starting new jobs after a cancellation
+                self._failed.set()
+                raise
+
+    def _dump_chunk(self, connection, table: dict, chunk: dict) -> None:
+        """
+        Dumps a range of rows of a table to a chunk file, recording its rows and bytes in the chunk.
+
+        The rows are rendered as SQL literals by the server (see row_expression), so the worker
+        only joins them into INSERT statements, and streamed to a job of the process runner
+        compressing them into the chunk file, or copying them when the dump is not compressed,
+        so the chunk is throttled, cancelled and timed out with the other backup jobs of the database.
+        """
+        start = time.monotonic()
+        columns = ', '.join(f"`{column}`" for column in table['columns'])
+        query = f"SELECT {row_expression(table['columns'], table['types'])} FROM `{table['name']}`"
+        conditions = []
+        if chunk['from'] is not None:
+            conditions.append(f"`{table['primary_key'][0]}` >= {chunk['from']}")
+        if chunk['to'] is not None:
+            conditions.append(f"`{table['primary_key'][0]}` < {chunk['to']}")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        prefix = f"INSERT INTO `{table['name']}` ({columns}) VALUES ".encode('utf-8')
+        one_row_statements = self.dump_profile == 'inserts'
+
+        if self.compression:
+            command = compress_command(self.compression, self.compression_level, self.compression_threads)
+        else:
+            command = ['cat']
+        pipe = StreamPipe()
+        job = default_runner().submit([command], name=self.module.job_name("backup", self.name), stdin=pipe,
+                                      stdout=self.destination / chunk['file'], timeout=self._remaining())
+        pipe.attach(job)
+        rows, written = 0, 0
+        try:
+            written += pipe.write(CHUNK_HEADER.encode('utf-8'))
+            cursor = connection.cursor(raw=True)
+            cursor.execute(query)
+            values = []
+            values_size = 0
+            while True:
+                batch = cursor.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                self._remaining()
+                for (value,) in batch:
+                    values.append(value)
+                    values_size += len(value) + 1
+                    if one_row_statements or values_size >= STATEMENT_SIZE:
+                        written += pipe.write(prefix + b','.join(values) + b';\n')
+                        values, values_size = [], 0
+                rows += len(batch)
+            if values:
+                written += pipe.write(prefix + b','.join(values) + b';\n')
+            cursor.close()
+            pipe.close()
+            job.result()
+        except BaseException:
+            job.cancel()
+            pipe.close()
+            raise
+        chunk['rows'] = rows
+        chunk['bytes'] = written
+        with self._lock:
+            self._dump_bytes += written
+        duration = time.monotonic() - start
+        logger.info(f"Dumped {rows} rows of {self.name}.{table['name']} to {chunk['file']} in {duration:.1f}s.")
@@ -0,0 +1,161 @@
+from pathlib import Path
+from typing import List, Optional
+import io
+import json
+import tarfile
+
+# Name of the manifest of a bundle, always its first member
+BUNDLE_MANIFEST = 'bundle.json'
+
+# Version of the bundle manifest layout, bumped on incompatible changes
+BUNDLE_VERSION = 1
+
+# Member of a bundle holding the dump of the whole database without the data of the bundled tables
+SCHEMA_MEMBER = 'schema.dump'
+
+# Directory of the bundle members holding the data of the tables
+TABLES_DIR = 'tables'
+
+# Size below which tables share a member, each shared member holding up to this size of tables
+GROUP_SIZE = 64 * 1024 * 1024
+
+# Size of a tar header block
+TAR_BLOCK_SIZE = 512
+
+
+def is_bundle(path: Path) -> bool:
+    """
+    Checks whether a backup file is a bundle of per-table dumps, from its first tar header.
+
+    Args:
+        path (Path): The backup file.
+
+    Returns:
+        bool: True if the file is a tar archive starting with the bundle manifest.
+    """
+    if not path.is_file():
+        return False
+    with open(path, 'rb') as f:
+        header = f.read(TAR_BLOCK_SIZE)
+    return header[257:262] == b'ustar' and header[:100].rstrip(b'\0') == BUNDLE_MANIFEST.encode()
+
+
+def read_bundle(path: Path) -> Optional[dict]:
+    """
+    Reads the manifest of a bundle.
+
+    Args:
+        path (Path): The backup file.
+
+    Returns:
+        Optional[dict]: The manifest, with the 'snapshot' the members were dumped from and the
+            'tables' with the member holding their data, None if the backup is not a bundle.
+    """
+    if not is_bundle(path):
+        return None
+    with tarfile.open(path) as tar:
+        manifest = json.load(tar.extractfile(BUNDLE_MANIFEST))
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Bundle manifest of {path} has unsupported version {manifest.get('version')}")
+    return manifest
+
+
+def group_tables(tables: List[dict], group_size: int = GROUP_SIZE) -> List[List[dict]]:
+    """
+    Groups the tables of a bundle into members, each large table in its own member and the
+    small tables together up to `group_size` bytes per member.
+
+    Args:
+        tables (List[dict]): The tables with their 'size', largest first.
+        group_size (int): The size below which tables share a member.
+
+    Returns:
+        List[List[dict]]: The tables of each member, the largest members first.
+    """
+    groups = []
+    group, size = [], 0
+    for table in tables:
+        if table['size'] >= group_size:
+            groups.append([table])
+            continue
+        if group and size + table['size'] > group_size:
+            groups.append(group)
+            group, size = [], 0
+        group.append(table)
+        size += table['size']
+    if group:
+        groups.append(group)
+    return groups
+
+
+def write_bundle(destination_file: Path, work_dir: Path, manifest: dict) -> None:
+    """
+    Bundles the dumps of a database into a single uncompressed tar file.
+
+    Args:
+        destination_file (Path): The bundle file.
+        work_dir (Path): The directory holding the members named in the manifest.
+        manifest (dict): The manifest, naming the 'schema' member and the 'member' of each table,
+            tables sharing a member naming the same one.
+    """
+    data = json.dumps(manifest, indent=2).encode('utf-8')
+    with tarfile.open(destination_file, 'w', format=tarfile.GNU_FORMAT) as tar:
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        for member in dict.fromkeys([manifest['schema'], *(table['member'] for table in manifest['tables'])]):
+            tar.add(work_dir / member, arcname=member)
+
+
+class MemberReader:
+    """
+    Reads a member of a bundle as a file, without extracting it.
+
+    Attributes:
+        size (int): The size of the member.
+    """
+
+    def __init__(self, bundle_file: Path, member: str):
+        """
+        Open a member of a bundle.
+
+        Args:
+            bundle_file (Path): The bundle file.
+            member (str): The name of the member.
+
+        Raises:
+            KeyError: If the bundle has no such member.
+        """
+        with tarfile.open(bundle_file) as tar:
+            info = tar.getmember(member)
+        self.size = info.size
+        self._left = info.size
+        self._file = open(bundle_file, 'rb')
+        self._file.seek(info.offset_data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads the next bytes of the member, the file being closed once they are all read.
+
+        Args:
+            size (int): The maximum number of bytes to read, all the remaining bytes if negative.
+
+        Returns:
+            bytes: The bytes read, empty at the end of the member.
+        """
+        if self._left <= 0:
+            self.close()
+            return b''
+        block = self._file.read(self._left if size < 0 else min(size, self._left))
+        self._left = self._left - len(block) if block else 0
+        return block
+
+    def close(self) -> None:
+        """Closes the bundle file."""
+        self._file.close()
@@ -0,0 +1,140 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import shutil
+
+# Name of the manifest of an incremental directory format dump, beside the TOC written by pg_dump
+INCREMENTAL_MANIFEST = 'incremental.json'
+
+# Version of the incremental manifest layout, bumped on incompatible changes
+INCREMENTAL_VERSION = 1
+
+# Directory of an incremental dump holding the data files reused from the previous dump
+REUSED_DIR = 'reused'
+
+
+def quote_name(name: str) -> str:
+    """
+    Quotes an SQL identifier.
+
+    Args:
+        name (str): The identifier.
+
+    Returns:
+        str: The identifier in double quotes.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_pattern(schema: str, table: str) -> str:
+    """
+    Builds the pg_dump pattern matching exactly one table.
+
+    Args:
+        schema (str): The schema of the table.
+        table (str): The name of the table.
+
+    Returns:
+        str: The pattern, with both names quoted so wildcards and dots are taken literally.
+    """
+    return f"{quote_name(schema)}.{quote_name(table)}"
+
+
+def copy_statement(schema: str, table: str, columns: List[str]) -> str:
+    """
+    Builds the COPY statement loading a table data file written by pg_dump.
+
+    Args:
+        schema (str): The schema of the table.
+        table (str): The name of the table.
+        columns (List[str]): The columns of the data file, in order.
+
+    Returns:
+        str: The COPY statement reading from the standard input.
+    """
+    return f"COPY {table_pattern(schema, table)} ({', '.join(quote_name(c) for c in columns)}) FROM stdin"
+
+
+def read_incremental(backup_dir: Path) -> Optional[dict]:
+    """
+    Reads the incremental manifest of a directory format dump.
+
+    Args:
+        backup_dir (Path): The dump directory.
+
+    Returns:
+        Optional[dict]: The manifest, with the 'tables' of the dump and their signature,
+            columns, data 'file' and whether it was 'reused', None if the dump is not incremental.
+    """
+    path = backup_dir / INCREMENTAL_MANIFEST
+    if not backup_dir.is_dir() or not path.exists():
+        return None
+    manifest = json.loads(path.read_text())
+    if manifest.get('version') != INCREMENTAL_VERSION:
+        raise ValueError(f"Incremental manifest {path} has unsupported version {manifest.get('version')}")
+    return manifest
+
+
+def data_files(backup_dir: Path, entries: List[dict]) -> Dict[Tuple[str, str], str]:
+    """
+    Finds the data file of each table of a directory format dump from its TOC.
+
+    Args:
+        backup_dir (Path): The dump directory.
+        entries (List[dict]): The TOC entries of the dump (see parse_toc).
+
+    Returns:
+        Dict[Tuple[str, str], str]: The data file name of each table, by schema and table name.
+    """
+    files = {}
+    for entry in entries:
+        if entry['kind'] != 'TABLE DATA':
+            continue
+        dump_id = entry['line'].split(';', 1)[0]
+        # The suffix of the file depends on the pg_dump compression
+        path = next(backup_dir.glob(f"{dump_id}.dat*"), None)
+        if path:
+            files[(entry['schema'], entry['tag'])] = path.name
+    return files
+
+
+def reusable_tables(previous: Optional[dict], signatures: Dict[Tuple[str, str], dict], dump_profile: str,
+                    previous_dir: Path) -> Dict[Tuple[str, str], dict]:
+    """
+    Selects the tables unchanged since the previous incremental dump, whose data file can be reused.
+
+    Args:
+        previous (dict): The incremental manifest of the previous dump, None if there is none.
+        signatures (Dict[Tuple[str, str], dict]): The current 'signature' and 'columns' of each table.
+        dump_profile (str): The dump profile of the new dump.
+        previous_dir (Path): The directory of the previous dump.
+
+    Returns:
+        Dict[Tuple[str, str], dict]: The table entries of the previous manifest, by schema and table name.
+    """
+    if not previous or previous.get('profile') != dump_profile:
+        return {}
+    reusable = {}
+    for table in previous['tables']:
+        key = (table['schema'], table['table'])
+        current = signatures.get(key)
+        if (current and current['signature'] == table['signature'] and current['columns'] == table['columns']
+                and table.get('file') and (previous_dir / table['file']).exists()):
+            reusable[key] = table
+    return reusable
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """
+    Hardlinks a file, or copies it when hardlinks are not possible.
+
+    Args:
+        source (Path): The file.
+        destination (Path): The new path of the file.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
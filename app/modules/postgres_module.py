@@ -1,11 +1,28 @@
 import psycopg2
 from psycopg2 import Error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
+import hashlib
+import json
 import subprocess
+import tempfile
+import time
 import logging
 
+from app.chunkstore import ChunkStore
+from app.compression import stream_to_file, read_stages
+from app.index import read_index, write_index
 from app.modules.abstract_module import AbstractModule
+from app.modules.postgres_bundle import (BUNDLE_VERSION, SCHEMA_MEMBER, TABLES_DIR, MemberReader, group_tables,
+                                         is_bundle, read_bundle, write_bundle)
+from app.modules.postgres_incremental import (INCREMENTAL_MANIFEST, INCREMENTAL_VERSION, REUSED_DIR, copy_statement,
+                                              data_files, link_or_copy, read_incremental, reusable_tables,
+                                              table_pattern)
+from app.modules.postgres_toc import OWNED_KINDS, parse_owners, parse_toc, select_entries
+from app.modules.postgres_wal import WAL_CODECS, read_wal_range, recovery_settings, segment_name
+from app.process import JobCancelled, default_runner
 
 # Configura il logger
 logger = logging.getLogger(__name__)
@@ -18,7 +35,53 @@ class PostgresModule(AbstractModule):
     providing methods for listing, backing up, and restoring databases.
     """
 
-    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str):
+    # pg_dump output formats supported by backup_database, the members of a bundle being custom format dumps
+    DUMP_FORMATS = {
+        'custom': 'c',
+        'directory': 'd',
+        'bundle': 'c',
+    }
+
+    # pg_dump options of each dump profile, 'copy' being the fast path
+    DUMP_PROFILES = {
+        'copy': [],
+        'inserts': ['--inserts', '--column-inserts'],
+        'schema-only': ['--schema-only'],
+    }
+
+    # Signature of each user table in the snapshot of an incremental dump: its file node, which
+    # changes on TRUNCATE and rewrites, its tuple counters, the last reset of the counters and
+    # the columns pg_dump writes
+    TABLE_SIGNATURES_QUERY = (
+        "SELECT s.schemaname, s.relname, pg_relation_filenode(s.relid), s.n_tup_ins, s.n_tup_upd, s.n_tup_del, "
+        "(SELECT stats_reset::text FROM pg_stat_database WHERE datname = current_database()), "
+        "ARRAY(SELECT attname::text FROM pg_attribute WHERE attrelid = s.relid AND attnum > 0 "
+        "AND NOT attisdropped AND attgenerated = '' ORDER BY attnum) "
+        "FROM pg_stat_user_tables s")
+
+    # Sessions running a statement, leaving out this one and the PostgreSQL tools, and the
+    # replication lag: the replay delay of a standby, none once it replayed all the WAL it received,
+    # or the largest replay lag of the standbys
+    SERVER_LOAD_QUERY = (
+        "SELECT (SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND backend_type = 'client backend' "
+        "AND pid <> pg_backend_pid() AND application_name NOT IN ('pg_dump', 'pg_restore', 'pg_basebackup')), "
+        "CASE WHEN NOT pg_is_in_recovery() "
+        "THEN (SELECT EXTRACT(EPOCH FROM max(replay_lag)) FROM pg_stat_replication) "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END")
+
+    # User tables whose data is dumped in the members of a bundle, largest first; the tables of
+    # extensions are left to the dump of the database, which dumps them along with their extension
+    BUNDLE_TABLES_QUERY = (
+        "SELECT n.nspname, c.relname, pg_table_size(c.oid) FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relkind = 'r' AND n.nspname <> 'information_schema' AND n.nspname NOT LIKE 'pg\\_%' "
+        "AND NOT EXISTS (SELECT 1 FROM pg_depend d WHERE d.classid = 'pg_class'::regclass "
+        "AND d.objid = c.oid AND d.deptype = 'e') "
+        "ORDER BY 3 DESC, 1, 2")
+
+    def __init__(self, host: str, port: str, username: str, password: str, maintenance_db: str,
+                 target: Optional[str] = None):
         """
         Initializes the PostgresModule with connection details.
 
@@ -27,13 +90,18 @@ class PostgresModule(AbstractModule):
             port (str): The port number of the PostgreSQL server.
             username (str): The username to connect to the PostgreSQL server.
             password (str): The password to connect to the PostgreSQL server.
+            maintenance_db (str): The name of the database used for maintenance.
+            target (str): The name of the backup target of the server, None if it is the only one.
         """
-        super().__init__(host, port, username, password, maintenance_db)
+        super().__init__(host, port, username, password, maintenance_db, target)
 
-    def _connect(self):
+    def _connect(self, dbname: str = None):
         """
         Establishes a connection to the PostgreSQL server.
 
+        Args:
+            dbname (str): The database to connect to, the maintenance database if None.
+
         Returns:
             psycopg2.connection: The connection object if successful, None otherwise.
         """
@@ -43,7 +111,7 @@ class PostgresModule(AbstractModule):
                 port=self._port,
                 user=self._username,
                 password=self._password,
-                dbname=self._maintenance_db
+                dbname=dbname or self._maintenance_db
             )
             logger.info("Successfully connected to PostgreSQL database.")
             return connection
@@ -76,36 +144,589 @@ class PostgresModule(AbstractModule):
             logger.error("Unknown error connecting to database.")
             return []
 
-    def backup_database(self, name: str, destination_file: Path) -> bool:
+    def get_database_sizes(self) -> Dict[str, int]:
+        """
+        Reads the size of the databases of the PostgreSQL server with pg_database_size.
+
+        Returns:
+            Dict[str, int]: The size in bytes of each database, empty if the sizes cannot be read.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT datname, pg_database_size(datname) FROM pg_database "
+                               "WHERE datistemplate = false AND datallowconn;")
+                sizes = cursor.fetchall()
+                cursor.close()
+                return {db_name: size for db_name, size in sizes}
+            except Error as e:
+                logger.error(f"Error reading database sizes: {e}")
+                return {}
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return {}
+
+    def get_server_load(self) -> Optional[dict]:
+        """
+        Samples the load of the PostgreSQL server from pg_stat_activity and the replication lag.
+
+        The lag of a standby is the time since the last replayed transaction, or 0 once it
+        replayed all the WAL it received, so an idle primary does not make it look behind.
+
+        Returns:
+            Optional[dict]: The number of 'active' sessions and the replication 'lag' in seconds,
+                None if the load cannot be read.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                cursor.execute(self.SERVER_LOAD_QUERY)
+                active, lag = cursor.fetchone()
+                cursor.close()
+                return {'active': active, 'lag': float(lag) if lag is not None else None}
+            except Error as e:
+                logger.error(f"Error reading server load: {e}")
+                return None
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return None
+
+    def get_change_token(self, name: str) -> Optional[str]:
+        """
+        Computes a token of the tuple counters of a database from pg_stat_database.
+
+        The counters include the system catalogs, so schema changes are detected as well.
+        Transaction counters and the WAL position are not part of the token: read-only
+        transactions (including pg_dump itself) and writes to other databases of the
+        cluster would make every database look changed.
+
+        Args:
+            name (str): The name of the database.
+
+        Returns:
+            Optional[str]: The change token, None if the counters cannot be read.
+        """
+        connection = self._connect()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT tup_inserted, tup_updated, tup_deleted, stats_reset "
+                               "FROM pg_stat_database WHERE datname = %s;", (name,))
+                counters = cursor.fetchone()
+                cursor.close()
+                if counters is None:
+                    return None
+                return hashlib.sha256(repr(counters).encode('utf-8')).hexdigest()
+            except Error as e:
+                logger.error(f"Error reading change counters of database {name}: {e}")
+                return None
+            finally:
+                connection.close()
+        else:
+            logger.error("Unknown error connecting to database.")
+            return None
+
+    def backup_database(self, name: str, destination_file: Path, dump_format: str = 'custom', dump_jobs: int = 1,
+                        dump_profile: str = 'copy', compression: str = None, compression_level: int = None,
+                        compression_threads: int = 0, timeout: float = None, index: bool = True,
+                        chunk_store: ChunkStore = None, internal_compression: bool = True, stats: dict = None,
+                        incremental: bool = False, previous_backup: Path = None, **options) -> bool:
         """
         Backs up the specified database to a file.
 
+        With the 'directory' format the backup is a directory dumped by `dump_jobs` parallel
+        pg_dump workers instead of a single file. With the 'bundle' format the backup is still a
+        single file, whose tables are dumped by `dump_jobs` parallel pg_dump workers sharing one
+        snapshot (see _dump_bundle). The 'copy' profile stores table data as
+        COPY blocks, the 'inserts' profile as one INSERT statement per row and the
+        'schema-only' profile does not store table data at all.
+
+        If a compression codec is given, a custom format dump is written uncompressed by
+        pg_dump and compressed by the codec while it is streamed to the file. Directory
+        format dumps and bundles keep the pg_dump compression. Without codec, custom format dumps are
+        compressed by pg_dump unless `internal_compression` is False, e.g. for the dumps
+        stored as deltas.
+
+        With a chunk store, a custom format dump is written uncompressed by pg_dump and stored
+        as deduplicated chunks, compressed with zlib if a codec is given (see stream_to_file).
+
+        Custom format dumps of a database whose backup jobs are throttled by the process runner
+        are written to the file at the rate of the throttle; directory format dumps and
+        bundles are written by pg_dump itself and cannot be throttled, which is logged.
+
+        With `index`, the TOC of the dump is cached in the sidecar index `<backup>.index`
+        once the dump is written (see index_backup).
+
+        With `incremental`, a directory format dump is taken from an exported snapshot, in which
+        the signature of each table is read from pg_stat_user_tables. The data of the tables
+        whose signature did not change since `previous_backup` is not dumped again: their data
+        files are hardlinked from the previous backup into `reused/`, and the manifest
+        `incremental.json` describes the tables of the resulting synthetic full dump (see
+        restore_database). The tuple counters are flushed by the sessions of the server shortly
+        after their transactions, so a change committed just before the snapshot may go unseen
+        until the next dump.
+
         Args:
             name (str): The name of the database to back up.
             destination_file (Path): The path to the file where the backup will be stored.
+            dump_format (str): The output format, 'custom', 'directory' or 'bundle'.
+            dump_jobs (int): The number of parallel jobs used by the 'directory' and 'bundle' formats.
+            dump_profile (str): The dump profile, 'copy', 'inserts' or 'schema-only'.
+            compression (str): The compression codec ('zstd', 'lz4' or 'gzip'), None for no compression.
+            compression_level (int): The compression level, the codec default if None.
+            compression_threads (int): The number of compression threads, 0 for one per core.
+            timeout (float): The maximum duration of the dump in seconds, None for no limit.
+            index (bool): Whether to cache the TOC of the dump in its sidecar index.
+            chunk_store (ChunkStore): The chunk store of the backup, None to write the dump to the file.
+            internal_compression (bool): Whether pg_dump compresses custom format dumps written without codec.
+            stats (dict): If given, filled with the 'dump_bytes' produced by the dump tool when known.
+            incremental (bool): Whether to reuse the data of the tables unchanged since the previous backup.
+            previous_backup (Path): The previous incremental backup of the database, None for a full dump.
 
         Returns:
             bool: True if the backup was successful, False otherwise.
         """
-        command = (f"pg_dump --inserts --column-inserts -h {self._host} -p {self._port} -U {self._username} -d {name} -F c -b -v -f"
-                   f" {destination_file}")
+        if incremental and (dump_format != 'directory' or dump_profile == 'schema-only'):
+            logger.warning(f"Incremental backup only applies to directory format dumps with data of {name}.")
+            incremental = False
+        format_options = ['-F', self.DUMP_FORMATS[dump_format]]
+        if dump_format == 'directory':
+            format_options += ['--jobs', str(dump_jobs)]
+        if dump_format != 'custom':
+            if default_runner().rate(self.job_name("backup", name)):
+                logger.warning(f"Rate limit is not applied to {dump_format} format backup of {name}.")
+            if compression:
+                logger.warning(f"Compression '{compression}' is not applied to {dump_format} format backup of {name}.")
+                compression = None
+            if chunk_store:
+                logger.warning(f"Chunk storage is not applied to {dump_format} format backup of {name}.")
+                chunk_store = None
+        command = ['pg_dump', *self.DUMP_PROFILES[dump_profile], *self._connection_options(name),
+                   *format_options, '-b', '-v']
+        snapshot_connection = None
         try:
             # Set the PGPASSWORD environment variable to avoid password prompt
             env = {"PGPASSWORD": self._password}
-            subprocess.run(command, shell=True, check=True, text=True, env=env)
+            if incremental:
+                snapshot_connection, snapshot, signatures, reused = self._plan_incremental(name, previous_backup,
+                                                                                          dump_profile)
+                command += [f'--snapshot={snapshot}']
+                command += [f'--exclude-table-data={table_pattern(*key)}' for key in reused]
+            if dump_format == 'bundle':
+                self._dump_bundle(name, destination_file, dump_jobs, dump_profile, env, timeout)
+            elif compression or chunk_store or not internal_compression:
+                dump_bytes = stream_to_file(command + ['-Z', '0'], destination_file, compression, compression_level,
+                                            compression_threads, env=env, timeout=timeout,
+                                            name=self.job_name("backup", name), chunk_store=chunk_store)
+                if stats is not None:
+                    stats['dump_bytes'] = dump_bytes
+            elif dump_format == 'custom' and default_runner().throttles(self.job_name("backup", name)):
+                # Throttled dumps are streamed through the runner, pg_dump writing to a file itself
+                stream_to_file(command, destination_file, env=env, timeout=timeout, name=self.job_name("backup", name))
+            else:
+                default_runner().run([command + ['-f', destination_file]], name=self.job_name("backup", name), env=env,
+                                     timeout=timeout)
+            if incremental:
+                self._write_incremental(destination_file, previous_backup, signatures, reused, dump_profile, timeout)
             logger.info(f"Backup successful for database {name} to {destination_file}.")
-            return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled, Error) as e:
             logger.error(f"Error backing up database {name}: {e}")
             return False
+        finally:
+            if snapshot_connection:
+                snapshot_connection.close()
+        if index:
+            try:
+                self.index_backup(destination_file, timeout=timeout)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled) as e:
+                # The backup is still complete, single tables are restored by reading its TOC again
+                logger.warning(f"Cannot index backup {destination_file}: {e}")
+        return True
+
+    @staticmethod
+    def _archive_stages(source_file: Path, *options) -> Tuple[List[List[str]], object]:
+        """
+        Builds the pipeline running pg_restore on an archive, decompressing it if needed.
+
+        Plain archive files and directories are read by pg_restore itself, which can then seek
+        in them; compressed and chunked archives, and the dump of the database of a bundle, are
+        streamed to its standard input.
+
+        Args:
+            source_file (Path): The archive file or directory.
+            *options: The pg_restore options.
+
+        Returns:
+            Tuple[List[List[str]], object]: The argv of the stages of the pipeline, and its input.
+        """
+        if is_bundle(source_file):
+            # Bundles are read through the dump of the database, the data of their tables being in other members
+            return [['pg_restore', *options]], MemberReader(source_file, SCHEMA_MEMBER)
+        stages, stdin = read_stages(source_file)
+        if stdin == source_file:
+            return [['pg_restore', *options, source_file]], None
+        return stages + [['pg_restore', *options]], stdin
+
+    def index_backup(self, source_file: Path, timeout: float = None) -> dict:
+        """
+        Reads the TOC of a backup with `pg_restore --list` and caches it in the sidecar index.
+
+        The table owning each TOC entry is recorded, so the entries restoring a table can be
+        selected without reading the archive again. Indexes and sequences only name their table
+        in their SQL definition, which is read for these entries only.
+
+        Args:
+            source_file (Path): The backup file or directory.
+            timeout (float): The maximum duration of each pg_restore run in seconds, None for no limit.
+
+        Returns:
+            dict: The index, with the TOC 'entries' of the backup.
+
+        Raises:
+            subprocess.CalledProcessError: If the TOC cannot be read.
+        """
+        runner = default_runner()
+        job_name = self.job_name("index", source_file.name)
+        entries = self._list_toc(source_file, timeout)
+        with tempfile.TemporaryDirectory(prefix='index-', dir=source_file.parent) as work_dir:
+            owned_file, sql_file = (Path(work_dir) / name for name in ('owned.list', 'owned.sql'))
+            owned = [entry['line'] for entry in entries if entry['kind'] in OWNED_KINDS]
+            owners = {}
+            if owned:
+                owned_file.write_text('\n'.join(owned) + '\n')
+                stages, stdin = self._archive_stages(source_file, '-L', owned_file, '-f', sql_file)
+                runner.run(stages, name=job_name, stdin=stdin, timeout=timeout)
+                owners = parse_owners(sql_file.read_text())
+        for entry in entries:
+            if entry['table'] is None:
+                entry['table'] = owners.get((entry['schema'], entry['tag']))
+        index = {'format': 'toc', 'entries': entries}
+        write_index(source_file, index)
+        logger.info(f"Backup {source_file} indexed with {len(entries)} TOC entries.")
+        return index
+
+    def _list_toc(self, source_file: Path, timeout: float = None) -> List[dict]:
+        """
+        Reads the TOC of a backup with `pg_restore --list`.
+
+        Args:
+            source_file (Path): The backup file or directory.
+            timeout (float): The maximum duration of pg_restore in seconds, None for no limit.
+
+        Returns:
+            List[dict]: The TOC entries of the backup (see parse_toc).
+
+        Raises:
+            subprocess.CalledProcessError: If the TOC cannot be read.
+        """
+        with tempfile.TemporaryDirectory(prefix='index-', dir=source_file.parent) as work_dir:
+            toc_file = Path(work_dir) / 'toc.list'
+            stages, stdin = self._archive_stages(source_file, '--list', '-f', toc_file)
+            default_runner().run(stages, name=self.job_name("index", source_file.name), stdin=stdin, timeout=timeout)
+            return parse_toc(toc_file.read_text())
+
+    def _plan_incremental(self, name: str, previous_backup: Optional[Path], dump_profile: str) -> tuple:
+        """
+        Exports the snapshot of an incremental dump and selects the tables unchanged since the previous dump.
 
-    def restore_database(self, name: str, source_file: Path) -> bool:
+        Args:
+            name (str): The name of the database.
+            previous_backup (Path): The previous incremental backup, None if there is none.
+            dump_profile (str): The dump profile.
+
+        Returns:
+            tuple: The connection holding the snapshot, to be closed once pg_dump is done, the
+                snapshot id, the signature and columns of each table, and the entries of the
+                previous manifest of the unchanged tables, by schema and table name.
+
+        Raises:
+            psycopg2.Error: If the snapshot cannot be exported or the tables read.
+        """
+        connection = self._connect(name)
+        if not connection:
+            raise Error(f"Cannot connect to database {name} to export its snapshot")
+        try:
+            connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = connection.cursor()
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot = cursor.fetchone()[0]
+            # Read after the snapshot, so changes made after it can only make tables look changed
+            cursor.execute(self.TABLE_SIGNATURES_QUERY)
+            signatures = {(schema, table): {'signature': list(signature), 'columns': columns}
+                          for schema, table, *signature, columns in cursor.fetchall()}
+            cursor.close()
+        except Error:
+            connection.close()
+            raise
+        previous = read_incremental(previous_backup) if previous_backup else None
+        reused = reusable_tables(previous, signatures, dump_profile, previous_backup)
+        logger.info(f"Incremental backup of {name}: {len(reused)} of {len(signatures)} tables unchanged"
+                    f"{f' since {previous_backup}' if previous else ''}.")
+        return connection, snapshot, signatures, reused
+
+    def _dump_bundle(self, name: str, destination_file: Path, dump_jobs: int, dump_profile: str, env: dict,
+                     timeout: float = None) -> None:
+        """
+        Dumps a database as a bundle: a single tar file holding custom format dumps of the tables.
+
+        A snapshot is exported on a connection held open during the whole dump, which then locks
+        the bundled tables in ACCESS SHARE mode as the leader of `pg_dump -j` does, so they cannot
+        be dropped or altered before the workers lock them, and `dump_jobs` pg_dump workers import
+        the snapshot, so the bundle is consistent. The data of each large user table is dumped by
+        its own `pg_dump --data-only -t` worker, and the small tables are grouped into members of
+        up to GROUP_SIZE bytes dumped by one worker each, the largest members first, while one
+        more worker dumps the rest of the database without the data of these tables. The
+        members are staged beside the bundle, then bundled with the manifest `bundle.json`.
+
+        Args:
+            name (str): The name of the database.
+            destination_file (Path): The bundle file.
+            dump_jobs (int): The number of pg_dump workers running at the same time.
+            dump_profile (str): The dump profile.
+            env (dict): The environment of pg_dump.
+            timeout (float): The maximum duration of each pg_dump worker in seconds, None for no limit.
+
+        Raises:
+            psycopg2.Error: If the snapshot cannot be exported or the tables read or locked.
+            subprocess.CalledProcessError: If a pg_dump worker fails.
+        """
+        connection = self._connect(name)
+        if not connection:
+            raise Error(f"Cannot connect to database {name} to export its snapshot")
+        job_name = self.job_name("backup", name)
+        try:
+            connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = connection.cursor()
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot = cursor.fetchone()[0]
+            cursor.execute(self.BUNDLE_TABLES_QUERY)
+            rows = cursor.fetchall() if dump_profile != 'schema-only' else []
+            groups = group_tables([{'schema': schema, 'table': table, 'size': size} for schema, table, size in rows])
+            tables = []
+            for number, group in enumerate(groups):
+                for table in group:
+                    table['member'] = f"{TABLES_DIR}/{number:05d}.dump"
+                tables += group
+            if tables:
+                cursor.execute(f"LOCK TABLE {', '.join(table_pattern(t['schema'], t['table']) for t in tables)} "
+                               f"IN ACCESS SHARE MODE")
+            cursor.close()
+            base_command = ['pg_dump', *self.DUMP_PROFILES[dump_profile], *self._connection_options(name),
+                            '-F', 'c', f'--snapshot={snapshot}']
+            with tempfile.TemporaryDirectory(prefix='bundle-', dir=destination_file.parent) as work_dir:
+                work_dir = Path(work_dir)
+                (work_dir / TABLES_DIR).mkdir()
+                commands = [base_command + [f"--exclude-table-data={table_pattern(t['schema'], t['table'])}"
+                                            for t in tables] + ['-b', '-v', '-f', work_dir / SCHEMA_MEMBER]]
+                commands += [base_command + ['--data-only',
+                                             *(option for t in group for option in
+                                               ('-t', table_pattern(t['schema'], t['table']))),
+                                             '-f', work_dir / group[0]['member']] for group in groups]
+                logger.info(f"Dumping database {name} as a bundle of {len(tables)} tables in {len(groups)} members "
+                            f"with {dump_jobs} jobs.")
+                with ThreadPoolExecutor(max_workers=max(1, dump_jobs)) as executor:
+                    futures = [executor.submit(default_runner().run, [command], name=job_name, env=env,
+                                               timeout=timeout) for command in commands]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except Exception:
+                        for future in futures:
+                            future.cancel()
+                        default_runner().cancel(job_name)
+                        raise
+                manifest = {'version': BUNDLE_VERSION, 'database': name, 'snapshot': snapshot,
+                            'profile': dump_profile, 'schema': SCHEMA_MEMBER, 'tables': tables}
+                write_bundle(destination_file, work_dir, manifest)
+        finally:
+            connection.close()
+
+    def _load_bundle_tables(self, name: str, source_file: Path, bundle: dict, tables: List[dict], jobs: int = 1,
+                            timeout: float = None) -> None:
+        """
+        Loads the data of the tables of a bundle from their members.
+
+        Members whose tables are all loaded are restored whole, while the tables loaded from a
+        member shared with other tables are selected with `pg_restore -n -t`.
+
+        Args:
+            name (str): The name of the database to load the tables into.
+            source_file (Path): The bundle file.
+            bundle (dict): The manifest of the bundle.
+            tables (List[dict]): The manifest entries of the tables to load.
+            jobs (int): The number of members loaded at the same time.
+            timeout (float): The maximum duration of each load in seconds, None for no limit.
+
+        Raises:
+            subprocess.CalledProcessError: If a table cannot be loaded.
+        """
+        env = {"PGPASSWORD": self._password}
+        members = {}
+        for table in bundle['tables']:
+            members.setdefault(table['member'], []).append(table)
+        loads = []
+        for member, member_tables in members.items():
+            selected = [table for table in member_tables if table in tables]
+            if len(selected) == len(member_tables):
+                loads.append((member, selected, []))
+            else:
+                loads += [(member, [table], ['-n', table['schema'], '-t', table['table']]) for table in selected]
+
+        def load(member, member_tables, options):
+            with MemberReader(source_file, member) as reader:
+                default_runner().run([['pg_restore', *options, *self._connection_options(name)]],
+                                     name=self.job_name("restore", name), stdin=reader, env=env, timeout=timeout)
+            loaded = ', '.join(f"{table['schema']}.{table['table']}" for table in member_tables)
+            logger.info(f"Data of tables {loaded} loaded into database {name}.")
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for future in [executor.submit(load, *arguments) for arguments in loads]:
+                future.result()
+
+    def _write_incremental(self, destination_dir: Path, previous_backup: Optional[Path],
+                           signatures: Dict[Tuple[str, str], dict], reused: Dict[Tuple[str, str], dict],
+                           dump_profile: str, timeout: float = None) -> None:
+        """
+        Links the data files of the unchanged tables into an incremental dump and writes its manifest.
+
+        Args:
+            destination_dir (Path): The directory of the new dump.
+            previous_backup (Path): The previous incremental backup.
+            signatures (Dict[Tuple[str, str], dict]): The signature and columns of each table.
+            reused (Dict[Tuple[str, str], dict]): The previous manifest entries of the unchanged tables.
+            dump_profile (str): The dump profile.
+            timeout (float): The maximum duration of the TOC listing in seconds, None for no limit.
+        """
+        files = data_files(destination_dir, self._list_toc(destination_dir, timeout))
+        tables = []
+        for (schema, table), current in sorted(signatures.items()):
+            entry = {'schema': schema, 'table': table, **current, 'file': files.get((schema, table)), 'reused': False}
+            if (schema, table) in reused:
+                source = previous_backup / reused[(schema, table)]['file']
+                # Keep the compression suffix written by pg_dump
+                entry['file'] = f"{REUSED_DIR}/{len(tables):05d}.dat{source.name.split('.dat', 1)[1]}"
+                entry['reused'] = True
+                link_or_copy(source, destination_dir / entry['file'])
+            tables.append(entry)
+        manifest = {'version': INCREMENTAL_VERSION, 'profile': dump_profile, 'tables': tables}
+        (destination_dir / INCREMENTAL_MANIFEST).write_text(json.dumps(manifest, indent=2))
+
+    def _load_reused_tables(self, name: str, source_dir: Path, manifest: dict, tables: List[dict], jobs: int = 1,
+                            timeout: float = None) -> None:
+        """
+        Loads the data files of the tables an incremental dump reused from a previous dump.
+
+        COPY data files are loaded by `COPY ... FROM stdin`, INSERT data files are run as they are.
+
+        Args:
+            name (str): The name of the database to load the tables into.
+            source_dir (Path): The directory of the dump.
+            manifest (dict): The incremental manifest of the dump.
+            tables (List[dict]): The manifest entries of the tables to load.
+            jobs (int): The number of tables loaded at the same time.
+            timeout (float): The maximum duration of each load in seconds, None for no limit.
+
+        Raises:
+            subprocess.CalledProcessError: If a table cannot be loaded.
+        """
+        env = {"PGPASSWORD": self._password}
+
+        def load(table):
+            psql = ['psql', '-v', 'ON_ERROR_STOP=1', '-q', *self._connection_options(name)]
+            if manifest['profile'] != 'inserts':
+                psql += ['-c', copy_statement(table['schema'], table['table'], table['columns'])]
+            stages, stdin = read_stages(source_dir / table['file'])
+            default_runner().run(stages + [psql], name=self.job_name("restore", name), stdin=stdin, env=env,
+                                 timeout=timeout)
+            logger.info(f"Reused data of table {table['schema']}.{table['table']} loaded into database {name}.")
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for future in [executor.submit(load, table) for table in tables]:
+                future.result()
+
+    def _section_stages(self, name: str, source_file: Path, section: str,
+                        jobs: int = 1) -> Tuple[List[List[str]], object]:
+        """
+        Builds the pipeline restoring a section of an archive, with parallel jobs when pg_restore reads it itself.
+
+        Args:
+            name (str): The name of the database to restore into.
+            source_file (Path): The archive file or directory.
+            section (str): The section, 'pre-data', 'data' or 'post-data'.
+            jobs (int): The number of parallel pg_restore jobs.
+
+        Returns:
+            Tuple[List[List[str]], object]: The argv of the stages of the pipeline, and its input.
+        """
+        options = [f'--section={section}', *self._connection_options(name)]
+        stages, stdin = self._archive_stages(source_file, *options)
+        if stdin is None and len(stages) == 1:
+            stages = [['pg_restore', '--jobs', str(jobs), *options, source_file]]
+        return stages, stdin
+
+    def _server_options(self) -> List[str]:
+        """
+        Returns the options connecting the PostgreSQL tools to the server, for cluster-wide tools.
+
+        Returns:
+            List[str]: The connection options.
+        """
+        return ['-h', self._host, '-p', str(self._port), '-U', self._username]
+
+    def _connection_options(self, name: str) -> List[str]:
+        """
+        Returns the options connecting the PostgreSQL tools to a database of the server.
+
+        Args:
+            name (str): The name of the database.
+
+        Returns:
+            List[str]: The connection options.
+        """
+        return [*self._server_options(), '-d', name]
+
+    def _prepare_database_commands(self, name: str) -> List[List[str]]:
+        """
+        Returns the commands to run on a freshly created database before restoring it.
+
+        Args:
+            name (str): The name of the database being restored.
+
+        Returns:
+            List[List[str]]: The argv of the commands to run, in order.
+        """
+        return []
+
+    def restore_database(self, name: str, source_file: Path, jobs: int = 1, timeout: float = None,
+                         swap: bool = False, **options) -> bool:
         """
         Restores the specified PostgreSQL database from a backup file.
 
+        Compressed backups are decompressed, and chunked backups read from the chunk store,
+        while they are streamed to pg_restore, which then restores them with a single job.
+
+        By default the live database is dropped before the backup is loaded. With `swap` the
+        backup is loaded into a shadow database `<name>__restore_<timestamp>`, which replaces
+        the live database by renaming once it is loaded and checked, so the live database is
+        only unavailable during the rename.
+
+        Incremental directory format dumps and bundles are restored section by section: the
+        table data incremental dumps reused from previous dumps, and the data of the tables of
+        a bundle, is loaded after the data section, before the indexes and constraints of the
+        post-data section are created.
+
         Args:
             name (str): The name of the database to restore.
-            source_file (Path): The path to the backup file.
+            source_file (Path): The path to the backup file or directory.
+            jobs (int): The number of parallel pg_restore jobs.
+            timeout (float): The maximum duration of each restore step in seconds, None for no limit.
+            swap (bool): Whether to load the backup into a shadow database swapped with the live one.
 
         Returns:
             bool: True if the restore was successful, False otherwise.
@@ -116,33 +737,371 @@ class PostgresModule(AbstractModule):
             "PGPASSWORD": self._password
         }
 
-        drop_command = (f"psql -h {self._host} -p {self._port} -U {self._username} -d postgres "
-                        f"-c 'DROP DATABASE IF EXISTS {name};'")
-        create_command = (f"psql -h {self._host} -p {self._port} -U {self._username} -d postgres "
-                          f"-c 'CREATE DATABASE {name};'")
-        restore_command = f"pg_restore -h {self._host} -p {self._port} -U {self._username} -d {name} {source_file}"
+        if not source_file.exists():
+            logger.error(f"Backup file {source_file} not found.")
+            return False
+
+        target = self._shadow_database_name(name) if swap else name
+        drop_command = ['psql', *self._connection_options('postgres'), '-c', f'DROP DATABASE IF EXISTS {target};']
+        create_command = ['psql', *self._connection_options('postgres'), '-c', f'CREATE DATABASE {target};']
+        restore_stages, restore_input = self._archive_stages(source_file, *self._connection_options(target))
+        if restore_input is None and len(restore_stages) == 1:
+            restore_stages = [['pg_restore', '--jobs', str(jobs), *self._connection_options(target), source_file]]
+        manifest = read_incremental(source_file)
+        reused = [table for table in manifest['tables'] if table['reused']] if manifest else []
+        bundle = read_bundle(source_file)
 
+        runner = default_runner()
+        job_name = self.job_name("restore", name)
         try:
             # Drop the database
-            subprocess.run(drop_command, shell=True, check=True, text=True, encoding='utf-8', env=env)
-            logger.info(f"Database {name} dropped successfully.")
+            runner.run([drop_command], name=job_name, env=env, timeout=timeout)
+            logger.info(f"Database {target} dropped successfully.")
 
             # Create the database
-            subprocess.run(create_command, shell=True, check=True, text=True, encoding='utf-8', env=env)
-            logger.info(f"Database {name} created successfully.")
+            runner.run([create_command], name=job_name, env=env, timeout=timeout)
+            logger.info(f"Database {target} created successfully.")
+
+            # Prepare the database, e.g. enabling the extensions it needs
+            for prepare_command in self._prepare_database_commands(target):
+                runner.run([prepare_command], name=job_name, env=env, timeout=timeout)
+                logger.info(f"Database {target} prepared with command: {prepare_command}")
 
             # Restore the database from the backup file
-            subprocess.run(restore_command, shell=True, check=True, text=True, encoding='utf-8', env=env)
-            logger.info(f"Restore successful for database {name} from {source_file}.")
+            if reused or bundle:
+                for section in ('pre-data', 'data'):
+                    stages, stdin = self._section_stages(target, source_file, section, jobs)
+                    runner.run(stages, name=job_name, stdin=stdin, env=env, timeout=timeout)
+                if reused:
+                    self._load_reused_tables(target, source_file, manifest, reused, jobs, timeout)
+                if bundle:
+                    self._load_bundle_tables(target, source_file, bundle, bundle['tables'], jobs, timeout)
+                stages, stdin = self._section_stages(target, source_file, 'post-data', jobs)
+                runner.run(stages, name=job_name, stdin=stdin, env=env, timeout=timeout)
+            else:
+                runner.run(restore_stages, name=job_name, stdin=restore_input, env=env, timeout=timeout)
+            logger.info(f"Restore successful for database {target} from {source_file}.")
+
+            if swap:
+                self._check_restored_database(target, len(self._backup_tables(source_file, timeout)))
+                self._swap_database(target, name)
             return True
         except subprocess.CalledProcessError as e:
-            logger.error(
-                f"Error restoring database {name}: {e}. "
-                f"Command: {drop_command if e.cmd == drop_command else restore_command}")
-            return False
-        except FileNotFoundError:
+            logger.error(f"Error restoring database {name}: {e}. Command: {e.cmd}")
+        except (subprocess.TimeoutExpired, JobCancelled, Error) as e:
+            logger.error(f"Error restoring database {name}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error occurred while restoring database {name}: {e}")
+        if swap:
+            self._drop_database(target)
+        return False
+
+    def restore_tables(self, name: str, source_file: Path, tables: List[str], schema: str = None,
+                       timeout: float = None, **options) -> bool:
+        """
+        Restores some tables of a database, or a whole schema, from a backup, leaving the other
+        objects untouched.
+
+        The TOC entries of the tables (their definition, data, constraints, indexes, triggers,
+        defaults, sequences, comments and privileges) are selected from the cached TOC of the
+        backup, which is read and cached first if the backup has no index, and are restored by
+        `pg_restore -L` in a single transaction after dropping the current objects. Foreign keys
+        of other tables referencing a restored table make its drop fail, so such tables must be
+        restored together. The data an incremental dump reused from a previous dump, or a bundle
+        holds in the member of the table, is loaded once the entries are restored.
+
+        Args:
+            name (str): The name of the database to restore the tables into.
+            source_file (Path): The path to the backup file or directory.
+            tables (List[str]): The names of the tables to restore, all the objects of the schema if empty.
+            schema (str): The schema of the tables, any schema if None.
+            timeout (float): The maximum duration of each restore step in seconds, None for no limit.
+            **options: Other restore options, not used by pg_restore.
+
+        Returns:
+            bool: True if the restore was successful, False otherwise.
+        """
+        env = {"PGPASSWORD": self._password}
+        if not source_file.exists():
             logger.error(f"Backup file {source_file} not found.")
             return False
+        if not tables and not schema:
+            logger.error("No table nor schema to restore.")
+            return False
+        try:
+            index = read_index(source_file)
+            if not index or index.get('format') != 'toc':
+                index = self.index_backup(source_file, timeout=timeout)
+            entries = select_entries(index['entries'], tables, schema)
+            found = {entry['table'] for entry in entries if entry['kind'] == 'TABLE'}
+            missing = set(tables) - found
+            if missing:
+                logger.error(f"Tables {', '.join(sorted(missing))} not found in backup {source_file}.")
+                return False
+            if not entries:
+                logger.error(f"Schema {schema} not found in backup {source_file}.")
+                return False
+            with tempfile.TemporaryDirectory(prefix='restore-', dir=source_file.parent) as work_dir:
+                list_file = Path(work_dir) / 'restore.list'
+                list_file.write_text('\n'.join(entry['line'] for entry in entries) + '\n')
+                stages, stdin = self._archive_stages(source_file, '--clean', '--if-exists', '--single-transaction',
+                                                     '-L', list_file, *self._connection_options(name))
+                default_runner().run(stages, name=self.job_name("restore", name), stdin=stdin, env=env, timeout=timeout)
+            restored = {(entry['schema'], entry['table']) for entry in entries if entry['kind'] == 'TABLE'}
+            manifest = read_incremental(source_file)
+            if manifest:
+                self._load_reused_tables(name, source_file, manifest, [
+                    table for table in manifest['tables']
+                    if table['reused'] and (table['schema'], table['table']) in restored], timeout=timeout)
+            bundle = read_bundle(source_file)
+            if bundle:
+                self._load_bundle_tables(name, source_file, bundle, [
+                    table for table in bundle['tables'] if (table['schema'], table['table']) in restored],
+                    timeout=timeout)
+            logger.info(f"Restored {len(entries)} objects of {', '.join(tables) or f'schema {schema}'} "
+                        f"into database {name} from {source_file}.")
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error restoring tables of database {name}: {e}. Command: {e.cmd}")
+        except (subprocess.TimeoutExpired, JobCancelled) as e:
+            logger.error(f"Error restoring tables of database {name}: {e}")
         except Exception as e:
-            logger.error(f"Unexpected error occurred while restoring database {name}: {e}")
+            logger.error(f"Unexpected error occurred while restoring tables of database {name}: {e}")
+        return False
+
+    def backup_cluster(self, destination_dir: Path, compression: str = None, compression_level: int = None,
+                       timeout: float = None, **options) -> bool:
+        """
+        Takes a physical base backup of the whole cluster with pg_basebackup.
+
+        The backup is a directory holding the tar archives of the data directory and of the WAL
+        streamed during the backup, compressed on the client side if a codec is given, and the
+        manifest recording the WAL range the backup needs to be consistent. The connecting user
+        needs the REPLICATION privilege.
+
+        pg_basebackup writes the backup itself, so the rate limit of the backup jobs of the
+        cluster when the backup starts is passed as its `--max-rate`, within its bounds of
+        32 kB to 1 GB per second.
+
+        Args:
+            destination_dir (Path): The directory where the backup will be stored, created by pg_basebackup.
+            compression (str): The compression codec ('zstd', 'lz4' or 'gzip'), None for no compression.
+            compression_level (int): The compression level, the codec default if None.
+            timeout (float): The maximum duration of the backup in seconds, None for no limit.
+            **options: Other dump options, not used by physical backups.
+
+        Returns:
+            bool: True if the backup was successful, False otherwise.
+        """
+        command = ['pg_basebackup', *self._server_options(), '-D', destination_dir, '-F', 't', '-X', 'stream',
+                   '-c', 'fast', '-v']
+        if compression:
+            level = f":{compression_level}" if compression_level is not None else ''
+            command += ['--compress', f"client-{compression}{level}"]
+        job_name = self.job_name("backup", "cluster")
+        rate = default_runner().rate(job_name)
+        if rate:
+            command += [f"--max-rate={min(max(int(rate // 1024), 32), 1024 * 1024)}"]
+        try:
+            default_runner().run([command], name=job_name, env={"PGPASSWORD": self._password}, timeout=timeout)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled) as e:
+            logger.error(f"Error taking base backup to {destination_dir}: {e}")
             return False
+        wal_range = read_wal_range(destination_dir)
+        if wal_range:
+            logger.info(f"Base backup successful to {destination_dir}, WAL from segment "
+                        f"{segment_name(wal_range['timeline'], wal_range['start_lsn'])}.")
+        return True
+
+    def receive_wal(self, wal_dir: Path, slot: str, compression: str = None) -> None:
+        """
+        Archives the WAL of the cluster with pg_receivewal, until the connection is lost.
+
+        The replication slot is created first if missing, so the server keeps the WAL segments
+        not yet archived while pg_receivewal is not running.
+
+        Args:
+            wal_dir (Path): The WAL archive directory.
+            slot (str): The name of the physical replication slot.
+            compression (str): The compression codec of the segments, None for no compression.
+                pg_receivewal cannot write zstd, so zstd segments are compressed with lz4.
+
+        Raises:
+            subprocess.CalledProcessError: If the slot cannot be created or pg_receivewal fails.
+            JobCancelled: If the archiving is cancelled.
+        """
+        env = {"PGPASSWORD": self._password}
+        wal_dir.mkdir(parents=True, exist_ok=True)
+        runner = default_runner()
+        runner.run([['pg_receivewal', *self._server_options(), '--slot', slot, '--create-slot', '--if-not-exists']],
+                   name=self.job_name("wal", slot), env=env)
+        command = ['pg_receivewal', *self._server_options(), '-D', wal_dir, '--slot', slot, '--no-loop', '-v']
+        if compression:
+            if WAL_CODECS[compression] != compression:
+                logger.warning(f"WAL segments are compressed with {WAL_CODECS[compression]} instead of {compression}.")
+            command += ['--compress', WAL_CODECS[compression]]
+        logger.info(f"Archiving WAL to {wal_dir} with replication slot {slot}.")
+        runner.run([command], name=self.job_name("wal", slot), env=env)
+
+    def restore_cluster(self, source_dir: Path, data_dir: Path, wal_dir: Path, target_time: datetime = None,
+                        timeout: float = None, **options) -> bool:
+        """
+        Prepares a data directory recovering a base backup to a point in time.
+
+        The archives of the base backup are extracted into the data directory, which must be
+        empty and not used by a running server, and the recovery settings are written: once
+        the server is started on it, it replays the archived WAL with `restore_command` up to
+        the target time, then promotes. The WAL archive must be readable by the server at the
+        same path.
+
+        Args:
+            source_dir (Path): The base backup directory.
+            data_dir (Path): The data directory of the server to recover.
+            wal_dir (Path): The WAL archive directory.
+            target_time (datetime): The time to recover to, the end of the archived WAL if None.
+            timeout (float): The maximum duration of each extraction in seconds, None for no limit.
+            **options: Other restore options, not used by physical restores.
+
+        Returns:
+            bool: True if the data directory was prepared, False otherwise.
+        """
+        if data_dir.exists() and any(data_dir.iterdir()):
+            logger.error(f"Data directory {data_dir} is not empty, stop the server and empty it first.")
+            return False
+        try:
+            data_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            for archive, destination in (('base', data_dir), ('pg_wal', data_dir / 'pg_wal')):
+                archive_file = next(source_dir.glob(f"{archive}.tar*"), None)
+                if archive_file is None:
+                    continue
+                destination.mkdir(mode=0o700, exist_ok=True)
+                stages, stdin = read_stages(archive_file)
+                default_runner().run(stages + [['tar', '-x', '-C', destination]],
+                                     name=self.job_name("restore", data_dir), stdin=stdin, timeout=timeout)
+            (data_dir / 'recovery.signal').touch()
+            with open(data_dir / 'postgresql.auto.conf', 'a') as f:
+                f.write(recovery_settings(wal_dir, target_time))
+            logger.info(f"Data directory {data_dir} prepared from {source_dir}, recovering "
+                        f"{f'to {target_time}' if target_time else 'to the end of the archived WAL'} on start.")
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, JobCancelled) as e:
+            logger.error(f"Error extracting base backup {source_dir}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error occurred while restoring base backup {source_dir}: {e}")
+        return False
+
+    def _backup_tables(self, source_file: Path, timeout: float = None) -> Set[Tuple[str, str]]:
+        """
+        Lists the tables of a backup from its TOC, read from its index or with `pg_restore --list`.
+
+        Args:
+            source_file (Path): The backup file or directory.
+            timeout (float): The maximum duration of pg_restore in seconds, None for no limit.
+
+        Returns:
+            Set[Tuple[str, str]]: The schema and name of each table.
+        """
+        index = read_index(source_file)
+        if not index or index.get('format') != 'toc':
+            index = self.index_backup(source_file, timeout=timeout)
+        return {(entry['schema'], entry['table']) for entry in index['entries'] if entry['kind'] == 'TABLE'}
+
+    def _check_restored_database(self, name: str, expected: int) -> int:
+        """
+        Checks that a restored database accepts connections and holds every table of its backup.
+
+        Tables created by extensions are not counted, as they are not part of the dumps.
+
+        Args:
+            name (str): The name of the restored database.
+            expected (int): The number of tables of the backup.
+
+        Returns:
+            int: The number of tables of the database.
+
+        Raises:
+            psycopg2.Error: If the database cannot be queried or has another number of tables.
+        """
+        connection = self._connect(name)
+        if not connection:
+            raise Error(f"Cannot connect to restored database {name}")
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                               "WHERE c.relkind IN ('r', 'p') "
+                               "AND n.nspname NOT IN ('pg_catalog', 'information_schema') "
+                               "AND NOT EXISTS (SELECT 1 FROM pg_depend d WHERE d.classid = 'pg_class'::regclass "
+                               "AND d.objid = c.oid AND d.deptype = 'e');")
+                tables = cursor.fetchone()[0]
+        finally:
+            connection.close()
+        if tables != expected:
+            raise Error(f"Restored database {name} has {tables} tables, its backup has {expected}")
+        logger.info(f"Restored database {name} checked with {tables} tables.")
+        return tables
+
+    def _swap_database(self, shadow: str, name: str, attempts: int = 5) -> None:
+        """
+        Replaces a live database with a restored shadow database by renaming both in one transaction.
+
+        The sessions connected to the live database are terminated, as PostgreSQL cannot rename
+        a database in use; the rename is retried while sessions are still closing. The replaced
+        database is dropped afterwards.
+
+        Args:
+            shadow (str): The name of the restored shadow database.
+            name (str): The name of the live database.
+            attempts (int): The number of rename attempts.
+
+        Raises:
+            psycopg2.Error: If the databases cannot be renamed.
+        """
+        old = self._shadow_database_name(name, 'old')
+        connection = self._connect()
+        if not connection:
+            raise Error("Cannot connect to the maintenance database")
+        try:
+            for attempt in range(1, attempts + 1):
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,))
+                        exists = cursor.fetchone() is not None
+                        if exists:
+                            cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                                           "WHERE datname = %s AND pid <> pg_backend_pid();", (name,))
+                            cursor.execute(f"ALTER DATABASE {name} RENAME TO {old};")
+                        cursor.execute(f"ALTER DATABASE {shadow} RENAME TO {name};")
+                    connection.commit()
+                    break
+                except Error as e:
+                    connection.rollback()
+                    if attempt == attempts:
+                        raise
+                    logger.warning(f"Swap of database {name} failed (attempt {attempt}): {e}")
+                    time.sleep(attempt)
+            logger.info(f"Database {shadow} swapped in as {name}.")
+        finally:
+            connection.close()
+        if exists:
+            self._drop_database(old)
+
+    def _drop_database(self, name: str) -> None:
+        """
+        Drops a temporary database of a restore, logging a warning if it cannot be dropped.
+
+        Args:
+            name (str): The name of the database.
+        """
+        connection = self._connect()
+        if not connection:
+            logger.warning(f"Database {name} left on the server: cannot connect to drop it.")
+            return
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS {name};")
+            logger.info(f"Database {name} dropped successfully.")
+        except Error as e:
+            logger.warning(f"Database {name} left on the server: {e}")
+        finally:
+            connection.close()
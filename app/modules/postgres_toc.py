@@ -0,0 +1,145 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+# Kinds of TOC entries made of several words, longest first
+MULTIWORD_KINDS = ('MATERIALIZED VIEW DATA', 'SEQUENCE OWNED BY', 'MATERIALIZED VIEW', 'FK CONSTRAINT', 'TABLE DATA',
+                   'SEQUENCE SET', 'DEFAULT ACL', 'TABLE ATTACH', 'INDEX ATTACH', 'LARGE OBJECT', 'BLOB METADATA',
+                   'CHECK CONSTRAINT', 'EVENT TRIGGER', 'FOREIGN TABLE', 'ROW SECURITY')
+
+# Kinds of TOC entries whose tag starts with the name of their table
+TABLE_TAG_KINDS = ('CONSTRAINT', 'FK CONSTRAINT', 'CHECK CONSTRAINT', 'TRIGGER', 'DEFAULT', 'POLICY', 'RULE',
+                   'ROW SECURITY', 'TABLE ATTACH')
+
+# Kinds of TOC entries whose table is only known from their SQL definition
+OWNED_KINDS = ('INDEX', 'SEQUENCE', 'SEQUENCE OWNED BY')
+
+# Line of a TOC listing: `<dump id>; <table oid> <oid> <kind> <schema> <tag> <owner>`
+TOC_LINE_PATTERN = re.compile(r'^(\d+); (\d+) (\d+) (.*)$')
+
+# Comment heading each object in the SQL written by pg_restore
+OBJECT_COMMENT_PATTERN = re.compile(r'^-- Name: (.*); Type: (.*); Schema: (.*); Owner: ', re.MULTILINE)
+
+# Statements naming the table owning an index or a sequence
+OWNER_PATTERNS = {
+    'INDEX': re.compile(r'\bON (?:ONLY )?((?:"(?:[^"]|"")*"|[^\s."(]+)(?:\.(?:"(?:[^"]|"")*"|[^\s."(]+))*)'),
+    'SEQUENCE': re.compile(r'ALTER TABLE (?:ONLY )?((?:"(?:[^"]|"")*"|[^\s."]+)(?:\.(?:"(?:[^"]|"")*"|[^\s."]+))*) '
+                           r'ALTER COLUMN'),
+    'SEQUENCE OWNED BY': re.compile(r'OWNED BY ((?:"(?:[^"]|"")*"|[^\s.";]+)(?:\.(?:"(?:[^"]|"")*"|[^\s.";]+))*)'),
+}
+
+# Parts of a qualified SQL name
+NAME_PART_PATTERN = re.compile(r'"((?:[^"]|"")*)"|([^."]+)')
+
+
+def split_name(qualified: str) -> List[str]:
+    """
+    Splits a qualified SQL name into its unquoted parts.
+
+    Args:
+        qualified (str): The name, e.g. `public."My Table"`.
+
+    Returns:
+        List[str]: The parts of the name, e.g. ['public', 'My Table'].
+    """
+    return [quoted.replace('""', '"') if quoted else plain
+            for quoted, plain in NAME_PART_PATTERN.findall(qualified)]
+
+
+def parse_toc(listing: str) -> List[dict]:
+    """
+    Parses the TOC listing written by `pg_restore --list`.
+
+    The table of each entry is derived from its tag when possible: tables and their data are
+    tagged with the table name, and constraints, triggers, column defaults, policies and rules
+    with the table name followed by their own name. Since the listing does not quote names,
+    the table in such a tag is the longest table of the schema listed in the archive the tag
+    starts with, so table names with spaces are found too.
+
+    Args:
+        listing (str): The TOC listing.
+
+    Returns:
+        List[dict]: The entries in TOC order, with their 'line', 'kind', 'schema', 'tag' and
+            'table' (None when not known from the listing).
+    """
+    entries = []
+    for line in listing.splitlines():
+        match = TOC_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        rest = match.group(4)
+        kind = next((kind for kind in MULTIWORD_KINDS if rest.startswith(kind + ' ')), rest.split(' ', 1)[0])
+        words = rest[len(kind) + 1:].split(' ')
+        schema = words[0] if words else '-'
+        # The owner is missing from the entries of objects without owner
+        tag = ' '.join(words[1:-1]) if len(words) > 2 else ' '.join(words[1:])
+        table = None
+        if kind in ('TABLE', 'TABLE DATA'):
+            table = tag
+        elif kind in ('ACL', 'COMMENT') and tag.startswith('TABLE '):
+            table = tag[len('TABLE '):]
+        elif kind == 'COMMENT' and tag.startswith('COLUMN '):
+            table = tag[len('COLUMN '):].rsplit('.', 1)[0]
+        entries.append({'line': line, 'kind': kind, 'schema': schema, 'tag': tag, 'table': table})
+
+    tables: Dict[str, List[str]] = {}
+    for entry in entries:
+        if entry['kind'] == 'TABLE':
+            tables.setdefault(entry['schema'], []).append(entry['tag'])
+    for entry in entries:
+        if entry['kind'] in TABLE_TAG_KINDS:
+            tag = entry['tag']
+            candidates = [table for table in tables.get(entry['schema'], []) if tag.startswith(table + ' ')]
+            entry['table'] = max(candidates, key=len) if candidates else tag.split(' ', 1)[0]
+    return entries
+
+
+def parse_owners(sql: str) -> Dict[Tuple[str, str], str]:
+    """
+    Finds the tables owning the indexes and sequences defined in the SQL written by pg_restore.
+
+    Args:
+        sql (str): The SQL of the INDEX, SEQUENCE and SEQUENCE OWNED BY entries of an archive.
+
+    Returns:
+        Dict[Tuple[str, str], str]: The owning table of each index and sequence, by schema and name.
+    """
+    owners = {}
+    comments = list(OBJECT_COMMENT_PATTERN.finditer(sql))
+    for comment, following in zip(comments, comments[1:] + [None]):
+        name, kind, schema = comment.groups()
+        pattern = OWNER_PATTERNS.get(kind)
+        if not pattern:
+            continue
+        match = pattern.search(sql, comment.end(), following.start() if following else len(sql))
+        if not match:
+            continue
+        parts = split_name(match.group(1))
+        # OWNED BY names the owning column after the table
+        table = parts[-2] if kind == 'SEQUENCE OWNED BY' and len(parts) > 1 else parts[-1]
+        owners[(schema, name)] = table
+    return owners
+
+
+def select_entries(entries: Iterable[dict], tables: List[str], schema: Optional[str] = None) -> List[dict]:
+    """
+    Selects the TOC entries restoring some tables, or a whole schema.
+
+    Args:
+        entries (Iterable[dict]): The entries of the archive, with their owning table.
+        tables (List[str]): The names of the tables, all the tables of the schema if empty.
+        schema (str): The schema of the tables, any schema if None.
+
+    Returns:
+        List[dict]: The selected entries, in TOC order.
+    """
+    selected = []
+    for entry in entries:
+        if schema and entry['schema'] != schema:
+            continue
+        if tables and entry['table'] not in tables:
+            continue
+        if entry['table'] is None and not (schema and not tables):
+            continue
+        selected.append(entry)
+    return selected
@@ -0,0 +1,144 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+import json
+import re
+import shlex
+
+# Default size of the WAL segments of a PostgreSQL cluster
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Name of a WAL segment file, `<timeline><log><segment>` in hexadecimal, with the suffix of
+# its compression or `.partial` while pg_receivewal is still writing it
+SEGMENT_PATTERN = re.compile(r'^([0-9A-F]{8})([0-9A-F]{8})([0-9A-F]{8})(\.gz|\.lz4)?(\.partial)?$')
+
+# Compression methods of pg_receivewal, with the suffix of the segments and the command
+# decompressing them to stdout, and the method used for each codec of the backups
+WAL_COMPRESSION = {
+    'gzip': {'suffix': '.gz', 'decompress': 'gzip -dc'},
+    'lz4': {'suffix': '.lz4', 'decompress': 'lz4 -dc'},
+}
+WAL_CODECS = {
+    'gzip': 'gzip',
+    'lz4': 'lz4',
+    # pg_receivewal cannot write zstd segments
+    'zstd': 'lz4',
+}
+
+# Name of the manifest written by pg_basebackup, recording the WAL range of the base backup
+MANIFEST_NAME = 'backup_manifest'
+
+
+def parse_lsn(lsn: str) -> int:
+    """
+    Parses a log sequence number.
+
+    Args:
+        lsn (str): The LSN, e.g. `0/2000028`.
+
+    Returns:
+        int: The byte position in the WAL.
+    """
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def segment_name(timeline: int, lsn: int, segment_size: int = SEGMENT_SIZE) -> str:
+    """
+    Returns the name of the WAL segment holding a position of the WAL.
+
+    Args:
+        timeline (int): The timeline.
+        lsn (int): The byte position in the WAL.
+        segment_size (int): The size of the WAL segments.
+
+    Returns:
+        str: The segment name, e.g. `000000010000000000000002`.
+    """
+    segments_per_log = 0x100000000 // segment_size
+    number = lsn // segment_size
+    return f"{timeline:08X}{number // segments_per_log:08X}{number % segments_per_log:08X}"
+
+
+def parse_segment(name: str, segment_size: int = SEGMENT_SIZE) -> Optional[Tuple[int, int, bool]]:
+    """
+    Parses the name of a WAL segment file.
+
+    Args:
+        name (str): The file name.
+        segment_size (int): The size of the WAL segments.
+
+    Returns:
+        Optional[Tuple[int, int, bool]]: The timeline, the sequential number of the segment and
+            whether it is still partial, None if the file is not a WAL segment.
+    """
+    match = SEGMENT_PATTERN.match(name)
+    if not match:
+        return None
+    timeline, log, segment = (int(part, 16) for part in match.group(1, 2, 3))
+    return timeline, log * (0x100000000 // segment_size) + segment, bool(match.group(5))
+
+
+def read_wal_range(backup_dir: Path) -> Optional[dict]:
+    """
+    Reads the WAL range a base backup needs to be consistent from its manifest.
+
+    Args:
+        backup_dir (Path): The base backup directory written by pg_basebackup.
+
+    Returns:
+        Optional[dict]: The 'timeline', 'start_lsn' and 'end_lsn' of the backup, None if the
+            backup has no manifest.
+    """
+    manifest = backup_dir / MANIFEST_NAME
+    if not manifest.exists():
+        return None
+    wal_range = json.loads(manifest.read_text())['WAL-Ranges'][-1]
+    return {'timeline': wal_range['Timeline'], 'start_lsn': parse_lsn(wal_range['Start-LSN']),
+            'end_lsn': parse_lsn(wal_range['End-LSN'])}
+
+
+def restore_command(wal_dir: Path, segment_size: int = SEGMENT_SIZE) -> str:
+    """
+    Builds the `restore_command` of a server recovering from the WAL archive.
+
+    The segments are looked for uncompressed first, then with each compression suffix. When
+    the complete segment is missing, e.g. the last segment streamed before the server was
+    lost, the `.partial` segment pg_receivewal was writing is used, padded with zeros to the
+    segment size the server expects: recovery ends at its last complete record.
+
+    Args:
+        wal_dir (Path): The WAL archive, as seen by the server.
+        segment_size (int): The size of the WAL segments of the cluster.
+
+    Returns:
+        str: The shell command, with the `%f` and `%p` placeholders of PostgreSQL.
+    """
+    source = shlex.quote(str(wal_dir)) + '/%f'
+    branches = []
+    for partial in ('', '.partial'):
+        # A segment still being compressed ends with an incomplete block, whose decompression fails
+        pad = f'; truncate -s {segment_size} "%p"' if partial else ''
+        branches.append(f'[ -f {source}{partial} ]; then cp {source}{partial} "%p"{pad}')
+        for method in WAL_COMPRESSION.values():
+            compressed = f'{source}{method["suffix"]}{partial}'
+            branches.append(f'[ -f {compressed} ]; then {method["decompress"]} {compressed} > "%p"{pad}')
+    return 'if ' + '; elif '.join(branches) + '; else exit 1; fi'
+
+
+def recovery_settings(wal_dir: Path, target_time: Optional[datetime] = None) -> str:
+    """
+    Builds the settings recovering a restored base backup from the WAL archive.
+
+    Args:
+        wal_dir (Path): The WAL archive, as seen by the server.
+        target_time (datetime): The time to recover to, the end of the archived WAL if None.
+
+    Returns:
+        str: The lines to append to `postgresql.auto.conf`.
+    """
+    lines = [f"restore_command = '{restore_command(wal_dir).replace(chr(39), chr(39) * 2)}'"]
+    if target_time:
+        lines.append(f"recovery_target_time = '{target_time.astimezone().isoformat(sep=' ')}'")
+        lines.append("recovery_target_action = 'promote'")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional
+import heapq
+import statistics
+
+
+def estimate_durations(databases: List[str], sizes: Dict[str, int],
+                       samples: Dict[str, List[dict]]) -> Dict[str, Optional[float]]:
+    """
+    Estimates the dump duration of each database from its size and from its past dumps.
+
+    A database dumped before is estimated from its own seconds per byte applied to its current
+    size, or from its past durations when its size was not known. A database never dumped is
+    estimated from the median seconds per byte of the other databases.
+
+    Args:
+        databases (List[str]): The databases to estimate.
+        sizes (Dict[str, int]): The current size of the databases in bytes, by name; may be partial.
+        samples (Dict[str, List[dict]]): The latest successful dumps of each database, with their
+            'duration' in seconds and the 'source_size' of the database in bytes when known.
+
+    Returns:
+        Dict[str, Optional[float]]: The estimated duration in seconds of each database, None
+            when it cannot be estimated.
+    """
+    rates = {}
+    for db_name, runs in samples.items():
+        db_rates = [run['duration'] / run['source_size'] for run in runs if run.get('source_size')]
+        if db_rates:
+            rates[db_name] = statistics.median(db_rates)
+    default_rate = statistics.median(rates.values()) if rates else None
+    estimates = {}
+    for db_name in databases:
+        size, runs = sizes.get(db_name), samples.get(db_name)
+        if size and db_name in rates:
+            estimates[db_name] = size * rates[db_name]
+        elif runs:
+            estimates[db_name] = statistics.median(run['duration'] for run in runs)
+        elif size and default_rate is not None:
+            estimates[db_name] = size * default_rate
+        else:
+            estimates[db_name] = None
+    return estimates
+
+
+def lpt_order(databases: List[str], estimates: Dict[str, Optional[float]], sizes: Dict[str, int]) -> List[str]:
+    """
+    Orders the databases longest processing time first.
+
+    Databases without an estimate come first, largest first, since they may be the longest
+    ones; the others follow by decreasing estimated duration.
+
+    Args:
+        databases (List[str]): The databases to order.
+        estimates (Dict[str, Optional[float]]): The estimated duration of each database (see estimate_durations).
+        sizes (Dict[str, int]): The current size of the databases in bytes, by name; may be partial.
+
+    Returns:
+        List[str]: The databases in dump order.
+    """
+    def key(db_name):
+        estimate = estimates.get(db_name)
+        if estimate is None:
+            return 0, -sizes.get(db_name, 0)
+        return 1, -estimate
+    return sorted(databases, key=key)
+
+
+def predict_makespan(durations: List[float], workers: int) -> float:
+    """
+    Predicts the duration of a run dumping the databases in order with a pool of workers.
+
+    Each database is taken by the first worker to become free, as the thread pool of the
+    scheduler does.
+
+    Args:
+        durations (List[float]): The estimated durations of the databases, in dump order.
+        workers (int): The number of workers.
+
+    Returns:
+        float: The predicted duration of the run in seconds.
+    """
+    finish_times = [0.0] * max(1, workers)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
@@ -0,0 +1,177 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+import itertools
+import threading
+
+# Numbers of the threads started by dispatch
+_run_ids = itertools.count(1)
+
+
+def dispatch(fn: Callable, *args, **kwargs) -> Future:
+    """
+    Runs a task in a thread of its own, outside of the workers of any pool.
+
+    Meant for the backup runs, which mostly wait on the dumps they submit to a pool: running
+    them here keeps them from holding a worker, or a thread of the job scheduler firing them.
+
+    Args:
+        fn (callable): The task.
+        *args: The arguments of the task.
+        **kwargs: The keyword arguments of the task.
+
+    Returns:
+        Future: The future of the result of the task.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"backup-run-{next(_run_ids)}").start()
+    return future
+
+
+class WorkerPool:
+    """
+    Pool of workers shared by the backup runs of all the targets, with concurrency caps.
+
+    Each task is submitted with keys, e.g. its target and the host of its server, and only
+    starts once a worker is free and every key is below its cap. Tasks are started in
+    submission order, a task whose keys are all at their cap letting the next tasks go
+    first, so a busy server never holds the workers needed by the others.
+
+    Attributes:
+        workers (int): The number of workers.
+        limits (Dict[str, int]): The cap of each key; keys without cap are only limited by the workers.
+    """
+
+    def __init__(self, workers: int, limits: Optional[Dict[str, int]] = None):
+        """
+        Initialize the pool, starting its workers on demand.
+
+        Args:
+            workers (int): The number of workers.
+            limits (Dict[str, int]): The cap of each key.
+        """
+        self.workers = max(1, workers)
+        self.limits = dict(limits or {})
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backup-worker")
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._running = 0
+        self._running_keys: Dict[str, int] = {}
+
+    def limit(self, key: str, limit: Optional[int]) -> None:
+        """
+        Sets the cap of a key, the tasks already running being kept.
+
+        Args:
+            key (str): The key.
+            limit (int): The maximum number of running tasks with the key, None for no cap.
+        """
+        with self._lock:
+            if limit is None:
+                self.limits.pop(key, None)
+            else:
+                self.limits[key] = max(1, limit)
+        self._dispatch()
+
+    def submit(self, keys: Iterable[str], fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queues a task until a worker is free and its keys are below their cap.
+
+        Args:
+            keys (Iterable[str]): The keys of the task.
+            fn (callable): The task.
+            *args: The arguments of the task.
+            **kwargs: The keyword arguments of the task.
+
+        Returns:
+            Future: The future of the result of the task.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((tuple(keys), future, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def running(self, key: Optional[str] = None) -> int:
+        """
+        Counts the running tasks.
+
+        Args:
+            key (str): Count only the tasks with this key, all tasks if None.
+
+        Returns:
+            int: The number of running tasks.
+        """
+        with self._lock:
+            return self._running if key is None else self._running_keys.get(key, 0)
+
+    def capacity(self, keys: Iterable[str]) -> int:
+        """
+        Counts the tasks with some keys that can run at the same time.
+
+        Args:
+            keys (Iterable[str]): The keys of the tasks.
+
+        Returns:
+            int: The number of workers, or the lowest cap of the keys if lower.
+        """
+        with self._lock:
+            return min([self.workers, *(self.limits[key] for key in keys if key in self.limits)])
+
+    def _admissible(self, keys) -> bool:
+        """Whether a task with these keys can start now; called with the lock held."""
+        return all(self._running_keys.get(key, 0) < self.limits[key] for key in keys if key in self.limits)
+
+    def _dispatch(self) -> None:
+        """Starts the pending tasks that can run, in submission order."""
+        started = []
+        with self._lock:
+            for task in list(self._pending):
+                if self._running >= self.workers:
+                    break
+                keys = task[0]
+                if not self._admissible(keys):
+                    continue
+                self._pending.remove(task)
+                self._running += 1
+                for key in keys:
+                    self._running_keys[key] = self._running_keys.get(key, 0) + 1
+                started.append(task)
+        for keys, future, fn, args, kwargs in started:
+            if future.set_running_or_notify_cancel():
+                self._executor.submit(self._run, keys, future, fn, args, kwargs)
+            else:
+                self._release(keys)
+
+    def _run(self, keys, future, fn, args, kwargs) -> None:
+        """Runs a task in a worker, then releases its slot and starts the next tasks."""
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._release(keys)
+
+    def _release(self, keys) -> None:
+        """Releases the slot of a task and starts the next tasks."""
+        with self._lock:
+            self._running -= 1
+            for key in keys:
+                self._running_keys[key] -= 1
+        self._dispatch()
+
+    def shutdown(self) -> None:
+        """Cancels the pending tasks and waits for the running ones."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for _, future, *_ in pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
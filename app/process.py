@@ -0,0 +1,494 @@
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import itertools
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import logging
+
+from app.throttle import TokenBucket, reserve_all
+
+# Configura il logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Size of the blocks streamed between the stages of a pipeline
+CHUNK_SIZE = 1024 * 1024
+
+# Number of stderr lines of a failed stage kept for the error
+STDERR_TAIL = 20
+
+# ionice scheduling classes available without privileges
+IONICE_CLASSES = {
+    'best-effort': '2',
+    'idle': '3',
+}
+
+
+def priority_command(nice: Optional[int] = None, ionice_class: Optional[str] = None,
+                     ionice_level: Optional[int] = None) -> List[str]:
+    """
+    Builds the argv prefix running a command with a CPU and an IO scheduling priority.
+
+    Args:
+        nice (int): The niceness of the command, from 0 to 19, None to keep the current one.
+        ionice_class (str): The IO scheduling class, 'best-effort' or 'idle', None to keep the current one.
+        ionice_level (int): The priority within the 'best-effort' class, from 0 (highest) to 7.
+
+    Returns:
+        List[str]: The argv prefix, empty if the priority is not changed.
+    """
+    prefix = []
+    if nice is not None:
+        prefix += ['nice', '-n', str(nice)]
+    if ionice_class is not None:
+        if shutil.which('ionice') is None:
+            logger.warning("ionice not found, the IO priority of the dumps is not changed.")
+        else:
+            prefix += ['ionice', '-c', IONICE_CLASSES[ionice_class]]
+            if ionice_class == 'best-effort' and ionice_level is not None:
+                prefix += ['-n', str(ionice_level)]
+    return prefix
+
+
+class JobCancelled(Exception):
+    """Raised by a job cancelled while it was running."""
+
+
+class StreamPipe:
+    """
+    Pipe streaming the bytes written by a thread to the standard input of a job.
+
+    The pipe is passed as the stdin of a job, whose future is then attached to it. Writes are
+    buffered into blocks of CHUNK_SIZE bytes, wait while `capacity` blocks are queued, and
+    fail once the job has ended, e.g. because it was cancelled or timed out, so the writing
+    thread stops with the job.
+    """
+
+    def __init__(self, capacity: int = 4):
+        """
+        Initialize the pipe.
+
+        Args:
+            capacity (int): The number of blocks queued before writes wait.
+        """
+        self._blocks = queue.Queue(capacity)
+        self._buffer = bytearray()
+        self._future: Optional[Future] = None
+
+    def attach(self, future: Future) -> None:
+        """
+        Attaches the job reading the pipe.
+
+        Args:
+            future (Future): The future of the job.
+        """
+        self._future = future
+
+    def read(self, size: int = -1) -> bytes:
+        """Returns the next block written to the pipe, an empty block once it is closed."""
+        return self._blocks.get()
+
+    def write(self, data: bytes) -> int:
+        """
+        Writes bytes for the job, queuing a block once enough bytes are buffered.
+
+        Args:
+            data (bytes): The bytes.
+
+        Returns:
+            int: The number of bytes written.
+
+        Raises:
+            BrokenPipeError: If the job has ended, or the exception of the job if it failed.
+        """
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        """
+        Queues the buffered bytes for the job.
+
+        Raises:
+            BrokenPipeError: If the job has ended, or the exception of the job if it failed.
+        """
+        block, self._buffer = bytes(self._buffer), bytearray()
+        if block and not self._put(block):
+            self._future.result()
+            raise BrokenPipeError("The job reading the pipe has ended")
+
+    def close(self) -> None:
+        """Queues the buffered bytes and ends the stream, or only releases the reader if the job has ended."""
+        block, self._buffer = bytes(self._buffer), bytearray()
+        if not block or self._put(block):
+            self._put(b'')
+
+    def _put(self, block: bytes) -> bool:
+        """Queues a block while the job runs, returning False and releasing its reader once it has ended."""
+        while self._future is None or not self._future.done():
+            try:
+                self._blocks.put(block, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        try:
+            self._blocks.put_nowait(b'')
+        except queue.Full:
+            pass
+        return False
+
+
+class ProcessRunner:
+    """
+    Runs the external tools of the database modules on a single asyncio event loop.
+
+    Jobs are pipelines of argv lists spawned without a shell: the standard output of each
+    stage is streamed to the standard input of the next one, and the output of the last
+    stage to a file. The event loop runs in a background thread, so many concurrent jobs
+    share one thread for their I/O, while callers wait on the job futures.
+
+    Every job can be given a timeout, after which its processes are killed, and a name
+    identifying it for cancellation, throttling and prioritization: the output of the last
+    stage of the jobs of a throttled name, i.e. the bytes written to their output, is streamed
+    at the rate of its token buckets, and
+    the stages of the jobs of a prioritized name are run with its CPU and IO priority.
+    """
+
+    def __init__(self):
+        """Initialize the runner, starting its event loop on the first job."""
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._jobs: Dict[int, tuple] = {}
+        self._ids = itertools.count(1)
+        self._throttles: Dict[str, List[TokenBucket]] = {}
+        self._priorities: Dict[str, List[str]] = {}
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """Returns the event loop of the runner, starting it in a background thread if needed."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='process-runner', daemon=True).start()
+            return self._loop
+
+    def submit(self, stages: List[List[str]], name: str = None, stdin: Path = None, stdout: Path = None,
+               env: dict = None, timeout: float = None) -> Future:
+        """
+        Starts a pipeline on the event loop.
+
+        Args:
+            stages (List[List[str]]): The argv of each stage of the pipeline, in order.
+            name (str): The name of the job, used to cancel it.
+            stdin (Path): The file read by the first stage, or an object with a `read` method
+                streamed to it, None for no input.
+            stdout (Path): The file where the output of the last stage is written, or an object
+                with a `write` method receiving its blocks, None to inherit the standard output.
+            env (dict): Environment variables added to the environment of the stages.
+            timeout (float): The maximum duration of the job in seconds, None for no limit.
+
+        Returns:
+            Future: The future of the job, resolving to the number of bytes written to its
+                standard output by the first stage.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._job(stages, name, stdin, stdout, env, timeout), self._event_loop())
+
+    def run(self, stages: List[List[str]], name: str = None, stdin: Path = None, stdout: Path = None,
+            env: dict = None, timeout: float = None) -> int:
+        """
+        Runs a pipeline on the event loop and waits for its end.
+
+        Args:
+            stages (List[List[str]]): The argv of each stage of the pipeline, in order.
+            name (str): The name of the job, used to cancel it.
+            stdin (Path): The file read by the first stage, or an object with a `read` method
+                streamed to it, None for no input.
+            stdout (Path): The file where the output of the last stage is written, or an object
+                with a `write` method receiving its blocks, None to inherit the standard output.
+            env (dict): Environment variables added to the environment of the stages.
+            timeout (float): The maximum duration of the job in seconds, None for no limit.
+
+        Returns:
+            int: The number of bytes written to its standard output by the first stage.
+
+        Raises:
+            subprocess.CalledProcessError: If a stage exits with an error.
+            subprocess.TimeoutExpired: If the job exceeds its timeout.
+            JobCancelled: If the job is cancelled.
+        """
+        return self.submit(stages, name, stdin, stdout, env, timeout).result()
+
+    def running(self) -> List[str]:
+        """
+        Lists the running jobs.
+
+        Returns:
+            List[str]: The names of the running jobs.
+        """
+        with self._lock:
+            return [name for name, *_ in self._jobs.values()]
+
+    def pids(self) -> List[int]:
+        """
+        Lists the processes of the running jobs.
+
+        Returns:
+            List[int]: The process ids of the stages started by the running jobs.
+        """
+        with self._lock:
+            return [process.pid for _, _, processes in self._jobs.values() for process in processes]
+
+    def cancel(self, name: str = None) -> int:
+        """
+        Cancels running jobs, killing their processes.
+
+        Args:
+            name (str): The name of the jobs to cancel, None to cancel all jobs.
+
+        Returns:
+            int: The number of jobs cancelled.
+        """
+        with self._lock:
+            tasks = [task for job_name, task, _ in self._jobs.values() if name is None or job_name == name]
+        for task in tasks:
+            self._loop.call_soon_threadsafe(task.cancel)
+        return len(tasks)
+
+    def throttle(self, name: str, *buckets: TokenBucket) -> None:
+        """
+        Limits the rate of the jobs of a name, including the jobs already running.
+
+        Args:
+            name (str): The name of the jobs.
+            *buckets (TokenBucket): The token buckets the output of the jobs takes its tokens
+                from, in addition to the buckets already limiting it.
+        """
+        with self._lock:
+            self._throttles[name] = self._throttles.get(name, []) + list(buckets)
+
+    def unthrottle(self, name: str, *buckets: TokenBucket) -> None:
+        """
+        Removes token buckets limiting the rate of the jobs of a name.
+
+        Args:
+            name (str): The name of the jobs.
+            *buckets (TokenBucket): The buckets to remove, all the buckets of the name if none.
+        """
+        with self._lock:
+            remaining = [bucket for bucket in self._throttles.get(name, []) if buckets and bucket not in buckets]
+            if remaining:
+                self._throttles[name] = remaining
+            else:
+                self._throttles.pop(name, None)
+
+    def throttles(self, name: str) -> List[TokenBucket]:
+        """
+        Lists the token buckets limiting the rate of the jobs of a name.
+
+        Args:
+            name (str): The name of the jobs.
+
+        Returns:
+            List[TokenBucket]: The buckets, empty if the jobs are not throttled.
+        """
+        with self._lock:
+            return list(self._throttles.get(name, []))
+
+    def rate(self, name: str) -> Optional[float]:
+        """
+        Returns the current rate limit of the jobs of a name, for tools limiting their rate themselves.
+
+        Args:
+            name (str): The name of the jobs.
+
+        Returns:
+            Optional[float]: The lowest rate of the buckets of the name in bytes per second, None if not limited.
+        """
+        rates = [bucket.rate for bucket in self.throttles(name) if bucket.rate]
+        return min(rates) if rates else None
+
+    def prioritize(self, name: str, prefix: Optional[List[str]] = None) -> None:
+        """
+        Sets the priority of the jobs of a name started from now on.
+
+        Args:
+            name (str): The name of the jobs.
+            prefix (List[str]): The argv prefix setting the priority of each stage (see
+                priority_command), None or empty to run the stages with the priority of the runner.
+        """
+        with self._lock:
+            if prefix:
+                self._priorities[name] = list(prefix)
+            else:
+                self._priorities.pop(name, None)
+
+    def priority(self, name: str) -> List[str]:
+        """
+        Returns the argv prefix setting the priority of the jobs of a name.
+
+        Args:
+            name (str): The name of the jobs.
+
+        Returns:
+            List[str]: The argv prefix, empty if the jobs are not prioritized.
+        """
+        with self._lock:
+            return list(self._priorities.get(name, []))
+
+    async def _job(self, stages, name, stdin, stdout, env, timeout) -> int:
+        """Runs a pipeline as a named job, enforcing its timeout and killing its processes on exit."""
+        job_id = next(self._ids)
+        processes = []
+        with self._lock:
+            self._jobs[job_id] = (name, asyncio.current_task(), processes)
+        try:
+            return await asyncio.wait_for(self._pipeline(stages, name, stdin, stdout, env, processes), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Job {name or stages[0][0]} timed out after {timeout} seconds.")
+            raise subprocess.TimeoutExpired(stages[0], timeout)
+        except asyncio.CancelledError:
+            logger.warning(f"Job {name or stages[0][0]} cancelled.")
+            raise JobCancelled(f"Job {name or stages[0][0]} cancelled")
+        finally:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            with self._lock:
+                del self._jobs[job_id]
+
+    async def _pipeline(self, stages, name, stdin, stdout, env, processes) -> int:
+        """Spawns the stages of a pipeline, streams data between them and checks their exit codes."""
+        env = {**os.environ, **env} if env else None
+        reader = stdin if hasattr(stdin, 'read') else None
+        input_file = open(stdin, 'rb') if stdin and not reader else None
+        writer = stdout if hasattr(stdout, 'write') else None
+        output_file = writer or (open(stdout, 'wb') if stdout else None)
+        prefix = self.priority(name) if name else []
+        throttled = bool(name and self.throttles(name))
+        try:
+            for index, argv in enumerate(stages):
+                first, last = index == 0, index == len(stages) - 1
+                if first and not reader:
+                    stage_stdin = input_file or asyncio.subprocess.DEVNULL
+                else:
+                    stage_stdin = asyncio.subprocess.PIPE
+                # The output of the first stage is always streamed, to count the bytes it produces,
+                # and the output of the last stage of a throttled job, to write it at its rate
+                if last and not writer and not (output_file and (first or throttled)):
+                    stage_stdout = output_file
+                else:
+                    stage_stdout = asyncio.subprocess.PIPE
+                processes.append(await asyncio.create_subprocess_exec(
+                    *[str(arg) for arg in prefix + list(argv)], stdin=stage_stdin, stdout=stage_stdout,
+                    stderr=asyncio.subprocess.PIPE, env=env))
+
+            stderr_tails = [deque(maxlen=STDERR_TAIL) for _ in processes]
+            killed = set()
+            tasks = [self._log_stderr(process, argv[0], tail)
+                     for process, argv, tail in zip(processes, stages, stderr_tails)]
+            if reader:
+                tasks.append(self._feed(reader, processes[0]))
+            pumps = []
+            for index, process in enumerate(processes):
+                throttle = name if index == len(processes) - 1 and name else None
+                if index + 1 < len(processes):
+                    pumps.append(self._pump(index, process, processes[index + 1].stdin, None, killed, throttle))
+                elif process.stdout is not None:
+                    pumps.append(self._pump(index, process, None, output_file, killed, throttle))
+            results = await asyncio.gather(*pumps, *tasks, *[process.wait() for process in processes])
+
+            # Stages killed because the next stage stopped reading are not failures by themselves:
+            # the next stage either failed too or did not need the rest of the stream
+            failed = [index for index, process in enumerate(processes)
+                      if process.returncode != 0 and index not in killed]
+            if failed:
+                index = failed[0]
+                raise subprocess.CalledProcessError(processes[index].returncode, stages[index],
+                                                    stderr='\n'.join(stderr_tails[index]))
+            return results[0] if pumps else 0
+        finally:
+            if input_file:
+                input_file.close()
+            if output_file and not writer:
+                output_file.close()
+
+    async def _pump(self, index, process, target, output_file, killed, throttle=None) -> int:
+        """
+        Streams the standard output of a process to the next stage or to a file.
+
+        If the next stage stops reading, the process is killed and its index added to `killed`.
+        With a throttle, the blocks are streamed at the rate of the token buckets of the name.
+
+        Returns:
+            int: The number of bytes streamed.
+        """
+        loop = asyncio.get_running_loop()
+        written = 0
+        try:
+            while True:
+                chunk = await process.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                delay = reserve_all(self.throttles(throttle), len(chunk)) if throttle else 0
+                if delay:
+                    await asyncio.sleep(delay)
+                if target is not None:
+                    target.write(chunk)
+                    await target.drain()
+                else:
+                    await loop.run_in_executor(None, output_file.write, chunk)
+                written += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.error(f"Pipeline stage stopped reading after {written} bytes.")
+            killed.add(index)
+            process.kill()
+        finally:
+            if target is not None:
+                target.close()
+        return written
+
+    async def _feed(self, reader, process) -> None:
+        """Streams the blocks of a reader to the standard input of the first stage, until it stops reading."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                block = await loop.run_in_executor(None, reader.read, CHUNK_SIZE)
+                if not block:
+                    break
+                process.stdin.write(block)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Pipeline stopped reading its input before the end.")
+        finally:
+            process.stdin.close()
+
+    async def _log_stderr(self, process, tool: str, tail: deque) -> None:
+        """Logs the standard error of a process line by line, keeping its last lines."""
+        while True:
+            line = await process.stderr.readline()
+            if not line:
+                break
+            text = line.decode('utf-8', errors='replace').rstrip()
+            tail.append(text)
+            logger.info(f"{tool}: {text}")
+
+
+_default_runner = ProcessRunner()
+
+
+def default_runner() -> ProcessRunner:
+    """
+    Returns the runner shared by the database modules.
+
+    Returns:
+        ProcessRunner: The shared runner.
+    """
+    return _default_runner
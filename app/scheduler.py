@@ -1,10 +1,32 @@
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
+import contextlib
+import functools
 import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
 import logging
 
+from app.catalog import Catalog, TIMESTAMP_FORMAT
+from app.delta import delta_fits, delta_path, drop_base_cache, encode_delta, read_delta, resolve_base, write_delta
+from app.history import RunHistory
+from app.index import index_path
+from app.load import LoadGovernor
+from app.metrics import Metrics
+from app.planning import estimate_durations, lpt_order, predict_makespan
+from app.pool import dispatch
+from app.process import default_runner, priority_command
+from app.throttle import TokenBucket
+from app.triggers import OffsetTrigger, jitter_offset
+
 
 class Scheduler:
     """
@@ -14,10 +36,51 @@ class Scheduler:
         db_module (AbstractModule): The database module to interact with the database.
         cron_configs (list): List of cron configurations.
         backup_dir (Path): The root directory for storing backups.
-        health (bool): Global health state of the last backup operation.
+        catalog (Catalog): The catalog of the backups stored in the backup directory.
+        metrics (Metrics): The metrics of the backups, labelled by configuration and database.
+        history (RunHistory): The history of the latest backup runs of each configuration and database.
+        wal_dir (Path): The WAL archive of the physical backups.
+        binlog_dir (Path): The binary log archive of the MySQL backups taken with binary log coordinates.
+        rate_limit (TokenBucket): The token bucket shared by the dumps of all the configurations.
+        pool (WorkerPool): The worker pool shared with the schedulers of the other targets, None for a pool per run.
+        instance_id (str): The identifier of this instance, spreading the runs of the instances over the jitter.
     """
 
-    def __init__(self, db_module, cron_configs, backup_dir):
+    # Keys of a cron configuration forwarded to the database module as dump options
+    DUMP_OPTION_KEYS = ("dump_format", "dump_jobs", "dump_chunk_mb", "dump_profile", "compression",
+                        "compression_level", "compression_threads", "timeout", "index", "storage", "delta",
+                        "delta_full_every", "mode", "binlog", "incremental")
+
+    # Keys of a cron configuration adapting its runs to the load of the server (see create_load_governor)
+    LOAD_OPTION_KEYS = ("load_max_active", "load_max_lag", "load_defer_max", "load_concurrency",
+                        "load_rate_limit_mb", "load_check_interval")
+
+    # Keys of a cron configuration limiting the rate and the priority of its dumps (see governed_backup)
+    THROTTLE_OPTION_KEYS = ("rate_limit_mb", "nice", "ionice_class", "ionice_level")
+
+    # Keys of a cron configuration setting the scheduling policy of its job (see start)
+    SCHEDULE_OPTION_KEYS = ("max_instances", "coalesce", "misfire_grace_time", "jitter")
+
+    # Seconds a run may start after its fire time before it is reported as delayed
+    DELAY_TOLERANCE = 1
+
+    # Name of the backups of the whole server taken by the physical configurations
+    CLUSTER_NAME = "cluster"
+
+    # Directory of the WAL archive in the backup directory, and replication slot archiving it
+    WAL_DIR_NAME = ".wal"
+    WAL_SLOT = "nards_db_backup"
+
+    # Directory of the binary log archive in the backup directory, and server id archiving it
+    BINLOG_DIR_NAME = ".binlog"
+    BINLOG_SERVER_ID = 4217
+
+    # Seconds between two log archiving attempts, and between two scans of the WAL archive
+    LOG_RETRY_INTERVAL = 10
+    WAL_SYNC_INTERVAL = 60
+
+    def __init__(self, db_module, cron_configs, backup_dir, catalog=None, metrics=None, history=None,
+                 rate_limit=None, instance_id=None, pool=None, background_scheduler=None):
         """
         Initialize the Scheduler with database module, cron configs, and backup directory.
 
@@ -25,47 +88,816 @@ class Scheduler:
             db_module (AbstractModule): The database module.
             cron_configs (list): List of cron configuration dictionaries.
             backup_dir (Path): The root directory for backups.
+            catalog (Catalog): The catalog of the backup directory, opened from backup_dir if None.
+            metrics (Metrics): The metrics registry, a new one if None.
+            history (RunHistory): The run history, a new one if None.
+            rate_limit (float or TokenBucket): The rate limit in bytes per second of all the dumps together,
+                None for no limit, or the token bucket shared with the schedulers of the other targets.
+            instance_id (str): The identifier of this instance, the host name if None.
+            pool (WorkerPool): The worker pool shared with the schedulers of the other targets.
+            background_scheduler (BackgroundScheduler): The scheduler of the jobs shared with the other
+                targets, a new one if None.
         """
-        self.scheduler = BackgroundScheduler()
+        self.scheduler = background_scheduler or BackgroundScheduler()
         self.db_module = db_module
         self.cron_configs = cron_configs
         self.backup_dir = backup_dir
-        self.health = True
+        self.catalog = catalog or Catalog(backup_dir)
+        self.metrics = metrics or Metrics()
+        self.history = history or RunHistory()
+        self.wal_dir = Path(backup_dir) / self.WAL_DIR_NAME
+        self.binlog_dir = Path(backup_dir) / self.BINLOG_DIR_NAME
+        self.rate_limit = rate_limit if isinstance(rate_limit, TokenBucket) else TokenBucket(rate_limit)
+        self.pool = pool
+        self.instance_id = instance_id or socket.gethostname()
+        self._jobs = {}
+        self._run_slots = {}
+        self._queued_runs = {}
+        self._last_fire_times = {}
+        self._lock = threading.Lock()
+        self._archive_stop = threading.Event()
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
     def start(self):
-        """Start the scheduler and add jobs based on cron configurations."""
-        for cron_config in self.cron_configs:
+        """
+        Start the scheduler and add jobs based on cron configurations.
+
+        Configurations triggering at the same times with the same dump options share a
+        single job: each database is dumped once and published into every configuration.
+
+        Each job starts its runs 'jitter' seconds at most after its fire times (see get_trigger)
+        in threads of their own, so the threads of the job scheduler never wait on whole runs,
+        and runs at most 'max_instances' times at once (see run_scheduled_backup). Runs missed
+        while the scheduler could not run them are coalesced into one, or run one after the
+        other, if they are at most 'misfire_grace_time' seconds late. Skipped and delayed runs
+        are logged and counted (see on_job_event).
+
+        If a configuration takes physical backups, the WAL of the server is archived
+        continuously in a background thread, and so are the binary logs of a MySQL server
+        if a configuration records the binary log coordinates of its dumps.
+        """
+        for cron_configs in self.group_cron_configs():
+            cron_config, shared = cron_configs[0], cron_configs[1:]
             cron_expr = cron_config["cron"]
             retention_max = cron_config.get("retention_max")
             cron_name = cron_config.get("name")
+            concurrency = max(config.get("concurrency", 1) for config in cron_configs)
+            shared_configs = [config.get("name") for config in shared]
             self.logger.info(f"Scheduling backup for cron configuration: {cron_name}")
-            trigger = CronTrigger.from_crontab(cron_expr)
-            self.scheduler.add_job(self.run_backup, trigger, args=[cron_name, retention_max])
-        self.scheduler.start()
+            if shared_configs:
+                self.logger.info(f"Backups of '{cron_name}' are shared with cron configurations: {shared_configs}")
+            job_id = self.get_job_id(cron_name)
+            self._jobs[job_id] = (cron_name, shared_configs)
+            self._run_slots[cron_name] = threading.Semaphore(cron_config.get("max_instances", 1))
+            self.scheduler.add_job(self.run_scheduled_backup, self.get_trigger(cron_name),
+                                   args=[cron_name, retention_max, concurrency, shared_configs], id=job_id,
+                                   name=f"backup {job_id} ({cron_expr})",
+                                   coalesce=cron_config.get("coalesce", True),
+                                   misfire_grace_time=cron_config.get("misfire_grace_time", 60) or None)
+        self.scheduler.add_listener(self.on_job_event,
+                                    EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+        physical = [config for config in self.cron_configs if config.get("mode") == "physical"]
+        if physical:
+            threading.Thread(target=self.archive_log,
+                             args=["WAL", self.db_module.receive_wal, self.wal_dir, self.WAL_SLOT,
+                                   physical[0].get("compression")],
+                             name="wal-archiver", daemon=True).start()
+            self.scheduler.add_job(self.catalog.sync_wal, IntervalTrigger(seconds=self.WAL_SYNC_INTERVAL),
+                                   args=[self.wal_dir])
+        if any(config.get("binlog") for config in self.cron_configs):
+            threading.Thread(target=self.archive_log,
+                             args=["binary logs", self.db_module.receive_binlog, self.binlog_dir,
+                                   self.BINLOG_SERVER_ID],
+                             name="binlog-archiver", daemon=True).start()
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def archive_log(self, kind, receive, *args):
+        """
+        Archive a log of the server until stop_log_archiving is called.
+
+        The archiving is restarted after LOG_RETRY_INTERVAL seconds whenever it stops, e.g.
+        when the server restarts; the replication slot keeps the WAL segments meanwhile, and
+        the server keeps its binary logs until they expire.
+
+        Args:
+            kind (str): The kind of log, used in the log messages.
+            receive (callable): The method of the database module archiving the log until it stops.
+            *args: The arguments of the method.
+        """
+        while not self._archive_stop.is_set():
+            try:
+                receive(*args)
+                self.logger.warning(f"Archiving of {kind} stopped, restarting it")
+            except Exception as e:
+                self.logger.error(f"Error archiving {kind}: {e}")
+            self._archive_stop.wait(self.LOG_RETRY_INTERVAL)
+
+    def stop_log_archiving(self):
+        """
+        Stop archiving the WAL and the binary logs of the server.
+        """
+        self._archive_stop.set()
+        default_runner().cancel(self.db_module.job_name("wal", self.WAL_SLOT))
+        default_runner().cancel(self.db_module.job_name("binlog", "archive"))
+
+    def group_cron_configs(self):
+        """
+        Group the cron configurations triggering at the same times with the same dump, load, throttle and
+        scheduling options.
+
+        Returns:
+            list: The groups of cron configurations, in configuration order.
+        """
+        groups = {}
+        for cron_config in self.cron_configs:
+            trigger = CronTrigger.from_crontab(cron_config["cron"])
+            key = (str(trigger), str(trigger.timezone), bool(cron_config.get("skip_unchanged")),
+                   tuple(sorted(self.get_dump_options(cron_config["name"]).items())),
+                   tuple(cron_config.get(key) for key in
+                         self.LOAD_OPTION_KEYS + self.THROTTLE_OPTION_KEYS + self.SCHEDULE_OPTION_KEYS))
+            groups.setdefault(key, []).append(cron_config)
+        return list(groups.values())
+
+    def get_job_id(self, cron_name):
+        """
+        Get the identifier of the job of a cron configuration, qualified by the target when the
+        scheduler of the jobs is shared with the other targets.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+
+        Returns:
+            str: The identifier of the job.
+        """
+        target = self.db_module.target
+        return f"{target}/{cron_name}" if target else cron_name
+
+    def get_trigger(self, cron_name):
+        """
+        Get the trigger of the job of a cron configuration.
+
+        The fire times of the cron expression are shifted by an offset of up to 'jitter'
+        seconds, derived from the instance and the job identifier (see jitter_offset),
+        so the instances backing up the same server do not all start at the same time while
+        each of them keeps a stable schedule.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+
+        Returns:
+            BaseTrigger: The trigger, None if the configuration is unknown.
+        """
+        cron_config = self.get_cron_config(cron_name)
+        if not cron_config:
+            return None
+        trigger = CronTrigger.from_crontab(cron_config["cron"])
+        offset = jitter_offset(self.instance_id, self.get_job_id(cron_name), cron_config.get("jitter", 0))
+        return OffsetTrigger(trigger, offset) if offset else trigger
+
+    def on_job_event(self, event):
+        """
+        Log and count the backup runs skipped or delayed by the scheduling policy of their job.
+
+        Args:
+            event (JobEvent): The event of the job.
+        """
+        if event.job_id not in self._jobs:
+            return
+        cron_name, shared_configs = self._jobs[event.job_id]
+        names = [cron_name, *shared_configs]
+        if event.code == EVENT_JOB_MISSED:
+            self.logger.warning(f"Run of '{cron_name}' scheduled at {event.scheduled_run_time} skipped, "
+                                f"missed by more than its misfire grace time")
+            for name in names:
+                self.metrics.inc('backup_skipped_runs_total', config=name, reason='misfire')
+            return
+        run_times = event.scheduled_run_times
+        coalesced = self.count_fire_times(cron_name, run_times[-1]) - len(run_times)
+        if coalesced > 0:
+            self.logger.warning(f"{coalesced} missed runs of '{cron_name}' coalesced into the run "
+                                f"scheduled at {run_times[-1]}")
+            for name in names:
+                self.metrics.inc('backup_skipped_runs_total', coalesced, config=name, reason='coalesced')
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            self.report_overrun(cron_name)
+            return
+        delay = (datetime.now(run_times[0].tzinfo) - run_times[0]).total_seconds()
+        grace = self.get_cron_config(cron_name).get("misfire_grace_time", 60) or None
+        for name in names:
+            self.metrics.set('backup_start_delay_seconds', delay, config=name)
+        # Runs later than the grace time are reported as missed when the executor skips them
+        if delay >= self.DELAY_TOLERANCE and (grace is None or delay <= grace):
+            self.report_delay(cron_name, delay, "the scheduler")
+
+    def count_fire_times(self, cron_name, fire_time):
+        """
+        Count the fire times of a job since its previous submission or skip, up to a fire time.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            fire_time (datetime): The latest fire time of the runs being submitted or skipped.
+
+        Returns:
+            int: The number of fire times, 1 for the first run of the job.
+        """
+        with self._lock:
+            previous, self._last_fire_times[cron_name] = self._last_fire_times.get(cron_name), fire_time
+        if previous is None:
+            return 1
+        trigger, count = self.get_trigger(cron_name), 0
+        while previous is not None and previous < fire_time:
+            previous = trigger.get_next_fire_time(previous, previous)
+            count += 1
+        return count
+
+    def report_overrun(self, cron_name):
+        """
+        Log and count a run of a cron configuration skipped because the previous runs are still going.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+        """
+        self.logger.warning(f"Run of '{cron_name}' skipped, the previous runs are still going")
+        for name in [cron_name, *self._jobs.get(self.get_job_id(cron_name), (cron_name, []))[1]]:
+            self.metrics.inc('backup_skipped_runs_total', config=name, reason='overrun')
+
+    def report_delay(self, cron_name, delay, cause):
+        """
+        Log and count a run of a cron configuration started late.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            delay (float): The delay in seconds.
+            cause (str): What delayed the run, used in the log message.
+        """
+        self.logger.warning(f"Run of '{cron_name}' delayed by {delay:.0f} seconds by {cause}")
+        for name in [cron_name, *self._jobs.get(self.get_job_id(cron_name), (cron_name, []))[1]]:
+            self.metrics.inc('backup_delayed_runs_total', config=name)
+
+    def run_scheduled_backup(self, cron_name, retention_max, concurrency=1, shared_configs=()):
+        """
+        Dispatch a scheduled run of a cron configuration to a thread of its own, without waiting for it.
+
+        At most 'max_instances' runs of the configuration go at the same time. A run firing
+        while they are all going is skipped if 'coalesce' is set, otherwise it is queued until
+        one of them ends, a single run being queued at a time and the next ones skipped.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            retention_max (int): The maximum number of backups to retain.
+            concurrency (int): The number of databases to back up at the same time.
+            shared_configs (list): The names of the cron configurations sharing the dumps.
 
-    def run_backup(self, cron_name, retention_max):
+        Returns:
+            Future: The future of the backup result of each database, keyed by database name
+                (see run_backup), None if the run is skipped.
+        """
+        slots = self._run_slots[cron_name]
+        with self._lock:
+            queued = not slots.acquire(blocking=False)
+            if queued:
+                if self.get_cron_config(cron_name).get("coalesce", True) or self._queued_runs.get(cron_name):
+                    self.report_overrun(cron_name)
+                    return None
+                self._queued_runs[cron_name] = 1
+
+        def run():
+            if queued:
+                start = time.monotonic()
+                slots.acquire()
+                with self._lock:
+                    self._queued_runs[cron_name] = 0
+                waited = time.monotonic() - start
+                if waited >= self.DELAY_TOLERANCE:
+                    self.report_delay(cron_name, waited, "the previous runs")
+            try:
+                return self.run_backup(cron_name, retention_max, concurrency, shared_configs)
+            finally:
+                slots.release()
+
+        return dispatch(run)
+
+    def run_backup(self, cron_name, retention_max, concurrency=1, shared_configs=()):
         """
         Execute the backup job for a specific cron configuration.
 
+        Databases are dumped by a pool of `concurrency` workers, or by the worker pool shared with
+        the other targets, `concurrency` of them at most (see get_pool_keys), longest first (see
+        plan_backup). Old backups are cleaned up only for the databases whose backup succeeded.
+        Each dump is also published into the cron configurations sharing the job.
+
+        If the configuration has load thresholds, the run is deferred while the server is
+        overloaded, at most for 'load_defer_max' seconds, and then throttled whenever the
+        server is overloaded (see create_load_governor).
+
         Args:
             cron_name (str): The name of the cron configuration.
             retention_max (int): The maximum number of backups to retain.
+            concurrency (int): The number of databases to back up at the same time.
+            shared_configs (list): The names of the cron configurations sharing the dumps.
+
+        Returns:
+            dict: The backup result of each database, keyed by database name.
         """
         self.logger.info(f"Running backup for cron configuration: {cron_name}")
+        results = {}
+        databases = []
+        error = None
+        start = time.time()
+        governor = self.create_load_governor(cron_name, concurrency, shared_configs)
         try:
-            databases = self.db_module.list_all_databases()
-            self.logger.info(f"Detected the folliwing databases: {databases}")
-            for db in databases:
-                backup_file = self.calculate_backup_file_path(cron_name, db)
-                success = self.db_module.backup_database(db, backup_file)
-                if success:
-                    self.cleanup_old_backups(cron_name, db, retention_max)
-                self.health = success
+            if governor:
+                self.defer_backup(cron_name, governor, shared_configs)
+                governor.start()
+            dump_options = self.get_dump_options(cron_name)
+            if dump_options.get("mode") == "physical":
+                databases = [self.CLUSTER_NAME]
+            else:
+                databases = self.db_module.list_all_databases()
+                self.logger.info(f"Detected the folliwing databases: {databases}")
+            skip_unchanged = bool(self.get_cron_config(cron_name).get("skip_unchanged"))
+            databases, sizes = self.plan_backup(cron_name, databases, concurrency, shared_configs)
+            with contextlib.ExitStack() as stack:
+                if self.pool:
+                    keys = self.get_pool_keys(cron_name)
+                    self.pool.limit(keys[-1], concurrency)
+                    submit = functools.partial(self.pool.submit, keys)
+                else:
+                    submit = stack.enter_context(ThreadPoolExecutor(max_workers=max(1, concurrency),
+                                                                    thread_name_prefix=f"backup-{cron_name}")).submit
+                futures = {submit(self.governed_backup, governor, cron_name, db, retention_max, shared_configs,
+                                  skip_unchanged, sizes.get(db), **dump_options): db
+                           for db in databases}
+                for future in as_completed(futures):
+                    db = futures[future]
+                    try:
+                        results[db] = future.result()
+                    except Exception as e:
+                        self.logger.error(f"Error during backup of database '{db}': {e}")
+                        results[db] = False
+                        for name in [cron_name, *shared_configs]:
+                            self.history.record(name, db, start, time.time(), 0, 'failed')
+            failed = [db for db, success in results.items() if not success]
+            if failed:
+                self.logger.error(f"Backup failed on '{cron_name}' for databases: {failed}")
         except Exception as e:
             self.logger.error(f"Error during backup: {e}")
-            self.health = False
+            error = str(e)
+        finally:
+            if governor:
+                governor.stop()
+        for name in [cron_name, *shared_configs]:
+            self.history.record_config_run(name, start, time.time(), databases, error)
+        return results
+
+    def get_pool_keys(self, cron_name=None):
+        """
+        Get the keys of the dumps of a cron configuration in the shared worker pool.
+
+        The dumps are capped by the pool per target, per host of the database server and per
+        run; the caps of the target and of the host are set by whoever builds the pool.
+
+        Args:
+            cron_name (str): The name of the cron configuration, None for the keys of the target and host only.
+
+        Returns:
+            list: The keys of the target, of the host and of the run, in this order.
+        """
+        target = self.db_module.target
+        keys = [f"target:{target}", f"host:{self.db_module.host}"]
+        return keys + [f"run:{target}/{cron_name}"] if cron_name else keys
+
+    def create_load_governor(self, cron_name, concurrency=1, shared_configs=()):
+        """
+        Create the load governor of a run of a cron configuration with load thresholds.
+
+        The server is overloaded when it has more than 'load_max_active' active sessions or a
+        replication lag above 'load_max_lag' seconds. While it is, only 'load_concurrency'
+        databases are dumped at the same time, and the dumps are rate limited to
+        'load_rate_limit_mb' MB per second. The load is sampled every 'load_check_interval'
+        seconds and exposed in the metrics.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            concurrency (int): The number of databases backed up at the same time.
+            shared_configs (list): The names of the cron configurations sharing the run.
+
+        Returns:
+            LoadGovernor: The governor, None if the configuration has no load threshold.
+        """
+        cron_config = self.get_cron_config(cron_name)
+        if cron_config.get("load_max_active") is None and cron_config.get("load_max_lag") is None:
+            return None
+        rate_limit = cron_config.get("load_rate_limit_mb")
+
+        def observe(load, overloaded):
+            for name in [cron_name, *shared_configs]:
+                if load and load.get('active') is not None:
+                    self.metrics.set('backup_server_active_sessions', load['active'], config=name)
+                if load and load.get('lag') is not None:
+                    self.metrics.set('backup_server_replication_lag_seconds', load['lag'], config=name)
+                self.metrics.set('backup_load_throttled', int(overloaded), config=name)
+
+        return LoadGovernor(self.db_module.get_server_load, cron_config.get("load_max_active"),
+                            cron_config.get("load_max_lag"), concurrency, cron_config.get("load_concurrency", 1),
+                            rate_limit * 1024 * 1024 if rate_limit else None,
+                            cron_config.get("load_check_interval", 30), observe)
+
+    def defer_backup(self, cron_name, governor, shared_configs=()):
+        """
+        Defer a run while the server is overloaded, at most for the 'load_defer_max' seconds of
+        the cron configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            governor (LoadGovernor): The load governor of the run.
+            shared_configs (list): The names of the cron configurations sharing the run.
+
+        Returns:
+            float: The time the run was deferred in seconds.
+        """
+        waited = governor.wait_until_calm(self.get_cron_config(cron_name).get("load_defer_max", 0))
+        for name in [cron_name, *shared_configs]:
+            self.metrics.set('backup_deferred_seconds', waited, config=name)
+            if governor.overloaded:
+                self.metrics.inc('backup_throttled_runs_total', config=name)
+        if governor.overloaded:
+            self.logger.warning(f"Server still overloaded after deferring '{cron_name}' for {waited:.0f} seconds, "
+                                f"running it throttled")
+        elif waited >= 1:
+            self.logger.info(f"Run of '{cron_name}' deferred for {waited:.0f} seconds by the server load")
+        return waited
+
+    def governed_backup(self, governor, cron_name, db_name, *args, **kwargs):
+        """
+        Back up a single database in a slot of the load governor of the run, limiting the rate
+        and the priority of its dump.
+
+        The dump output takes its tokens from the global rate limit of the scheduler, from a
+        bucket of 'rate_limit_mb' MB per second of its own, and from the governor bucket while
+        the server is overloaded. The dump and compression processes run with the 'nice',
+        'ionice_class' and 'ionice_level' priority of the cron configuration.
+
+        Args:
+            governor (LoadGovernor): The load governor of the run, None to back up the database without slot.
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            *args: The other arguments of backup_database.
+            **kwargs: The other keyword arguments of backup_database.
+
+        Returns:
+            bool: True if the backup was successful or skipped, False otherwise.
+        """
+        cron_config = self.get_cron_config(cron_name)
+        job_name = self.db_module.job_name("backup", db_name)
+        rate_limit = cron_config.get("rate_limit_mb")
+        buckets = [self.rate_limit] if self.rate_limit.rate else []
+        if rate_limit:
+            buckets.append(TokenBucket(rate_limit * 1024 * 1024))
+        if governor:
+            buckets.append(governor.bucket)
+        runner = default_runner()
+        with governor.slot() if governor else contextlib.nullcontext():
+            if buckets:
+                runner.throttle(job_name, *buckets)
+            runner.prioritize(job_name, priority_command(cron_config.get("nice"), cron_config.get("ionice_class"),
+                                                         cron_config.get("ionice_level")))
+            try:
+                return self.backup_database(cron_name, db_name, *args, **kwargs)
+            finally:
+                if buckets:
+                    runner.unthrottle(job_name, *buckets)
+                runner.prioritize(job_name, None)
+
+    def plan_backup(self, cron_name, databases, concurrency=1, shared_configs=()):
+        """
+        Order the databases of a run longest processing time first and predict its duration.
+
+        The duration of each dump is estimated from the current size of the database and the
+        durations of its previous dumps recorded in the catalog (see estimate_durations). Dumping
+        the longest databases first keeps a long dump from starting last while the other workers
+        are idle. The run is predicted with `concurrency` workers, or fewer if the caps of the
+        target and of the host in the shared worker pool are lower. A warning is logged when the
+        predicted duration of the run goes past the next firing of the cron configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            databases (list): The databases to back up.
+            concurrency (int): The number of databases backed up at the same time.
+            shared_configs (list): The names of the cron configurations sharing the dumps.
+
+        Returns:
+            tuple: The databases in dump order, and the size in bytes of each database whose size is known.
+        """
+        try:
+            sizes = self.db_module.get_database_sizes()
+        except Exception as e:
+            self.logger.warning(f"Cannot read the database sizes: {e}")
+            sizes = {}
+        if databases == [self.CLUSTER_NAME]:
+            sizes = {self.CLUSTER_NAME: sum(sizes.values())} if sizes else {}
+        sizes = {db: size for db, size in sizes.items() if db in databases}
+        for name in [cron_name, *shared_configs]:
+            for db, size in sizes.items():
+                self.metrics.set('backup_database_size_bytes', size, config=name, database=db)
+        estimates = estimate_durations(databases, sizes, self.catalog.durations(cron_name))
+        ordered = lpt_order(databases, estimates, sizes)
+        self.logger.info(f"Dump order on '{cron_name}': {ordered}")
+        if not databases or any(estimates[db] is None for db in databases):
+            self.logger.info(f"Cannot predict the duration of '{cron_name}' without the size or the history "
+                             f"of every database")
+            return ordered, sizes
+        workers = min(concurrency, self.pool.capacity(self.get_pool_keys())) if self.pool else concurrency
+        predicted = predict_makespan([estimates[db] for db in ordered], workers)
+        time_left = self.get_time_until_next_run(cron_name)
+        overrun = max(0.0, predicted - time_left) if time_left is not None else 0.0
+        for name in [cron_name, *shared_configs]:
+            self.metrics.set('backup_predicted_duration_seconds', predicted, config=name)
+            self.metrics.set('backup_predicted_overrun_seconds', overrun, config=name)
+        if overrun:
+            self.logger.warning(f"Run of '{cron_name}' predicted to take {predicted:.0f} seconds, "
+                                f"{overrun:.0f} seconds past its next firing")
+        else:
+            self.logger.info(f"Run of '{cron_name}' predicted to take {predicted:.0f} seconds")
+        return ordered, sizes
+
+    def get_cron_config(self, cron_name):
+        """
+        Get a cron configuration by name.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+
+        Returns:
+            dict: The cron configuration, an empty dictionary if not found.
+        """
+        for cron_config in self.cron_configs:
+            if cron_config.get("name") == cron_name:
+                return cron_config
+        return {}
+
+    def get_dump_options(self, cron_name):
+        """
+        Get the dump options of a cron configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+
+        Returns:
+            dict: The dump options to forward to the database module.
+        """
+        cron_config = self.get_cron_config(cron_name)
+        return {key: cron_config[key] for key in self.DUMP_OPTION_KEYS if key in cron_config}
+
+    def backup_database(self, cron_name, db_name, retention_max, shared_configs=(), skip_unchanged=False,
+                        source_size=None, **dump_options):
+        """
+        Back up a single database, record it in the catalog and clean up its old backups if
+        the backup succeeded.
+
+        With `skip_unchanged`, a database whose change token matches the one of its latest
+        backup is not dumped again and is recorded as unchanged since that backup.
+
+        With the 'delta' dump option, the backup is stored as a delta against the latest full
+        backup of the database (see backup_delta), and a full backup is taken instead after
+        'delta_full_every' deltas.
+
+        With the 'physical' mode, a base backup of the whole server is taken instead of a dump,
+        and the WAL archive is pruned up to the oldest base backup left by the retention.
+
+        With the 'incremental' dump option, the tables of a directory format dump unchanged
+        since the latest backup of the database are reused from it instead of being dumped again.
+
+        With the 'binlog' dump option, the dump records its binary log coordinates, and the
+        binary log archive is pruned up to the oldest dump left by the retention.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            retention_max (int): The maximum number of backups to retain.
+            shared_configs (list): The names of the cron configurations the backup is published into.
+            skip_unchanged (bool): Whether to skip the backup of unchanged databases.
+            source_size (int): The size of the database in bytes, recorded with the dump duration if known.
+            **dump_options: The dump options forwarded to the database module. With the 'chunks'
+                storage, the module is given the chunk store of the catalog instead. The 'delta'
+                and 'delta_full_every' options are handled by the scheduler, the 'mode' option
+                selects between dumps and base backups.
+
+        Returns:
+            bool: True if the backup was successful or skipped, False otherwise.
+        """
+        start = time.time()
+        backup_file = self.calculate_backup_file_path(cron_name, db_name)
+        change_token = self.db_module.get_change_token(db_name) if skip_unchanged else None
+        if change_token:
+            previous = self.catalog.latest(cron_name, db_name)
+            if previous and previous['change_token'] == change_token:
+                self.logger.info(f"Database '{db_name}' unchanged since {self.catalog.resolve(previous)}, "
+                                 f"skipping backup on '{cron_name}'")
+                self.catalog.record(cron_name, backup_file, status='unchanged', change_token=change_token,
+                                    unchanged_since=previous)
+                for shared_name in shared_configs:
+                    self.skip_unchanged_backup(previous, shared_name, db_name, change_token)
+                for name in [cron_name, *shared_configs]:
+                    self.history.record(name, db_name, start, time.time(), 0, 'unchanged')
+                    self.metrics.inc('backup_runs_total', config=name, database=db_name, status='unchanged')
+                    self.metrics.set('backup_last_success_timestamp_seconds', time.time(),
+                                     config=name, database=db_name)
+                return True
+
+        if dump_options.pop("storage", "files") == "chunks":
+            dump_options["chunk_store"] = self.catalog.chunk_store
+        physical = dump_options.pop("mode", "logical") == "physical"
+        delta = dump_options.pop("delta", False) and not physical
+        full_every = dump_options.pop("delta_full_every", 24)
+        base = self.catalog.delta_base(cron_name, db_name, full_every) if delta else None
+        previous = self.catalog.latest(cron_name, db_name) if delta and not base else None
+        if dump_options.get("incremental") and not physical:
+            previous_dump = self.catalog.latest(cron_name, db_name)
+            previous_path = self.catalog.resolve(previous_dump) if previous_dump else None
+            if previous_path and previous_dump['format'] == 'directory' and previous_path.exists():
+                dump_options["previous_backup"] = previous_path
+        stats = {}
+        dump_start = time.monotonic()
+        if physical:
+            success = self.db_module.backup_cluster(backup_file, stats=stats, **dump_options)
+        elif base:
+            base_entry, deltas = base
+            success = self.backup_delta(db_name, backup_file, self.catalog.resolve(base_entry), deltas + 1,
+                                        stats=stats, **dump_options)
+        else:
+            success = self.db_module.backup_database(db_name, backup_file, stats=stats, **dump_options)
+        duration = time.monotonic() - dump_start
+        entry = self.catalog.record(cron_name, backup_file, status='success' if success else 'failed',
+                                    change_token=change_token, duration=duration, source_size=source_size)
+        for name in [cron_name, *shared_configs]:
+            self.history.record(name, db_name, start, time.time(), entry['size'], entry['status'])
+            self.metrics.inc('backup_runs_total', config=name, database=db_name, status=entry['status'])
+        if success:
+            if previous:
+                # Deltas are only made against the new full backup from now on
+                drop_base_cache(self.backup_dir / (previous['base'] or previous['path']))
+            for name in [cron_name, *shared_configs]:
+                self.observe_backup(name, db_name, entry['size'], duration, stats.get('dump_bytes'))
+            self.cleanup_old_backups(cron_name, db_name, retention_max)
+            for shared_name in shared_configs:
+                self.publish_backup(backup_file, shared_name, db_name, change_token)
+            if physical:
+                self.catalog.sync_wal(self.wal_dir)
+                self.catalog.prune_wal(self.wal_dir)
+            if dump_options.get("binlog"):
+                self.catalog.prune_binlogs(self.binlog_dir)
+        return success
+
+    def backup_delta(self, db_name, backup_file, base_file, sequence, stats=None, compression=None,
+                     compression_level=None, compression_threads=0, timeout=None, chunk_store=None, **dump_options):
+        """
+        Back up a single database as a zstd delta against a full backup.
+
+        The dump is staged uncompressed beside the backup file, since zstd needs the size of
+        the file it encodes, then encoded against the uncompressed content of the base and
+        deleted. Only the delta and its sidecar files are kept.
+
+        A full backup is taken instead when the base or the dump is too large for a zstd delta
+        (see DELTA_MAX_SIZE) or the delta cannot be encoded, and becomes the base of the next deltas.
+
+        Args:
+            db_name (str): The name of the database.
+            backup_file (Path): The path of the delta backup.
+            base_file (Path): The full backup the delta is made against.
+            sequence (int): The number of deltas made against the base up to this one.
+            stats (dict): If given, filled with the 'dump_bytes' produced by the dump tool when known.
+            compression (str): The compression codec of the configuration, its level is used for the delta if 'zstd'.
+            compression_level (int): The compression level, the zstd default if None.
+            compression_threads (int): The number of compression threads, 0 for one per core.
+            timeout (float): The maximum duration of the dump and of the encoding in seconds, None for no limit.
+            chunk_store (ChunkStore): The chunk store of a full backup taken instead of the delta.
+            **dump_options: The other dump options forwarded to the database module.
+
+        Returns:
+            bool: True if the backup was successful, False otherwise.
+        """
+        def backup_full(reason):
+            self.logger.warning(f"{reason}, backing up database '{db_name}' in full instead of as a delta")
+            # The next deltas are made against the new full backup
+            drop_base_cache(base_file)
+            return self.db_module.backup_database(db_name, backup_file, stats=stats, compression=compression,
+                                                  compression_level=compression_level,
+                                                  compression_threads=compression_threads, timeout=timeout,
+                                                  chunk_store=chunk_store, **dump_options)
+
+        if not delta_fits(base_file):
+            return backup_full(f"Base {base_file} is too large for a zstd delta")
+        staging_file = backup_file.with_name(backup_file.name + ".tmp")
+        self.logger.info(f"Backing up database '{db_name}' as a delta against {base_file}")
+        try:
+            if not self.db_module.backup_database(db_name, staging_file, compression=None,
+                                                  compression_threads=compression_threads, timeout=timeout,
+                                                  internal_compression=False, stats=stats, **dump_options):
+                return False
+            try:
+                size = encode_delta(staging_file, base_file, backup_file, sequence,
+                                    compression_level if compression == "zstd" else None, compression_threads,
+                                    timeout=timeout, name=self.db_module.job_name("backup", db_name))
+            except (subprocess.CalledProcessError, ValueError) as e:
+                backup_file.unlink(missing_ok=True)
+                delta_path(backup_file).unlink(missing_ok=True)
+                staging_file.unlink(missing_ok=True)
+                index_path(staging_file).unlink(missing_ok=True)
+                return backup_full(f"Delta of database '{db_name}' not encoded: {e}")
+            if index_path(staging_file).exists():
+                os.replace(index_path(staging_file), index_path(backup_file))
+            self.logger.info(f"Delta backup {backup_file} written: {size} bytes for {staging_file.stat().st_size} "
+                             f"dumped bytes")
+            return True
+        except Exception as e:
+            self.logger.error(f"Error storing delta backup of database '{db_name}': {e}")
+            backup_file.unlink(missing_ok=True)
+            delta_path(backup_file).unlink(missing_ok=True)
+            return False
+        finally:
+            staging_file.unlink(missing_ok=True)
+            index_path(staging_file).unlink(missing_ok=True)
+
+    def observe_backup(self, cron_name, db_name, bytes_written, duration, dump_bytes=None):
+        """
+        Update the metrics of a successful backup.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            bytes_written (int): The size of the backup on disk.
+            duration (float): The duration of the dump in seconds.
+            dump_bytes (int): The uncompressed bytes produced by the dump tool, if known.
+        """
+        labels = {'config': cron_name, 'database': db_name}
+        self.metrics.set('backup_dump_duration_seconds', duration, **labels)
+        self.metrics.set('backup_bytes_written', bytes_written, **labels)
+        self.metrics.set('backup_throughput_bytes_per_second', (dump_bytes or bytes_written) / max(duration, 1e-6),
+                         **labels)
+        if dump_bytes is not None:
+            self.metrics.set('backup_dump_bytes', dump_bytes, **labels)
+            if bytes_written:
+                self.metrics.set('backup_compression_ratio', dump_bytes / bytes_written, **labels)
+        self.metrics.set('backup_last_success_timestamp_seconds', time.time(), **labels)
+
+    def skip_unchanged_backup(self, previous, cron_name, db_name, change_token):
+        """
+        Record an unchanged database in a cron configuration sharing the backups of another one.
+
+        If the configuration has no backup matching the change token, the previous backup of
+        the other configuration is published into it instead.
+
+        Args:
+            previous (dict): The catalog entry of the latest backup of the database.
+            cron_name (str): The name of the cron configuration.
+            db_name (str): The name of the database.
+            change_token (str): The change token of the database.
+        """
+        shared_previous = self.catalog.latest(cron_name, db_name)
+        if shared_previous and shared_previous['change_token'] == change_token:
+            backup_file = self.calculate_backup_file_path(cron_name, db_name)
+            self.catalog.record(cron_name, backup_file, status='unchanged', change_token=change_token,
+                                unchanged_since=shared_previous)
+        else:
+            self.publish_backup(self.catalog.resolve(previous), cron_name, db_name, change_token)
+
+    def publish_backup(self, backup_file, cron_name, db_name, change_token=None):
+        """
+        Publish a backup into the tree of another cron configuration and apply its retention.
+
+        The backup is hardlinked, or reflinked/copied when hardlinks are not possible, so
+        the published backup does not use additional disk space and is deleted independently.
+        Its sidecar index is copied along, and a delta backup keeps referencing the base it
+        was made against.
+
+        Args:
+            backup_file (Path): The backup to publish.
+            cron_name (str): The name of the cron configuration to publish into.
+            db_name (str): The name of the database.
+            change_token (str): The change token of the database when it was backed up.
+        """
+        published_file = self.calculate_backup_file_path(cron_name, db_name).with_name(backup_file.name)
+        self.logger.info(f"Publishing backup {backup_file} to {published_file}")
+        try:
+            if backup_file.is_dir():
+                shutil.copytree(backup_file, published_file, copy_function=os.link)
+            else:
+                os.link(backup_file, published_file)
+        except OSError as e:
+            self.logger.warning(f"Cannot hardlink {backup_file} to {published_file}, copying it instead: {e}")
+            if published_file.is_dir():
+                shutil.rmtree(published_file)
+            subprocess.run(["cp", "-a", "--reflink=auto", str(backup_file), str(published_file)], check=True)
+        if index_path(backup_file).exists():
+            shutil.copyfile(index_path(backup_file), index_path(published_file))
+        delta = read_delta(backup_file)
+        if delta:
+            write_delta(published_file, resolve_base(backup_file, delta), delta['sequence'])
+        self.catalog.record(cron_name, published_file, change_token=change_token)
+        self.cleanup_old_backups(cron_name, db_name, self.get_cron_config(cron_name).get("retention_max", 90))
 
     def calculate_backup_file_path(self, cron_name, db_name):
         """
@@ -81,33 +913,127 @@ class Scheduler:
         now = datetime.now()
         backup_path = self.backup_dir / cron_name / str(now.year) / str(now.month) / str(now.day)
         backup_path.mkdir(parents=True, exist_ok=True)
-        backup_file = backup_path / f"{db_name}.{now.strftime('%Y%m%d%H%M%S')}.backup"
+        backup_file = backup_path / f"{db_name}.{now.strftime(TIMESTAMP_FORMAT)}.backup"
         self.logger.info(f"Calculated backup file path: {backup_file}")
         return backup_file
 
     def cleanup_old_backups(self, cron_name, db_name, retention_max):
         """
-        Clean up old backups exceeding the retention limit.
+        Clean up old backups exceeding the retention limit, and failed backups.
+
+        Backups in directory format are removed as a whole.
 
         Args:
             cron_name (str): The name of the cron configuration.
             db_name (str): The name of the database.
             retention_max (int): The maximum number of backups to retain.
         """
-        db_backup_dir = self.backup_dir / cron_name
-        all_backups = list(db_backup_dir.glob(f'**/{db_name}.*.backup'))
-        all_backups.sort(key=os.path.getmtime, reverse=True)
         self.logger.info(f"Cleaning up old backups on '{cron_name}' for '{db_name}' db, keeping the latest {retention_max} backups")
-        if len(all_backups) > retention_max:
-            for old_backup in all_backups[retention_max:]:
-                self.logger.info(f"Deleting old backup: {old_backup}")
-                old_backup.unlink()
+        start = time.monotonic()
+        for old_backup in self.catalog.expired(cron_name, db_name, retention_max):
+            self.logger.info(f"Deleting {old_backup['status']} backup: {self.catalog.resolve(old_backup)}")
+            self.catalog.remove(old_backup)
+        self.metrics.set('backup_cleanup_duration_seconds', time.monotonic() - start, config=cron_name, database=db_name)
+        self.metrics.set('backup_artifacts', self.catalog.count(cron_name, db_name), config=cron_name, database=db_name)
+
+    def cancel_backups(self, db_name=None):
+        """
+        Cancel the running dumps, killing the dump tools. Cancelled backups are recorded as failed.
+
+        Args:
+            db_name (str): The database whose dump is cancelled, None to cancel all dumps.
+
+        Returns:
+            int: The number of dumps cancelled.
+        """
+        if db_name is None:
+            prefix = self.db_module.job_name("backup", "")
+            return sum(default_runner().cancel(name) for name in set(default_runner().running())
+                       if name and name.startswith(prefix))
+        return default_runner().cancel(self.db_module.job_name("backup", db_name))
+
+    def count_missed_runs(self, cron_name, since, limit):
+        """
+        Count the fire times of a cron configuration since a time, up to now.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+            since (float): The time from which the fire times are counted, as a POSIX timestamp.
+            limit (int): Stop counting at this number of fire times.
+
+        Returns:
+            int: The number of fire times, at most 'limit', None if the configuration is unknown.
+        """
+        trigger = self.get_trigger(cron_name)
+        if trigger is None:
+            return None
+        now = datetime.now(trigger.timezone)
+        fire_time, count = datetime.fromtimestamp(since, trigger.timezone), 0
+        while count < limit:
+            fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+            if fire_time is None or fire_time > now:
+                break
+            count += 1
+        return count
+
+    def get_time_until_next_run(self, cron_name):
+        """
+        Get the time left until the next trigger of a cron configuration.
+
+        Args:
+            cron_name (str): The name of the cron configuration.
+
+        Returns:
+            float: The time left in seconds, None if the configuration is unknown.
+        """
+        trigger = self.get_trigger(cron_name)
+        if trigger is None:
+            return None
+        now = datetime.now(trigger.timezone)
+        return (trigger.get_next_fire_time(now, now) - now).total_seconds()
+
+    def get_health_problems(self):
+        """
+        Evaluate the health policies against the run history.
+
+        A configuration is unhealthy if its latest run could not list the databases, and a
+        database is unhealthy if its latest backup failed or if `health_max_intervals` fire
+        times of its cron configuration passed since its latest successful backup, so crons
+        with uneven intervals (e.g. weekdays only) are judged by the runs they actually missed.
+
+        Returns:
+            list: The descriptions of the health problems, empty if healthy.
+        """
+        problems = []
+        for cron_config in self.cron_configs or [{"name": name} for name in self.history.snapshot()]:
+            cron_name = cron_config["name"]
+            config_run = self.history.config_run(cron_name)
+            if config_run is None:
+                continue
+            if config_run['error']:
+                problems.append(f"'{cron_name}' run failed: {config_run['error']}")
+            max_missed = cron_config.get("health_max_intervals", 2)
+            for db_name in config_run['databases']:
+                latest = self.history.latest(cron_name, db_name)
+                if latest is None:
+                    continue
+                if latest['status'] == 'failed':
+                    problems.append(f"'{cron_name}' backup of '{db_name}' failed")
+                last_success = self.history.last_success(cron_name, db_name)
+                if last_success is None:
+                    if self.get_trigger(cron_name) is not None:
+                        problems.append(f"'{cron_name}' backup of '{db_name}' never succeeded")
+                    continue
+                missed = self.count_missed_runs(cron_name, last_success['end'], max_missed)
+                if missed is not None and missed >= max_missed:
+                    problems.append(f"'{cron_name}' backup of '{db_name}' missed {missed} scheduled runs")
+        return problems
 
     def get_health(self):
         """
-        Get the current health state of the last backup operation.
+        Get the current health state of the backups.
 
         Returns:
             bool: The health state.
         """
-        return self.health
+        return not self.get_health_problems()
@@ -0,0 +1,80 @@
+from typing import Iterable, Optional
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting a byte rate.
+
+    Tokens are added at `rate` bytes per second up to `burst` bytes, and every block taken
+    from the bucket consumes its size. Consumers taking more tokens than available go into
+    debt and are told how long to wait, so concurrent consumers share the rate.
+
+    Attributes:
+        burst (float): The maximum number of tokens, in bytes.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate (float): The rate in bytes per second, None for no limit.
+            burst (float): The maximum number of tokens in bytes, one second of rate if None.
+        """
+        self._lock = threading.Lock()
+        self._rate = rate
+        self.burst = burst
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+
+    def _capacity(self) -> float:
+        """Maximum number of tokens at the current rate."""
+        return self.burst if self.burst is not None else (self._rate or 0)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """The rate in bytes per second, None for no limit."""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: Optional[float]) -> None:
+        with self._lock:
+            if rate != self._rate:
+                self._rate = rate
+                self._tokens = min(self._tokens, self._capacity())
+                self._updated = time.monotonic()
+
+    def reserve(self, size: int) -> float:
+        """
+        Takes tokens from the bucket.
+
+        Args:
+            size (int): The number of bytes.
+
+        Returns:
+            float: The time in seconds the caller must wait before going on, 0 if not limited.
+        """
+        with self._lock:
+            if not self._rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= size
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+
+def reserve_all(buckets: Iterable[TokenBucket], size: int) -> float:
+    """
+    Takes tokens from several buckets limiting the same stream.
+
+    Args:
+        buckets (Iterable[TokenBucket]): The buckets.
+        size (int): The number of bytes.
+
+    Returns:
+        float: The time in seconds to wait before going on, the longest wait of the buckets.
+    """
+    return max((bucket.reserve(size) for bucket in buckets), default=0.0)
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+
+from apscheduler.triggers.base import BaseTrigger
+
+
+def jitter_offset(instance_id: str, cron_name: str, jitter: float) -> float:
+    """
+    Computes the start offset of the runs of a cron configuration on an instance.
+
+    The offset is derived from a hash of the instance and of the configuration, so every
+    instance keeps the same offset across restarts while the instances sharing a database
+    server are spread over the jitter window.
+
+    Args:
+        instance_id (str): The identifier of the instance, e.g. its host name.
+        cron_name (str): The name of the cron configuration.
+        jitter (float): The width of the jitter window in seconds.
+
+    Returns:
+        float: The offset in seconds, from 0 included to jitter excluded, with millisecond resolution.
+    """
+    if not jitter or jitter <= 0:
+        return 0.0
+    digest = hashlib.sha256(f"{instance_id}:{cron_name}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % int(jitter * 1000) / 1000
+
+
+class OffsetTrigger(BaseTrigger):
+    """
+    Trigger firing a fixed offset after each fire time of another trigger.
+
+    Attributes:
+        trigger (BaseTrigger): The shifted trigger.
+        offset (timedelta): The offset added to its fire times.
+        timezone (tzinfo): The time zone of the shifted trigger, None if it has none.
+    """
+
+    def __init__(self, trigger: BaseTrigger, offset: float):
+        """
+        Initialize the trigger.
+
+        Args:
+            trigger (BaseTrigger): The shifted trigger.
+            offset (float): The offset in seconds.
+        """
+        self.trigger = trigger
+        self.offset = timedelta(seconds=offset)
+        self.timezone = getattr(trigger, 'timezone', None)
+
+    def get_next_fire_time(self, previous_fire_time: Optional[datetime], now: datetime) -> Optional[datetime]:
+        """
+        Computes the next fire time of the shifted trigger, shifted by the offset.
+
+        Args:
+            previous_fire_time (datetime): The previous fire time, None if the trigger never fired.
+            now (datetime): The current time.
+
+        Returns:
+            Optional[datetime]: The next fire time, None if the shifted trigger never fires again.
+        """
+        previous = previous_fire_time - self.offset if previous_fire_time else None
+        fire_time = self.trigger.get_next_fire_time(previous, now - self.offset)
+        return fire_time + self.offset if fire_time else None
+
+    def __str__(self):
+        return f"{self.trigger} + {self.offset.total_seconds():g}s"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({self.trigger!r}, offset={self.offset.total_seconds():g})>"
@@ -0,0 +1,141 @@
+"""
+Benchmark of the restore throughput of each dump profile.
+
+The benchmark fills a scratch database with a table of generated rows, backs it up with
+each dump profile and measures how many rows per second are restored from each backup.
+It connects to the database server configured by the usual environment variables
+(DB_TYPE, DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_MAINTENANCE_NAME):
+
+    python benchmarks/dump_profiles.py --rows 1000000
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+# insert root directory into python module search path
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from app.config import Config
+
+BENCHMARK_DB = 'nards_benchmark_profiles'
+PROFILES = ('copy', 'inserts', 'schema-only')
+
+
+def create_module():
+    """Create the database module configured by the environment."""
+    if Config.DB_TYPE == 'mysql':
+        from app.modules.mysql_module import MySQLModule as DatabaseModule
+    elif Config.DB_TYPE == 'postgis':
+        from app.modules.postgis_module import PostGISModule as DatabaseModule
+    else:
+        from app.modules.postgres_module import PostgresModule as DatabaseModule
+    return DatabaseModule(Config.DB_HOST, Config.DB_PORT, Config.DB_USER, Config.DB_PASSWORD,
+                          Config.DB_MAINTENANCE_NAME)
+
+
+def connect(database):
+    """Open a connection to the given database of the configured server."""
+    if Config.DB_TYPE == 'mysql':
+        import mysql.connector
+        return mysql.connector.connect(host=Config.DB_HOST, port=Config.DB_PORT, user=Config.DB_USER,
+                                       password=Config.DB_PASSWORD, database=database)
+    import psycopg2
+    connection = psycopg2.connect(host=Config.DB_HOST, port=Config.DB_PORT, user=Config.DB_USER,
+                                  password=Config.DB_PASSWORD, dbname=database)
+    connection.autocommit = True
+    return connection
+
+
+def create_benchmark_database(rows):
+    """Create the scratch database with a table of `rows` generated rows."""
+    connection = connect(Config.DB_MAINTENANCE_NAME)
+    cursor = connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {BENCHMARK_DB}")
+    cursor.execute(f"CREATE DATABASE {BENCHMARK_DB}")
+    cursor.close()
+    connection.close()
+
+    connection = connect(BENCHMARK_DB)
+    cursor = connection.cursor()
+    if Config.DB_TYPE == 'mysql':
+        cursor.execute("CREATE TABLE bench (id INT PRIMARY KEY, data VARCHAR(255) NOT NULL, amount DOUBLE)")
+        cursor.execute("SET SESSION cte_max_recursion_depth = %s", (rows + 1,))
+        cursor.execute("INSERT INTO bench (id, data, amount) "
+                       "WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s) "
+                       "SELECT n, MD5(n), n * 0.5 FROM seq", (rows,))
+        connection.commit()
+    else:
+        cursor.execute("CREATE TABLE bench (id INT PRIMARY KEY, data VARCHAR(255) NOT NULL, amount DOUBLE PRECISION)")
+        cursor.execute("INSERT INTO bench (id, data, amount) "
+                       "SELECT n, md5(n::text), n * 0.5 FROM generate_series(1, %s) AS n", (rows,))
+    cursor.close()
+    connection.close()
+
+
+def count_rows():
+    """Count the rows of the benchmark table, 0 if the table is missing or empty."""
+    connection = connect(BENCHMARK_DB)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM bench")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def backup_size(path):
+    """Size in bytes of a backup file or directory."""
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size
+
+
+@click.command()
+@click.option("--rows", default=200000, show_default=True, help="Number of rows of the benchmark table.")
+def main(rows):
+    """Back up and restore a generated table with each dump profile and report the restore throughput."""
+    module = create_module()
+    click.echo(f"Creating {BENCHMARK_DB} with {rows} rows on {Config.DB_TYPE} server {Config.DB_HOST}")
+    create_benchmark_database(rows)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in PROFILES:
+            backup_file = Path(tmp_dir) / f"{BENCHMARK_DB}.{profile}.backup"
+
+            start = time.perf_counter()
+            if not module.backup_database(BENCHMARK_DB, backup_file, dump_profile=profile):
+                raise click.ClickException(f"Backup failed with profile '{profile}'")
+            backup_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if not module.restore_database(BENCHMARK_DB, backup_file):
+                raise click.ClickException(f"Restore failed with profile '{profile}'")
+            restore_seconds = time.perf_counter() - start
+
+            restored_rows = count_rows()
+            results.append((profile, backup_size(backup_file), backup_seconds, restore_seconds, restored_rows))
+
+            # Put back the full dataset for the next profile
+            create_benchmark_database(rows)
+
+    click.echo(f"{'profile':<12} {'size (MB)':>10} {'dump (s)':>10} {'restore (s)':>12} {'rows':>10} {'rows/s':>12}")
+    for profile, size, backup_seconds, restore_seconds, restored_rows in results:
+        rows_per_second = restored_rows / restore_seconds if restore_seconds else 0
+        click.echo(f"{profile:<12} {size / 1024 / 1024:>10.1f} {backup_seconds:>10.2f} {restore_seconds:>12.2f} "
+                   f"{restored_rows:>10} {rows_per_second:>12.0f}")
+
+    connection = connect(Config.DB_MAINTENANCE_NAME)
+    cursor = connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {BENCHMARK_DB}")
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import random
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.catalog import Catalog
+from app.chunkstore import ChunkStore, ChunkWriter, RecipeReader, find_boundary, is_recipe, read_recipe
+from app.compression import read_stages, stream_to_file
+from app.process import default_runner
+
+
+def make_dump(rows, seed=1):
+    generator = random.Random(seed)
+    return b''.join(f"INSERT INTO t VALUES ({i}, '{generator.getrandbits(128):032x}');\n".encode()
+                    for i in range(rows))
+
+
+def split(data):
+    chunks = []
+    while data:
+        cut = find_boundary(data) or len(data)
+        chunks.append(data[:cut])
+        data = data[cut:]
+    return chunks
+
+
+def test_boundaries_realign_after_insertion():
+    dump = make_dump(100000)
+    changed = b"INSERT INTO t VALUES (-1, 'new row');\n" + dump
+
+    original, shifted = split(dump), split(changed)
+
+    assert len(original) > 3
+    assert b''.join(shifted) == changed
+    # Only the first chunk differs
+    assert set(original[1:]) <= set(shifted)
+
+
+def test_small_writes_cut_the_same_chunks(tmp_path):
+    dump = make_dump(100000)
+    writer = ChunkWriter(ChunkStore(tmp_path / ".chunks"), tmp_path / "db.backup")
+    for offset in range(0, len(dump), 1000):
+        writer.write(dump[offset:offset + 1000])
+
+    assert [length for _, length in writer.close()['chunks']] == [len(chunk) for chunk in split(dump)]
+
+
+def test_pending_chunks_survive_the_release_of_other_recipes(tmp_path):
+    store = ChunkStore(tmp_path / ".chunks")
+    digest, _ = store.put(b"shared chunk")
+    store.reference(tmp_path / "old.backup", [digest])
+
+    store.release(tmp_path / "old.backup")
+    assert store.chunk_path(digest).exists()
+    assert store.settle([digest], referenced=False) == 1
+    assert not store.chunk_path(digest).exists()
+
+
+def test_chunked_backups_share_chunks(tmp_path):
+    catalog = Catalog(tmp_path)
+    day = tmp_path / "hourly" / "2026" / "10" / "18"
+    day.mkdir(parents=True)
+    first, second = day / "db.20261018100000.backup", day / "db.20261018110000.backup"
+    source = tmp_path / "dump.sql"
+    dump = make_dump(100000)
+
+    source.write_bytes(dump)
+    assert stream_to_file(["cat", str(source)], first, compression="zstd", chunk_store=catalog.chunk_store) == len(dump)
+    source.write_bytes(dump + b"INSERT INTO t VALUES (-1, 'new row');\n")
+    stream_to_file(["cat", str(source)], second, compression="zstd", chunk_store=catalog.chunk_store)
+    first_entry, second_entry = catalog.record("hourly", first), catalog.record("hourly", second)
+
+    assert is_recipe(first) and first_entry['compression'] == 'chunks'
+    first_chunks = {digest for digest, _ in read_recipe(first)['chunks']}
+    second_chunks = {digest for digest, _ in read_recipe(second)['chunks']}
+    assert len(second_chunks - first_chunks) == 1
+    assert read_recipe(second)['new_bytes'] < read_recipe(first)['new_bytes']
+    assert RecipeReader(second).read() == source.read_bytes()
+    stages, stdin = read_stages(first)
+    default_runner().run(stages + [["cat"]], stdin=stdin, stdout=tmp_path / "restored.sql")
+    assert (tmp_path / "restored.sql").read_bytes() == dump
+
+    catalog.remove(first_entry)
+    assert all(catalog.chunk_store.chunk_path(digest).exists() for digest in second_chunks)
+    assert not any(catalog.chunk_store.chunk_path(digest).exists() for digest in first_chunks - second_chunks)
+    catalog.remove(second_entry)
+    assert not any(catalog.chunk_store.chunk_path(digest).exists() for digest in first_chunks | second_chunks)
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import time
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+import pytest
+from app.compression import stream_to_file, detect_codec, decompress_command
+from app.process import JobCancelled, default_runner
+
+DUMP_COMMAND = ["sh", "-c", "for i in $(seq 1 20000); do echo \"INSERT INTO t VALUES ($i, 'row $i');\"; done"]
+
+
+@pytest.mark.parametrize("codec", ["zstd", "lz4", "gzip"])
+def test_stream_to_file_round_trip(tmp_path, codec):
+    raw = subprocess.run(DUMP_COMMAND, check=True, capture_output=True).stdout
+    destination = tmp_path / "db.backup"
+
+    written = stream_to_file(DUMP_COMMAND, destination, compression=codec, compression_level=1)
+
+    assert written == len(raw)
+    assert destination.stat().st_size < len(raw)
+    assert detect_codec(destination) == codec
+    restored = subprocess.run(decompress_command(codec, destination), check=True, capture_output=True).stdout
+    assert restored == raw
+
+
+def test_stream_to_file_uncompressed(tmp_path):
+    destination = tmp_path / "db.backup"
+
+    written = stream_to_file(DUMP_COMMAND, destination)
+
+    assert written == destination.stat().st_size
+    assert detect_codec(destination) is None
+
+
+def test_stream_to_file_fails_with_dump_command(tmp_path):
+    with pytest.raises(subprocess.CalledProcessError):
+        stream_to_file(["sh", "-c", "echo partial; exit 3"], tmp_path / "db.backup", compression="gzip")
+
+
+def test_stream_to_file_times_out(tmp_path):
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        stream_to_file(["sleep", "30"], tmp_path / "db.backup", compression="gzip", timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert default_runner().running() == []
+
+
+def test_cancel_running_job(tmp_path):
+    future = default_runner().submit([["sleep", "30"]], name="backup:db", stdout=tmp_path / "db.backup")
+    while not default_runner().pids():
+        time.sleep(0.01)
+
+    assert default_runner().running() == ["backup:db"]
+    assert len(default_runner().pids()) == 1
+    assert default_runner().cancel("other") == 0
+    assert default_runner().cancel("backup:db") == 1
+    with pytest.raises(JobCancelled):
+        future.result(timeout=5)
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.delta import base_cache_path, materialize, read_delta
+from app.scheduler import Scheduler
+
+
+class DumpingModule:
+    """Database module writing a large dump, changed by one row at every backup."""
+
+    def __init__(self):
+        generator = random.Random(7)
+        self.rows = [f"INSERT INTO t VALUES ({i}, '{generator.random()}');\n" for i in range(50000)]
+        self.dumps = []
+
+    def job_name(self, kind, name):
+        return f"{kind}:{name}"
+
+    def backup_database(self, name, destination_file, stats=None, **options):
+        self.rows.append(f"INSERT INTO t VALUES ({len(self.rows)}, 'new');\n")
+        destination_file.write_text("".join(self.rows))
+        self.dumps.append(destination_file.read_bytes())
+        return True
+
+
+def test_delta_backups_are_rebuilt_and_keep_their_base(tmp_path, monkeypatch):
+    backup_dir = tmp_path / "backups"
+    module = DumpingModule()
+    scheduler = Scheduler(module, [{"cron": "0 * * * *", "name": "hourly", "delta": True, "delta_full_every": 2,
+                                    "compression": "zstd"}], backup_dir)
+    paths = iter(backup_dir / "hourly" / "2026" / "1" / "1" / f"db.2026010100{minute:02d}00.backup"
+                 for minute in range(10))
+
+    def next_path(cron_name, db_name):
+        path = next(paths)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    monkeypatch.setattr(scheduler, "calculate_backup_file_path", next_path)
+    for _ in range(2):
+        assert scheduler.backup_database("hourly", "db", 1, **scheduler.get_dump_options("hourly"))
+
+    full, delta_file = sorted((backup_dir / "hourly" / "2026" / "1" / "1").glob("*.backup"))
+    assert read_delta(full) is None and read_delta(delta_file)
+    assert delta_file.stat().st_size < full.stat().st_size / 100
+    assert not delta_file.with_name(delta_file.name + ".tmp").exists()
+    assert scheduler.catalog.latest("hourly", "db")["compression"] == "delta"
+    with materialize(delta_file) as restored_file:
+        assert restored_file.read_bytes() == module.dumps[1]
+    # The base is kept beyond the retention limit while a delta made against it is kept
+    assert full.exists()
+
+    assert scheduler.backup_database("hourly", "db", 1, **scheduler.get_dump_options("hourly"))
+    assert full.exists() and not delta_file.exists()
+
+    # After two deltas the next backup is full: the deltas and their base expire together
+    assert scheduler.backup_database("hourly", "db", 1, **scheduler.get_dump_options("hourly"))
+    assert [path.name for path in full.parent.glob("*.backup")] == ["db.20260101000300.backup"]
+    assert not base_cache_path(full).exists()
+
+
+def test_too_large_deltas_fall_back_to_full_backups(tmp_path, monkeypatch):
+    backup_dir = tmp_path / "backups"
+    module = DumpingModule()
+    scheduler = Scheduler(module, [{"cron": "0 * * * *", "name": "hourly", "delta": True, "delta_full_every": 5}],
+                          backup_dir)
+    day = backup_dir / "hourly" / "2026" / "1" / "1"
+    day.mkdir(parents=True)
+    paths = iter(day / f"db.2026010100{minute:02d}00.backup" for minute in range(10))
+    monkeypatch.setattr(scheduler, "calculate_backup_file_path", lambda cron_name, db_name: next(paths))
+    assert scheduler.backup_database("hourly", "db", 5, **scheduler.get_dump_options("hourly"))
+    full = next(day.glob("*.backup"))
+
+    # The staged dump, one row longer than the base, is over the limit: the dump is taken again in full
+    monkeypatch.setattr("app.delta.DELTA_MAX_SIZE", full.stat().st_size + 10)
+    assert scheduler.backup_database("hourly", "db", 5, **scheduler.get_dump_options("hourly"))
+    latest = scheduler.catalog.latest("hourly", "db")
+    assert latest["compression"] != "delta" and read_delta(scheduler.catalog.resolve(latest)) is None
+    assert len(module.dumps) == 3
+    assert not list(day.glob("*.tmp"))
+
+    # The base is over the limit: the database is dumped in full once, without staging
+    monkeypatch.setattr("app.delta.DELTA_MAX_SIZE", 1)
+    assert scheduler.backup_database("hourly", "db", 5, **scheduler.get_dump_options("hourly"))
+    assert scheduler.catalog.latest("hourly", "db")["compression"] != "delta"
+    assert len(module.dumps) == 4
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+import pytest
+from app.load import LoadGovernor
+from app.process import JobCancelled, ProcessRunner, StreamPipe, priority_command
+from app.throttle import TokenBucket
+
+
+def test_throttled_jobs_stream_at_the_bucket_rate(tmp_path):
+    runner = ProcessRunner()
+    bucket = TokenBucket(2 * 1024 * 1024)
+    runner.throttle("backup:db", bucket)
+    start = time.monotonic()
+    written = runner.run([["head", "-c", str(4 * 1024 * 1024), "/dev/zero"]], name="backup:db",
+                         stdout=tmp_path / "out")
+    assert written == 4 * 1024 * 1024
+    assert time.monotonic() - start >= 0.8
+
+    # The compressed output is throttled, not the dump feeding the compressor
+    start = time.monotonic()
+    written = runner.run([["head", "-c", str(4 * 1024 * 1024), "/dev/zero"], ["gzip"]], name="backup:db",
+                         stdout=tmp_path / "out.gz")
+    assert written == 4 * 1024 * 1024
+    assert time.monotonic() - start < 0.8
+    assert runner.rate("backup:db") == 2 * 1024 * 1024
+
+    runner.unthrottle("backup:db", bucket)
+    assert runner.throttles("backup:db") == []
+    assert runner.rate("backup:db") is None
+    bucket.rate = None
+    assert bucket.reserve(10 ** 9) == 0
+
+
+def test_prioritized_jobs_run_niced(tmp_path):
+    runner = ProcessRunner()
+    runner.prioritize("backup:db", priority_command(nice=19 - os.nice(0)))
+    runner.run([["nice"]], name="backup:db", stdout=tmp_path / "out")
+    assert (tmp_path / "out").read_text().strip() == "19"
+
+    runner.prioritize("backup:db", None)
+    assert runner.priority("backup:db") == []
+
+
+def test_stream_pipe_feeds_a_job_and_stops_with_it(tmp_path):
+    runner = ProcessRunner()
+    pipe = StreamPipe()
+    job = runner.submit([["cat"]], name="backup:db", stdin=pipe, stdout=tmp_path / "out")
+    pipe.attach(job)
+    for _ in range(10):
+        pipe.write(b"x" * 1024)
+    pipe.close()
+    assert job.result() == 10 * 1024
+    assert (tmp_path / "out").stat().st_size == 10 * 1024
+
+    pipe = StreamPipe()
+    job = runner.submit([["sleep", "5"]], name="backup:db", stdin=pipe, stdout=tmp_path / "out")
+    pipe.attach(job)
+    while "backup:db" not in runner.running():
+        time.sleep(0.01)
+    assert runner.cancel("backup:db") == 1
+    with pytest.raises(JobCancelled):
+        while True:
+            pipe.write(b"x" * 1024)
+    pipe.close()
+
+
+def test_governor_defers_and_lowers_concurrency():
+    samples = iter([{"active": 12, "lag": None}, {"active": 3, "lag": 0.5}, {"active": 2, "lag": 90.0}])
+    governor = LoadGovernor(lambda: next(samples), max_active=10, max_lag=60, concurrency=3,
+                            throttled_concurrency=1, rate_limit=1024, interval=0.01)
+
+    assert governor.wait_until_calm(5) < 1
+    assert not governor.overloaded and governor.bucket.rate is None
+    assert governor.update()
+    assert governor.bucket.rate == 1024
+
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def dump():
+        with governor.slot():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=dump) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 1
@@ -0,0 +1,70 @@
+import gzip
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.catalog import Catalog
+from app.modules.mysql_binlog import gtid_stop_options, list_binlogs, parse_binlog_position, replay_command
+
+MARIADB_HEADER = b"""-- MariaDB dump 10.19  Distrib 10.11.6-MariaDB
+--
+-- Position to start replication or point-in-time recovery from
+--
+
+-- CHANGE MASTER TO MASTER_LOG_FILE='mysql-bin.000003', MASTER_LOG_POS=344;
+
+--
+-- Table structure for table `t`
+--
+"""
+
+
+def test_binlog_positions_and_replay_options(tmp_path):
+    assert parse_binlog_position(MARIADB_HEADER) == {"file": "mysql-bin.000003", "position": 344}
+    assert parse_binlog_position(b"-- CHANGE REPLICATION SOURCE TO SOURCE_LOG_FILE='binlog.000012', "
+                                 b"SOURCE_LOG_POS=157;") == {"file": "binlog.000012", "position": 157}
+    assert parse_binlog_position(b"-- MySQL dump 10.13\n") is None
+
+    for name in ("binlog.000010", "binlog.000009", "binlog.000011", "other.000010", "binlog.index"):
+        (tmp_path / name).write_bytes(b"")
+    assert [path.name for path in list_binlogs(tmp_path, "binlog.000010")] == ["binlog.000010", "binlog.000011"]
+
+    assert gtid_stop_options("3e11fa47-71ca-11e1-9e33-c80aa9429562:23") == [
+        "--exclude-gtids=3e11fa47-71ca-11e1-9e33-c80aa9429562:24-9223372036854775806"]
+    assert gtid_stop_options("0-1-42") == ["--stop-position=0-1-42"]
+    with pytest.raises(ValueError):
+        gtid_stop_options("42")
+
+    command = replay_command("shop", list_binlogs(tmp_path, "binlog.000010"), 344,
+                             stop_time=datetime(2026, 1, 2, 3, 4, 5), skip_gtids=True)
+    assert command == ["mysqlbinlog", "--database=shop", "--start-position=344", "--stop-datetime=2026-01-02 03:04:05",
+                       "--skip-gtids", str(tmp_path / "binlog.000010"), str(tmp_path / "binlog.000011")]
+
+
+def test_catalog_prunes_binlogs_older_than_the_oldest_dump(tmp_path):
+    backup_dir = tmp_path / "backups"
+    binlog_dir = backup_dir / ".binlog"
+    binlog_dir.mkdir(parents=True)
+    for number in range(1, 6):
+        (binlog_dir / f"mysql-bin.{number:06d}").write_bytes(b"binlog")
+    day_dir = backup_dir / "hourly" / "2026" / "1" / "1"
+    day_dir.mkdir(parents=True)
+    old_dump = day_dir / "shop.20260101000000.backup"
+    old_dump.write_bytes(gzip.compress(MARIADB_HEADER))
+    new_dump = day_dir / "shop.20260101010000.backup"
+    new_dump.write_bytes(MARIADB_HEADER.replace(b"000003", b"000005"))
+    catalog = Catalog(backup_dir)
+
+    entry = catalog.latest("hourly", "shop", before="20260101000000")
+    assert (entry["binlog_file"], entry["binlog_position"]) == ("mysql-bin.000003", 344)
+    assert catalog.prune_binlogs(binlog_dir) == 2
+    assert list_binlogs(binlog_dir)[0].name == "mysql-bin.000003"
+
+    catalog.remove(entry)
+    assert catalog.prune_binlogs(binlog_dir) == 2
+    assert [path.name for path in list_binlogs(binlog_dir)] == ["mysql-bin.000005"]
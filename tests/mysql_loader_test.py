@@ -0,0 +1,100 @@
+import os
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.modules.mysql_loader import defer_keys, split_dump
+
+DUMP = b"""-- MySQL dump 10.13
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+
+--
+-- Table structure for table `orders`
+--
+
+DROP TABLE IF EXISTS `orders`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+CREATE TABLE `orders` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `customer_id` int NOT NULL,
+  `code` varchar(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `code` (`code`),
+  KEY `customer_id` (`customer_id`),
+  CONSTRAINT `orders_ibfk_1` FOREIGN KEY (`customer_id`) REFERENCES `customers` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `orders`
+--
+
+LOCK TABLES `orders` WRITE;
+/*!40000 ALTER TABLE `orders` DISABLE KEYS */;
+INSERT INTO `orders` VALUES (1,1,'a'),(2,1,'b');
+INSERT INTO `orders` VALUES (3,2,'c');
+/*!40000 ALTER TABLE `orders` ENABLE KEYS */;
+UNLOCK TABLES;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50003 TRIGGER `orders_bi` BEFORE INSERT ON `orders` FOR EACH ROW SET NEW.code = UPPER(NEW.code) */;;
+DELIMITER ;
+
+--
+-- Final view structure for view `big_orders`
+--
+
+/*!50001 CREATE VIEW `big_orders` AS select `orders`.`id` AS `id` from `orders` */;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+"""
+
+
+def test_split_dump_separates_schema_data_and_triggers(tmp_path):
+    dump = split_dump(DUMP.splitlines(keepends=True), tmp_path, split_size=10)
+
+    assert b"FOREIGN_KEY_CHECKS=0" in dump.header
+    assert b"CREATE TABLE `orders`" in dump.schema
+    assert b"TRIGGER" not in dump.schema
+    assert b"TRIGGER `orders_bi`" in dump.post
+    assert b"CREATE VIEW `big_orders`" in dump.post
+    # A new file starts at each INSERT once the split size is reached
+    files = dump.tables["orders"]
+    assert len(files) == 2
+    first = files[0].read_bytes()
+    assert first.startswith(dump.header)
+    assert b"LOCK TABLES" not in first and b"DISABLE KEYS" not in first
+    assert files[1].read_bytes().endswith(b"INSERT INTO `orders` VALUES (3,2,'c');\n")
+
+
+def test_defer_keys_keeps_primary_and_auto_increment_keys(tmp_path):
+    schema = split_dump(DUMP.splitlines(keepends=True), tmp_path).schema.decode()
+
+    stripped, secondary_keys, foreign_keys = defer_keys(schema)
+
+    assert "KEY `customer_id`" not in stripped
+    assert "FOREIGN KEY" not in stripped
+    assert "  PRIMARY KEY (`id`)\n) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4;" in stripped
+    assert secondary_keys == {"orders": ["UNIQUE KEY `code` (`code`)", "KEY `customer_id` (`customer_id`)"]}
+    assert foreign_keys == {"orders": ["CONSTRAINT `orders_ibfk_1` FOREIGN KEY (`customer_id`) "
+                                       "REFERENCES `customers` (`id`)"]}
+
+
+def test_defer_keys_keeps_key_on_auto_increment_column():
+    schema = ("CREATE TABLE `t` (\n  `a` int NOT NULL,\n  `id` int NOT NULL AUTO_INCREMENT,\n"
+              "  PRIMARY KEY (`a`),\n  KEY `id` (`id`)\n) ENGINE=InnoDB;\n")
+
+    stripped, secondary_keys, _ = defer_keys(schema)
+
+    assert stripped == schema
+    assert secondary_keys == {}
+
+
+def test_defer_keys_keeps_composite_key_with_auto_increment_column():
+    schema = ("CREATE TABLE `t` (\n  `grp` int NOT NULL,\n  `id` int NOT NULL AUTO_INCREMENT,\n"
+              "  `name` varchar(10) DEFAULT NULL,\n  PRIMARY KEY (`grp`,`id`),\n  KEY `seq` (`grp`,`id`),\n"
+              "  KEY `name` (`name`(4),`grp` DESC)\n) ENGINE=MyISAM;\n")
+
+    stripped, secondary_keys, _ = defer_keys(schema)
+
+    assert "KEY `seq` (`grp`,`id`)" in stripped
+    assert secondary_keys == {"t": ["KEY `name` (`name`(4),`grp` DESC)"]}
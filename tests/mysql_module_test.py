@@ -1,4 +1,5 @@
 import os
+import shutil
 import sys
 
 from mysql.connector import Error
@@ -9,6 +10,7 @@ sys.path.insert(1, os.getcwd())
 import pytest
 from pathlib import Path
 import mysql.connector
+from app.index import index_path
 from app.modules.mysql_module import MySQLModule
 
 @pytest.fixture(scope="session")
@@ -133,3 +135,128 @@ def test_backup_and_restore_database(pytestconfig, mysql_connection, mysql_modul
     finally:
         if backup_file.exists():
             os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
+
+
+def test_restore_database_with_swap(pytestconfig, mysql_connection, mysql_module):
+    connection, cursor = mysql_connection
+
+    backup_file = Path(str(pytestconfig.rootdir), "tests", "test_mysql_db_swap_backup.sql")
+    if backup_file.exists():
+        os.remove(backup_file)
+    try:
+        cursor.execute("DELETE FROM test_table")
+        cursor.execute("INSERT INTO test_table (data) VALUES ('Original Data')")
+        cursor.execute("CREATE OR REPLACE VIEW test_view AS SELECT data FROM test_table")
+        connection.commit()
+
+        assert mysql_module.backup_database('test_db', backup_file)
+
+        cursor.execute("DELETE FROM test_table")
+        cursor.execute("INSERT INTO test_table (data) VALUES ('Altered Data')")
+        connection.commit()
+
+        assert mysql_module.restore_database('test_db', backup_file, swap=True)
+
+        cursor.execute("SELECT data FROM test_view")
+        assert cursor.fetchone()[0] == 'Original Data'
+        cursor.execute("SHOW DATABASES LIKE 'test\\_db\\_\\_%'")
+        assert cursor.fetchall() == []
+
+    finally:
+        if backup_file.exists():
+            os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
+
+
+def test_backup_and_restore_database_directory_format(pytestconfig, mysql_connection, mysql_module):
+    connection, cursor = mysql_connection
+
+    backup_dir = Path(str(pytestconfig.rootdir), "tests", "test_mysql_db_backup_dir")
+    if backup_dir.exists():
+        shutil.rmtree(backup_dir)
+    try:
+        cursor.execute("DELETE FROM test_table")
+        cursor.executemany("INSERT INTO test_table (data) VALUES (%s)", [(f"Row {i}",) for i in range(100)])
+        connection.commit()
+
+        assert mysql_module.backup_database('test_db', backup_dir, dump_format='directory', dump_jobs=2,
+                                            compression='gzip')
+        assert (backup_dir / 'manifest.json').exists()
+
+        cursor.execute("DELETE FROM test_table")
+        connection.commit()
+
+        assert mysql_module.restore_database('test_db', backup_dir)
+
+        cursor.execute("SELECT COUNT(*) FROM test_table")
+        assert cursor.fetchone()[0] == 100
+
+    finally:
+        if backup_dir.exists():
+            shutil.rmtree(backup_dir)
+
+
+def test_restore_database_in_parallel(pytestconfig, mysql_connection, mysql_module):
+    connection, cursor = mysql_connection
+
+    backup_file = Path(str(pytestconfig.rootdir), "tests", "test_mysql_db_parallel_backup.sql")
+    if backup_file.exists():
+        os.remove(backup_file)
+    try:
+        cursor.execute("DELETE FROM test_table")
+        cursor.executemany("INSERT INTO test_table (data) VALUES (%s)", [(f"Row {i}",) for i in range(100)])
+        connection.commit()
+
+        assert mysql_module.backup_database('test_db', backup_file, compression='zstd')
+
+        cursor.execute("DELETE FROM test_table")
+        connection.commit()
+
+        stats = {}
+        assert mysql_module.restore_database('test_db', backup_file, jobs=4, stats=stats)
+
+        cursor.execute("SELECT COUNT(*) FROM test_table")
+        assert cursor.fetchone()[0] == 100
+        assert 'test_table' in stats['tables']
+
+    finally:
+        if backup_file.exists():
+            os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
+
+
+def test_restore_single_table(pytestconfig, mysql_connection, mysql_module):
+    connection, cursor = mysql_connection
+
+    backup_file = Path(str(pytestconfig.rootdir), "tests", "test_mysql_db_table_backup.sql")
+    if backup_file.exists():
+        os.remove(backup_file)
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS other_table (data VARCHAR(255) NOT NULL)")
+        cursor.execute("DELETE FROM test_table")
+        cursor.execute("DELETE FROM other_table")
+        cursor.execute("INSERT INTO test_table (data) VALUES ('Original Data')")
+        cursor.execute("INSERT INTO other_table (data) VALUES ('Original Data')")
+        connection.commit()
+
+        assert mysql_module.backup_database('test_db', backup_file, compression='zstd')
+
+        cursor.execute("DROP TABLE test_table")
+        cursor.execute("UPDATE other_table SET data = 'Altered Data'")
+        connection.commit()
+
+        assert mysql_module.restore_tables('test_db', backup_file, ['test_table'])
+        assert not mysql_module.restore_tables('test_db', backup_file, ['missing_table'])
+
+        cursor.execute("SELECT data FROM test_table")
+        assert cursor.fetchone()[0] == 'Original Data'
+        cursor.execute("SELECT data FROM other_table")
+        assert cursor.fetchone()[0] == 'Altered Data'
+
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS other_table")
+        connection.commit()
+        if backup_file.exists():
+            os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
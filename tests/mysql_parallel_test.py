@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+import pytest
+from app.modules.mysql_parallel import MANIFEST_FILE, ParallelDump, is_unchanged, row_expression, \
+    value_expression
+
+
+@pytest.mark.parametrize("data_type, expression", [
+    ("int", "IFNULL(`c`, 'NULL')"),
+    ("decimal", "IFNULL(`c`, 'NULL')"),
+    ("bit", "IFNULL(`c` + 0, 'NULL')"),
+    ("varbinary", "IF(`c` IS NULL, 'NULL', CONCAT('X''', HEX(`c`), ''''))"),
+    ("point", "IF(`c` IS NULL, 'NULL', CONCAT('X''', HEX(`c`), ''''))"),
+    ("varchar", "QUOTE(`c`)"),
+    ("time", "QUOTE(`c`)"),
+    ("json", "QUOTE(`c`)"),
+])
+def test_value_expression(data_type, expression):
+    assert value_expression("c", data_type) == expression
+
+
+def test_row_expression():
+    assert row_expression(["id", "name"], ["bigint", "text"]) == \
+        "CONCAT('(', IFNULL(`id`, 'NULL'), ',', QUOTE(`name`), ')')"
+
+
+class FakeCursor:
+    def __init__(self, low, high):
+        self.bounds = (low, high)
+
+    def execute(self, query):
+        pass
+
+    def fetchone(self):
+        return self.bounds
+
+
+def test_ranges_cover_primary_key():
+    dump = ParallelDump(None, "db", "/tmp/unused")
+
+    ranges = dump._ranges(FakeCursor(1, 100), "t", "id", 4)
+
+    assert ranges == [(None, 26), (26, 51), (51, 76), (76, None)]
+    assert dump._ranges(FakeCursor(None, None), "t", "id", 4) == [(None, None)]
+
+
+def test_unchanged_tables_reuse_previous_chunks(tmp_path):
+    previous_dir, new_dir = tmp_path / "previous", tmp_path / "new"
+    previous_dir.mkdir()
+    new_dir.mkdir()
+    signature = {"create_time": "2026-01-01 00:00:00", "update_time": "2026-01-01 09:59:59", "checksum": None}
+    previous_tables = [
+        {"name": "kept", "columns": ["id"], "primary_key": ["id"], "signature": signature,
+         "chunks": [{"file": "0000.00000.sql", "from": None, "to": 10, "rows": 9, "bytes": 90},
+                    {"file": "0000.00001.sql", "from": 10, "to": None, "rows": 5, "bytes": 50}]},
+        {"name": "written", "columns": ["id"], "primary_key": ["id"], "signature": signature,
+         "chunks": [{"file": "0001.00000.sql", "from": None, "to": None, "rows": 1, "bytes": 10}]},
+    ]
+    for table in previous_tables:
+        for chunk in table["chunks"]:
+            (previous_dir / chunk["file"]).write_text(chunk["file"])
+    (previous_dir / MANIFEST_FILE).write_text(json.dumps({"profile": "copy", "compression": None,
+                                                          "snapshot_time": "2026-01-01 10:00:00",
+                                                          "tables": previous_tables}))
+    tables = [
+        {"name": "new", "columns": ["id"], "signature": None, "chunks": [{"file": "0000.00000.sql"}]},
+        {"name": "kept", "columns": ["id"], "signature": dict(signature), "chunks": [{"file": "0001.00000.sql"}]},
+        {"name": "written", "columns": ["id"], "signature": dict(signature, update_time="2026-01-01 10:00:01"),
+         "chunks": [{"file": "0002.00000.sql"}]},
+    ]
+
+    ParallelDump(None, "db", new_dir, incremental=True, previous=previous_dir)._reuse(tables)
+
+    assert [table.get("reused", False) for table in tables] == [False, True, False]
+    assert [chunk["file"] for chunk in tables[1]["chunks"]] == ["0001.00000.sql", "0001.00001.sql"]
+    assert tables[1]["chunks"][1]["rows"] == 5
+    assert (new_dir / "0001.00001.sql").read_text() == "0000.00001.sql"
+    assert sorted(path.name for path in new_dir.iterdir()) == ["0001.00000.sql", "0001.00001.sql"]
+
+    # A write in the second of the previous snapshot may have happened after it
+    assert not is_unchanged(previous_tables[0], {"columns": ["id"], "signature": signature}, "2026-01-01 09:59:59")
+    checksummed = dict(signature, update_time=None, checksum=1234)
+    assert is_unchanged({"columns": ["id"], "signature": checksummed}, {"columns": ["id"], "signature": checksummed},
+                        None)
+    assert not is_unchanged({"columns": ["id"], "signature": checksummed},
+                            {"columns": ["id", "name"], "signature": checksummed}, None)
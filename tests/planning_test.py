@@ -0,0 +1,26 @@
+import os
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.planning import estimate_durations, lpt_order, predict_makespan
+
+
+def test_durations_are_estimated_from_size_and_history():
+    samples = {
+        "a": [{"duration": 20.0, "source_size": 2000}, {"duration": 12.0, "source_size": 1000}],
+        "b": [{"duration": 30.0, "source_size": None}],
+        "c": [{"duration": 5.0, "source_size": 1000}],
+    }
+    sizes = {"a": 3000, "b": 4000, "new": 2000}
+    estimates = estimate_durations(["a", "b", "c", "new", "unknown"], sizes, samples)
+    assert estimates == {"a": 33.0, "b": 30.0, "c": 5.0, "new": 16.0, "unknown": None}
+
+    assert lpt_order(["c", "a", "new", "unknown", "b"], estimates, sizes) == ["unknown", "a", "b", "new", "c"]
+
+
+def test_makespan_follows_the_first_free_worker():
+    assert predict_makespan([10, 8, 5, 4, 3], 2) == 16
+    assert predict_makespan([10, 8, 5, 4, 3], 1) == 30
+    assert predict_makespan([], 4) == 0
@@ -0,0 +1,52 @@
+import os
+import sys
+import threading
+import time
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+import pytest
+from app.pool import WorkerPool, dispatch
+
+
+def test_tasks_run_within_the_caps_of_their_keys():
+    pool = WorkerPool(3, {"host:a": 1})
+    running, peak, lock = {}, {}, threading.Lock()
+
+    def task(key):
+        with lock:
+            running[key] = running.get(key, 0) + 1
+            peak[key] = max(peak.get(key, 0), running[key])
+        time.sleep(0.05)
+        with lock:
+            running[key] -= 1
+        return key
+
+    futures = [pool.submit(["host:a"], task, "a") for _ in range(3)] + \
+              [pool.submit(["host:b"], task, "b") for _ in range(4)]
+    assert [future.result() for future in futures] == ["a"] * 3 + ["b"] * 4
+    assert peak == {"a": 1, "b": 2}
+    assert pool.running() == 0
+    pool.shutdown()
+
+
+def test_task_errors_are_raised_by_their_future():
+    pool = WorkerPool(1)
+    future = pool.submit([], lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        future.result()
+    assert pool.submit(["host:a"], lambda: "next").result() == "next"
+    pool.shutdown()
+
+
+def test_dispatched_tasks_run_outside_of_the_workers():
+    pool = WorkerPool(1)
+    release = threading.Event()
+    busy = pool.submit([], release.wait)
+    # A run waiting on a task of the full pool does not take a worker itself
+    run = dispatch(lambda: pool.submit([], lambda: "dumped").result())
+    assert not run.done()
+    release.set()
+    assert run.result(timeout=5) == "dumped" and busy.result()
+    pool.shutdown()
@@ -4,6 +4,7 @@ import sys
 from psycopg2 import Error
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
+from app.index import index_path
 from app.modules.postgis_module import PostGISModule
 
 # insert root directory into python module search path
@@ -205,3 +206,4 @@ def test_backup_and_restore_database(pytestconfig, docker_ip, docker_services, p
     finally:
         if backup_file.exists():
             os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
@@ -0,0 +1,58 @@
+import os
+import sys
+import tarfile
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.catalog import describe_artifact
+from app.modules.postgres_bundle import MemberReader, group_tables, is_bundle, read_bundle, write_bundle
+
+
+def test_bundle_members_are_read_in_place(tmp_path):
+    work_dir = tmp_path / "work"
+    (work_dir / "tables").mkdir(parents=True)
+    (work_dir / "schema.dump").write_bytes(b"PGDMP schema")
+    (work_dir / "tables" / "00000.dump").write_bytes(b"PGDMP" + bytes(range(256)) * 40)
+    manifest = {"version": 1, "database": "shop", "snapshot": "00000003-00000002-1", "profile": "copy",
+                "schema": "schema.dump",
+                "tables": [{"schema": "public", "table": "orders", "size": 8192, "member": "tables/00000.dump"}]}
+    bundle_file = tmp_path / "shop.20260101000000.backup"
+    write_bundle(bundle_file, work_dir, manifest)
+
+    assert is_bundle(bundle_file)
+    assert not is_bundle(work_dir / "schema.dump")
+    assert read_bundle(bundle_file) == manifest
+    assert read_bundle(work_dir / "schema.dump") is None
+    assert describe_artifact(bundle_file) == ("bundle", None, bundle_file.stat().st_size)
+
+    with MemberReader(bundle_file, "tables/00000.dump") as reader:
+        blocks = []
+        while True:
+            block = reader.read(1000)
+            if not block:
+                break
+            blocks.append(block)
+    assert b"".join(blocks) == (work_dir / "tables" / "00000.dump").read_bytes()
+    assert MemberReader(bundle_file, "schema.dump").read() == b"PGDMP schema"
+
+
+def test_small_tables_share_members(tmp_path):
+    tables = [{"schema": "public", "table": name, "size": size}
+              for name, size in [("events", 500), ("orders", 100), ("users", 40), ("tags", 30), ("codes", 0)]]
+    groups = group_tables(tables, group_size=100)
+    assert [[table["table"] for table in group] for group in groups] == [
+        ["events"], ["orders"], ["users", "tags", "codes"]]
+
+    work_dir = tmp_path / "work"
+    (work_dir / "tables").mkdir(parents=True)
+    (work_dir / "schema.dump").write_bytes(b"PGDMP schema")
+    (work_dir / "tables" / "00000.dump").write_bytes(b"PGDMP users tags")
+    manifest = {"version": 1, "database": "shop", "snapshot": "00000003-00000002-1", "profile": "copy",
+                "schema": "schema.dump",
+                "tables": [{"schema": "public", "table": name, "size": 1, "member": "tables/00000.dump"}
+                           for name in ("users", "tags")]}
+    bundle_file = tmp_path / "shop.20260101000000.backup"
+    write_bundle(bundle_file, work_dir, manifest)
+    with tarfile.open(bundle_file) as tar:
+        assert tar.getnames() == ["bundle.json", "schema.dump", "tables/00000.dump"]
@@ -0,0 +1,44 @@
+import os
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.modules.postgres_incremental import copy_statement, data_files, reusable_tables, table_pattern
+from app.modules.postgres_toc import parse_toc
+
+LISTING = """;
+; Archive created at 2026-01-01 00:00:00 UTC
+;
+215; 1259 16385 TABLE public orders postgres
+216; 1259 16390 TABLE public My Table postgres
+3345; 0 16385 TABLE DATA public orders postgres
+3346; 0 16390 TABLE DATA public My Table postgres
+"""
+
+
+def test_names_are_quoted_for_pg_dump_and_copy():
+    assert table_pattern("public", 'we"ird*') == '"public"."we""ird*"'
+    assert copy_statement("public", "orders", ["id", "Total"]) == 'COPY "public"."orders" ("id", "Total") FROM stdin'
+
+
+def test_unchanged_tables_are_reused_from_the_previous_dump(tmp_path):
+    (tmp_path / "3345.dat.gz").write_bytes(b"")
+    (tmp_path / "3346.dat.gz").write_bytes(b"")
+    (tmp_path / "toc.dat").write_bytes(b"")
+    files = data_files(tmp_path, parse_toc(LISTING))
+    assert files == {("public", "orders"): "3345.dat.gz", ("public", "My Table"): "3346.dat.gz"}
+
+    previous = {"profile": "copy", "tables": [
+        {"schema": "public", "table": "orders", "signature": [16385, 10, 2, 0, None], "columns": ["id"],
+         "file": files[("public", "orders")]},
+        {"schema": "public", "table": "My Table", "signature": [16390, 1, 0, 0, None], "columns": ["id"],
+         "file": files[("public", "My Table")]},
+    ]}
+    signatures = {
+        ("public", "orders"): {"signature": [16385, 10, 2, 0, None], "columns": ["id"]},
+        ("public", "My Table"): {"signature": [16390, 2, 0, 0, None], "columns": ["id"]},
+    }
+    assert list(reusable_tables(previous, signatures, "copy", tmp_path)) == [("public", "orders")]
+    assert reusable_tables(previous, signatures, "inserts", tmp_path) == {}
+    assert reusable_tables(None, signatures, "copy", tmp_path) == {}
@@ -10,6 +10,7 @@ sys.path.insert(1, os.getcwd())
 import pytest
 from pathlib import Path
 import psycopg2
+from app.index import index_path
 from app.modules.postgres_module import PostgresModule
 
 @pytest.fixture(scope="session")
@@ -194,3 +195,92 @@ def test_backup_and_restore_database(pytestconfig, docker_ip, docker_services, p
     finally:
         if backup_file.exists():
             os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
+
+
+def test_restore_database_with_swap(pytestconfig, docker_ip, docker_services, postgres_module):
+    docker_port = docker_services.port_for("postgres", 5432)
+
+    def connect(database):
+        return psycopg2.connect(host=docker_ip, port=docker_port, user='test_user', password='test_password',
+                                database=database)
+
+    backup_file = Path(str(pytestconfig.rootdir), "tests", "test_postgres_db_swap_backup.sql")
+    if backup_file.exists():
+        os.remove(backup_file)
+    try:
+        connection = connect('test_db')
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS swap_table (data VARCHAR(255) NOT NULL)")
+        cursor.execute("DELETE FROM swap_table")
+        cursor.execute("INSERT INTO swap_table (data) VALUES ('Original Data')")
+        connection.commit()
+
+        assert postgres_module.backup_database('test_db', backup_file)
+
+        cursor.execute("DELETE FROM swap_table")
+        cursor.execute("INSERT INTO swap_table (data) VALUES ('Altered Data')")
+        connection.commit()
+
+        # The open session on the live database is terminated by the swap
+        assert postgres_module.restore_database('test_db', backup_file, swap=True)
+
+        connection = connect('test_db')
+        cursor = connection.cursor()
+        cursor.execute("SELECT data FROM swap_table")
+        assert cursor.fetchone()[0] == 'Original Data'
+        cursor.execute("SELECT datname FROM pg_database WHERE datname LIKE 'test_db\\_\\_%'")
+        assert cursor.fetchall() == []
+        cursor.close()
+        connection.close()
+
+    finally:
+        if backup_file.exists():
+            os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
+
+
+def test_restore_single_table(pytestconfig, docker_ip, docker_services, postgres_module):
+    docker_port = docker_services.port_for("postgres", 5432)
+    connection = psycopg2.connect(host=docker_ip, port=docker_port, user='test_user', password='test_password',
+                                  database='test_db')
+    cursor = connection.cursor()
+
+    backup_file = Path(str(pytestconfig.rootdir), "tests", "test_postgres_db_table_backup.sql")
+    if backup_file.exists():
+        os.remove(backup_file)
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS kept_table (id SERIAL PRIMARY KEY, data VARCHAR(255) NOT NULL)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS kept_table_data ON kept_table (data)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS other_table (data VARCHAR(255) NOT NULL)")
+        cursor.execute("DELETE FROM kept_table")
+        cursor.execute("DELETE FROM other_table")
+        cursor.execute("INSERT INTO kept_table (data) VALUES ('Original Data')")
+        cursor.execute("INSERT INTO other_table (data) VALUES ('Original Data')")
+        connection.commit()
+
+        assert postgres_module.backup_database('test_db', backup_file, compression='zstd')
+        assert index_path(backup_file).exists()
+
+        cursor.execute("DROP TABLE kept_table")
+        cursor.execute("UPDATE other_table SET data = 'Altered Data'")
+        connection.commit()
+
+        assert postgres_module.restore_tables('test_db', backup_file, ['kept_table'], schema='public')
+
+        cursor.execute("SELECT data FROM kept_table")
+        assert cursor.fetchone()[0] == 'Original Data'
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'kept_table' ORDER BY indexname")
+        assert [row[0] for row in cursor.fetchall()] == ['kept_table_data', 'kept_table_pkey']
+        cursor.execute("SELECT data FROM other_table")
+        assert cursor.fetchone()[0] == 'Altered Data'
+
+    finally:
+        connection.rollback()
+        cursor.execute("DROP TABLE IF EXISTS kept_table, other_table")
+        connection.commit()
+        cursor.close()
+        connection.close()
+        if backup_file.exists():
+            os.remove(backup_file)
+        index_path(backup_file).unlink(missing_ok=True)
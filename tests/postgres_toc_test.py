@@ -0,0 +1,81 @@
+import os
+import sys
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.modules.postgres_toc import parse_owners, parse_toc, select_entries
+
+TOC = """;
+; Archive created at 2026-10-18 10:00:00 UTC
+;
+215; 1259 16386 TABLE public orders app
+214; 1259 16385 SEQUENCE public orders_id_seq app
+3350; 0 0 SEQUENCE OWNED BY public orders_id_seq app
+216; 1259 16390 TABLE public customers app
+3200; 2604 16391 DEFAULT public orders id app
+3345; 0 16386 TABLE DATA public orders app
+3346; 0 16390 TABLE DATA public customers app
+3351; 0 0 SEQUENCE SET public orders_id_seq app
+3190; 2606 16395 CONSTRAINT public orders orders_pkey app
+3191; 1259 16397 INDEX public orders_customer_idx app
+3192; 2606 16399 FK CONSTRAINT public orders orders_customer_fk app
+3193; 0 0 COMMENT public TABLE orders app
+"""
+
+OWNED_SQL = """--
+-- Name: orders_id_seq; Type: SEQUENCE; Schema: public; Owner: app
+--
+
+CREATE SEQUENCE public.orders_id_seq AS integer;
+
+--
+-- Name: orders_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: app
+--
+
+ALTER SEQUENCE public.orders_id_seq OWNED BY public.orders.id;
+
+--
+-- Name: orders_customer_idx; Type: INDEX; Schema: public; Owner: app
+--
+
+CREATE INDEX orders_customer_idx ON public.orders USING btree (customer_id);
+"""
+
+
+def test_parse_toc():
+    entries = parse_toc(TOC)
+
+    assert len(entries) == 12
+    assert entries[0] == {'line': '215; 1259 16386 TABLE public orders app', 'kind': 'TABLE', 'schema': 'public',
+                          'tag': 'orders', 'table': 'orders'}
+    kinds = {(entry['kind'], entry['tag']): entry['table'] for entry in entries}
+    assert kinds[('SEQUENCE OWNED BY', 'orders_id_seq')] is None
+    assert kinds[('TABLE DATA', 'customers')] == 'customers'
+    assert kinds[('FK CONSTRAINT', 'orders orders_customer_fk')] == 'orders'
+    assert kinds[('COMMENT', 'TABLE orders')] == 'orders'
+
+
+def test_parse_toc_finds_quoted_tables_with_spaces():
+    entries = parse_toc("217; 1259 16400 TABLE public order lines app\n"
+                        "218; 1259 16401 TABLE public order app\n"
+                        "3194; 2606 16402 CONSTRAINT public order lines order lines_pkey app\n"
+                        "3195; 2620 16403 TRIGGER public order audit app\n")
+
+    assert [entry['table'] for entry in entries] == ['order lines', 'order', 'order lines', 'order']
+
+
+def test_select_table_entries_with_owners():
+    owners = parse_owners(OWNED_SQL)
+    assert owners == {('public', 'orders_id_seq'): 'orders', ('public', 'orders_customer_idx'): 'orders'}
+    entries = parse_toc(TOC)
+    for entry in entries:
+        if entry['table'] is None:
+            entry['table'] = owners.get((entry['schema'], entry['tag']))
+
+    selected = select_entries(entries, ['orders'], 'public')
+
+    assert [entry['kind'] for entry in selected] == [
+        'TABLE', 'SEQUENCE', 'SEQUENCE OWNED BY', 'DEFAULT', 'TABLE DATA', 'SEQUENCE SET', 'CONSTRAINT', 'INDEX',
+        'FK CONSTRAINT', 'COMMENT']
+    assert select_entries(entries, ['orders'], 'other') == []
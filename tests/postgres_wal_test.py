@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from app.catalog import Catalog
+from app.modules.postgres_wal import (parse_lsn, parse_segment, read_wal_range, recovery_settings, restore_command,
+                                      segment_name)
+
+
+def test_segment_names():
+    assert parse_lsn("0/2000028") == 0x2000028
+    assert segment_name(1, parse_lsn("0/2000028")) == "000000010000000000000002"
+    assert segment_name(2, parse_lsn("1/FF000000")) == "0000000200000001000000FF"
+    assert parse_segment("0000000200000001000000FF.gz") == (2, 0x1FF, False)
+    assert parse_segment("000000010000000000000003.partial") == (1, 3, True)
+    assert parse_segment("00000002.history") is None
+
+
+def test_restore_command_reads_compressed_segments(tmp_path):
+    archive = tmp_path / "wal"
+    archive.mkdir()
+    (archive / "000000010000000000000001").write_bytes(b"plain")
+    (archive / "000000010000000000000002.gz").write_bytes(gzip.compress(b"compressed"))
+    command = restore_command(archive)
+
+    for name, content in (("000000010000000000000001", b"plain"), ("000000010000000000000002", b"compressed")):
+        target = tmp_path / name
+        subprocess.run(["sh", "-c", command.replace("%f", name).replace("%p", str(target))], check=True)
+        assert target.read_bytes() == content
+    missing = subprocess.run(["sh", "-c", command.replace("%f", "000000010000000000000003")
+                              .replace("%p", str(tmp_path / "missing"))])
+    assert missing.returncode != 0
+
+    settings = recovery_settings(archive, datetime(2026, 1, 2, 3, 4, 5))
+    assert "recovery_target_time = '2026-01-02 03:04:05" in settings
+    assert "recovery_target_action = 'promote'" in settings
+
+
+def test_restore_command_falls_back_to_partial_segments(tmp_path):
+    archive = tmp_path / "wal"
+    archive.mkdir()
+    (archive / "000000010000000000000004.partial").write_bytes(b"partial")
+    (archive / "000000010000000000000005.gz.partial").write_bytes(gzip.compress(b"streamed")[:-4])
+    (archive / "000000010000000000000006").write_bytes(b"complete")
+    (archive / "000000010000000000000006.partial").write_bytes(b"stale")
+    command = restore_command(archive, segment_size=64)
+
+    for name, content in (("000000010000000000000004", b"partial"), ("000000010000000000000005", b"streamed"),
+                          ("000000010000000000000006", b"complete")):
+        target = tmp_path / name
+        subprocess.run(["sh", "-c", command.replace("%f", name).replace("%p", str(target))], check=True)
+        restored = target.read_bytes()
+        assert restored.rstrip(b"\0") == content
+        assert len(restored) == (len(content) if content == b"complete" else 64)
+
+
+def test_catalog_tracks_wal_of_base_backups(tmp_path):
+    backup_dir = tmp_path / "backups"
+    wal_dir = backup_dir / ".wal"
+    wal_dir.mkdir(parents=True)
+    for number in (1, 2, 3, 5):
+        (wal_dir / segment_name(1, number * 0x1000000)).write_bytes(b"segment")
+    (wal_dir / (segment_name(1, 6 * 0x1000000) + ".partial")).write_bytes(b"segment")
+    base = backup_dir / "physical" / "2026" / "1" / "1" / "cluster.20260101000000.backup"
+    base.mkdir(parents=True)
+    (base / "base.tar").write_bytes(b"")
+    (base / "backup_manifest").write_text(json.dumps(
+        {"WAL-Ranges": [{"Timeline": 1, "Start-LSN": "0/2000028", "End-LSN": "0/2000100"}]}))
+    catalog = Catalog(backup_dir)
+
+    entry = catalog.latest("physical", "cluster")
+    assert entry["format"] == "base"
+    assert entry["wal_start"] == entry["wal_end"] == "000000010000000000000002"
+    assert read_wal_range(base)["start_lsn"] == 0x2000028
+
+    assert catalog.sync_wal(wal_dir) == 4
+    segment_three = wal_dir / "000000010000000000000003"
+    assert catalog.wal_covered_until(entry["wal_start"]) == segment_three.stat().st_mtime
+    assert catalog.prune_wal(wal_dir) == 1
+    assert sorted(path.name for path in wal_dir.iterdir())[0] == "000000010000000000000002"
+
+    catalog.remove(entry)
+    assert catalog.prune_wal(wal_dir) == 0
@@ -0,0 +1,359 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+import pytest
+from app.process import JobCancelled, default_runner
+from app.scheduler import Scheduler
+
+
+class FakeModule:
+    """In-memory database module writing fake dumps and recording concurrency."""
+
+    def __init__(self, databases, failing=(), delay=0.0, target=None, host="localhost"):
+        self.databases = databases
+        self.target = target
+        self.host = host
+        self.failing = set(failing)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.sizes = {}
+        self.load = None
+        self.dumps = 0
+        self.order = []
+        self.limits = {}
+
+    def job_name(self, kind, name):
+        return f"{kind}:{self.target}/{name}" if self.target else f"{kind}:{name}"
+
+    def get_change_token(self, name):
+        return self.tokens.get(name)
+
+    def list_all_databases(self):
+        return list(self.databases)
+
+    def get_database_sizes(self):
+        return dict(self.sizes)
+
+    def get_server_load(self):
+        return self.load
+
+    def backup_database(self, name, destination_file, stats=None, **options):
+        with self.lock:
+            self.order.append(name)
+            job_name = self.job_name("backup", name)
+            self.limits[name] = (default_runner().throttles(job_name), default_runner().priority(job_name))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if name in self.failing:
+                return False
+            destination_file.write_text(f"dump of {name}")
+            if stats is not None:
+                stats["dump_bytes"] = 10 * destination_file.stat().st_size
+            self.dumps += 1
+            return True
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    return tmp_path / "backups"
+
+
+def test_run_backup_is_concurrent(backup_dir):
+    module = FakeModule([f"db_{i}" for i in range(8)], delay=0.1)
+    scheduler = Scheduler(module, [], backup_dir)
+
+    results = scheduler.run_backup("default", 5, concurrency=4)
+
+    assert results == {f"db_{i}": True for i in range(8)}
+    assert module.max_running == 4
+    assert scheduler.get_health()
+
+
+def test_run_backup_cleans_up_only_successful_databases(backup_dir, monkeypatch):
+    module = FakeModule(["good", "bad"], failing=["bad"])
+    scheduler = Scheduler(module, [], backup_dir)
+    cleaned = []
+    monkeypatch.setattr(scheduler, "cleanup_old_backups", lambda cron, db, retention: cleaned.append(db))
+
+    results = scheduler.run_backup("default", 5, concurrency=2)
+
+    assert results == {"good": True, "bad": False}
+    assert cleaned == ["good"]
+    assert not scheduler.get_health()
+
+
+def test_cleanup_removes_directory_backups(backup_dir):
+    scheduler = Scheduler(FakeModule([]), [], backup_dir)
+    day_dir = backup_dir / "default" / "2024" / "1" / "1"
+    day_dir.mkdir(parents=True)
+    for i in range(3):
+        artifact = day_dir / f"db.2024010100000{i}.backup"
+        artifact.mkdir()
+        (artifact / "toc.dat").write_text("toc")
+    scheduler.catalog.rebuild()
+
+    scheduler.cleanup_old_backups("default", "db", 1)
+
+    assert sorted(p.name for p in day_dir.iterdir()) == ["db.20240101000002.backup"]
+
+
+def test_run_backup_records_catalog(backup_dir):
+    module = FakeModule(["good", "bad"], failing=["bad"])
+    scheduler = Scheduler(module, [], backup_dir)
+
+    scheduler.run_backup("default", 1)
+    scheduler.run_backup("default", 1)
+
+    latest = scheduler.catalog.latest("default", "good")
+    assert scheduler.catalog.resolve(latest).read_text() == "dump of good"
+    assert latest["format"] == "plain"
+    assert scheduler.catalog.count("default", "good") == 1
+    assert scheduler.catalog.latest("default", "bad") is None
+
+
+def test_configs_on_same_tick_share_one_job(backup_dir):
+    cron_configs = [
+        {"cron": "0 * * * *", "retention_max": 15, "name": "every"},
+        {"cron": "0 * * * *", "retention_max": 1, "name": "hourly"},
+        {"cron": "0 0 * * *", "retention_max": 90, "name": "daily"},
+    ]
+    scheduler = Scheduler(FakeModule([]), cron_configs, backup_dir)
+
+    groups = scheduler.group_cron_configs()
+
+    assert [[config["name"] for config in group] for group in groups] == [["every", "hourly"], ["daily"]]
+
+
+def test_shared_backup_is_hardlinked_with_own_retention(backup_dir):
+    cron_configs = [
+        {"cron": "0 * * * *", "retention_max": 15, "name": "every"},
+        {"cron": "0 * * * *", "retention_max": 1, "name": "hourly"},
+    ]
+    module = FakeModule(["db"])
+    scheduler = Scheduler(module, cron_configs, backup_dir)
+
+    scheduler.run_backup("every", 15, shared_configs=["hourly"])
+
+    every = scheduler.catalog.resolve(scheduler.catalog.latest("every", "db"))
+    hourly = scheduler.catalog.resolve(scheduler.catalog.latest("hourly", "db"))
+    assert every != hourly
+    assert every.stat().st_ino == hourly.stat().st_ino
+
+
+def test_unchanged_database_is_not_dumped_again(backup_dir):
+    module = FakeModule(["db"])
+    module.tokens["db"] = "token-1"
+    scheduler = Scheduler(module, [], backup_dir)
+
+    scheduler.backup_database("default", "db", 5, skip_unchanged=True)
+    first = scheduler.catalog.latest("default", "db")
+    time.sleep(1)
+    assert scheduler.backup_database("default", "db", 5, skip_unchanged=True)
+
+    assert module.dumps == 1
+    assert scheduler.catalog.latest("default", "db") == first
+
+    module.tokens["db"] = "token-2"
+    time.sleep(1)
+    scheduler.backup_database("default", "db", 5, skip_unchanged=True)
+
+    assert module.dumps == 2
+    assert scheduler.catalog.latest("default", "db")["change_token"] == "token-2"
+
+
+def test_backup_metrics(backup_dir):
+    module = FakeModule(["good", "bad"], failing=["bad"])
+    scheduler = Scheduler(module, [], backup_dir)
+
+    scheduler.run_backup("default", 5)
+
+    page = scheduler.metrics.render()
+    assert 'backup_compression_ratio{config="default",database="good"} 10.0' in page
+    assert 'backup_artifacts{config="default",database="good"} 1' in page
+    assert 'backup_runs_total{config="default",database="bad",status="failed"} 1' in page
+    assert 'backup_last_success_timestamp_seconds{config="default",database="bad"}' not in page
+
+
+def test_health_tracks_each_database(backup_dir):
+    module = FakeModule(["good", "bad"], failing=["bad"])
+    scheduler = Scheduler(module, [{"name": "default", "cron": "0 * * * *"}], backup_dir)
+
+    scheduler.run_backup("default", 5)
+    assert scheduler.get_health_problems() == ["'default' backup of 'bad' failed",
+                                               "'default' backup of 'bad' never succeeded"]
+
+    # A later success of another database does not hide the failure
+    scheduler.backup_database("default", "good", 5)
+    assert not scheduler.get_health()
+
+    module.failing.clear()
+    time.sleep(1)
+    scheduler.run_backup("default", 5)
+    assert scheduler.get_health()
+    assert [run["status"] for run in scheduler.history.snapshot()["default"]["databases"]["bad"]] == ["failed", "success"]
+    for run in scheduler.history.snapshot()["default"]["databases"]["good"]:
+        assert run["start"] <= run["end"] and abs(run["start"] - time.time()) < 60
+
+
+def test_health_fails_on_stale_backups(backup_dir):
+    module = FakeModule(["db"])
+    scheduler = Scheduler(module, [{"name": "default", "cron": "0 * * * *", "health_max_intervals": 1}], backup_dir)
+
+    scheduler.run_backup("default", 5)
+    assert scheduler.get_health()
+
+    scheduler.history.last_success("default", "db")["end"] -= 3601
+    assert scheduler.get_health_problems() == ["'default' backup of 'db' missed 1 scheduled runs"]
+
+
+def test_health_counts_the_missed_runs_of_uneven_crons(backup_dir):
+    module = FakeModule(["db"])
+    # Fires on February 29th only, so a backup a year old has missed at most one run
+    scheduler = Scheduler(module, [{"name": "leap", "cron": "0 0 29 2 *"}], backup_dir)
+
+    scheduler.run_backup("leap", 5)
+    scheduler.history.last_success("leap", "db")["end"] -= 366 * 86400
+    assert scheduler.get_health()
+
+    scheduler.history.last_success("leap", "db")["end"] -= 8 * 366 * 86400
+    assert scheduler.get_health_problems() == ["'leap' backup of 'db' missed 2 scheduled runs"]
+
+
+def test_run_backup_dumps_longest_databases_first(backup_dir, monkeypatch):
+    module = FakeModule(["small", "large", "new"])
+    module.sizes = {"small": 1000, "large": 50000, "new": 20000}
+    scheduler = Scheduler(module, [{"name": "default", "cron": "0 0 1 1 *"}], backup_dir)
+
+    scheduler.run_backup("default", 5)
+    assert module.order == ["large", "new", "small"]
+    assert "backup_predicted_duration_seconds{" not in scheduler.metrics.render()
+
+    # Durations are predicted from the seconds per byte of the previous dumps
+    with scheduler.catalog._connect() as connection:
+        connection.execute("UPDATE backups SET duration = source_size / 1000.0")
+    module.sizes["huge"] = 100000
+    module.databases.append("huge")
+    module.order.clear()
+    time.sleep(1)
+    submitted = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(next(arg for arg in args if arg in module.databases))
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr("app.scheduler.ThreadPoolExecutor", RecordingExecutor)
+    scheduler.run_backup("default", 5, concurrency=2)
+    assert submitted == ["huge", "large", "new", "small"]
+    page = scheduler.metrics.render()
+    assert 'backup_predicted_duration_seconds{config="default"} 100.0' in page
+    assert 'backup_predicted_overrun_seconds{config="default"} 0.0' in page
+    assert 'backup_database_size_bytes{config="default",database="huge"} 100000' in page
+
+
+def test_overloaded_server_defers_and_throttles_the_run(backup_dir):
+    module = FakeModule([f"db_{i}" for i in range(4)], delay=0.05)
+    module.load = {"active": 50, "lag": None}
+    cron_configs = [{"name": "default", "cron": "0 * * * *", "load_max_active": 10, "load_defer_max": 0.2,
+                     "load_concurrency": 1, "load_check_interval": 0.05}]
+    scheduler = Scheduler(module, cron_configs, backup_dir)
+
+    assert all(scheduler.run_backup("default", 5, concurrency=4).values())
+    assert module.max_running == 1
+    page = scheduler.metrics.render()
+    assert 'backup_throttled_runs_total{config="default"} 1' in page
+    assert 'backup_server_active_sessions{config="default"} 50' in page
+    assert scheduler.metrics.values["backup_deferred_seconds"][(("config", "default"),)] >= 0.2
+
+
+def test_dumps_are_rate_limited_and_prioritized(backup_dir):
+    module = FakeModule(["db_1"])
+    cron_configs = [{"name": "default", "cron": "0 * * * *", "rate_limit_mb": 4, "nice": 10}]
+    scheduler = Scheduler(module, cron_configs, backup_dir, rate_limit=64 * 1024 * 1024)
+
+    assert scheduler.run_backup("default", 5) == {"db_1": True}
+    buckets, priority = module.limits["db_1"]
+    assert [bucket.rate for bucket in buckets] == [64 * 1024 * 1024, 4 * 1024 * 1024]
+    assert priority == ["nice", "-n", "10"]
+    assert default_runner().throttles("backup:db_1") == [] and default_runner().priority("backup:db_1") == []
+
+
+def test_skipped_and_delayed_runs_are_counted(backup_dir):
+    from datetime import datetime, timedelta, timezone
+    from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_SUBMITTED, JobSubmissionEvent
+
+    module = FakeModule(["db_1"], delay=0.3)
+    cron_configs = [{"name": "default", "cron": "0 * * * *", "coalesce": False, "jitter": 600}]
+    scheduler = Scheduler(module, cron_configs, backup_dir, instance_id="backup-1")
+    scheduler._jobs["default"] = ("default", [])
+    scheduler._run_slots["default"] = threading.Semaphore(1)
+
+    scheduler.DELAY_TOLERANCE = 0.1
+    fire_time = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc) + scheduler.get_trigger("default").offset
+    scheduler.on_job_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, "default", "default", [fire_time]))
+    scheduler.on_job_event(JobSubmissionEvent(EVENT_JOB_MAX_INSTANCES, "default", "default",
+                                              [fire_time + timedelta(hours=3)]))
+    values = scheduler.metrics.values["backup_skipped_runs_total"]
+    assert values[(("config", "default"), ("reason", "coalesced"))] == 2
+    assert values[(("config", "default"), ("reason", "overrun"))] == 1
+
+    # The runs are dispatched at once: the second one is queued, the third one skipped
+    futures = [scheduler.run_scheduled_backup("default", 5) for _ in range(3)]
+    assert futures[2] is None
+    assert [future.result(timeout=10) for future in futures[:2]] == [{"db_1": True}] * 2
+    assert module.max_running == 1 and module.dumps == 2
+    assert values[(("config", "default"), ("reason", "overrun"))] == 2
+    assert scheduler.metrics.values["backup_delayed_runs_total"][(("config", "default"),)] == 1
+
+
+def test_targets_share_the_worker_pool_within_their_caps(tmp_path):
+    from app.metrics import Metrics
+    from app.pool import WorkerPool
+
+    pool = WorkerPool(3)
+    registry = Metrics()
+    modules = {name: FakeModule([f"db_{i}" for i in range(4)], delay=0.05, target=name, host="db-host")
+               for name in ("orders", "billing")}
+    schedulers = [Scheduler(module, [{"name": "default", "cron": "0 * * * *"}], tmp_path / name,
+                            metrics=registry.labels(target=name), pool=pool) for name, module in modules.items()]
+    target_key, host_key = schedulers[0].get_pool_keys()
+    pool.limit(target_key, 1)
+    pool.limit(host_key, 2)
+    assert pool.capacity([target_key, host_key]) == 1
+    assert pool.capacity(schedulers[1].get_pool_keys()) == 2
+
+    threads = [threading.Thread(target=scheduler.run_backup, args=["default", 5, 4]) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert modules["orders"].max_running == 1 and modules["orders"].dumps == 4
+    assert modules["billing"].dumps == 4
+    assert 'target="billing"' in registry.render() and 'target="orders"' in registry.render()
+
+
+def test_cancel_counts_each_job_once(backup_dir, tmp_path):
+    scheduler = Scheduler(FakeModule(["db"]), [{"name": "default", "cron": "0 * * * *"}], backup_dir)
+    futures = [default_runner().submit([["sleep", "30"]], name="backup:db", stdout=tmp_path / f"part_{i}")
+               for i in range(3)]
+    while len(default_runner().running()) < 3:
+        time.sleep(0.01)
+
+    assert scheduler.cancel_backups() == 3
+    for future in futures:
+        with pytest.raises(JobCancelled):
+            future.result(timeout=5)
@@ -0,0 +1,24 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+# insert root directory into python module search path
+sys.path.insert(1, os.getcwd())
+
+from apscheduler.triggers.cron import CronTrigger
+from app.triggers import OffsetTrigger, jitter_offset
+
+
+def test_jitter_is_stable_per_instance_and_spread_over_the_window():
+    assert jitter_offset("backup-1", "hourly", 300) == jitter_offset("backup-1", "hourly", 300)
+    offsets = {jitter_offset(f"backup-{i}", "hourly", 300) for i in range(20)}
+    assert len(offsets) > 10 and all(0 <= offset < 300 for offset in offsets)
+    assert jitter_offset("backup-1", "hourly", 0) == 0
+
+
+def test_offset_trigger_shifts_the_fire_times():
+    trigger = OffsetTrigger(CronTrigger.from_crontab("0 * * * *", timezone=timezone.utc), 90)
+    now = datetime(2026, 1, 1, 10, 0, 30, tzinfo=timezone.utc)
+    first = trigger.get_next_fire_time(None, now)
+    assert first == datetime(2026, 1, 1, 10, 1, 30, tzinfo=timezone.utc)
+    assert trigger.get_next_fire_time(first, first) == datetime(2026, 1, 1, 11, 1, 30, tzinfo=timezone.utc)